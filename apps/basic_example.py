@@ -47,15 +47,10 @@ if len(flight_path) == 1:
 	print("No Wind Data available for this prediction scenario!")
 	sys.exit(1)
 
-# Create a list of items to add into the KML output file
-geom_items = []
-
-# Add the flight path track, and the landing location to the list
-geom_items.append(flight_path_to_geometry(flight_path, comment="Predicted Flight Path"))
-geom_items.append(flight_path_landing_placemark(flight_path, comment="Predicted Landing Location"))
-
-# Write everything in the list out to the KML file
-write_flight_path_kml(geom_items, filename=OUTPUT_KML, comment="Balloon Flight Prediction")
+# Write the flight path track, and the landing location out to the KML file
+with KMLWriter(OUTPUT_KML, name="Balloon Flight Prediction") as kml:
+	kml.add_track(flight_path, comment="Predicted Flight Path")
+	kml.add_point(flight_path[-1], comment="Predicted Landing Location", style='landing', altitude_mode='clampToGround')
 
 # Print out some basic information about the prediction
 # Launch time:
@@ -7,12 +7,10 @@
 #	This is an example of running prediction, and outputting data to a KML file.
 #
 
-import fastkml
 import datetime
 import argparse
 from dateutil.parser import parse
 from cusfpredict.predict import Predictor
-from pygeoif.geometry import Point, LineString
 from cusfpredict.utils import *
 
 # Predictor Parameters
@@ -55,13 +53,14 @@ altitude_mode = "absolute" if args.absolute else "clampToGround"
 burst_alt_variations = [float(item) for item in args.altitude_deltas.split(',')]
 launch_time_variations = [float(item) for item in args.time_deltas.split(',')]
 
-predictions = []
-
 print("Running using GFS Model: %s" % gfs_model_age(GFS_PATH))
 
 # Create the predictor object.
 pred = Predictor(bin_path=PRED_BINARY, gfs_path=GFS_PATH)
 
+# Predictions are written out to the KML file as they are completed.
+kml = KMLWriter(args.output, name="HAB Prediction")
+
 for _delta_alt in burst_alt_variations:
 	for _delta_time in launch_time_variations:
 
@@ -82,12 +81,10 @@ for _delta_alt in burst_alt_variations:
 
 		pred_comment = "%s %.1f/%.1f/%.1f" % (_launch_time.isoformat(), ASCENT_RATE, _burst_alt, DESCENT_RATE)
 
-		predictions.append(flight_path_to_geometry(flight_path, comment=pred_comment, altitude_mode=altitude_mode))
-		predictions.append(flight_path_burst_placemark(flight_path, comment="Burst (%dm)"%_burst_alt, altitude_mode=altitude_mode))
-		predictions.append(flight_path_landing_placemark(flight_path, comment=pred_comment))
+		kml.add_flight_path(flight_path, comment=pred_comment, altitude_mode=altitude_mode, burst=True, burst_comment="Burst (%dm)"%_burst_alt)
 
 		print("%s - Landing: %.4f, %.4f at %s" % (pred_comment, flight_path[-1][1], flight_path[-1][2], datetime.datetime.utcfromtimestamp(flight_path[-1][0]).isoformat()))
 
-write_flight_path_kml(predictions, filename=args.output)
+kml.close()
 print("KML written to %s" % args.output)
 
@@ -14,13 +14,11 @@
 #	with lat/lon parameters chaged as appropriate.
 #
 import argparse
-import fastkml
 import datetime
-import json
 from dateutil.parser import parse
 from cusfpredict.predict import Predictor
-from pygeoif.geometry import Point, LineString
 from cusfpredict.utils import *
+from cusfpredict.export import PredictionExporter
 
 # Predictor Parameters
 PRED_BINARY = "./pred"
@@ -50,6 +48,11 @@ parser.add_argument('--step', type=int, default=LAUNCH_STEP, help="Time step bet
 parser.add_argument('--limit', type=int, default=LAUNCH_TIME_LIMIT, help="Predict up to this many hours into the future. Default = %d" % LAUNCH_TIME_LIMIT)
 parser.add_argument('-s', '--site', type=str, default="Radiosonde", help="Launch site name. Default: Radiosonde")
 parser.add_argument('-o', '--output', type=str, default='sonde_predictions', help="Output JSON File. .json will be appended. Default = sonde_predictions[.json]")
+parser.add_argument('--tolerance', type=float, default=0.0, help="Simplify tracks in the JSON output, to within this many metres. Default = 0 (no simplification)")
+parser.add_argument('--precision', type=int, default=None, help="Decimal places of latitude/longitude to keep in the JSON output. Default = full precision")
+parser.add_argument('--delta', action="store_true", default=False, help="Delta-encode track coordinates in the JSON output.")
+parser.add_argument('--split', action="store_true", default=False, help="Write a JSON index file, with tracks in separate files which are loaded as required.")
+parser.add_argument('--gzip', action="store_true", default=False, help="Also write precompressed .json.gz files, for web servers which support them.")
 args = parser.parse_args()
 
 
@@ -72,21 +75,27 @@ LAUNCH_TIME = datetime.datetime(current_day.year, current_day.month, current_day
 # These can all be left at zero, or you can add a range of delta values
 launch_time_variations = range(0,args.limit,args.step)
 
-# A list to store predicton results
-predictions = []
-
 # Separate store for JSON output data.
-json_out = {
-	'dataset': gfs_model_age(GFS_PATH),
-	'predictions':{},
-	'site': args.site,
-	'launch_lat': LAUNCH_LAT,
-	'launch_lon': LAUNCH_LON
-}
+json_out = PredictionExporter(
+	OUTPUT_FILE+".json",
+	header={
+		'dataset': gfs_model_age(GFS_PATH),
+		'site': args.site,
+		'launch_lat': LAUNCH_LAT,
+		'launch_lon': LAUNCH_LON
+	},
+	tolerance=args.tolerance,
+	precision=args.precision,
+	delta=args.delta,
+	split=args.split,
+	gzip_copy=args.gzip)
 
 # Create the predictor object.
 pred = Predictor(bin_path=PRED_BINARY, gfs_path=GFS_PATH)
 
+# Predictions are written out to the KML file as they are completed.
+kml = KMLWriter(OUTPUT_FILE+".kml", name="Sonde Predictions - %s" % gfs_model_age(GFS_PATH))
+
 
 # Iterate through the range of launch times set above
 for _delta_time in launch_time_variations:
@@ -113,22 +122,17 @@ for _delta_time in launch_time_variations:
 	pred_time_string = _launch_time.strftime("%Y%m%d-%H%M")
 	pred_comment = "%s %.1f/%.1f/%.1f" % (pred_time_string, ASCENT_RATE, BURST_ALT, DESCENT_RATE)
 
-	# Add the track and placemark to our list of predictions
-	predictions.append(flight_path_to_geometry(flight_path, comment=pred_comment))
-	predictions.append(flight_path_landing_placemark(flight_path, comment=pred_comment))
+	# Add the track and landing placemark to the KML file
+	kml.add_flight_path(flight_path, comment=pred_comment)
 
-	json_out['predictions'][pred_comment] = {
-		'timestamp': _launch_time.strftime("%Y-%m-%d %H:%M:%S"),
-		'path':flight_path_to_polyline(flight_path),
-		'burst_alt': BURST_ALT
-	}
+	json_out.add(pred_comment, flight_path,
+		timestamp=_launch_time.strftime("%Y-%m-%d %H:%M:%S"),
+		burst_alt=BURST_ALT)
 
 	print("Prediction Run: %s" % pred_comment)
 
-# Write out the prediction data to the KML file
-kml_comment = "Sonde Predictions - %s" % gfs_model_age()
-write_flight_path_kml(predictions, filename=OUTPUT_FILE+".kml", comment=kml_comment)
+# Finish off the KML file
+kml.close()
 
-# Write out the JSON blob.
-with open(OUTPUT_FILE+".json",'w') as f:
-	f.write(json.dumps(json_out))
\ No newline at end of file
+# Write out the JSON blob (and track files, if splitting).
+json_out.close()
\ No newline at end of file
@@ -17,6 +17,11 @@
 #   or close to being available.
 #
 #   40 3,9,15,21 * * * /home/username/cusf_predictor_wrapper/apps/sonde_predict.sh
+#
+#   NOTE: This script deletes the existing wind data before downloading the new dataset,
+#   leaving a window with no data available. The cusfpredict daemon (see daemon.cfg.example)
+#   performs the same job as a long-running process, and swaps in new datasets atomically:
+#     python3 -m cusfpredict.daemon -c daemon.cfg
 
 # Home location latitude & longitude
 HOME_LAT=-34.0
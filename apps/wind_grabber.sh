@@ -3,6 +3,7 @@
 # Wind Grabber Script Example
 #
 # An example of how cusfpredict.gfs could be run as a cron-job, to keep a directory of wind data up to date.
+# Alternatively, the cusfpredict daemon can be used to keep a dataset up to date (see daemon.cfg.example).
 #
 
 # Run cusfpredict.gfs
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+#
+#   Project Horus
+#   CUSF Standalone Predictor Python Wrapper - Dataset Archive Benchmarks
+#   Copyright 2020 Mark Jessop <vk5qi@rfhead.net>
+#
+#   Time archiving a number of model cycles (cusfpredict.archive), the disk space they take with
+#   their data files hard-linked, and finding the cycles covering a time and position using the
+#   archive index, compared against scanning the file names in every cycle directory.
+#
+import datetime
+import os
+import shutil
+
+from harness import time_function
+
+
+# Model cycles to archive.
+CYCLES = 28
+
+
+def _scan(archive_dir, timestamp, lat, lon):
+    ''' Find the cycles with a tile covering a time and position, by listing every cycle directory. '''
+    from cusfpredict.files import cusf_files
+    from cusfpredict.wind import parse_cusf_filename
+
+    _cycles = []
+    for _name in sorted(os.listdir(archive_dir), reverse=True):
+        _path = os.path.join(archive_dir, _name)
+        if _name.startswith('.') or not os.path.isdir(_path):
+            continue
+        _times = []
+        for _filename in cusf_files(_path):
+            (_ts, _lat, _lon, _latrad, _lonrad) = parse_cusf_filename(_filename)
+            if abs(lat - _lat) <= _latrad and abs(lon - _lon) <= _lonrad:
+                _times.append(_ts)
+        if _times and min(_times) <= timestamp <= max(_times):
+            _cycles.append(_name)
+    return _cycles
+
+
+def _disk_bytes(directory):
+    ''' Disk space used by a directory tree, counting each hard-linked file once. '''
+    _seen = set()
+    _total = 0
+    for (_root, _dirs, _files) in os.walk(directory):
+        for _name in _files:
+            _stat = os.stat(os.path.join(_root, _name))
+            if _stat.st_ino not in _seen:
+                _seen.add(_stat.st_ino)
+                _total += _stat.st_size
+    return _total
+
+
+def run(ctx):
+    from cusfpredict.archive import Archive
+    from cusfpredict.gfs import write_dataset_info
+
+    _gfs = ctx.cusf_dataset()
+    _dataset_dir = os.path.join(ctx.workdir, 'archive_dataset')
+    _archive_dir = os.path.join(ctx.workdir, 'archive')
+    shutil.rmtree(_dataset_dir, ignore_errors=True)
+    shutil.rmtree(_archive_dir, ignore_errors=True)
+    shutil.copytree(_gfs, _dataset_dir)
+
+    _cycles = [ctx.model_dt - datetime.timedelta(hours=6*_i) for _i in range(CYCLES)][::-1]
+    write_dataset_info(_dataset_dir, _cycles[0])
+
+    _results = []
+    try:
+        _archive = Archive(_archive_dir)
+        _remaining = list(_cycles)
+        _result = time_function('archive_add', lambda: _archive.add(_dataset_dir, _remaining.pop(0)),
+            repeat=CYCLES - 1, warmup=1, params={'cycles': CYCLES})
+        _result['disk_bytes'] = _disk_bytes(_archive_dir)
+        _result['dataset_bytes'] = _disk_bytes(_dataset_dir)
+        _results.append(_result)
+
+        _time = ctx.model_dt + datetime.timedelta(hours=1)
+        _timestamp = int((_time - datetime.datetime(1970, 1, 1)).total_seconds())
+
+        # The index is loaded on first use, and then only re-read if it changes.
+        _results.append(time_function('archive_find_first', lambda: Archive(_archive_dir).find(_time, ctx.lat, ctx.lon),
+            repeat=ctx.repeat, params={'cycles': CYCLES}))
+        _results.append(time_function('archive_find', lambda: _archive.find(_time, ctx.lat, ctx.lon),
+            repeat=ctx.repeat * 20, params={'cycles': CYCLES}))
+        _results.append(time_function('archive_scan', lambda: _scan(_archive_dir, _timestamp, ctx.lat, ctx.lon),
+            repeat=ctx.repeat, params={'cycles': CYCLES}))
+    finally:
+        shutil.rmtree(_dataset_dir, ignore_errors=True)
+        shutil.rmtree(_archive_dir, ignore_errors=True)
+
+    return _results
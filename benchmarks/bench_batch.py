@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+#
+#   Project Horus
+#   CUSF Standalone Predictor Python Wrapper - Batched Engine Benchmarks
+#   Copyright 2020 Mark Jessop <vk5qi@rfhead.net>
+#
+#   Compare particle-steps (one flight advanced by one model timestep) per second through the batched
+#   model (cusfpredict.engine.Engine.predict_batch, src/run_batch.c), against running each flight of
+#   an ensemble in turn through the existing model (Engine.predict). Also reports the distance between
+#   the ensemble mean landings of the two, which should be small compared to the ensemble spread.
+#   Requires --lib.
+#
+import calendar
+import time
+
+import numpy as np
+
+from harness import make_result
+from bench_core import scenario
+
+
+# Ensemble sizes. The existing model is only run for the smallest.
+PARTICLES = [100, 1000, 5000]
+
+
+def _ensemble(ctx, n, seed=0):
+    ''' Ensemble of launch parameters around the reference scenario. '''
+    _rng = np.random.default_rng(seed)
+    _scenario = scenario(ctx)
+    return dict(_scenario,
+        ascent_rate=_rng.uniform(4.0, 6.0, n),
+        burst_alt=_rng.uniform(_scenario['burst_alt'] - 3000.0, _scenario['burst_alt'] + 3000.0, n),
+        descent_rate=_rng.uniform(5.0, 7.0, n))
+
+
+def _particle_steps(ctx, landings):
+    ''' Number of timesteps taken by each flight (the model timestep is 1 second). '''
+    _launch = calendar.timegm(scenario(ctx)['launch_time'].utctimetuple())
+    return int(np.sum(landings[:, 0] - _launch))
+
+
+def run(ctx):
+    if ctx.lib is None:
+        return []
+
+    from cusfpredict.engine import Engine, PRED_OK
+    from cusfpredict.live import distance_metres
+
+    _results = []
+    with Engine(gfs_path=ctx.cusf_dataset(), lib_path=ctx.lib) as _engine:
+        # Load the wind data.
+        _engine.predict(**scenario(ctx))
+
+        _n = PARTICLES[0]
+        _ensemble_params = _ensemble(ctx, _n)
+        _times = []
+        for _i in range(ctx.repeat):
+            _start = time.perf_counter()
+            _landings = []
+            for _j in range(_n):
+                _params = {_k: (_v[_j] if isinstance(_v, np.ndarray) else _v) for (_k, _v) in _ensemble_params.items()}
+                _landings.append(_engine.predict(**_params)[-1].copy())
+            _times.append(time.perf_counter() - _start)
+        _scalar_landings = np.array(_landings)
+        _steps = _particle_steps(ctx, _scalar_landings)
+
+        _result = make_result('batch_scalar_%d' % _n, _times, params={'particles': _n}, particle_steps=_steps)
+        _result['particle_steps_per_second'] = _steps / _result['median']
+        _results.append(_result)
+        _scalar_rate = _result['particle_steps_per_second']
+
+        for _n in PARTICLES:
+            _ensemble_params = _ensemble(ctx, _n)
+            _times = []
+            for _i in range(ctx.repeat):
+                _start = time.perf_counter()
+                (_landings, _status) = _engine.predict_batch(seed=_i, **_ensemble_params)
+                _times.append(time.perf_counter() - _start)
+            _steps = _particle_steps(ctx, _landings)
+
+            _result = make_result('batch_%d' % _n, _times, params={'particles': _n}, particle_steps=_steps,
+                failed=int(np.sum(_status != PRED_OK)))
+            _result['particle_steps_per_second'] = _steps / _result['median']
+            _result['speedup'] = _result['particle_steps_per_second'] / _scalar_rate
+            if _n == PARTICLES[0]:
+                _result['mean_landing_offset_m'] = distance_metres(
+                    np.mean(_scalar_landings[:, 1]), np.mean(_scalar_landings[:, 2]),
+                    np.mean(_landings[:, 1]), np.mean(_landings[:, 2]))
+                _result['landing_spread_m'] = float(np.median([distance_metres(
+                    np.mean(_landings[:, 1]), np.mean(_landings[:, 2]), _lat, _lon) for (_lat, _lon) in _landings[:, 1:3]]))
+            _results.append(_result)
+
+    return _results
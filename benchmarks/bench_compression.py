@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+#
+#   Project Horus
+#   CUSF Standalone Predictor Python Wrapper - Compressed Tile Benchmarks
+#   Copyright 2020 Mark Jessop <vk5qi@rfhead.net>
+#
+#   Compare each tile storage format (uncompressed, gzip, and zstd if the zstandard module is
+#   installed): disk space used, time to write the dataset, time (and peak memory) to read a
+#   tile in Python, and pred's tile load time. pred must be built with zlib (and libzstd) to
+#   read compressed tiles; formats it cannot read are skipped.
+#
+import os
+import time
+import tracemalloc
+
+from harness import time_function, make_result
+from bench_core import scenario
+
+
+def _formats():
+    from cusfpredict.gfs import CUSF_COMPRESSION
+    from cusfpredict.reader import zstandard
+
+    return [_format for _format in CUSF_COMPRESSION if _format != 'zstd' or zstandard is not None]
+
+
+def _disk_bytes(files):
+    return sum(os.path.getsize(_file) for _file in files)
+
+
+def _read_peak_bytes(filename):
+    ''' Peak Python memory allocated while reading a tile. '''
+    from cusfpredict.reader import read_cusf_wind
+
+    tracemalloc.start()
+    try:
+        read_cusf_wind(filename)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def _time_pred(ctx, name, gfs, **extra):
+    ''' Time pred runs against a dataset, collecting the tile load time reported by pred --stats. '''
+    from cusfpredict.predict import Predictor
+
+    _predictor = Predictor(bin_path=ctx.pred, gfs_path=gfs)
+    _times = []
+    _load_times = []
+    for _i in range(ctx.repeat + 1):
+        _start = time.perf_counter()
+        (_path, _stats) = _predictor.predict(stats=True, **scenario(ctx))
+        _duration = time.perf_counter() - _start
+        if len(_path) == 0:
+            # pred was built without support for this format.
+            return None
+        if _i == 0:
+            continue
+        _times.append(_duration)
+        if 'tile_load_time' in _stats:
+            _load_times.append(_stats['tile_load_time'])
+
+    if _load_times:
+        extra['tile_load_time_median'] = sorted(_load_times)[len(_load_times)//2]
+    return make_result(name, _times, **extra)
+
+
+def run(ctx):
+    from synthetic import write_synthetic_dataset
+
+    _results = []
+    _hours = min(ctx.hours, 6)
+
+    for _format in _formats():
+        _label = _format if _format else 'none'
+        _gfs = os.path.join(ctx.workdir, 'gfs_%s' % _label)
+
+        _files = []
+        _result = time_function('compression_write_%s' % _label,
+            lambda: _files.append(write_synthetic_dataset(_gfs, hours=_hours, model_dt=ctx.model_dt,
+                compression=_format, **ctx.dataset_params())),
+            repeat=1, warmup=0, params={'tiles': _hours})
+        _files = _files[-1]
+        _result['disk_bytes'] = _disk_bytes(_files)
+        _results.append(_result)
+
+        from cusfpredict.reader import read_cusf_wind
+        _result = time_function('compression_read_%s' % _label, lambda: read_cusf_wind(_files[0]),
+            repeat=ctx.repeat, bytes=os.path.getsize(_files[0]))
+        _result['peak_bytes'] = _read_peak_bytes(_files[0])
+        _results.append(_result)
+
+        if ctx.pred is not None:
+            _result = _time_pred(ctx, 'compression_pred_%s' % _label, _gfs)
+            if _result is None:
+                print("pred cannot read %s tiles, skipping." % _label)
+            else:
+                _results.append(_result)
+
+    # Space saved, relative to uncompressed tiles.
+    _uncompressed = [_result['disk_bytes'] for _result in _results if _result['name'] == 'compression_write_none'][0]
+    for _result in _results:
+        if 'disk_bytes' in _result:
+            _result['ratio'] = _uncompressed / _result['disk_bytes']
+
+    return _results
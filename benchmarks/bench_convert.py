@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+#
+#   Project Horus
+#   CUSF Standalone Predictor Python Wrapper - Offline GRIB Conversion Benchmarks
+#   Copyright 2020 Mark Jessop <vk5qi@rfhead.net>
+#
+#   Time converting the synthetic GRIB files into a CUSF dataset with cusfpredict.convert, using a
+#   single decoding process and one per CPU, and re-running the conversion once the dataset is up
+#   to date (which only checks the manifest). Requires the eccodes, xarray and cfgrib modules.
+#
+import os
+import shutil
+
+from harness import time_function
+
+
+def run(ctx):
+    _files = ctx.grib_files()
+    if _files is None:
+        return []
+
+    try:
+        from cusfpredict.gfs import import_grib_decoder
+        import_grib_decoder()
+    except ImportError as e:
+        print("Cannot decode GRIB files: %s" % str(e))
+        return []
+
+    from cusfpredict.convert import convert_grib_files
+
+    _output_dir = os.path.join(ctx.workdir, 'convert')
+    _window = (ctx.lat, ctx.lon, ctx.radius / 2.0, ctx.radius / 2.0)
+    _params = {'files': len(_files), 'cpus': os.cpu_count()}
+
+    _results = []
+    try:
+        for (_name, _workers) in [('convert_serial', 1), ('convert_pool', None)]:
+            _results.append(time_function(_name,
+                lambda: convert_grib_files(_files, output_dir=_output_dir, window=_window, workers=_workers, force=True),
+                repeat=max(1, ctx.repeat // 2), warmup=0, params=dict(_params, workers=_workers or os.cpu_count())))
+
+        _results.append(time_function('convert_uptodate',
+            lambda: convert_grib_files(_files, output_dir=_output_dir, window=_window),
+            repeat=ctx.repeat, params=_params))
+    finally:
+        for _name in os.listdir(ctx.workdir):
+            if _name == 'convert' or _name.startswith('convert.'):
+                _path = os.path.join(ctx.workdir, _name)
+                if os.path.islink(_path):
+                    os.remove(_path)
+                else:
+                    shutil.rmtree(_path, ignore_errors=True)
+
+    return _results
@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+#
+#   Project Horus
+#   CUSF Standalone Predictor Python Wrapper - Core Benchmarks
+#   Copyright 2020 Mark Jessop <vk5qi@rfhead.net>
+#
+#   Benchmarks of the dataset writer/readers, the predictor, and output export.
+#
+import calendar
+import datetime
+import glob
+import json
+import os
+import subprocess
+import time
+
+from harness import time_function, make_result
+from synthetic import synthetic_wind_dict
+
+
+def synthetic_flight_path(launch_time, points=400, lat=-34.9499, lon=138.5194):
+    ''' Generate a plausible-looking flight path, for export benchmarks which should not depend on pred '''
+    _start = calendar.timegm(launch_time.timetuple())
+    _path = []
+    for _i in range(points):
+        # Ascend for 2/3 of the flight, and descend for the rest.
+        _frac = _i / float(points - 1)
+        _alt = 26000.0 * (_frac / 0.667 if _frac < 0.667 else (1.0 - _frac) / 0.333)
+        _path.append([_start + _i*50, lat + 0.0005*_i, lon + 0.002*_i, _alt])
+    return _path
+
+
+def scenario(ctx, hour_offset=1, **kwargs):
+    ''' A prediction scenario within the synthetic dataset '''
+    _scenario = {
+        'launch_lat': ctx.lat - 0.9,
+        'launch_lon': ctx.lon + 0.5,
+        'launch_alt': 0.0,
+        'ascent_rate': 5.0,
+        'descent_rate': 6.0,
+        'burst_alt': 26000.0,
+        'launch_time': ctx.model_dt + datetime.timedelta(hours=hour_offset)
+    }
+    _scenario.update(kwargs)
+    return _scenario
+
+
+def bench_wind_dict_to_cusf(ctx):
+    from cusfpredict.gfs import wind_dict_to_cusf
+
+    _data = synthetic_wind_dict(calendar.timegm(ctx.model_dt.timetuple()), **ctx.dataset_params())
+    _output_dir = os.path.join(ctx.workdir, 'write_test')
+    os.makedirs(_output_dir, exist_ok=True)
+
+    return [time_function('wind_dict_to_cusf', lambda: wind_dict_to_cusf(_data, output_dir=_output_dir), repeat=ctx.repeat)]
+
+
+def bench_read_cusf_gfs(ctx):
+    from cusfpredict.reader import read_cusf_gfs
+
+    from cusfpredict.files import cusf_files
+
+    _tile = cusf_files(ctx.cusf_dataset())[0]
+
+    return [time_function('read_cusf_gfs', lambda: read_cusf_gfs(_tile), repeat=ctx.repeat,
+        bytes=os.path.getsize(_tile))]
+
+
+def bench_parse_grib_to_dict(ctx):
+    _files = ctx.grib_files()
+    if _files is None:
+        return []
+
+    from cusfpredict.gfs import parse_grib_to_dict
+
+    def _setup():
+        # Remove any cfgrib index files, so each run sees a freshly downloaded file.
+        for _idx in glob.glob(_files[0] + "*.idx"):
+            os.remove(_idx)
+        return _files[0]
+
+    return [time_function('parse_grib_to_dict', parse_grib_to_dict, setup=_setup, repeat=ctx.repeat,
+        bytes=os.path.getsize(_files[0]))]
+
+
+def bench_predict(ctx):
+    if ctx.pred is None:
+        return []
+
+    from cusfpredict.predict import Predictor, PredictorPool
+
+    _gfs = ctx.cusf_dataset()
+    _results = []
+
+    _pred = Predictor(bin_path=ctx.pred, gfs_path=_gfs)
+    _results.append(time_function('predict_single', lambda: _pred.predict(**scenario(ctx)), repeat=ctx.repeat))
+
+    # Batch of predictions, spread over the dataset, run through a pool of predictors.
+    _workers = os.cpu_count() or 1
+    _pool = PredictorPool(bin_path=ctx.pred, gfs_path=_gfs, workers=_workers)
+    _scenarios = [scenario(ctx, hour_offset=1, burst_alt=20000.0 + 500.0*_i) for _i in range(16)]
+    _results.append(time_function('predict_batch_16', lambda: list(_pool.predict_many(_scenarios)), repeat=ctx.repeat,
+        params={'workers': _workers, 'predictions': len(_scenarios)}))
+    _pool.close()
+
+    return _results
+
+
+def bench_predict_stream(ctx):
+    ''' Time until the first flight path points are available from Predictor.predict_stream, and until pred exits. '''
+    if ctx.pred is None:
+        return []
+
+    from cusfpredict.predict import Predictor
+
+    _pred = Predictor(bin_path=ctx.pred, gfs_path=ctx.cusf_dataset())
+
+    _first_times = []
+    _times = []
+    _events = 0
+    for _i in range(ctx.repeat + 1):
+        _start = time.perf_counter()
+        _first = None
+        _events = 0
+        for _event in _pred.predict_stream(**scenario(ctx)):
+            if (_first is None) and (_event['type'] == 'points'):
+                _first = time.perf_counter() - _start
+            _events += 1
+        if _i == 0:
+            continue
+        _first_times.append(_first)
+        _times.append(time.perf_counter() - _start)
+
+    return [make_result('predict_stream_first_point', _first_times), make_result('predict_stream', _times, events=_events)]
+
+
+def _time_pred_startup(ctx, name, gfs):
+    ''' Time for pred to index the data directory and exit, using a launch time which is not covered by the dataset. '''
+    _launch = ctx.model_dt - datetime.timedelta(days=30)
+    _scenario = ("[launch-site]\nlatitude = %.4f\nlongitude = %.4f\naltitude = 0\n"
+        "[altitude-model]\nascent-rate = 5.0\ndescent-rate = 6.0\nburst-altitude = 26000\n"
+        "[launch-time]\nhour = %d\nminute = 0\nsecond = 0\nday = %d\nmonth = %d\nyear = %d\n") % (
+        ctx.lat, ctx.lon, _launch.hour, _launch.day, _launch.month, _launch.year)
+
+    _env = dict(os.environ)
+    _env['TZ'] = 'UTC'
+
+    _times = []
+    _scan_times = []
+    for _i in range(ctx.repeat + 1):
+        _start = time.perf_counter()
+        _p = subprocess.run([ctx.pred, '-i', gfs, '--stats'], input=_scenario.encode('ascii'),
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=_env)
+        _duration = time.perf_counter() - _start
+        if _i == 0:
+            continue
+        _times.append(_duration)
+        for _line in _p.stderr.decode('ascii', errors='replace').split('\n'):
+            if _line.startswith('{'):
+                _scan_times.append(json.loads(_line)['dir_scan_time'])
+
+    from cusfpredict.files import cusf_files
+
+    _extra = {'files': len(cusf_files(gfs))}
+    if _scan_times:
+        _extra['dir_scan_time_median'] = sorted(_scan_times)[len(_scan_times)//2]
+
+    return make_result(name, _times, **_extra)
+
+
+def bench_pred_startup(ctx):
+    ''' pred startup time, scanning the data directory, and then using the directory index. '''
+    if ctx.pred is None:
+        return []
+
+    from cusfpredict.gfs import DATASET_INDEX_FILENAME, write_dataset_index
+
+    _gfs = ctx.cusf_dataset()
+    _results = [_time_pred_startup(ctx, 'pred_startup', _gfs)]
+
+    # Leave the dataset as it was generated (without an index) for the other benchmarks.
+    write_dataset_index(_gfs)
+    try:
+        _results.append(_time_pred_startup(ctx, 'pred_startup_indexed', _gfs))
+    finally:
+        os.remove(os.path.join(_gfs, DATASET_INDEX_FILENAME))
+
+    return _results
+
+
+def bench_export(ctx):
+    from cusfpredict.utils import flight_path_to_polyline
+
+    _paths = [synthetic_flight_path(ctx.model_dt + datetime.timedelta(hours=_i)) for _i in range(50)]
+    _results = []
+
+    def _json_export():
+        _json_out = {'predictions': {}}
+        for _i, _path in enumerate(_paths):
+            _json_out['predictions']["%d" % _i] = {'path': flight_path_to_polyline(_path)}
+        with open(os.path.join(ctx.workdir, 'export.json'), 'w') as _f:
+            _f.write(json.dumps(_json_out))
+
+    _results.append(time_function('export_json_50', _json_export, repeat=ctx.repeat))
+
+    def _compact_export():
+        from cusfpredict.export import PredictionExporter
+        _exporter = PredictionExporter(os.path.join(ctx.workdir, 'export_compact.json'), header={},
+            tolerance=10.0, precision=5, delta=True, gzip_copy=True)
+        for _i, _path in enumerate(_paths):
+            _exporter.add("%d" % _i, _path)
+        _exporter.close()
+
+    _results.append(time_function('export_json_compact_50', _compact_export, repeat=ctx.repeat))
+    _results[-1]['bytes'] = os.path.getsize(os.path.join(ctx.workdir, 'export_compact.json'))
+    _results[-1]['bytes_gzip'] = os.path.getsize(os.path.join(ctx.workdir, 'export_compact.json.gz'))
+    _results[0]['bytes'] = os.path.getsize(os.path.join(ctx.workdir, 'export.json'))
+
+    def _kml_export():
+        from cusfpredict.utils import flight_path_to_geometry, flight_path_landing_placemark, write_flight_path_kml
+        _items = []
+        for _path in _paths:
+            _items.append(flight_path_to_geometry(_path))
+            _items.append(flight_path_landing_placemark(_path))
+        write_flight_path_kml(_items, filename=os.path.join(ctx.workdir, 'export.kml'))
+
+    _results.append(time_function('export_kml_50', _kml_export, repeat=ctx.repeat))
+
+    def _kml_stream():
+        from cusfpredict.utils import KMLWriter
+        with KMLWriter(os.path.join(ctx.workdir, 'export_stream.kml')) as _kml:
+            for _i, _path in enumerate(_paths):
+                _kml.add_flight_path(_path, comment="%d" % _i)
+
+    _results.append(time_function('export_kml_stream_50', _kml_stream, repeat=ctx.repeat))
+
+    def _geojson_stream():
+        from cusfpredict.utils import GeoJSONWriter
+        with GeoJSONWriter(os.path.join(ctx.workdir, 'export_stream.geojson')) as _geojson:
+            for _i, _path in enumerate(_paths):
+                _geojson.add_flight_path(_path, comment="%d" % _i)
+
+    _results.append(time_function('export_geojson_stream_50', _geojson_stream, repeat=ctx.repeat))
+
+    return _results
+
+
+BENCHMARKS = [
+    bench_wind_dict_to_cusf,
+    bench_read_cusf_gfs,
+    bench_parse_grib_to_dict,
+    bench_predict,
+    bench_predict_stream,
+    bench_pred_startup,
+    bench_export,
+]
+
+
+def run(ctx):
+    _results = []
+    for _bench in BENCHMARKS:
+        _results.extend(_bench(ctx))
+    return _results
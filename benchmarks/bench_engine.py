@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+#
+#   Project Horus
+#   CUSF Standalone Predictor Python Wrapper - In-Process Engine Benchmarks
+#   Copyright 2020 Mark Jessop <vk5qi@rfhead.net>
+#
+#   Compare predictions per second through the libpred shared library (cusfpredict.engine)
+#   against spawning pred for each run (cusfpredict.predict), for the same scenario.
+#   Requires both --pred and --lib.
+#
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from harness import time_function
+from bench_core import scenario
+
+
+def run(ctx):
+    if ctx.pred is None or ctx.lib is None:
+        return []
+
+    from cusfpredict.engine import Engine
+    from cusfpredict.predict import Predictor
+
+    _scenario = scenario(ctx)
+    _calls = max(ctx.repeat, 5)
+    _results = []
+
+    _predictor = Predictor(bin_path=ctx.pred, gfs_path=ctx.cusf_dataset())
+    _result = time_function('engine_subprocess', lambda: [_predictor.predict(**_scenario) for _i in range(_calls)],
+        repeat=ctx.repeat, params={'calls': _calls})
+    _result['calls_per_second'] = _calls / _result['median']
+    _results.append(_result)
+
+    # First prediction against a new handle, including loading the wind data.
+    _engines = []
+    _result = time_function('engine_cold',
+        lambda _engine: _engine.predict(**_scenario),
+        setup=lambda: _engines.append(Engine(gfs_path=ctx.cusf_dataset(), lib_path=ctx.lib)) or _engines[-1],
+        repeat=ctx.repeat)
+    _results.append(_result)
+    for _engine in _engines:
+        _engine.close()
+
+    with Engine(gfs_path=ctx.cusf_dataset(), lib_path=ctx.lib) as _engine:
+        _result = time_function('engine_warm', lambda: [_engine.predict(**_scenario) for _i in range(_calls)],
+            repeat=ctx.repeat, params={'calls': _calls})
+        _result['calls_per_second'] = _calls / _result['median']
+        _result['speedup'] = _result['calls_per_second'] / _results[0]['calls_per_second']
+        _results.append(_result)
+
+        # One shared handle, used from a thread per CPU.
+        _workers = os.cpu_count() or 1
+        with ThreadPoolExecutor(max_workers=_workers) as _executor:
+            _result = time_function('engine_threaded',
+                lambda: list(_executor.map(lambda _i: _engine.predict(**_scenario), range(_calls * _workers))),
+                repeat=ctx.repeat, params={'calls': _calls * _workers, 'workers': _workers})
+            _result['calls_per_second'] = _calls * _workers / _result['median']
+            _results.append(_result)
+
+    return _results
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+#
+#   Project Horus
+#   CUSF Standalone Predictor Python Wrapper - Ensemble Ingest Benchmarks
+#   Copyright 2020 Mark Jessop <vk5qi@rfhead.net>
+#
+#   Time ingesting a number of ensemble members (cusfpredict.gfs.ingest_ensemble) from a local
+#   HTTP server standing in for the GRIB filter, which returns a synthetic GRIB file after a fixed
+#   delay (the filter's processing time). This is compared against ingesting each member forecast
+#   hour in turn, with ingest_forecast_hour. Requires the eccodes module.
+#
+import os
+import shutil
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from harness import make_result
+
+
+# Members and forecast hours to ingest.
+MEMBERS = 6
+HOURS = 2
+
+# Time the server takes to respond to each request.
+REQUEST_LATENCY = 0.5
+
+
+def _serve_grib(data):
+    class _FilterHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(REQUEST_LATENCY)
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    _server = ThreadingHTTPServer(('127.0.0.1', 0), _FilterHandler)
+    threading.Thread(target=_server.serve_forever, daemon=True).start()
+    return _server
+
+
+def run(ctx):
+    _files = ctx.grib_files()
+    if _files is None:
+        return []
+
+    from cusfpredict import gfs
+
+    with open(_files[0], 'rb') as _f:
+        _server = _serve_grib(_f.read())
+
+    _model = 'gefs_0p50'
+    _bench_model = 'gefs_benchmark'
+    gfs.VALID_MODELS[_bench_model] = dict(gfs.VALID_MODELS[_model],
+        filter_url='http://127.0.0.1:%d/filter' % _server.server_port)
+
+    _members = gfs.VALID_MODELS[_model]['members'][:MEMBERS]
+    _forecast_times = gfs.VALID_MODELS[_model]['times'][:HOURS]
+    _output_dir = os.path.join(ctx.workdir, 'ensemble')
+
+    _results = []
+    try:
+        _params = {'members': MEMBERS, 'hours': HOURS, 'request_latency': REQUEST_LATENCY}
+        _repeat = max(1, ctx.repeat // 2)
+
+        _times = []
+        for _i in range(_repeat):
+            shutil.rmtree(_output_dir, ignore_errors=True)
+            _start = time.perf_counter()
+            _written = 0
+            for _hour in _forecast_times:
+                for _member in _members:
+                    os.makedirs(os.path.join(_output_dir, _member), exist_ok=True)
+                    if gfs.ingest_forecast_hour(model=_bench_model, model_dt=ctx.model_dt, forecast_time=int(_hour), member=_member,
+                        lat=ctx.lat, lon=ctx.lon, latdelta=ctx.radius, londelta=ctx.radius, output_dir=os.path.join(_output_dir, _member)):
+                        _written += 1
+            _times.append(time.perf_counter() - _start)
+        _results.append(make_result('ensemble_sequential', _times, params=_params,
+            files=_written, files_per_second=_written / min(_times)))
+
+        _times = []
+        for _i in range(_repeat):
+            shutil.rmtree(_output_dir, ignore_errors=True)
+            _summary = gfs.ingest_ensemble(model=_bench_model, model_dt=ctx.model_dt, forecast_times=_forecast_times,
+                members=_members, lat=ctx.lat, lon=ctx.lon, latdelta=ctx.radius, londelta=ctx.radius,
+                output_dir=_output_dir, rate_limit=100.0)
+            _times.append(_summary['duration'])
+        _results.append(make_result('ensemble_pipeline', _times, params=_params,
+            files=_summary['written'],
+            failed=_summary['failed'],
+            files_per_second=_summary['written'] / min(_times),
+            download_time=_summary['download_time'],
+            decode_time=_summary['decode_time'],
+            speedup=_results[0]['median'] / float(sorted(_times)[len(_times)//2])))
+    finally:
+        del gfs.VALID_MODELS[_bench_model]
+        _server.shutdown()
+        shutil.rmtree(_output_dir, ignore_errors=True)
+
+    return _results
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+#
+#   Project Horus
+#   CUSF Standalone Predictor Python Wrapper - Landing Heatmap Benchmarks
+#   Copyright 2020 Mark Jessop <vk5qi@rfhead.net>
+#
+#   Aggregation throughput of cusfpredict.heatmap.LandingGrid, for large synthetic ensembles,
+#   and the cost of producing the GeoJSON contour and PNG outputs.
+#
+import datetime
+import os
+import numpy as np
+
+from harness import time_function
+from bench_core import synthetic_flight_path
+
+
+def run(ctx):
+    from cusfpredict.heatmap import LandingGrid
+
+    _rng = np.random.default_rng(0)
+    _lat = ctx.lat - 0.9
+    _lon = ctx.lon + 0.5
+    _results = []
+
+    # A million landings, arriving in chunks of 10000.
+    _chunks = [(_rng.normal(_lat, 0.1, 10000), _rng.normal(_lon, 0.15, 10000)) for _i in range(100)]
+
+    def _bin_landings():
+        _grid = LandingGrid.around(_lat, _lon, radius=100000.0, resolution=0.005)
+        for (_lats, _lons) in _chunks:
+            _grid.add_landings(_lats, _lons)
+        return _grid
+
+    _result = time_function('heatmap_landings_1M', _bin_landings, repeat=ctx.repeat, params={'members': 1000000})
+    _result['members_per_second'] = 1e6 / _result['median']
+    _results.append(_result)
+
+    # Full flight paths, one at a time (as they would arrive from a predictor pool), including ground tracks.
+    _launch_time = ctx.model_dt + datetime.timedelta(hours=1)
+    _paths = [synthetic_flight_path(_launch_time, lat=_lat + _rng.normal(0, 0.05), lon=_lon + _rng.normal(0, 0.05)) for _i in range(1000)]
+
+    def _bin_paths():
+        _grid = LandingGrid.around(_lat, _lon, radius=150000.0, resolution=0.005, tracks=True)
+        _grid.add_flight_paths(_paths)
+        return _grid
+
+    _result = time_function('heatmap_flight_paths_1000', _bin_paths, repeat=ctx.repeat, params={'members': 1000, 'tracks': True})
+    _result['members_per_second'] = 1000 / _result['median']
+    _results.append(_result)
+
+    # Outputs, from the million-member grid, smoothed with a 1km kernel.
+    _grid = _bin_landings()
+    _results.append(time_function('heatmap_contours', lambda: _grid.contours(levels=(0.5, 0.9, 0.99), bandwidth=1000.0),
+        repeat=ctx.repeat, params={'rows': _grid.rows, 'cols': _grid.cols}))
+
+    _png = os.path.join(ctx.workdir, "heatmap.png")
+    _result = time_function('heatmap_png', lambda: _grid.write_png(_png, bandwidth=1000.0), repeat=ctx.repeat, params={'rows': _grid.rows, 'cols': _grid.cols})
+    _result['bytes'] = os.path.getsize(_png)
+    _results.append(_result)
+
+    return _results
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+#
+#   Project Horus
+#   CUSF Standalone Predictor Python Wrapper - Time-Lagged Comparison Benchmarks
+#   Copyright 2020 Mark Jessop <vk5qi@rfhead.net>
+#
+#   Time comparing a launch across an archive of model cycles (cusfpredict.lagged), against running
+#   pred once per cycle in turn, and against a single prediction through a warm engine handle.
+#   Each cycle is a synthetic dataset with a different seed. Requires both --pred and --lib.
+#
+import datetime
+import os
+import shutil
+
+from harness import time_function
+from bench_core import scenario
+
+
+# Model cycles compared.
+CYCLES = 4
+
+
+def run(ctx):
+    if ctx.pred is None or ctx.lib is None:
+        return []
+
+    from synthetic import write_synthetic_dataset
+    from cusfpredict.archive import Archive
+    from cusfpredict.engine import Engine
+    from cusfpredict.gfs import write_dataset_info
+    from cusfpredict.lagged import LaggedComparison
+    from cusfpredict.predict import Predictor
+
+    _archive_dir = os.path.join(ctx.workdir, 'lagged_archive')
+    _dataset_dir = os.path.join(ctx.workdir, 'lagged_dataset')
+    shutil.rmtree(_archive_dir, ignore_errors=True)
+
+    # Each cycle's data starts at its model time, so older cycles need more hours to cover the launch.
+    _hours = min(ctx.hours, 6)
+    _cycles = [ctx.model_dt - datetime.timedelta(hours=6*_i) for _i in range(CYCLES)]
+    _archive = Archive(_archive_dir)
+    for (_i, _cycle) in enumerate(_cycles):
+        shutil.rmtree(_dataset_dir, ignore_errors=True)
+        write_synthetic_dataset(_dataset_dir, hours=_hours + 6*_i, model_dt=_cycle, seed=_i, **ctx.dataset_params())
+        write_dataset_info(_dataset_dir, _cycle)
+        _archive.add(_dataset_dir, _cycle)
+    shutil.rmtree(_dataset_dir, ignore_errors=True)
+
+    _scenario = scenario(ctx)
+    _params = {'cycles': CYCLES}
+    _results = []
+    try:
+        _predictors = [Predictor(bin_path=ctx.pred, gfs_path=_archive_dir, cycle=_cycle) for _cycle in _cycles]
+        _results.append(time_function('lagged_sequential_pred',
+            lambda: [_predictor.predict(**_scenario) for _predictor in _predictors],
+            repeat=ctx.repeat, params=_params))
+
+        with Engine(gfs_path=_archive.path(_cycles[0]), lib_path=ctx.lib) as _engine:
+            _results.append(time_function('lagged_single_warm', lambda: _engine.predict(**_scenario),
+                repeat=ctx.repeat))
+
+        # First comparison, opening a handle per cycle and loading its wind data.
+        _comparisons = []
+        _results.append(time_function('lagged_compare_cold', lambda _comparison: _comparison.compare(_scenario, count=CYCLES),
+            setup=lambda: _comparisons.append(LaggedComparison(_archive_dir, lib_path=ctx.lib)) or _comparisons[-1],
+            repeat=ctx.repeat, params=_params))
+        for _comparison in _comparisons:
+            _comparison.close()
+
+        with LaggedComparison(_archive_dir, lib_path=ctx.lib) as _comparison:
+            _spread = _comparison.compare(_scenario, count=CYCLES)['spread']
+            _result = time_function('lagged_compare_warm', lambda: _comparison.compare(_scenario, count=CYCLES),
+                repeat=ctx.repeat, params=_params)
+            _result['speedup'] = _results[0]['median'] / _result['median']
+            _result['single_ratio'] = _result['median'] / _results[1]['median']
+            if _spread is not None:
+                _result['landing_rms_distance_m'] = _spread['rms_distance']
+                _result['landing_max_distance_m'] = _spread['max_distance']
+            _results.append(_result)
+    finally:
+        shutil.rmtree(_archive_dir, ignore_errors=True)
+
+    return _results
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+#
+#   Project Horus
+#   CUSF Standalone Predictor Python Wrapper - Live Descent Re-Prediction Benchmarks
+#   Copyright 2020 Mark Jessop <vk5qi@rfhead.net>
+#
+#   Per-update latency of cusfpredict.live.LivePredictor, fed with a simulated descent
+#   (with GPS-like position and altitude noise), compared against running pred in descent mode.
+#
+import calendar
+import datetime
+import random
+
+from harness import time_function, make_result
+
+
+def simulated_telemetry(wind, timestamp, lat, lon, alt, descent_rate=6.0, interval=2.0, noise=5.0, seed=0):
+    ''' Simulate telemetry from a descending payload, as a list of (timestamp, lat, lon, alt) fixes '''
+    from cusfpredict.live import predict_descent
+
+    _rng = random.Random(seed)
+    _path = predict_descent(wind, timestamp, lat, lon, alt, descent_rate, altitude_step=10.0, max_timestep=1.0)
+
+    _fixes = []
+    _next = _path[0][0]
+    for _point in _path:
+        if _point[0] >= _next:
+            _fixes.append((_point[0],
+                _point[1] + _rng.gauss(0.0, noise) / 111320.0,
+                _point[2] + _rng.gauss(0.0, noise) / 91000.0,
+                _point[3] + _rng.gauss(0.0, noise)))
+            _next += interval
+
+    return _fixes
+
+
+def run(ctx):
+    from cusfpredict.live import LivePredictor
+    from cusfpredict.wind import WindDataset
+
+    _wind = WindDataset(ctx.cusf_dataset(), max_tiles=24)
+    _start = calendar.timegm((ctx.model_dt + datetime.timedelta(hours=1)).timetuple())
+    _fixes = simulated_telemetry(_wind, _start, ctx.lat - 0.5, ctx.lon + 0.3, 20000.0)
+
+    _results = []
+
+    # Feed the whole descent through a live predictor, timing every update.
+    _live = LivePredictor(wind=_wind)
+    _times = []
+    _reused = 0
+    for _fix in _fixes:
+        _result = _live.add_fix(*_fix)
+        if _result is not None:
+            _times.append(_result['compute_time'])
+            _reused += 1 if _result['reused'] else 0
+
+    _result = make_result('live_update', _times, params={'fixes': len(_fixes), 'interval': 2.0},
+        reused_fraction=_reused / float(len(_times)))
+    print("    %d updates, %.0f%% re-used previous solution, p99 %.2f ms" % (len(_times), 100.0*_result['reused_fraction'], _result['p99']*1e3))
+    _results.append(_result)
+
+    # Cost of a full re-integration from the top of the descent.
+    _results.append(time_function('live_full_solution', lambda: (_live.reset(), _live.add_fix(*_fixes[0]), _live.add_fix(*_fixes[1])), repeat=ctx.repeat))
+
+    # The same update using pred in descent mode, for comparison.
+    if ctx.pred is not None:
+        from cusfpredict.predict import Predictor
+        _pred = Predictor(bin_path=ctx.pred, gfs_path=ctx.cusf_dataset())
+        _fix = _fixes[len(_fixes)//2]
+        _results.append(time_function('live_update_pred_subprocess', lambda: _pred.predict(
+            launch_lat=_fix[1], launch_lon=_fix[2], launch_alt=_fix[3], descent_rate=6.0,
+            launch_time=datetime.datetime.utcfromtimestamp(_fix[0]), descent_mode=True), repeat=ctx.repeat))
+
+    return _results
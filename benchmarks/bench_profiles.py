@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+#
+#   Project Horus
+#   CUSF Standalone Predictor Python Wrapper - Download Profile Benchmarks
+#   Copyright 2020 Mark Jessop <vk5qi@rfhead.net>
+#
+#   Ingest a model cycle (FUTURE hours of the 0p25_1hr model) under each download profile
+#   (cusfpredict.gfs.DOWNLOAD_PROFILES), through ingest_forecast_hour for each planned request, and
+#   compare the bytes downloaded and the total ingest time against the full download.
+#   The GRIB filter is stood in for by a local HTTP server, which returns a synthetic GRIB file with
+#   the area and pressure levels of each request. The server responds immediately, so the ingest time
+#   is that of transferring, decoding and writing the data: the time the GRIB filter would take to
+#   handle the requests (at most REQUEST_RATE_LIMIT per second) is reported separately.
+#   To keep the run time down, one request of each distinct area and set of levels is ingested, and
+#   its time (and size) counted for each of the requests like it.
+#   Requires the eccodes module.
+#
+import os
+import shutil
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from harness import make_result
+
+
+# Forecast hours ingested.
+FUTURE = 192
+
+
+def _request_area(query):
+    ''' Centre and radius of the area of a GRIB filter request, and its pressure levels. '''
+    _bounds = {_key: float(query[_key][0]) for _key in ('toplat', 'bottomlat', 'leftlon', 'rightlon')}
+    _levels = sorted([float(_key[4:-3]) for _key in query if _key.startswith('lev_')], reverse=True)
+    return ((_bounds['toplat'] + _bounds['bottomlat']) / 2.0,
+        (_bounds['leftlon'] + _bounds['rightlon']) / 2.0,
+        (_bounds['toplat'] - _bounds['bottomlat']) / 2.0,
+        tuple(_levels))
+
+
+def _serve_filter(make_grib):
+    ''' Serve a GRIB file for each distinct request area and set of levels, made (once) by make_grib(lat, lon, radius, levels) '''
+    _responses = {}
+
+    class _FilterHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            _key = _request_area(parse_qs(urlparse(self.path).query, keep_blank_values=True))
+            if _key not in _responses:
+                _responses[_key] = make_grib(*_key)
+            _data = _responses[_key]
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(_data)))
+            self.end_headers()
+            self.wfile.write(_data)
+
+        def log_message(self, format, *args):
+            pass
+
+    _server = ThreadingHTTPServer(('127.0.0.1', 0), _FilterHandler)
+    threading.Thread(target=_server.serve_forever, daemon=True).start()
+    return (_server, _responses)
+
+
+def run(ctx):
+    if ctx.grib_files() is None:
+        return []
+
+    from synthetic import synthetic_wind_dict, write_grib
+    from cusfpredict import gfs, metrics
+
+    _grib_dir = os.path.join(ctx.workdir, 'profile_grib')
+    _output_dir = os.path.join(ctx.workdir, 'profile_dataset')
+    os.makedirs(_grib_dir, exist_ok=True)
+
+    def _make_grib(lat, lon, radius, levels):
+        _filename = write_grib(synthetic_wind_dict(0, lat=lat, lon=lon, radius=radius, resolution=ctx.resolution, levels=levels),
+            os.path.join(_grib_dir, 'response.grib'), ctx.model_dt, 0)
+        with open(_filename, 'rb') as _f:
+            return _f.read()
+
+    (_server, _responses) = _serve_filter(_make_grib)
+
+    _model = '0p25_1hr'
+    _bench_model = 'profile_benchmark'
+    gfs.VALID_MODELS[_bench_model] = dict(gfs.VALID_MODELS[_model],
+        filter_url='http://127.0.0.1:%d/filter' % _server.server_port, resolution=ctx.resolution)
+    _times = gfs.VALID_MODELS[_model]['times']
+    _forecast_times = _times[:gfs.find_nearest(_times, FUTURE)+1]
+
+    _downloaded = {'bytes': 0}
+    def _count_bytes(kind, name, value, labels):
+        if name == 'download_bytes':
+            _downloaded['bytes'] += value
+
+    _results = []
+    metrics.add_hook(_count_bytes)
+    try:
+        _repeat = max(1, ctx.repeat // 3)
+        for _profile in gfs.DOWNLOAD_PROFILES:
+            _plan = gfs.plan_downloads(model=_bench_model, model_dt=ctx.model_dt, forecast_times=_forecast_times,
+                profile=_profile, lat=ctx.lat, lon=ctx.lon, latdelta=ctx.radius, londelta=ctx.radius)
+
+            # Group the requests by area and levels, and make the server's responses before timing.
+            _groups = {}
+            for _request in _plan:
+                _key = _request_area({_key: [_value] for (_key, _value) in _request['params'].items()})
+                _groups.setdefault(_key, []).append(_request)
+                if _key not in _responses:
+                    _responses[_key] = _make_grib(*_key)
+
+            _times = [0.0] * _repeat
+            _bytes = 0
+            for _requests in _groups.values():
+                _request = _requests[0]
+                # The first run warms up the decoder.
+                for _i in range(-1, _repeat):
+                    shutil.rmtree(_output_dir, ignore_errors=True)
+                    os.makedirs(_output_dir)
+                    _downloaded['bytes'] = 0
+                    _start = time.perf_counter()
+                    if not gfs.ingest_forecast_hour(model=_bench_model, model_dt=ctx.model_dt, forecast_time=_request['forecast_time'],
+                        lat=ctx.lat, lon=ctx.lon, latdelta=_request['latdelta'], londelta=_request['londelta'],
+                        output_dir=_output_dir, levels=_request['levels']):
+                        raise Exception("Could not ingest T+%03d" % _request['forecast_time'])
+                    if _i >= 0:
+                        _times[_i] += len(_requests) * (time.perf_counter() - _start)
+                _bytes += len(_requests) * _downloaded['bytes']
+
+            _summary = gfs.summarise_plan(_plan)
+            _result = make_result('profile_%s' % _profile, _times,
+                params={'profile': _profile, 'future': FUTURE, 'radius': ctx.radius},
+                requests=_summary['requests'],
+                request_shapes=len(_groups),
+                bytes=_bytes,
+                estimated_bytes=_summary['bytes'],
+                filter_time=_summary['requests'] / gfs.REQUEST_RATE_LIMIT)
+            if _results:
+                _result['bytes_ratio'] = _result['bytes'] / _results[0]['bytes']
+                _result['time_ratio'] = _result['median'] / _results[0]['median']
+                _result['requests_ratio'] = _result['requests'] / _results[0]['requests']
+            _results.append(_result)
+    finally:
+        metrics.remove_hook(_count_bytes)
+        del gfs.VALID_MODELS[_bench_model]
+        _server.shutdown()
+        shutil.rmtree(_grib_dir, ignore_errors=True)
+        shutil.rmtree(_output_dir, ignore_errors=True)
+
+    return _results
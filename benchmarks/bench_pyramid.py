@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+#
+#   Project Horus
+#   CUSF Standalone Predictor Python Wrapper - Tile Pyramid Benchmarks
+#   Copyright 2020 Mark Jessop <vk5qi@rfhead.net>
+#
+#   Compare predictions against the full resolution data, and each downsampled level written by
+#   cusfpredict.gfs.write_pyramid, over a set of reference scenarios: the time to run each scenario,
+#   the disk space of each level, and the landing position error relative to the full resolution data.
+#
+import datetime
+import os
+import time
+
+from harness import make_result
+
+
+# Reference scenarios: launch offsets from the dataset centre (degrees), launch time offsets (hours) and burst altitudes.
+LAUNCH_OFFSETS = [(-0.9, 0.5), (0.5, -0.5), (0.0, 0.0), (0.8, 0.8)]
+HOUR_OFFSETS = [1, 2]
+BURST_ALTS = [20000.0, 30000.0]
+
+
+def reference_scenarios(ctx):
+    _scenarios = []
+    for (_dlat, _dlon) in LAUNCH_OFFSETS:
+        for _hour in HOUR_OFFSETS:
+            for _burst_alt in BURST_ALTS:
+                _scenarios.append({
+                    'launch_lat': ctx.lat + _dlat,
+                    'launch_lon': ctx.lon + _dlon,
+                    'launch_alt': 0.0,
+                    'ascent_rate': 5.0,
+                    'descent_rate': 6.0,
+                    'burst_alt': _burst_alt,
+                    'launch_time': ctx.model_dt + datetime.timedelta(hours=_hour),
+                })
+    return _scenarios
+
+
+def _disk_bytes(directory):
+    return sum(_entry.stat().st_size for _entry in os.scandir(directory) if _entry.is_file())
+
+
+def run(ctx):
+    if ctx.pred is None:
+        return []
+
+    from synthetic import write_synthetic_dataset
+    from cusfpredict.gfs import PYRAMID_LEVELS
+    from cusfpredict.live import distance_metres
+    from cusfpredict.predict import Predictor
+
+    _gfs = os.path.join(ctx.workdir, 'gfs_pyramid')
+    write_synthetic_dataset(_gfs, hours=min(ctx.hours, 6), model_dt=ctx.model_dt, pyramid=True, **ctx.dataset_params())
+
+    _pred = Predictor(bin_path=ctx.pred, gfs_path=_gfs)
+    _scenarios = reference_scenarios(ctx)
+
+    _results = []
+    _landings = {}
+    for _level in [None] + sorted(PYRAMID_LEVELS.keys()):
+        _name = _level if _level else 'full'
+        _times = []
+        _landings[_name] = []
+        for _i in range(ctx.repeat + 1):
+            for _scenario in _scenarios:
+                _start = time.perf_counter()
+                _path = _pred.predict(resolution=_level, **_scenario)
+                _duration = time.perf_counter() - _start
+                if _i == 0:
+                    _landings[_name].append(_path[-1] if _path else None)
+                else:
+                    _times.append(_duration)
+
+        _errors = []
+        for (_full, _landing) in zip(_landings['full'], _landings[_name]):
+            if (_full is not None) and (_landing is not None):
+                _errors.append(distance_metres(_full[1], _full[2], _landing[1], _landing[2]))
+
+        _result = make_result('pyramid_predict_%s' % _name, _times, params={'scenarios': len(_scenarios)},
+            disk_bytes=_disk_bytes(os.path.join(_gfs, _level) if _level else _gfs),
+            failed=sum(1 for _landing in _landings[_name] if _landing is None))
+        if _errors:
+            _errors.sort()
+            _result['landing_error_median_m'] = _errors[len(_errors)//2]
+            _result['landing_error_max_m'] = _errors[-1]
+        _results.append(_result)
+
+    # Speed-up relative to the full resolution data.
+    for _result in _results:
+        _result['speedup'] = _results[0]['median'] / _result['median']
+
+    return _results
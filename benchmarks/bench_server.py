@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+#
+#   Project Horus
+#   CUSF Standalone Predictor Python Wrapper - Prediction Service Load Test
+#   Copyright 2020 Mark Jessop <vk5qi@rfhead.net>
+#
+#   Generate concurrent load against the HTTP prediction service (cusfpredict.server),
+#   and report latency percentiles, throughput and response status counts.
+#
+#   As part of the benchmark suite, a service is started against the synthetic dataset.
+#   It can also be pointed at a running service:
+#       python benchmarks/bench_server.py --url http://127.0.0.1:8080 --clients 16 --requests 200 --unique 4
+#
+import argparse
+import datetime
+import json
+import os
+import sys
+import threading
+import time
+import numpy as np
+import requests
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+
+def load_scenarios(launch_time, unique=4, lat=-34.9, lon=138.5):
+    ''' A set of <unique> distinct prediction requests '''
+    _scenarios = []
+    for _i in range(unique):
+        _scenarios.append({
+            'launch_lat': lat,
+            'launch_lon': lon,
+            'ascent_rate': 5.0,
+            'descent_rate': 6.0,
+            'burst_alt': 20000.0 + 250.0*_i,
+            'launch_time': launch_time.strftime("%Y-%m-%dT%H:%M:%SZ")
+        })
+    return _scenarios
+
+
+def run_load(url, scenarios, clients=8, count=100, timeout=120.0):
+    '''
+    Send <count> prediction requests from <clients> concurrent clients, cycling through the list of scenarios.
+    Returns a dictionary of latency percentiles (seconds), throughput, and response status counts.
+    '''
+    _local = threading.local()
+    _lock = threading.Lock()
+    _latencies = []
+    _statuses = {}
+
+    def _request(index):
+        if not hasattr(_local, 'session'):
+            _local.session = requests.Session()
+
+        _start = time.perf_counter()
+        try:
+            _status = _local.session.post(url.rstrip('/') + '/predict', data=json.dumps(scenarios[index % len(scenarios)]), timeout=timeout).status_code
+        except Exception:
+            _status = 'error'
+        _latency = time.perf_counter() - _start
+
+        with _lock:
+            _statuses[str(_status)] = _statuses.get(str(_status), 0) + 1
+            if _status == 200:
+                _latencies.append(_latency)
+
+    _start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as _pool:
+        list(_pool.map(_request, range(count)))
+    _duration = time.perf_counter() - _start
+
+    _result = {
+        'clients': clients,
+        'requests': count,
+        'unique': len(scenarios),
+        'duration': _duration,
+        'throughput': count / _duration,
+        'statuses': _statuses,
+    }
+    if _latencies:
+        _result.update({
+            'p50': float(np.percentile(_latencies, 50)),
+            'p90': float(np.percentile(_latencies, 90)),
+            'p99': float(np.percentile(_latencies, 99)),
+            'max': float(np.max(_latencies)),
+        })
+
+    return _result
+
+
+def print_load_result(name, result):
+    if 'p50' in result:
+        print("%-40s p50 %8.1f ms  p90 %8.1f ms  p99 %8.1f ms  max %8.1f ms  %6.1f req/s  %s" % (
+            name, result['p50']*1e3, result['p90']*1e3, result['p99']*1e3, result['max']*1e3, result['throughput'], json.dumps(result['statuses'])))
+    else:
+        print("%-40s no successful requests  %s" % (name, json.dumps(result['statuses'])))
+
+
+def run(ctx):
+    ''' Start a prediction service against the synthetic dataset, and load test it. '''
+    if ctx.pred is None:
+        return []
+
+    from cusfpredict.server import PredictionService, PredictionServer
+
+    _workers = os.cpu_count() or 1
+    _service = PredictionService(bin_path=ctx.pred, gfs_path=ctx.cusf_dataset(), workers=_workers, max_queue=_workers*4)
+    _server = PredictionServer(_service, port=0)
+    _thread = threading.Thread(target=_server.serve_forever, daemon=True)
+    _thread.start()
+    _url = "http://127.0.0.1:%d" % _server.server_port
+
+    _launch_time = ctx.model_dt + datetime.timedelta(hours=1)
+    _count = max(ctx.repeat * 8, 20)
+
+    _results = []
+    try:
+        for (_name, _unique, _clients) in [
+                ('server_coalesced', 1, 16),
+                ('server_distinct', _count, _workers),
+                ('server_overload', _count, _workers*8)]:
+            _result = run_load(_url, load_scenarios(_launch_time, unique=_unique, lat=ctx.lat-0.9, lon=ctx.lon+0.5), clients=_clients, count=_count)
+            _result['name'] = _name
+            _result['params'] = {'workers': _workers, 'max_queue': _service.max_queue}
+            _result['median'] = _result.get('p50')
+            print_load_result(_name, _result)
+            _results.append(_result)
+
+        _results[-1]['service_stats'] = _service.status()['stats']
+    finally:
+        _server.shutdown()
+        _server.server_close()
+        _service.close()
+
+    return _results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', type=str, default='http://127.0.0.1:8080', help="Prediction service URL.")
+    parser.add_argument('--clients', type=int, default=8, help="Number of concurrent clients.")
+    parser.add_argument('--requests', type=int, default=100, help="Total number of requests.")
+    parser.add_argument('--unique', type=int, default=4, help="Number of distinct prediction scenarios.")
+    parser.add_argument('--time', type=str, default=None, help="Launch time (UTC). Default: Now")
+    parser.add_argument('--lat', type=float, default=-34.9, help="Launch latitude.")
+    parser.add_argument('--lon', type=float, default=138.5, help="Launch longitude.")
+    args = parser.parse_args()
+
+    from dateutil.parser import parse
+    _launch_time = parse(args.time) if args.time else datetime.datetime.utcnow()
+
+    _result = run_load(args.url, load_scenarios(_launch_time, unique=args.unique, lat=args.lat, lon=args.lon), clients=args.clients, count=args.requests)
+    print_load_result("load test", _result)
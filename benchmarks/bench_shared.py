@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+#
+#   Project Horus
+#   CUSF Standalone Predictor Python Wrapper - Shared-Memory Wind Dataset Benchmarks
+#   Copyright 2020 Mark Jessop <vk5qi@rfhead.net>
+#
+#   Time decoding the synthetic dataset into shared memory and attaching to it, and compare
+#   the memory each worker process needs to hold the whole dataset: its own parsed copy of
+#   every tile (cusfpredict.wind.WindDataset), versus attaching to a SharedWindDataset.
+#
+import multiprocessing
+import os
+
+from harness import time_function
+
+
+def _resident_bytes():
+    ''' Private (non-shared) resident memory of this process, from /proc. '''
+    _private = 0
+    with open('/proc/self/smaps_rollup', 'r') as _f:
+        for _line in _f:
+            if _line.startswith('Private_Clean:') or _line.startswith('Private_Dirty:'):
+                _private += int(_line.split()[1]) * 1024
+    return _private
+
+
+def _worker_memory(gfs_path, name):
+    ''' Load the whole dataset in a worker process, returning the increase in private memory and a wind value. '''
+    from cusfpredict.shared import SharedWindDataset
+    from cusfpredict.wind import WindDataset
+
+    _before = _resident_bytes()
+    if name:
+        _wind = SharedWindDataset.attach(name)
+    else:
+        _wind = WindDataset(gfs_path, max_tiles=10000)
+        for _file in _wind.files:
+            _wind.tile(_file[-1])
+    # Touch every tile, as an analysis would.
+    _sum = 0.0
+    for _file in _wind.files:
+        _sum += float(_wind.tile(_file[-1]).u.sum())
+    _used = _resident_bytes() - _before
+    if name:
+        _wind.close()
+    return (_used, _sum)
+
+
+def _in_worker(gfs_path, name):
+    # A freshly spawned worker for each measurement, so nothing is already loaded.
+    with multiprocessing.get_context('spawn').Pool(1) as _pool:
+        return _pool.apply(_worker_memory, (gfs_path, name))
+
+
+def run(ctx):
+    if not os.path.exists('/proc/self/smaps_rollup'):
+        return []
+
+    from cusfpredict.shared import SharedWindDataset
+
+    _gfs_path = ctx.cusf_dataset()
+    _results = []
+
+    _datasets = []
+    _result = time_function('shared_create', lambda: _datasets.append(SharedWindDataset.create(_gfs_path)),
+        repeat=1, warmup=0)
+    _dataset = _datasets[-1]
+    _result['tiles'] = len(_dataset.files)
+    _result['segment_bytes'] = _dataset.shm.size
+    _results.append(_result)
+
+    try:
+        _result = time_function('shared_attach', lambda: SharedWindDataset.attach(_dataset.name).close(),
+            repeat=ctx.repeat * 4)
+        _results.append(_result)
+
+        # Memory required in each worker to hold the whole dataset.
+        for (_label, _name) in [('private', None), ('shared', _dataset.name)]:
+            _memory = []
+            _result = time_function('shared_worker_%s' % _label,
+                lambda: _memory.append(_in_worker(_gfs_path, _name)),
+                repeat=1, warmup=0)
+            _result['worker_bytes'] = _memory[-1][0]
+            _results.append(_result)
+    finally:
+        _dataset.close()
+
+    return _results
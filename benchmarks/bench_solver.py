@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+#
+#   Project Horus
+#   CUSF Standalone Predictor Python Wrapper - Launch Parameter Solver Benchmarks
+#   Copyright 2020 Mark Jessop <vk5qi@rfhead.net>
+#
+#   Run cusfpredict.solver.LaunchSolver against the synthetic dataset, with a target offset from a
+#   known landing, and report how much of the search space was covered within the time budget.
+#   The search is then repeated, to measure the benefit of the prediction cache.
+#
+import datetime
+import os
+
+from harness import make_result
+from bench_core import scenario
+
+
+def run(ctx):
+    if ctx.pred is None:
+        return []
+
+    from cusfpredict.predict import Predictor
+    from cusfpredict.solver import LaunchSolver, Target
+
+    _scenario = scenario(ctx, burst_alt=20000.0)
+    _landing = Predictor(bin_path=ctx.pred, gfs_path=ctx.cusf_dataset()).predict(**_scenario)[-1]
+    _target = Target(lat=_landing[1] + 0.05, lon=_landing[2] - 0.05, radius=500.0)
+
+    _ranges = {
+        'ascent_rate': (4.0, 6.0),
+        'burst_alt': (16000.0, 24000.0),
+        'launch_time': (_scenario['launch_time'] - datetime.timedelta(minutes=30), _scenario['launch_time'] + datetime.timedelta(minutes=30)),
+    }
+    _fixed = {'launch_lat': _scenario['launch_lat'], 'launch_lon': _scenario['launch_lon'], 'descent_rate': _scenario['descent_rate']}
+    _workers = os.cpu_count() or 1
+    _budget = 30.0
+
+    _results = []
+    _solver = LaunchSolver(bin_path=ctx.pred, gfs_path=ctx.cusf_dataset(), workers=_workers)
+    try:
+        for _name in ['solver_cold', 'solver_cached']:
+            _predictions = _solver.stats['predictions']
+            _result = _solver.solve(_target, _ranges, fixed=_fixed, grid=3, budget=_budget)
+            _predictions = _solver.stats['predictions'] - _predictions
+
+            _results.append(make_result(_name, [_result['elapsed']], params={'workers': _workers, 'budget': _budget, 'grid': 3},
+                evaluated=_result['evaluated'],
+                predictions=_predictions,
+                rounds=_result['rounds'],
+                evaluations_per_second=_result['evaluated'] / _result['elapsed'],
+                pareto_options=len(_result['options']),
+                best_distance=_result['best']['distance'] if _result['best'] else None))
+            print("    %d options evaluated (%d predictions) in %d rounds, best miss distance %s" % (
+                _result['evaluated'], _predictions, _result['rounds'],
+                "%.0f m" % _results[-1]['best_distance'] if _results[-1]['best_distance'] is not None else "n/a"))
+    finally:
+        _solver.close()
+
+    return _results
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+#
+#   Project Horus
+#   CUSF Standalone Predictor Python Wrapper - Start-up Benchmarks
+#   Copyright 2020 Mark Jessop <vk5qi@rfhead.net>
+#
+#   Time importing each of the commonly used modules (in a fresh interpreter), and constructing
+#   a Predictor, both the first time (which runs the binary to check it) and after that.
+#   Short-lived scripts and per-request handlers pay these costs on every run.
+#
+import os
+import subprocess
+import sys
+
+from harness import time_function, make_result
+
+
+IMPORT_MODULES = [
+    'cusfpredict.predict',
+    'cusfpredict.utils',
+    'cusfpredict.wind',
+    'cusfpredict.gfs',
+    'cusfpredict.server',
+]
+
+_IMPORT_SCRIPT = "import time; _start = time.perf_counter(); import %s; print(time.perf_counter() - _start)"
+
+
+def _time_import(ctx, module):
+    _env = dict(os.environ)
+    _env['PYTHONPATH'] = os.pathsep.join(sys.path)
+
+    _times = []
+    for _i in range(ctx.repeat + 1):
+        _p = subprocess.run([sys.executable, '-c', _IMPORT_SCRIPT % module],
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, env=_env)
+        if _p.returncode != 0:
+            # Missing dependencies.
+            return None
+        if _i > 0:
+            _times.append(float(_p.stdout.decode('ascii').strip().split('\n')[-1]))
+
+    return make_result('import_%s' % module.split('.')[-1], _times)
+
+
+def run(ctx):
+    _results = []
+
+    for _module in IMPORT_MODULES:
+        _result = _time_import(ctx, _module)
+        if _result is not None:
+            _results.append(_result)
+
+    if ctx.pred is not None:
+        from cusfpredict import predict
+        _gfs = ctx.cusf_dataset()
+
+        def _clear():
+            predict._valid_binaries.clear()
+            predict._valid_gfs_paths.clear()
+
+        _results.append(time_function('predictor_construct_first',
+            lambda _arg: predict.Predictor(bin_path=ctx.pred, gfs_path=_gfs), setup=_clear, repeat=ctx.repeat))
+        _results.append(time_function('predictor_construct',
+            lambda: predict.Predictor(bin_path=ctx.pred, gfs_path=_gfs), repeat=ctx.repeat * 20))
+
+    return _results
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+#
+#   Project Horus
+#   CUSF Standalone Predictor Python Wrapper - Landing Surrogate Benchmarks
+#   Copyright 2020 Mark Jessop <vk5qi@rfhead.net>
+#
+#   Build a small cusfpredict.surrogate grid against the synthetic dataset, then compare
+#   query latency and landing accuracy against running pred for the same launch parameters.
+#
+import datetime
+import os
+import random
+import numpy as np
+
+from harness import time_function
+from bench_core import scenario
+
+
+def run(ctx):
+    if ctx.pred is None:
+        return []
+
+    from cusfpredict.live import distance_metres
+    from cusfpredict.predict import Predictor, PredictorPool
+    from cusfpredict.surrogate import build_surrogate
+
+    _base = scenario(ctx)
+    _site = {'name': 'Benchmark', 'latitude': _base['launch_lat'], 'longitude': _base['launch_lon'], 'altitude': 0.0}
+    _axes = {
+        'launch_time': [_base['launch_time'] + datetime.timedelta(hours=_h) for _h in (0, 1, 2)],
+        'ascent_rate': [4.0, 5.0, 6.0],
+        'burst_alt': [18000.0, 22000.0, 26000.0],
+        'descent_rate': [5.0, 7.0],
+    }
+
+    _results = []
+    _workers = os.cpu_count() or 1
+    _pool = PredictorPool(bin_path=ctx.pred, gfs_path=ctx.cusf_dataset(), workers=_workers)
+    try:
+        _surrogates = []
+        _result = time_function('surrogate_build', lambda: _surrogates.append(build_surrogate(_pool, _site, _axes)),
+            repeat=1, warmup=0, params={'workers': _workers})
+        _surrogate = _surrogates[-1]
+        _result['predictions'] = _surrogate.size
+        _results.append(_result)
+    finally:
+        _pool.close()
+
+    _filename = os.path.join(ctx.workdir, "surrogate.npz")
+    _surrogate.save(_filename)
+
+    # Random queries within the grid.
+    _rng = random.Random(0)
+    _start = _axes['launch_time'][0]
+    _queries = [(_start + datetime.timedelta(seconds=_rng.uniform(0, 7200)), round(_rng.uniform(4.0, 6.0), 1),
+        int(_rng.uniform(18000, 26000)), round(_rng.uniform(5.0, 7.0), 1)) for _i in range(max(ctx.repeat, 5))]
+
+    _result = time_function('surrogate_query', lambda: [_surrogate.query(*_q) for _q in _queries], repeat=ctx.repeat*20,
+        params={'queries': len(_queries)})
+    for _key in ['min', 'mean', 'median', 'p95', 'p99', 'max']:
+        _result[_key] /= len(_queries)
+    _result['file_bytes'] = os.path.getsize(_filename)
+
+    # Accuracy against pred, and how well the error estimate covers the actual error.
+    _predictor = Predictor(bin_path=ctx.pred, gfs_path=ctx.cusf_dataset())
+    _errors = []
+    _estimates = []
+    for _q in _queries:
+        _landing = _predictor.predict(launch_lat=_site['latitude'], launch_lon=_site['longitude'], launch_time=_q[0],
+            ascent_rate=_q[1], burst_alt=_q[2], descent_rate=_q[3])[-1]
+        _answer = _surrogate.query(*_q)
+        _errors.append(distance_metres(_answer['landing'][1], _answer['landing'][2], _landing[1], _landing[2]))
+        _estimates.append(_answer['error'])
+
+    _result['error_median'] = float(np.median(_errors))
+    _result['error_max'] = float(np.max(_errors))
+    _result['estimate_coverage'] = float(np.mean(np.array(_errors) <= 2.0*np.array(_estimates)))
+    print("    %.1f us per query, landing error median %.0f m (max %.0f m), %.0f%% within 2x the error estimate" % (
+        _result['median']*1e6, _result['error_median'], _result['error_max'], 100.0*_result['estimate_coverage']))
+    _results.append(_result)
+
+    _results.append(time_function('surrogate_equivalent_pred', lambda: _predictor.predict(launch_lat=_site['latitude'],
+        launch_lon=_site['longitude'], launch_time=_queries[0][0], ascent_rate=_queries[0][1], burst_alt=_queries[0][2],
+        descent_rate=_queries[0][3]), repeat=ctx.repeat))
+
+    return _results
@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+#
+#   Project Horus
+#   CUSF Standalone Predictor Python Wrapper - Benchmark Harness
+#   Copyright 2020 Mark Jessop <vk5qi@rfhead.net>
+#
+#   Timing helpers, and machine-readable result output, shared by the benchmark modules.
+#
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import numpy as np
+
+
+def time_function(name, func, repeat=5, warmup=1, setup=None, params=None, **extra):
+    '''
+    Time <func> over <repeat> runs (after <warmup> untimed runs).
+    If setup is provided, it is called (untimed) before each run, and its return value is passed to func.
+    Returns a result dictionary.
+    '''
+    _times = []
+    for _i in range(warmup + repeat):
+        _arg = setup() if setup else None
+        _start = time.perf_counter()
+        if setup:
+            func(_arg)
+        else:
+            func()
+        _duration = time.perf_counter() - _start
+        if _i >= warmup:
+            _times.append(_duration)
+
+    return make_result(name, _times, params=params, **extra)
+
+
+def make_result(name, times, params=None, **extra):
+    ''' Summarise a list of timings (seconds) into a result dictionary '''
+    _times = np.array(times, dtype=float)
+    _result = {
+        'name': name,
+        'repeat': len(_times),
+        'min': float(np.min(_times)),
+        'mean': float(np.mean(_times)),
+        'median': float(np.median(_times)),
+        'p95': float(np.percentile(_times, 95)),
+        'p99': float(np.percentile(_times, 99)),
+        'max': float(np.max(_times)),
+        'params': params if params else {},
+    }
+    _result.update(extra)
+
+    print("%-40s median %10.3f ms  (min %10.3f ms, max %10.3f ms, n=%d)" % (
+        name, _result['median']*1e3, _result['min']*1e3, _result['max']*1e3, _result['repeat']))
+
+    return _result
+
+
+def git_revision():
+    ''' Get the current git revision of the repository, if available '''
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.DEVNULL).decode('ascii').strip()
+    except Exception:
+        return None
+
+
+def write_results(results, filename, config=None):
+    ''' Write benchmark results out as JSON, along with information about the environment they were run in. '''
+    _output = {
+        'timestamp': datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ"),
+        'git_revision': git_revision(),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'config': config if config else {},
+        'results': results
+    }
+
+    with open(filename, 'w') as _f:
+        _f.write(json.dumps(_output, indent=2))
+
+    return _output
+
+
+def compare_results(baseline_file, current_file, threshold=0.1):
+    ''' Compare two results files, printing the change in median time for each benchmark. Returns a list of regressions. '''
+    with open(baseline_file, 'r') as _f:
+        _baseline = {_r['name']: _r for _r in json.load(_f)['results']}
+    with open(current_file, 'r') as _f:
+        _current = {_r['name']: _r for _r in json.load(_f)['results']}
+
+    _regressions = []
+    for _name in sorted(_current.keys()):
+        if _name not in _baseline:
+            continue
+        _change = (_current[_name]['median'] - _baseline[_name]['median']) / _baseline[_name]['median']
+        _flag = ""
+        if _change > threshold:
+            _flag = "  <-- REGRESSION"
+            _regressions.append(_name)
+        print("%-40s %+7.1f%%%s" % (_name, _change*100.0, _flag))
+
+    return _regressions
+
+
+class BenchmarkContext(object):
+    ''' Configuration and shared (lazily generated) synthetic datasets for a benchmark run. '''
+
+    def __init__(self, workdir, pred=None, lib=None, hours=12, resolution=0.25, radius=10.0, levels=31, repeat=5, lat=-34.0, lon=138.0):
+        self.workdir = workdir
+        self.pred = pred
+        self.lib = lib
+        self.hours = hours
+        self.resolution = resolution
+        self.radius = radius
+        self.levels = levels
+        self.repeat = repeat
+        self.lat = lat
+        self.lon = lon
+
+        # All synthetic datasets start at the beginning of the current hour.
+        self.model_dt = datetime.datetime.utcnow().replace(minute=0, second=0, microsecond=0)
+
+        self._cusf_dir = None
+        self._grib_files = None
+
+    def config(self):
+        return {
+            'pred': self.pred,
+            'lib': self.lib,
+            'hours': self.hours,
+            'resolution': self.resolution,
+            'radius': self.radius,
+            'levels': self.levels,
+            'repeat': self.repeat,
+        }
+
+    def dataset_params(self):
+        from cusfpredict.gfs import GFS_LEVELS
+        return {
+            'lat': self.lat,
+            'lon': self.lon,
+            'radius': self.radius,
+            'resolution': self.resolution,
+            'levels': GFS_LEVELS[:self.levels],
+        }
+
+    def cusf_dataset(self):
+        ''' Directory containing a synthetic CUSF dataset of <hours> tiles '''
+        if self._cusf_dir is None:
+            from synthetic import write_synthetic_dataset
+            self._cusf_dir = os.path.join(self.workdir, 'gfs')
+            _start = time.perf_counter()
+            write_synthetic_dataset(self._cusf_dir, hours=self.hours, model_dt=self.model_dt, **self.dataset_params())
+            print("Generated synthetic CUSF dataset in %.1f seconds." % (time.perf_counter() - _start))
+        return self._cusf_dir
+
+    def grib_files(self):
+        ''' List of synthetic GRIB2 files, or None if they cannot be generated (i.e. eccodes is not installed) '''
+        if self._grib_files is None:
+            try:
+                from synthetic import write_synthetic_dataset
+                self._grib_files = write_synthetic_dataset(os.path.join(self.workdir, 'grib'),
+                    hours=min(self.hours, 3), model_dt=self.model_dt, grib=True, **self.dataset_params())
+            except ImportError as e:
+                print("Cannot generate GRIB files: %s" % str(e))
+                self._grib_files = []
+        return self._grib_files if self._grib_files else None
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+#
+#   Project Horus
+#   CUSF Standalone Predictor Python Wrapper - Benchmark Runner
+#   Copyright 2020 Mark Jessop <vk5qi@rfhead.net>
+#
+#   Runs the benchmark suite against synthetic data (no network access required),
+#   and writes the results out as JSON for comparison across commits.
+#
+#   Usage:
+#       python benchmarks/run_benchmarks.py --pred ./pred -o results.json
+#       python benchmarks/run_benchmarks.py --pred ./pred -o new.json --compare results.json
+#
+import argparse
+import importlib
+import os
+import shutil
+import sys
+from tempfile import mkdtemp
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from harness import BenchmarkContext, write_results, compare_results
+
+# Benchmark modules, each providing a run(ctx) function returning a list of results.
+BENCHMARK_MODULES = [
+    'bench_core',
+    'bench_server',
+    'bench_live',
+    'bench_heatmap',
+    'bench_solver',
+    'bench_surrogate',
+    'bench_engine',
+    'bench_shared',
+    'bench_compression',
+    'bench_startup',
+    'bench_ensemble',
+    'bench_archive',
+    'bench_convert',
+    'bench_pyramid',
+    'bench_lagged',
+    'bench_batch',
+    'bench_profiles',
+]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pred', type=str, default=None, help="Location of the pred binary. Predictor benchmarks are skipped if not provided.")
+    parser.add_argument('--lib', type=str, default=None, help="Location of the libpred shared library. Engine benchmarks are skipped if not provided.")
+    parser.add_argument('-o', '--output', type=str, default='benchmark_results.json', help="Output JSON file. (Default: benchmark_results.json)")
+    parser.add_argument('--hours', type=int, default=12, help="Number of hours of synthetic data. (Default: 12)")
+    parser.add_argument('--resolution', type=float, default=0.25, help="Synthetic grid resolution (degrees). (Default: 0.25)")
+    parser.add_argument('--radius', type=float, default=10.0, help="Synthetic tile radius (degrees). (Default: 10)")
+    parser.add_argument('--levels', type=int, default=31, help="Number of pressure levels. (Default: 31)")
+    parser.add_argument('--repeat', type=int, default=5, help="Number of timed runs per benchmark. (Default: 5)")
+    parser.add_argument('--only', type=str, default=None, help="Comma-delimited list of benchmark modules to run.")
+    parser.add_argument('--workdir', type=str, default=None, help="Working directory for synthetic data. (Default: a temporary directory)")
+    parser.add_argument('--compare', type=str, default=None, help="Compare results against a previous results file.")
+    args = parser.parse_args()
+
+    _workdir = args.workdir if args.workdir else mkdtemp(prefix="cusf_bench_")
+    os.makedirs(_workdir, exist_ok=True)
+
+    _ctx = BenchmarkContext(
+        _workdir,
+        pred=os.path.abspath(args.pred) if args.pred else None,
+        lib=os.path.abspath(args.lib) if args.lib else None,
+        hours=args.hours,
+        resolution=args.resolution,
+        radius=args.radius,
+        levels=args.levels,
+        repeat=args.repeat)
+
+    _modules = BENCHMARK_MODULES
+    if args.only:
+        _modules = [_m if _m.startswith('bench_') else 'bench_' + _m for _m in args.only.split(',')]
+
+    _results = []
+    try:
+        for _module_name in _modules:
+            print("Running %s..." % _module_name)
+            _module = importlib.import_module(_module_name)
+            _results.extend(_module.run(_ctx))
+    finally:
+        if args.workdir is None:
+            shutil.rmtree(_workdir, ignore_errors=True)
+
+    write_results(_results, args.output, config=_ctx.config())
+    print("Results written to %s" % args.output)
+
+    if args.compare:
+        _regressions = compare_results(args.compare, args.output)
+        if _regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+#
+#   Project Horus
+#   CUSF Standalone Predictor Python Wrapper - Synthetic GFS Dataset Generator
+#   Copyright 2020 Mark Jessop <vk5qi@rfhead.net>
+#
+#   Generates synthetic, but physically plausible, wind datasets for offline benchmarking.
+#   Output is either CUSF-format tiles (via cusfpredict.gfs.wind_dict_to_cusf), or GRIB2
+#   files laid out like a GRIB filter response (requires the eccodes python module).
+#
+#   Geopotential heights follow the standard atmosphere, with a gentle equator-to-pole slope.
+#   Winds are westerlies with a jet stream maximum near the tropopause, plus smooth
+#   spatial and temporal variations, and a little seeded noise.
+#
+#   Usage: python synthetic.py -o ./gfs_synthetic --hours 24 --resolution 0.25 --radius 10
+#
+import argparse
+import calendar
+import datetime
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from cusfpredict.gfs import GFS_LEVELS, wind_dict_to_cusf, write_pyramid
+
+
+def standard_atmosphere_height(pressure):
+    ''' Approximate geopotential height (m) of a pressure level (hPa), using the standard atmosphere '''
+    pressure = np.asarray(pressure, dtype=float)
+    # Troposphere
+    _height = 44330.8 * (1.0 - (pressure/1013.25)**0.190263)
+    # Isothermal layer and above (approximately)
+    _strat = pressure < 226.32
+    _height[_strat] = 11000.0 - 6341.6*np.log(pressure[_strat]/226.32)
+    return _height
+
+
+def synthetic_wind_dict(valid_time,
+                        lat=-34.0,
+                        lon=138.0,
+                        radius=10.0,
+                        resolution=0.25,
+                        levels=GFS_LEVELS,
+                        seed=0):
+    ''' Generate a wind dictionary in the format produced by cusfpredict.gfs.parse_grib_to_dict '''
+
+    _rng = np.random.default_rng(seed + int(valid_time) // 3600)
+
+    # GFS data is ordered north-to-south.
+    _lats = np.round(np.arange(lat + radius, lat - radius - resolution/2, -resolution), 4)
+    _lons = np.round(np.arange(lon - radius, lon + radius + resolution/2, resolution), 4)
+    _lon_grid, _lat_grid = np.meshgrid(_lons, _lats)
+
+    _hour = (int(valid_time) % 864000) / 3600.0
+
+    output = {}
+    output['lon_scale'] = _lons
+    output['lat_scale'] = _lats
+    output['iso_scale'] = np.array(levels, dtype=float)
+    output['lon_centre'] = _lons[len(_lons)//2]
+    output['lat_centre'] = _lats[len(_lats)//2]
+    output['lon_radius'] = (max(_lons) - min(_lons))/2.0
+    output['lat_radius'] = (max(_lats) - min(_lats))/2.0
+    output['valid_time'] = int(valid_time)
+
+    _heights = standard_atmosphere_height(levels)
+
+    for _level, _base_height in zip(levels, _heights):
+        # Heights drop towards the poles, more so at altitude.
+        _hgt = _base_height - (np.abs(_lat_grid) - 30.0) * (_base_height / 2000.0)
+
+        # Jet stream near the tropopause, with smooth spatial and temporal variation.
+        _jet = 35.0 * np.exp(-((_base_height - 11000.0)/4500.0)**2)
+        _ugrd = 5.0 + _jet * np.cos(np.radians(_lat_grid + 30.0)) + 4.0*np.sin(np.radians(_lon_grid*7.0) + _hour*0.05)
+        _vgrd = 6.0 * np.sin(np.radians(_lat_grid*11.0 + _lon_grid*5.0) + _hour*0.1) * (0.5 + _base_height/30000.0)
+
+        _ugrd += _rng.normal(0.0, 0.5, _ugrd.shape)
+        _vgrd += _rng.normal(0.0, 0.5, _vgrd.shape)
+
+        output[int(_level)] = {
+            'HGT': _hgt.astype(np.float32),
+            'UGRD': _ugrd.astype(np.float32),
+            'VGRD': _vgrd.astype(np.float32)
+        }
+
+    return output
+
+
+def write_grib(data, filename, model_dt, forecast_time):
+    ''' Write a synthetic wind dictionary out to a GRIB2 file, as would be returned by the GRIB filter '''
+    import eccodes
+
+    _levels = sorted([_key for _key in data.keys() if type(_key) == int], reverse=True)
+    _lats = data['lat_scale']
+    _lons = data['lon_scale']
+
+    with open(filename, 'wb') as _f:
+        for _level in _levels:
+            for (_short_name, _param) in [('gh', 'HGT'), ('u', 'UGRD'), ('v', 'VGRD')]:
+                _h = eccodes.codes_grib_new_from_samples('regular_ll_pl_grib2')
+                eccodes.codes_set(_h, 'centre', 'kwbc')
+                eccodes.codes_set(_h, 'dataDate', int(model_dt.strftime("%Y%m%d")))
+                eccodes.codes_set(_h, 'dataTime', int(model_dt.strftime("%H%M")))
+                eccodes.codes_set(_h, 'stepUnits', 1)
+                eccodes.codes_set(_h, 'forecastTime', int(forecast_time))
+                eccodes.codes_set(_h, 'typeOfLevel', 'isobaricInhPa')
+                eccodes.codes_set(_h, 'level', int(_level))
+                eccodes.codes_set(_h, 'shortName', _short_name)
+                eccodes.codes_set(_h, 'Ni', len(_lons))
+                eccodes.codes_set(_h, 'Nj', len(_lats))
+                eccodes.codes_set(_h, 'latitudeOfFirstGridPointInDegrees', float(_lats[0]))
+                eccodes.codes_set(_h, 'latitudeOfLastGridPointInDegrees', float(_lats[-1]))
+                eccodes.codes_set(_h, 'longitudeOfFirstGridPointInDegrees', float(_lons[0]) % 360.0)
+                eccodes.codes_set(_h, 'longitudeOfLastGridPointInDegrees', float(_lons[-1]) % 360.0)
+                eccodes.codes_set(_h, 'iDirectionIncrementInDegrees', abs(float(_lons[1] - _lons[0])))
+                eccodes.codes_set(_h, 'jDirectionIncrementInDegrees', abs(float(_lats[1] - _lats[0])))
+                eccodes.codes_set(_h, 'jScansPositively', 0)
+                eccodes.codes_set_values(_h, data[_level][_param].astype(np.float64).flatten())
+                eccodes.codes_write(_h, _f)
+                eccodes.codes_release(_h)
+
+    return filename
+
+
+def write_synthetic_dataset(output_dir,
+                            hours=24,
+                            model_dt=None,
+                            lat=-34.0,
+                            lon=138.0,
+                            radius=10.0,
+                            resolution=0.25,
+                            levels=GFS_LEVELS,
+                            grib=False,
+                            seed=0,
+                            compression=None,
+                            pyramid=False):
+    '''
+    Write out a synthetic dataset of <hours> hourly CUSF tiles (or GRIB2 files if grib is True).
+    CUSF tiles can be compressed, as per cusfpredict.gfs.wind_dict_to_cusf, and the downsampled levels
+    written out with them if pyramid is True (see cusfpredict.gfs.write_pyramid).
+    The dataset starts at model_dt, which defaults to the start of the current hour (UTC).
+    Returns a list of the files written.
+    '''
+    if model_dt is None:
+        model_dt = datetime.datetime.utcnow().replace(minute=0, second=0, microsecond=0)
+
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    _files = []
+    for _hour in range(hours):
+        _valid_time = calendar.timegm((model_dt + datetime.timedelta(hours=_hour)).timetuple())
+        _data = synthetic_wind_dict(_valid_time, lat=lat, lon=lon, radius=radius, resolution=resolution, levels=levels, seed=seed)
+
+        if grib:
+            _filename = os.path.join(output_dir, "gfs.t%sz.pgrb2.f%03d.grib" % (model_dt.strftime("%H"), _hour))
+            _files.append(write_grib(_data, _filename, model_dt, _hour))
+        else:
+            (_filename, _text) = wind_dict_to_cusf(_data, output_dir=output_dir, compression=compression)
+            _files.append(_filename)
+            if pyramid:
+                write_pyramid(_data, output_dir=output_dir, compression=compression)
+
+    if not grib:
+        with open(os.path.join(output_dir, "dataset.txt"), 'w') as _f:
+            _f.write(model_dt.strftime("%Y%m%d%Hz"))
+
+    return _files
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-o', '--output_dir', type=str, default='./gfs_synthetic', help="Output directory.")
+    parser.add_argument('--hours', type=int, default=24, help="Number of hourly files to generate.")
+    parser.add_argument('--lat', type=float, default=-34.0, help="Tile centre latitude.")
+    parser.add_argument('--lon', type=float, default=138.0, help="Tile centre longitude.")
+    parser.add_argument('--radius', type=float, default=10.0, help="Tile radius (degrees).")
+    parser.add_argument('--resolution', type=float, default=0.25, help="Grid resolution (degrees).")
+    parser.add_argument('--levels', type=int, default=len(GFS_LEVELS), help="Number of pressure levels (from the surface up).")
+    parser.add_argument('--grib', action='store_true', default=False, help="Write GRIB2 files instead of CUSF tiles.")
+    parser.add_argument('--seed', type=int, default=0, help="Random seed.")
+    parser.add_argument('--compression', type=str, default=None, choices=['gzip', 'zstd'], help="Compress the CUSF tiles.")
+    parser.add_argument('--pyramid', action='store_true', default=False, help="Also write out downsampled levels of the CUSF tiles.")
+    args = parser.parse_args()
+
+    _files = write_synthetic_dataset(
+        args.output_dir,
+        hours=args.hours,
+        lat=args.lat,
+        lon=args.lon,
+        radius=args.radius,
+        resolution=args.resolution,
+        levels=GFS_LEVELS[:args.levels],
+        grib=args.grib,
+        seed=args.seed,
+        compression=args.compression,
+        pyramid=args.pyramid)
+
+    print("Wrote %d files to %s" % (len(_files), args.output_dir))
@@ -0,0 +1,401 @@
+#!/usr/bin/env python
+#
+#   Project Horus
+#   CUSF Standalone Predictor Python Wrapper - Multi-Cycle Dataset Archive
+#   Copyright 2020 Mark Jessop <vk5qi@rfhead.net>
+#
+#   Keep the datasets of past model cycles, for post-flight analysis and hindcasts, which need the
+#   model cycle that was current at launch time. Each cycle is a complete dataset directory within
+#   the archive, named by the model cycle (i.e. archive/2020101906z/), which can be used directly as
+#   a pred data directory. Ensemble member subdirectories are kept as-is.
+#
+#   Data files are hard-linked into the archive where possible: from an identical file already in
+#   the archive (i.e. when a cycle is re-archived), or otherwise from the dataset being archived,
+#   so archiving a published dataset copies no data. Files are copied if linking is not possible.
+#
+#   An index of every archived data file (ARCHIVE_INDEX_FILENAME), with its model cycle, coverage
+#   and content hash, is used to find the cycles covering a time and position without scanning
+#   the archive directories.
+#
+#   The archive can be limited to the most recent N cycles, and cycles older than the newest M can
+#   be thinned, keeping only the first few forecast hours (which are all a hindcast needs, once
+#   the following cycles are available).
+#
+#   Usage:
+#       from cusfpredict.archive import Archive
+#       archive = Archive('./archive')
+#       archive.add('./gfs')
+#       archive.apply_retention(keep=28, thin_after=4, thin_hours=12)
+#       cycle = archive.select_cycle(launch_time, lat, lon)
+#       # Predictions against the cycle current at each launch time:
+#       pred = Predictor(bin_path='./pred', gfs_path='./archive', cycle='launch')
+#
+import bisect
+import calendar
+import datetime
+import errno
+import fcntl
+import hashlib
+import logging
+import os
+import shutil
+import time
+
+from . import metrics
+from .files import cusf_files, dataset_members
+from .gfs import read_dataset_info, write_dataset_info, index_dataset, DATASET_INDEX_FILENAME
+
+
+# Index of all data files in the archive.
+ARCHIVE_INDEX_FILENAME = "archive_index.txt"
+
+# Cycle directory name format, as per cusfpredict.gfs.publish_dataset.
+CYCLE_FORMAT = "%Y%m%d%Hz"
+
+# Time from a model cycle's nominal time until it is available, used to determine which
+# cycle was current at a given time.
+PUBLISH_DELAY = datetime.timedelta(hours=4)
+
+
+def cycle_path(archive_dir, cycle):
+    ''' Path of the dataset directory of a model cycle (a datetime) within an archive. '''
+    return os.path.join(archive_dir, cycle.strftime(CYCLE_FORMAT))
+
+
+def _timestamp(value):
+    ''' Convert a datetime (UTC) into a POSIX timestamp. Numbers are returned as-is. '''
+    if isinstance(value, datetime.datetime):
+        return calendar.timegm(value.utctimetuple())
+    return value
+
+
+def _file_hash(filename):
+    _hash = hashlib.sha1()
+    with open(filename, 'rb') as _f:
+        for _block in iter(lambda: _f.read(1 << 20), b''):
+            _hash.update(_block)
+    return _hash.hexdigest()
+
+
+def _link_or_copy(source, destination):
+    ''' Hard-link source to destination, copying it if that is not possible. Returns True if linked. '''
+    try:
+        os.link(source, destination)
+        return True
+    except OSError as e:
+        if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP):
+            raise
+    shutil.copy2(source, destination)
+    return False
+
+
+def _read_dataset_index(dataset_dir):
+    ''' Read the index written by cusfpredict.gfs.write_dataset_index. Returns a list of (filename, lat, latrad, lon, lonrad, timestamp). '''
+    _entries = []
+    with open(os.path.join(dataset_dir, DATASET_INDEX_FILENAME), 'r') as _f:
+        for _line in _f:
+            if _line.startswith('#'):
+                continue
+            _fields = _line.strip().split(',')
+            _entries.append((_fields[0], float(_fields[1]), float(_fields[2]), float(_fields[3]), float(_fields[4]), int(_fields[5])))
+    return _entries
+
+
+class _ArchiveLock(object):
+    ''' Exclusive lock (fcntl) serialising changes to an archive, across processes. '''
+
+    def __init__(self, archive_dir):
+        self.path = os.path.join(archive_dir, ".lock")
+
+    def __enter__(self):
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *args):
+        fcntl.flock(self.fd, fcntl.LOCK_UN)
+        os.close(self.fd)
+
+
+class Archive(object):
+    '''
+    An archive of model cycle datasets. The index is loaded on first use, and re-loaded if another
+    process changes the archive.
+    '''
+
+    def __init__(self, archive_dir="./archive"):
+        self.archive_dir = archive_dir
+        os.makedirs(archive_dir, exist_ok=True)
+
+        # Identity (inode and modification time) of the index when it was loaded, None if there is no index yet.
+        self._index_id = -1
+        # Index entries, by cycle: a list of (member, filename, lat, latrad, lon, lonrad, timestamp, size, sha1)
+        self._entries = {}
+        # Data file timestamps, by (cycle, member, window), for lookups.
+        self._windows = {}
+
+
+    def _index_path(self):
+        return os.path.join(self.archive_dir, ARCHIVE_INDEX_FILENAME)
+
+
+    def _load(self):
+        ''' (Re-)load the index if it has changed. '''
+        # The index is replaced (never modified) when written, so a new inode means it has changed.
+        try:
+            _stat = os.stat(self._index_path())
+            _id = (_stat.st_ino, _stat.st_mtime_ns)
+        except FileNotFoundError:
+            _id = None
+
+        if _id == self._index_id:
+            return
+
+        _entries = {}
+        if _id is not None:
+            with open(self._index_path(), 'r') as _f:
+                for _line in _f:
+                    if _line.startswith('#'):
+                        continue
+                    _fields = _line.strip().split(',')
+                    _cycle = datetime.datetime.strptime(_fields[0], CYCLE_FORMAT)
+                    _entries.setdefault(_cycle, []).append((_fields[1], _fields[2],
+                        float(_fields[3]), float(_fields[4]), float(_fields[5]), float(_fields[6]),
+                        int(_fields[7]), int(_fields[8]), _fields[9]))
+
+        self._set_entries(_entries)
+        self._index_id = _id
+
+
+    def _set_entries(self, entries):
+        self._entries = entries
+        self._windows = {}
+        for (_cycle, _cycle_entries) in entries.items():
+            for _entry in _cycle_entries:
+                _key = (_cycle, _entry[0], _entry[2:6])
+                self._windows.setdefault(_key, []).append((_entry[6], _entry[1]))
+        for _timestamps in self._windows.values():
+            _timestamps.sort()
+
+
+    def _write(self, entries):
+        ''' Write out the index, and update the in-memory copy. Must be called with the lock held. '''
+        _index_file = self._index_path()
+        _temp_file = _index_file + ".tmp"
+        with open(_temp_file, 'w') as _f:
+            _f.write("# cycle, member, filename, window centre latitude, window latitude radius, window centre longitude, "
+                "window longitude radius, POSIX timestamp, size, sha1\n")
+            for _cycle in sorted(entries.keys()):
+                for _entry in entries[_cycle]:
+                    _f.write("%s,%s,%s,%s,%s,%s,%s,%d,%d,%s\n" % ((_cycle.strftime(CYCLE_FORMAT),) + _entry))
+        os.replace(_temp_file, _index_file)
+
+        self._set_entries(entries)
+        _stat = os.stat(_index_file)
+        self._index_id = (_stat.st_ino, _stat.st_mtime_ns)
+
+
+    def cycles(self):
+        ''' List the archived model cycles, oldest first. '''
+        self._load()
+        return sorted(self._entries.keys())
+
+
+    def path(self, cycle, member=None):
+        ''' Path of the data directory of a cycle (and ensemble member). '''
+        _path = cycle_path(self.archive_dir, cycle)
+        return os.path.join(_path, member) if member else _path
+
+
+    def add(self, dataset_dir, cycle=None):
+        '''
+        Archive a dataset directory (i.e. as written by cusfpredict.gfs), as the model cycle given,
+        or as per the dataset's dataset.txt. An existing copy of the cycle is replaced.
+        Returns the path of the archived dataset.
+        '''
+        _start = time.perf_counter()
+
+        if cycle is None:
+            cycle = read_dataset_info(dataset_dir)
+            if cycle is None:
+                raise ValueError("Model cycle of %s is not known." % dataset_dir)
+
+        _target = cycle_path(self.archive_dir, cycle)
+        _staging = os.path.join(self.archive_dir, ".staging-%s" % cycle.strftime(CYCLE_FORMAT))
+
+        with _ArchiveLock(self.archive_dir):
+            self._load()
+            _entries = dict(self._entries)
+
+            # Archived files, by content, to link identical files to.
+            _archived = {}
+            for (_cycle, _cycle_entries) in _entries.items():
+                for _entry in _cycle_entries:
+                    _archived[(_entry[7], _entry[8])] = os.path.join(self.path(_cycle, _entry[0]), _entry[1])
+
+            if os.path.exists(_staging):
+                shutil.rmtree(_staging)
+
+            _hashes = {}
+            _linked = 0
+            _copied = 0
+            _shared = 0
+            for _member in [''] + dataset_members(dataset_dir):
+                _source_dir = os.path.join(dataset_dir, _member) if _member else dataset_dir
+                _dest_dir = os.path.join(_staging, _member) if _member else _staging
+                os.makedirs(_dest_dir, exist_ok=True)
+
+                for _source in cusf_files(_source_dir):
+                    _filename = os.path.basename(_source)
+                    _key = (os.path.getsize(_source), _file_hash(_source))
+                    _hashes[(_member, _filename)] = _key
+                    _destination = os.path.join(_dest_dir, _filename)
+
+                    if (_key in _archived) and os.path.exists(_archived[_key]):
+                        os.link(_archived[_key], _destination)
+                        _shared += 1
+                    elif _link_or_copy(_source, _destination):
+                        _linked += 1
+                    else:
+                        _copied += 1
+
+            write_dataset_info(_staging, cycle)
+            index_dataset(_staging)
+
+            # Swap in the new copy of the cycle.
+            _replaced = None
+            if os.path.exists(_target):
+                _replaced = _target + ".replaced"
+                if os.path.exists(_replaced):
+                    shutil.rmtree(_replaced)
+                os.rename(_target, _replaced)
+            os.rename(_staging, _target)
+            if _replaced:
+                shutil.rmtree(_replaced)
+
+            _cycle_entries = []
+            for _member in [''] + dataset_members(_target):
+                for _entry in _read_dataset_index(self.path(cycle, _member)):
+                    _cycle_entries.append((_member,) + _entry + _hashes[(_member, _entry[0])])
+            _entries[cycle] = _cycle_entries
+            self._write(_entries)
+
+        metrics.observe('stage_duration_seconds', time.perf_counter() - _start, stage='archive')
+        logging.info("Archived model %s: %d files (%d already archived, %d linked, %d copied)." % (
+            cycle.strftime(CYCLE_FORMAT), len(_hashes), _shared, _linked, _copied))
+
+        return _target
+
+
+    def remove(self, cycle):
+        ''' Remove a model cycle from the archive. '''
+        with _ArchiveLock(self.archive_dir):
+            self._load()
+            self._remove([cycle])
+
+
+    def _remove(self, cycles):
+        _entries = dict(self._entries)
+        for _cycle in cycles:
+            _entries.pop(_cycle, None)
+        # Update the index first, so lookups never return a removed cycle.
+        self._write(_entries)
+        for _cycle in cycles:
+            shutil.rmtree(cycle_path(self.archive_dir, _cycle), ignore_errors=True)
+
+
+    def apply_retention(self, keep=None, thin_after=None, thin_hours=12):
+        '''
+        Apply a retention policy:
+            keep - Keep only the newest <keep> cycles.
+            thin_after - Thin all but the newest <thin_after> cycles, keeping only the data files
+                within <thin_hours> hours of the cycle's nominal time.
+        Returns a tuple of (cycles removed, files removed by thinning).
+        '''
+        _removed_cycles = 0
+        _removed_files = 0
+
+        with _ArchiveLock(self.archive_dir):
+            self._load()
+            _cycles = sorted(self._entries.keys(), reverse=True)
+
+            if (keep is not None) and (len(_cycles) > keep):
+                self._remove(_cycles[keep:])
+                _removed_cycles = len(_cycles) - keep
+                _cycles = _cycles[:keep]
+
+            if thin_after is not None:
+                _entries = dict(self._entries)
+                _thinned = []
+                for _cycle in _cycles[thin_after:]:
+                    _limit = _timestamp(_cycle) + thin_hours * 3600
+                    _keep = [_entry for _entry in _entries[_cycle] if _entry[6] <= _limit]
+                    if len(_keep) < len(_entries[_cycle]):
+                        _thinned.append((_cycle, [_entry for _entry in _entries[_cycle] if _entry[6] > _limit]))
+                        _entries[_cycle] = _keep
+
+                if _thinned:
+                    self._write(_entries)
+                    for (_cycle, _remove) in _thinned:
+                        for _entry in _remove:
+                            os.remove(os.path.join(self.path(_cycle, _entry[0]), _entry[1]))
+                            _removed_files += 1
+                        index_dataset(cycle_path(self.archive_dir, _cycle))
+
+        if _removed_cycles or _removed_files:
+            logging.info("Archive retention: removed %d cycles, and %d files from thinned cycles." % (_removed_cycles, _removed_files))
+
+        return (_removed_cycles, _removed_files)
+
+
+    def find(self, valid_time, lat, lon, member=None):
+        '''
+        Find the archived cycles with data covering a time (datetime in UTC, or POSIX timestamp) and position.
+        If member is None, all members (and non-ensemble datasets) are searched.
+        Returns a list of dictionaries, newest cycle first, with the cycle, member, data directory (path),
+        and the data files either side of the time (files).
+        '''
+        self._load()
+        _time = _timestamp(valid_time)
+
+        _found = []
+        for ((_cycle, _member, _window), _timestamps) in self._windows.items():
+            if (member is not None) and (_member != member):
+                continue
+
+            (_lat, _latrad, _lon, _lonrad) = _window
+            if abs(lat - _lat) > _latrad or abs((lon - _lon + 180.0) % 360.0 - 180.0) > _lonrad:
+                continue
+
+            # Data files either side of the time.
+            _index = bisect.bisect_left(_timestamps, (_time, ''))
+            if _index < len(_timestamps) and _timestamps[_index][0] == _time:
+                _files = [_timestamps[_index][1]]
+            elif 0 < _index < len(_timestamps):
+                _files = [_timestamps[_index-1][1], _timestamps[_index][1]]
+            else:
+                continue
+
+            _path = self.path(_cycle, _member)
+            _found.append({
+                'cycle': _cycle,
+                'member': _member if _member else None,
+                'path': _path,
+                'files': [os.path.join(_path, _file) for _file in _files]
+            })
+
+        _found.sort(key=lambda _entry: (_entry['cycle'], _entry['member'] or ''), reverse=True)
+        return _found
+
+
+    def select_cycle(self, valid_time, lat, lon, member=None, delay=PUBLISH_DELAY):
+        '''
+        Select the model cycle which was current at a time (datetime in UTC, or POSIX timestamp): the newest cycle
+        which was available by then (<delay> after its nominal time), and has data covering the time and position.
+        Returns the cycle (a datetime), or None if there is no such cycle.
+        '''
+        _time = _timestamp(valid_time)
+        for _entry in self.find(valid_time, lat, lon, member=member):
+            if _timestamp(_entry['cycle'] + delay) <= _time:
+                return _entry['cycle']
+        return None
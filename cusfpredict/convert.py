@@ -0,0 +1,294 @@
+#!/usr/bin/env python
+#
+#   Project Horus
+#   CUSF Standalone Predictor Python Wrapper - Offline GRIB Converter
+#   Copyright 2020 Mark Jessop <vk5qi@rfhead.net>
+#
+#   Convert GRIB2 files already on disk (i.e. from an archive or a mirror) into a CUSF dataset,
+#   without downloading anything. Files are decoded in a pool of processes (one per CPU by default),
+#   optionally cropped to a window, and the completed dataset is published atomically with
+#   cusfpredict.gfs.publish_dataset.
+#
+#   A manifest of the GRIB files converted (CONVERT_MANIFEST_FILENAME) is written into the dataset.
+#   When re-run, files which have not changed since they were converted (same size and modification
+#   time, and the same window and compression) are not converted again. If nothing has changed,
+#   the published dataset is left as-is.
+#
+#   Usage:
+#       python3 -m cusfpredict.convert -o ./gfs --lat=-34 --lon=138 --latdelta=10 --londelta=10 /data/gfs.20201019/00/
+#       python3 -m cusfpredict.convert -o ./gfs "/data/gfs.20201019/00/gfs.t00z.pgrb2.0p25.f0*"
+#
+#       from cusfpredict.convert import convert_grib_files
+#       summary = convert_grib_files(['/data/gfs.20201019/00/'], output_dir='./gfs', window=(-34.0, 138.0, 10.0, 10.0))
+#
+import argparse
+import datetime
+import glob
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from tempfile import mkdtemp
+
+from . import metrics
+from .gfs import CUSF_COMPRESSION, parse_grib_to_dict, wind_dict_to_cusf, write_dataset_info, publish_dataset, \
+    import_grib_decoder
+
+
+# Manifest of the converted GRIB files, written into the output dataset.
+CONVERT_MANIFEST_FILENAME = "convert_manifest.json"
+
+# Format version of the manifest.
+MANIFEST_VERSION = 1
+
+
+def is_grib_file(filename):
+    ''' Check if a file is a GRIB file (GRIB files often have no extension), from its first bytes. '''
+    try:
+        with open(filename, 'rb') as _f:
+            return _f.read(4) == b'GRIB'
+    except IOError:
+        return False
+
+
+def find_grib_files(sources):
+    '''
+    Find the GRIB files given by a list of sources, each of which is a file, a directory (all GRIB files
+    within it), or a glob pattern. Returns a sorted list of absolute paths.
+    '''
+    _files = set()
+    for _source in sources:
+        if os.path.isdir(_source):
+            _candidates = [os.path.join(_source, _name) for _name in os.listdir(_source)]
+        elif os.path.isfile(_source):
+            _candidates = [_source]
+        else:
+            _candidates = glob.glob(_source, recursive=True)
+
+        for _candidate in _candidates:
+            if os.path.isfile(_candidate) and is_grib_file(_candidate):
+                _files.add(os.path.abspath(_candidate))
+
+    return sorted(_files)
+
+
+def read_manifest(output_dir):
+    ''' Read the manifest of a converted dataset. Returns None if there is no (readable) manifest. '''
+    try:
+        with open(os.path.join(output_dir, CONVERT_MANIFEST_FILENAME), 'r') as _f:
+            _manifest = json.load(_f)
+    except (IOError, ValueError):
+        return None
+
+    if _manifest.get('version') != MANIFEST_VERSION:
+        return None
+    return _manifest
+
+
+def _source_id(filename):
+    _stat = os.stat(filename)
+    return [_stat.st_size, _stat.st_mtime_ns]
+
+
+def _convert_file(grib_file, work_dir, window, compression):
+    # Run in a worker process, where metrics are not collected - the decode time is returned instead.
+    # Each file is written into its own directory, as GRIB files of different cycles can have the same
+    # valid time (and so the same CUSF filename).
+    _start = time.perf_counter()
+    _wind = parse_grib_to_dict(grib_file, window=window)
+    if _wind is None:
+        return (None, None, time.perf_counter() - _start)
+
+    os.makedirs(work_dir)
+    (_filename, _text) = wind_dict_to_cusf(_wind, output_dir=work_dir, compression=compression)
+    return (_filename, _wind['model_time'], time.perf_counter() - _start)
+
+
+def convert_grib_files(sources,
+                        output_dir='./gfs/',
+                        window=None,
+                        compression=None,
+                        workers=None,
+                        force=False,
+                        progress=None):
+    '''
+    Convert local GRIB files (a list of files, directories or glob patterns - see find_grib_files) into a
+    CUSF dataset, and publish it to output_dir (see cusfpredict.gfs.publish_dataset).
+
+    If a window of (lat, lon, latdelta, londelta) is given, the data is cropped to it. Files are decoded in
+    a pool of <workers> processes (default: one per CPU). Files already converted (with the same window and
+    compression) into the dataset currently at output_dir are re-used, unless force is True.
+    If given, progress(done, total, grib_file) is called as each file is converted.
+
+    Returns a dictionary summarising the conversion: the number of files found, converted, re-used
+    and failed, the total (wall-clock) duration, and the time spent decoding, summed across workers.
+    '''
+    if compression not in CUSF_COMPRESSION:
+        raise ValueError("Unknown compression format: %s" % str(compression))
+
+    _start = time.perf_counter()
+    _output_dir = os.path.normpath(output_dir)
+    _options = {'window': list(window) if window is not None else None, 'compression': compression}
+
+    _grib_files = find_grib_files(sources)
+    _summary = {'files': len(_grib_files), 'converted': 0, 'reused': 0, 'failed': 0, 'decode_time': 0.0, 'published': None}
+    if len(_grib_files) == 0:
+        logging.error("No GRIB files found.")
+        _summary['duration'] = time.perf_counter() - _start
+        return _summary
+
+    # Work out which files have already been converted.
+    _previous = None if force else read_manifest(_output_dir)
+    if (_previous is not None) and (_previous['options'] != _options):
+        logging.info("Window or compression changed - converting all files.")
+        _previous = None
+
+    _entries = {}
+    _pending = []
+    for _grib_file in _grib_files:
+        _entry = _previous['files'].get(_grib_file) if _previous else None
+        if (_entry is not None) and (_entry['source'] == _source_id(_grib_file)) and \
+            os.path.isfile(os.path.join(_output_dir, _entry['output'])):
+            _entries[_grib_file] = _entry
+        else:
+            _pending.append(_grib_file)
+    _summary['reused'] = len(_entries)
+
+    if (len(_pending) == 0) and (_previous is not None) and (len(_entries) == len(_previous['files'])):
+        logging.info("Dataset %s is up to date (%d files)." % (_output_dir, len(_entries)))
+        _summary['duration'] = time.perf_counter() - _start
+        return _summary
+
+    # Build the new dataset alongside the output directory, so it can be moved into place.
+    _staging_dir = mkdtemp(prefix=".staging-", dir=os.path.dirname(os.path.abspath(_output_dir)))
+    try:
+        # Files which are already converted are hard-linked from the current dataset, which is about to be replaced.
+        for _grib_file in list(_entries.keys()):
+            _source = os.path.join(_output_dir, _entries[_grib_file]['output'])
+            try:
+                os.link(_source, os.path.join(_staging_dir, _entries[_grib_file]['output']))
+            except OSError:
+                shutil.copy2(_source, os.path.join(_staging_dir, _entries[_grib_file]['output']))
+
+        # As with ingest_ensemble, the workers are spawned rather than forked, as the caller may have threads running.
+        _results = []
+        _context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=_context) as _pool:
+            _futures = {}
+            for _i, _grib_file in enumerate(_pending):
+                _work_dir = os.path.join(_staging_dir, ".work-%d" % _i)
+                _futures[_pool.submit(_convert_file, _grib_file, _work_dir, window, compression)] = (_grib_file, _work_dir)
+
+            for _done, _future in enumerate(as_completed(_futures), 1):
+                (_grib_file, _work_dir) = _futures[_future]
+                _filename = None
+                try:
+                    (_filename, _model_time, _duration) = _future.result()
+                except Exception as e:
+                    logging.error("Error converting %s: %s" % (_grib_file, str(e)))
+                    (_filename, _model_time, _duration) = (None, None, 0.0)
+                finally:
+                    # A failed worker may have left a partly-written file in its scratch directory,
+                    # which must not be published with the dataset.
+                    if _filename is None:
+                        shutil.rmtree(_work_dir, ignore_errors=True)
+
+                _summary['decode_time'] += _duration
+                metrics.observe('stage_duration_seconds', _duration, stage='decode')
+
+                if _filename is None:
+                    metrics.count('failures_total', stage='decode')
+                    _summary['failed'] += 1
+                    logging.error("[%d/%d] Could not convert %s" % (_done, len(_pending), _grib_file))
+                else:
+                    _results.append((_model_time, _grib_file, _filename))
+                    logging.info("[%d/%d] Converted %s to %s (%.1f s)" % (_done, len(_pending), _grib_file,
+                        os.path.basename(_filename), _duration))
+
+                if progress is not None:
+                    progress(_done, len(_pending), _grib_file)
+
+        # Move the new files into place, oldest model cycle first, so where two files have the same valid time,
+        # the newest cycle wins.
+        for (_model_time, _grib_file, _filename) in sorted(_results):
+            _name = os.path.basename(_filename)
+            os.replace(_filename, os.path.join(_staging_dir, _name))
+            os.rmdir(os.path.dirname(_filename))
+            _entries[_grib_file] = {'source': _source_id(_grib_file), 'output': _name, 'model_time': _model_time}
+        _summary['converted'] = len(_results)
+
+        if len(_entries) == 0:
+            raise Exception("No GRIB files could be converted.")
+
+        _outputs = {}
+        for (_grib_file, _entry) in _entries.items():
+            if _entry['output'] in _outputs:
+                logging.warning("%s and %s have the same valid time - using the newest model cycle." % (_outputs[_entry['output']], _grib_file))
+            _outputs[_entry['output']] = _grib_file
+
+        with open(os.path.join(_staging_dir, CONVERT_MANIFEST_FILENAME), 'w') as _f:
+            json.dump({'version': MANIFEST_VERSION, 'options': _options, 'files': _entries}, _f, indent=1)
+
+        # The dataset is named by its newest model cycle.
+        _model_dt = datetime.datetime.utcfromtimestamp(max(_entry['model_time'] for _entry in _entries.values()))
+        write_dataset_info(_staging_dir, _model_dt)
+        _summary['published'] = publish_dataset(_staging_dir, _output_dir, _model_dt)
+    except:
+        shutil.rmtree(_staging_dir, ignore_errors=True)
+        raise
+
+    _summary['duration'] = time.perf_counter() - _start
+    metrics.observe('stage_duration_seconds', _summary['duration'], stage='convert')
+
+    logging.info("Converted %d files (%d re-used, %d failed) in %.1f seconds (%.1f s decoding, across all workers)." % (
+        _summary['converted'], _summary['reused'], _summary['failed'], _summary['duration'], _summary['decode_time']))
+
+    return _summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert local GRIB2 files into a CUSF predictor dataset.")
+    parser.add_argument('sources', nargs='+', help="GRIB files, directories of GRIB files, or glob patterns.")
+    parser.add_argument('-o', '--output_dir', type=str, default='./gfs/', help='GFS data output directory.')
+    parser.add_argument('--lat', type=float, default=None, help="Crop to a window: centre latitude in range (-90,90) degrees north")
+    parser.add_argument('--lon', type=float, default=None, help="Crop to a window: centre longitude in range (-180,180) degrees north")
+    parser.add_argument('--latdelta', type=float, default=10.0, help='Window radius in latitude in degrees')
+    parser.add_argument('--londelta', type=float, default=10.0, help='Window radius in longitude in degrees')
+    parser.add_argument('--compression', type=str, default=None, choices=['gzip', 'zstd'], help="Compress the data files written (gzip, or zstd if the zstandard module is installed).")
+    parser.add_argument('-j', '--workers', type=int, default=None, help="Number of decoding processes. (Default: one per CPU)")
+    parser.add_argument('--force', action='store_true', default=False, help="Convert all files, even if they have already been converted.")
+    parser.add_argument('-v', '--verbose', action='store_true', default=False, help="Verbose output.")
+    args = parser.parse_args()
+
+    if args.verbose:
+        logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
+    else:
+        logging.basicConfig(stream=sys.stdout, level=logging.INFO)
+
+    # Check we can decode the data before starting.
+    try:
+        import_grib_decoder()
+    except ImportError as e:
+        logging.critical(str(e))
+        sys.exit(1)
+
+    _window = None
+    if (args.lat is not None) or (args.lon is not None):
+        if (args.lat is None) or (args.lon is None):
+            logging.critical("Both --lat and --lon are required to crop to a window.")
+            sys.exit(1)
+        _window = (args.lat, args.lon, args.latdelta, args.londelta)
+
+    _summary = convert_grib_files(args.sources, output_dir=args.output_dir, window=_window,
+        compression=args.compression, workers=args.workers, force=args.force)
+
+    if (_summary['converted'] + _summary['reused']) == 0:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,504 @@
+#!/usr/bin/env python
+#
+#   Project Horus
+#   CUSF Standalone Predictor Python Wrapper - Ingest & Predict Daemon
+#   Copyright 2020 Mark Jessop <vk5qi@rfhead.net>
+#
+#   A long-running replacement for the sonde_predict.sh / wind_grabber.sh cron jobs.
+#   Watches for new GFS model cycles, ingests forecast hours as they are published,
+#   atomically publishes the completed dataset, and then re-runs the configured
+#   launch site prediction sets (and landing surrogates) through a pool of warm predictors.
+#
+#   Usage: python3 -m cusfpredict.daemon -c daemon.cfg
+#   See apps/daemon.cfg.example for an example configuration file.
+#
+import argparse
+import configparser
+import datetime
+import logging
+import os
+import shutil
+import signal
+import sys
+import time
+from tempfile import mkdtemp
+from dateutil.parser import parse
+
+from . import metrics
+from .gfs import VALID_MODELS, latest_model_name, find_nearest, determine_latest_available_dataset, \
+    ingest_forecast_hour, write_dataset_info, read_dataset_info, publish_dataset, import_grib_decoder, \
+    is_ensemble_model, load_download_profile, plan_downloads, summarise_plan, CUSF_COMPRESSION, DEFAULT_DOWNLOAD_PROFILE
+from .archive import Archive
+from .probe import CycleWatcher
+from .predict import PredictorPool
+from .export import PredictionExporter
+from .surrogate import build_surrogate, parse_axis
+
+
+# Default daemon settings, used if not provided in the configuration file.
+DAEMON_DEFAULTS = {
+    'model': '0p25_1hr',
+    'lat': '-34.0',
+    'lon': '138.0',
+    'latdelta': '10.0',
+    'londelta': '10.0',
+    'future': '192',
+    'profile': DEFAULT_DOWNLOAD_PROFILE,
+    'output_dir': './gfs',
+    'compression': '',
+    'pyramid': 'false',
+    'archive_dir': '',
+    'archive_keep': '',
+    'archive_thin_after': '',
+    'archive_thin_hours': '12',
+    'pred_binary': './pred',
+    'workers': '4',
+    'idle_poll': '300',
+    'ingest_retries': '2',
+    'ingest_retry_delay': '60',
+    'metrics_port': '',
+    'metrics_file': '',
+    'json_tolerance': '0',
+    'json_precision': '',
+    'json_delta': 'false',
+    'json_split': 'false',
+    'json_gzip': 'false',
+}
+
+# Default launch site settings.
+SITE_DEFAULTS = {
+    'altitude': '0.0',
+    'ascent_rate': '5.0',
+    'descent_rate': '6.0',
+    'burst_alt': '26000.0',
+    'launch_time': '11:15Z',
+    'step': '12',
+    'limit': '168',
+    'surrogate_output': '',
+    'surrogate_step': '1',
+    'surrogate_limit': '48',
+    'surrogate_ascent_rates': '4.0,5.0,6.0',
+    'surrogate_burst_alts': '22000,26000,30000',
+    'surrogate_descent_rates': '5.0,6.0,7.0',
+}
+
+
+def read_config(filename):
+    ''' Read in a daemon configuration file. Returns (settings, sites) '''
+    _config = configparser.ConfigParser()
+    if len(_config.read(filename)) == 0:
+        raise IOError("Could not read configuration file %s" % filename)
+
+    _settings = dict(DAEMON_DEFAULTS)
+    if _config.has_section('daemon'):
+        _settings.update(dict(_config.items('daemon')))
+
+    _daemon = {
+        'model': _settings['model'],
+        'lat': float(_settings['lat']),
+        'lon': float(_settings['lon']),
+        'latdelta': float(_settings['latdelta']),
+        'londelta': float(_settings['londelta']),
+        'future': int(_settings['future']),
+        'profile': _settings['profile'],
+        'output_dir': _settings['output_dir'],
+        'compression': _settings['compression'] if _settings['compression'] else None,
+        'pyramid': _config.BOOLEAN_STATES[_settings['pyramid'].lower()],
+        'archive_dir': _settings['archive_dir'] if _settings['archive_dir'] else None,
+        'archive_keep': int(_settings['archive_keep']) if _settings['archive_keep'] else None,
+        'archive_thin_after': int(_settings['archive_thin_after']) if _settings['archive_thin_after'] else None,
+        'archive_thin_hours': int(_settings['archive_thin_hours']),
+        'pred_binary': _settings['pred_binary'],
+        'workers': int(_settings['workers']),
+        'idle_poll': float(_settings['idle_poll']),
+        'ingest_retries': int(_settings['ingest_retries']),
+        'ingest_retry_delay': float(_settings['ingest_retry_delay']),
+        'metrics_port': int(_settings['metrics_port']) if _settings['metrics_port'] else None,
+        'metrics_file': _settings['metrics_file'] if _settings['metrics_file'] else None,
+        'json_tolerance': float(_settings['json_tolerance']),
+        'json_precision': int(_settings['json_precision']) if _settings['json_precision'] else None,
+        'json_delta': _config.BOOLEAN_STATES[_settings['json_delta'].lower()],
+        'json_split': _config.BOOLEAN_STATES[_settings['json_split'].lower()],
+        'json_gzip': _config.BOOLEAN_STATES[_settings['json_gzip'].lower()],
+    }
+
+    if _daemon['model'] not in VALID_MODELS.keys():
+        raise ValueError("Invalid GFS Model!")
+
+    # Predictions are run against a single dataset, so there is no use for the members of an ensemble.
+    if is_ensemble_model(_daemon['model']):
+        raise ValueError("Ensemble models are not supported by the daemon - use cusfpredict.gfs.")
+
+    # Check the download profile can be loaded.
+    load_download_profile(_daemon['profile'])
+
+    if _daemon['compression'] not in CUSF_COMPRESSION:
+        raise ValueError("Invalid compression format!")
+
+    # Launch sites are defined in sections named [site <Site Name>]
+    _sites = []
+    for _section in _config.sections():
+        if not _section.startswith('site'):
+            continue
+
+        _site = dict(SITE_DEFAULTS)
+        _site.update(dict(_config.items(_section)))
+
+        _name = _section[4:].strip()
+        if _name == "":
+            _name = "Radiosonde"
+
+        _sites.append({
+            'name': _name,
+            'latitude': float(_site['latitude']),
+            'longitude': float(_site['longitude']),
+            'altitude': float(_site['altitude']),
+            'ascent_rate': float(_site['ascent_rate']),
+            'descent_rate': float(_site['descent_rate']),
+            'burst_alt': float(_site['burst_alt']),
+            'launch_time': _site['launch_time'],
+            'step': int(_site['step']),
+            'limit': int(_site['limit']),
+            'output': _site.get('output', _name.replace(' ', '_').lower() + "_predictions.json"),
+            'surrogate_output': _site['surrogate_output'] if _site['surrogate_output'] else None,
+            'surrogate_step': float(_site['surrogate_step']),
+            'surrogate_limit': float(_site['surrogate_limit']),
+            'surrogate_ascent_rates': parse_axis(_site['surrogate_ascent_rates']),
+            'surrogate_burst_alts': parse_axis(_site['surrogate_burst_alts']),
+            'surrogate_descent_rates': parse_axis(_site['surrogate_descent_rates']),
+        })
+
+    return (_daemon, _sites)
+
+
+def site_scenarios(site):
+    ''' Generate the list of prediction scenarios for a launch site, as per sonde_predict.py '''
+
+    # Start at the configured launch time on the current UTC day.
+    _current_day = datetime.datetime.utcnow()
+    _launch_hour = parse(site['launch_time'])
+    _first_launch = datetime.datetime(_current_day.year, _current_day.month, _current_day.day, _launch_hour.hour, _launch_hour.minute)
+
+    _scenarios = []
+    for _delta_time in range(0, site['limit'], site['step']):
+        _scenarios.append({
+            'launch_lat': site['latitude'],
+            'launch_lon': site['longitude'],
+            'launch_alt': site['altitude'],
+            'ascent_rate': site['ascent_rate'],
+            'descent_rate': site['descent_rate'],
+            'burst_alt': site['burst_alt'],
+            'launch_time': _first_launch + datetime.timedelta(seconds=_delta_time*3600)
+        })
+
+    return _scenarios
+
+
+def site_surrogate_axes(site):
+    ''' Grid of launch parameters for a launch site's surrogate, with launch times starting from the current hour. '''
+    _start = datetime.datetime.utcnow().replace(minute=0, second=0, microsecond=0)
+    _count = int(site['surrogate_limit'] / site['surrogate_step']) + 1
+
+    return {
+        'launch_time': [_start + datetime.timedelta(seconds=_i*site['surrogate_step']*3600) for _i in range(_count)],
+        'ascent_rate': site['surrogate_ascent_rates'],
+        'burst_alt': site['surrogate_burst_alts'],
+        'descent_rate': site['surrogate_descent_rates'],
+    }
+
+
+class PredictionDaemon(object):
+    ''' Watch for new model cycles, ingest and publish them, then update launch site predictions. '''
+
+    def __init__(self, settings, sites):
+        self.settings = settings
+        self.sites = sites
+        self.pool = None
+        self.running = True
+
+        self.exporter = None
+        if settings.get('metrics_port') or settings.get('metrics_file'):
+            self.exporter = metrics.enable_prometheus(port=settings.get('metrics_port'))
+
+        # Published datasets are also kept in an archive of model cycles, if configured.
+        self.archive = None
+        if settings.get('archive_dir'):
+            self.archive = Archive(settings['archive_dir'])
+
+        _times = VALID_MODELS[settings['model']]['times']
+        self.available_times = _times[:find_nearest(_times, settings['future'])+1]
+        _plan = self.plan_downloads(latest_model_name(0))
+        self.forecast_times = [_request['forecast_time'] for _request in _plan]
+
+        # Estimated download size of each cycle, against the full download.
+        self.plan_summary = summarise_plan(_plan)
+        self.full_summary = summarise_plan(self.plan_downloads(latest_model_name(0), profile='full'))
+        logging.info("Download profile %s: %d requests per cycle, estimated %.1f MB (full download: %d requests, estimated %.1f MB)." % (
+            settings.get('profile', DEFAULT_DOWNLOAD_PROFILE), self.plan_summary['requests'], self.plan_summary['bytes']/1e6,
+            self.full_summary['requests'], self.full_summary['bytes']/1e6))
+
+
+    def plan_downloads(self, model_dt, profile=None):
+        '''
+        Plan the requests to ingest a model cycle, under a download profile (default: the configured profile).
+        See cusfpredict.gfs.plan_downloads.
+        '''
+        return plan_downloads(
+            model=self.settings['model'],
+            model_dt=model_dt,
+            forecast_times=self.available_times,
+            profile=profile if profile is not None else self.settings.get('profile', DEFAULT_DOWNLOAD_PROFILE),
+            lat=self.settings['lat'],
+            lon=self.settings['lon'],
+            latdelta=self.settings['latdelta'],
+            londelta=self.settings['londelta'])
+
+
+    def ingest_cycle(self, model_dt, timeout=None):
+        '''
+        Ingest a model cycle, downloading forecast hours as they are published, and publish it.
+        Forecast hours which could not be ingested are retried (up to ingest_retries times). If any still fail,
+        the cycle is abandoned, and the previously published dataset is left in place.
+        Returns a dictionary of timing information, or None if the cycle could not be completed.
+        '''
+        _output_dir = os.path.normpath(self.settings['output_dir'])
+        _staging_dir = mkdtemp(prefix=".staging-", dir=os.path.dirname(os.path.abspath(_output_dir)))
+
+        _plan = {_request['forecast_time']: _request for _request in self.plan_downloads(model_dt)}
+        _watcher = CycleWatcher(model=self.settings['model'], model_dt=model_dt, forecast_times=sorted(_plan.keys()))
+
+        _timing = {'first_hour': None, 'last_hour': None}
+        _failed = []
+
+        def _ingest(hour):
+            return ingest_forecast_hour(
+                model=self.settings['model'],
+                model_dt=model_dt,
+                forecast_time=hour,
+                lat=self.settings['lat'],
+                lon=self.settings['lon'],
+                latdelta=_plan[hour]['latdelta'],
+                londelta=_plan[hour]['londelta'],
+                output_dir=_staging_dir,
+                compression=self.settings['compression'],
+                pyramid=self.settings['pyramid'],
+                levels=_plan[hour]['levels'])
+
+        # Count the bytes downloaded for the cycle.
+        _downloaded = {'bytes': 0}
+        def _count_bytes(kind, name, value, labels):
+            if name == 'download_bytes':
+                _downloaded['bytes'] += value
+        metrics.add_hook(_count_bytes)
+
+        # The staging directory is removed unless it is published, including if the daemon is stopped part-way through.
+        _published = None
+        try:
+            logging.info("Watching for model %s" % model_dt.strftime("%Y%m%d%Hz"))
+            for _hour in _watcher.watch(timeout=timeout):
+                if _timing['first_hour'] is None:
+                    _timing['first_hour'] = time.time()
+
+                if _ingest(_hour) is None:
+                    _failed.append(_hour)
+
+                if not self.running:
+                    break
+
+            if (not _watcher.complete) or (not self.running):
+                logging.error("Model %s was not completely ingested." % model_dt.strftime("%Y%m%d%Hz"))
+                return None
+
+            for _attempt in range(self.settings['ingest_retries']):
+                if (not _failed) or (not self.running):
+                    break
+                logging.warning("Retrying %d forecast hours of model %s (attempt %d of %d)." % (
+                    len(_failed), model_dt.strftime("%Y%m%d%Hz"), _attempt+1, self.settings['ingest_retries']))
+                time.sleep(self.settings['ingest_retry_delay'])
+                _failed = [_hour for _hour in _failed if _ingest(_hour) is None]
+
+            if _failed or (not self.running):
+                logging.error("Model %s: %d forecast hours could not be ingested (%s). Keeping the previous dataset." % (
+                    model_dt.strftime("%Y%m%d%Hz"), len(_failed), ", ".join(["T+%03d" % _hour for _hour in _failed])))
+                metrics.count('failures_total', stage='ingest_cycle')
+                return None
+
+            _timing['bytes'] = _downloaded['bytes']
+            _timing['last_hour'] = time.time()
+            logging.info("Ingested model %s: %d requests, %.1f MB in %.1f s (full download estimated at %.1f MB)." % (
+                model_dt.strftime("%Y%m%d%Hz"), len(_plan), _timing['bytes']/1e6, _timing['last_hour'] - _timing['first_hour'],
+                self.full_summary['bytes']/1e6))
+
+            write_dataset_info(_staging_dir, model_dt)
+            _published = publish_dataset(_staging_dir, _output_dir, model_dt)
+            _timing['published'] = time.time()
+        finally:
+            metrics.remove_hook(_count_bytes)
+            if _published is None:
+                shutil.rmtree(_staging_dir, ignore_errors=True)
+
+        if self.archive is not None:
+            try:
+                self.archive.add(_published, model_dt)
+                self.archive.apply_retention(keep=self.settings['archive_keep'],
+                    thin_after=self.settings['archive_thin_after'], thin_hours=self.settings['archive_thin_hours'])
+            except Exception as e:
+                # The published dataset is still usable.
+                logging.exception("Could not archive model %s - %s" % (model_dt.strftime("%Y%m%d%Hz"), str(e)))
+                metrics.count('failures_total', stage='archive')
+
+        return _timing
+
+
+    def run_predictions(self, model_dt):
+        ''' Re-run all site prediction sets against the current dataset, writing JSON output as predictions complete. '''
+
+        if self.pool is None:
+            self.pool = PredictorPool(
+                bin_path=self.settings['pred_binary'],
+                gfs_path=self.settings['output_dir'],
+                workers=self.settings['workers'])
+
+        for _site in self.sites:
+            _json_out = PredictionExporter(
+                _site['output'],
+                header={
+                    'dataset': model_dt.strftime("%Y%m%d%Hz"),
+                    'site': _site['name'],
+                    'launch_lat': _site['latitude'],
+                    'launch_lon': _site['longitude']
+                },
+                tolerance=self.settings['json_tolerance'],
+                precision=self.settings['json_precision'],
+                delta=self.settings['json_delta'],
+                split=self.settings['json_split'],
+                gzip_copy=self.settings['json_gzip'])
+
+            _start = time.time()
+            for (_scenario, _flight_path) in self.pool.predict_many(site_scenarios(_site)):
+                # A single entry in the output means we don't have wind data for this launch time.
+                if len(_flight_path) <= 1:
+                    continue
+
+                _launch_time = _scenario['launch_time']
+                _pred_comment = "%s %.1f/%.1f/%.1f" % (_launch_time.strftime("%Y%m%d-%H%M"), _scenario['ascent_rate'], _scenario['burst_alt'], _scenario['descent_rate'])
+
+                _json_out.add(_pred_comment, _flight_path,
+                    timestamp=_launch_time.strftime("%Y-%m-%d %H:%M:%S"),
+                    burst_alt=_scenario['burst_alt'])
+
+                # Write out what we have so far.
+                _json_out.write()
+
+            _json_out.close()
+
+            logging.info("Site %s: %d predictions written to %s in %.1f seconds." % (
+                _site['name'], len(_json_out.predictions), _site['output'], time.time()-_start))
+
+            if _site['surrogate_output']:
+                _start = time.time()
+                _surrogate = build_surrogate(self.pool,
+                    {'name': _site['name'], 'latitude': _site['latitude'], 'longitude': _site['longitude'], 'altitude': _site['altitude']},
+                    site_surrogate_axes(_site),
+                    dataset=model_dt.strftime("%Y%m%d%Hz"))
+                _surrogate.save(_site['surrogate_output'])
+
+                logging.info("Site %s: surrogate of %d predictions written to %s in %.1f seconds." % (
+                    _site['name'], _surrogate.size, _site['surrogate_output'], time.time()-_start))
+
+
+    def run(self):
+        ''' Main daemon loop. '''
+
+        _current = read_dataset_info(self.settings['output_dir'])
+
+        # If we have no data at all, grab whatever is available right now, rather than waiting for the newest cycle.
+        if _current is None:
+            _model_dt = determine_latest_available_dataset(model=self.settings['model'], forecast_time=self.settings['future'])
+            if _model_dt is not None and self.ingest_cycle(_model_dt, timeout=0) is not None:
+                _current = _model_dt
+                self.run_predictions(_current)
+        elif len(self.sites) > 0:
+            # Make sure predictions reflect the dataset we already have.
+            self.run_predictions(_current)
+
+        while self.running:
+            _latest = latest_model_name(0)
+
+            if (_current is not None) and (_current >= _latest):
+                # Nothing to do until the next model cycle starts.
+                _next_cycle = latest_model_name(1)
+                _wait = min(self.settings['idle_poll'], max(1.0, (_next_cycle - datetime.datetime.utcnow()).total_seconds()))
+                time.sleep(_wait)
+                continue
+
+            # Watch the new cycle, giving up when the next one is due.
+            _timing = self.ingest_cycle(_latest, timeout=6*3600)
+            if _timing is None:
+                # Try the cycle again later, rather than immediately re-downloading it.
+                if self.running:
+                    time.sleep(self.settings['idle_poll'])
+                continue
+
+            _current = _latest
+            self.run_predictions(_current)
+            _done = time.time()
+
+            _nominal = (_current - datetime.datetime(1970, 1, 1)).total_seconds()
+            logging.info("Model %s: first hour seen at T+%.1f h, final hour at T+%.1f h. "
+                "Predictions updated %.1f s after first hour, %.1f s after final hour." % (
+                _current.strftime("%Y%m%d%Hz"),
+                (_timing['first_hour'] - _nominal)/3600.0,
+                (_timing['last_hour'] - _nominal)/3600.0,
+                _done - _timing['first_hour'],
+                _done - _timing['last_hour']))
+
+            if self.exporter and self.settings.get('metrics_file'):
+                self.exporter.write(self.settings['metrics_file'])
+
+
+    def close(self):
+        self.running = False
+        if self.pool is not None:
+            self.pool.close()
+        if self.exporter is not None:
+            self.exporter.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-c', '--config', type=str, default='daemon.cfg', help="Configuration file. (Default: daemon.cfg)")
+    parser.add_argument('-v', '--verbose', action='store_true', default=False, help="Verbose output.")
+    args = parser.parse_args()
+
+    if args.verbose:
+        logging.basicConfig(stream=sys.stdout, format="%(asctime)s %(levelname)s %(message)s", level=logging.DEBUG)
+    else:
+        logging.basicConfig(stream=sys.stdout, format="%(asctime)s %(levelname)s %(message)s", level=logging.INFO)
+
+    (_settings, _sites) = read_config(args.config)
+    logging.info("Loaded configuration with %d launch sites." % len(_sites))
+
+    try:
+        import_grib_decoder()
+    except ImportError as e:
+        logging.critical(str(e))
+        sys.exit(1)
+
+    _daemon = PredictionDaemon(_settings, _sites)
+
+    # Stop on SIGTERM (i.e. from systemd) as per Ctrl-C, so an in-progress ingest cleans up its staging directory.
+    def _terminate(signum, frame):
+        raise KeyboardInterrupt()
+    signal.signal(signal.SIGTERM, _terminate)
+
+    try:
+        _daemon.run()
+    except KeyboardInterrupt:
+        logging.info("Shutting down.")
+    finally:
+        _daemon.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,293 @@
+#!/usr/bin/env python
+#
+#   Project Horus
+#   CUSF Standalone Predictor Python Wrapper - In-Process Prediction Engine
+#   Copyright 2020 Mark Jessop <vk5qi@rfhead.net>
+#
+#   Runs predictions through libpred (the prediction engine built as a shared library, see
+#   src/libpred.h) instead of spawning pred for each run. Launch parameters are passed directly
+#   (no scenario file, no CSV output to parse), the flight path is written straight into a numpy
+#   array, and wind data files stay loaded between runs, which makes a large difference to the
+#   throughput of batch workloads (ensembles, the launch solver, surrogate grids).
+#
+#   The library releases the GIL while a prediction runs, and a single Engine may be used from
+#   multiple threads at once.
+#
+#   The library is found (in order) from the lib_path argument, the CUSFPREDICT_LIB environment
+#   variable, ./libpred.so, ./src/build/libpred.so, or the system library search path.
+#
+#   Usage:
+#       from cusfpredict.engine import Engine
+#       engine = Engine(gfs_path='./gfs')
+#       flight_path = engine.predict(launch_lat=-34.9499, launch_lon=138.5194, launch_time=datetime.datetime.utcnow())
+#       print(flight_path[-1])   # [timestamp, lat, lon, alt]
+#
+import calendar
+import ctypes
+import ctypes.util
+import datetime
+import logging
+import os
+import time
+import numpy as np
+
+from . import metrics
+
+
+# Status codes returned by pred_run (see src/libpred.h)
+PRED_OK = 1
+PRED_MODEL_ERROR = 0
+PRED_ERROR = -1
+
+# Library locations tried if no path is given.
+LIBRARY_SEARCH_PATHS = ['./libpred.so', './src/build/libpred.so']
+
+
+def find_library(lib_path=None):
+    ''' Find the libpred shared library. Returns its path, or None if it could not be found. '''
+    if lib_path is not None:
+        return lib_path if os.path.isfile(lib_path) else None
+
+    _env_path = os.environ.get('CUSFPREDICT_LIB')
+    if _env_path:
+        return _env_path if os.path.isfile(_env_path) else None
+
+    for _path in LIBRARY_SEARCH_PATHS:
+        if os.path.isfile(_path):
+            return _path
+
+    return ctypes.util.find_library('pred')
+
+
+_libraries = {}
+
+def load_library(lib_path=None):
+    ''' Load (once per path) the libpred shared library, and declare the function signatures. '''
+    _path = find_library(lib_path)
+    if _path is None:
+        raise Exception("Could not find the libpred shared library.")
+
+    if _path in _libraries:
+        return _libraries[_path]
+
+    _lib = ctypes.CDLL(_path)
+
+    _lib.pred_dataset_open.argtypes = [ctypes.c_char_p]
+    _lib.pred_dataset_open.restype = ctypes.c_void_p
+    _lib.pred_dataset_free.argtypes = [ctypes.c_void_p]
+    _lib.pred_dataset_free.restype = None
+    _lib.pred_dataset_files.argtypes = [ctypes.c_void_p]
+    _lib.pred_dataset_files.restype = ctypes.c_uint
+    _lib.pred_run.argtypes = [
+        ctypes.c_void_p,
+        ctypes.c_double, ctypes.c_double, ctypes.c_double, ctypes.c_long,
+        ctypes.c_double, ctypes.c_double, ctypes.c_double,
+        ctypes.c_int, ctypes.c_double,
+        ctypes.POINTER(ctypes.c_double), ctypes.c_int, ctypes.POINTER(ctypes.c_int)]
+    _lib.pred_run.restype = ctypes.c_int
+    _double_array = np.ctypeslib.ndpointer(dtype=np.float64, flags='C_CONTIGUOUS')
+    _lib.pred_run_batch.argtypes = [
+        ctypes.c_void_p, ctypes.c_int,
+        _double_array, _double_array, _double_array,
+        np.ctypeslib.ndpointer(dtype=np.int_, flags='C_CONTIGUOUS'),
+        _double_array, _double_array, _double_array,
+        ctypes.c_int, ctypes.c_double, ctypes.c_ulong,
+        _double_array, np.ctypeslib.ndpointer(dtype=np.intc, flags='C_CONTIGUOUS')]
+    _lib.pred_run_batch.restype = ctypes.c_int
+    _lib.pred_set_verbosity.argtypes = [ctypes.c_int]
+    _lib.pred_set_verbosity.restype = None
+    _lib.pred_seed.argtypes = [ctypes.c_ulong]
+    _lib.pred_seed.restype = None
+    _lib.pred_version.argtypes = []
+    _lib.pred_version.restype = ctypes.c_char_p
+
+    _libraries[_path] = _lib
+    return _lib
+
+
+class Engine:
+    '''
+    In-process prediction engine, holding a handle to a wind dataset.
+    predict() takes the same arguments as Predictor.predict, but returns the flight path
+    as an [N,4] numpy array of (timestamp, lat, lon, alt) rows.
+    '''
+    def __init__(self, gfs_path = "./gfs", lib_path = None, max_points = 4096, verbose = False):
+        self.lib = load_library(lib_path)
+        self.gfs_path = gfs_path
+        self.max_points = max_points
+
+        if not os.path.isdir(gfs_path):
+            raise Exception("GFS data directory does not exist.")
+
+        if verbose:
+            self.lib.pred_set_verbosity(2)
+
+        self.handle = self.lib.pred_dataset_open(os.fsencode(gfs_path))
+        if not self.handle:
+            raise Exception("Could not open GFS data directory.")
+
+        if self.lib.pred_dataset_files(self.handle) == 0:
+            self.close()
+            raise Exception("No GFS data files in directory.")
+
+
+    @property
+    def version(self):
+        return self.lib.pred_version().decode('ascii')
+
+
+    def predict(self,launch_lat= -34.9499,
+            launch_lon = 138.5194,
+            launch_alt = 0,
+            ascent_rate = 5.0,
+            descent_rate = 8.0,
+            burst_alt = 26000,
+            launch_time = None,
+            descent_mode = False,
+            wind_error = 0.0,
+            stats = False,
+            seed = None):
+        '''
+        Run a prediction. Returns an [N,4] numpy array of (timestamp, lat, lon, alt) rows,
+        which is a view onto the buffer the engine wrote into (no copies are made).
+        If the engine runs out of wind data, the partial flight path is returned, as per pred.
+        stats is accepted for compatibility with Predictor.predict, and is ignored.
+        If a seed is given, the sampling of the wind (within the variance of the surrounding grid points)
+        is seeded with it, so the prediction is reproducible (as per Predictor.predict with the same seed).
+        '''
+        if self.handle is None:
+            raise Exception("Engine has been closed.")
+
+        if seed is not None:
+            self.lib.pred_seed(int(seed))
+
+        if launch_time is None:
+            launch_time = datetime.datetime.utcnow()
+
+        _timestamp = calendar.timegm(launch_time.utctimetuple())
+        _max_points = self.max_points
+        _status = ctypes.c_int(PRED_ERROR)
+
+        _start = time.perf_counter()
+        while True:
+            _buffer = np.empty((_max_points, 4), dtype=np.float64)
+            _points = self.lib.pred_run(self.handle,
+                float(launch_lat), float(launch_lon), float(launch_alt), _timestamp,
+                float(ascent_rate), float(descent_rate), float(burst_alt),
+                1 if descent_mode else 0, float(wind_error),
+                _buffer.ctypes.data_as(ctypes.POINTER(ctypes.c_double)), _max_points,
+                ctypes.byref(_status))
+
+            if _points <= _max_points:
+                break
+
+            # Flight path was truncated - retry with a buffer large enough to hold it.
+            _max_points = _points
+
+        metrics.observe('stage_duration_seconds', time.perf_counter() - _start, stage='engine_run')
+
+        if _status.value == PRED_ERROR:
+            metrics.count('failures_total', stage='engine_run')
+            raise Exception("Prediction engine error.")
+        elif _status.value == PRED_MODEL_ERROR:
+            metrics.count('failures_total', stage='engine_run')
+            logging.debug("Prediction engine ran out of wind data.")
+
+        return _buffer[:_points]
+
+
+    def predict_batch(self,launch_lat= -34.9499,
+            launch_lon = 138.5194,
+            launch_alt = 0,
+            ascent_rate = 5.0,
+            descent_rate = 8.0,
+            burst_alt = 26000,
+            launch_time = None,
+            descent_mode = False,
+            wind_error = 0.0,
+            seed = None):
+        '''
+        Run a batch of predictions (i.e. an ensemble), stepping all of the flights together.
+        Each launch parameter may be a single value or an array (launch_time as datetimes or
+        POSIX timestamps), and are broadcast against each other.
+        Returns an [N,4] numpy array of the (timestamp, lat, lon, alt) landing of each flight
+        (or its last position, if it ran out of wind data), and an array of N status codes
+        (PRED_OK, or PRED_MODEL_ERROR). The wind is sampled using random numbers from seed,
+        so a batch with the same seed is reproducible.
+        '''
+        if self.handle is None:
+            raise Exception("Engine has been closed.")
+
+        if launch_time is None:
+            launch_time = datetime.datetime.utcnow()
+
+        _times = [calendar.timegm(_t.utctimetuple()) if isinstance(_t, datetime.datetime) else _t
+            for _t in np.ravel(np.array(launch_time, dtype=object))]
+        _times = np.array(_times, dtype=np.int_).reshape(np.shape(launch_time))
+
+        _params = np.broadcast_arrays(launch_lat, launch_lon, launch_alt, ascent_rate, descent_rate, burst_alt, _times)
+        _params = [np.ascontiguousarray(np.ravel(_p), dtype=np.float64) for _p in _params[:6]] + \
+            [np.ascontiguousarray(np.ravel(_params[6]), dtype=np.int_)]
+        _n = len(_params[0])
+
+        if seed is None:
+            seed = int.from_bytes(os.urandom(8), 'little')
+
+        _output = np.zeros((_n, 4), dtype=np.float64)
+        _status = np.zeros(_n, dtype=np.intc)
+
+        _start = time.perf_counter()
+        _landed = self.lib.pred_run_batch(self.handle, _n,
+            _params[0], _params[1], _params[2], _params[6], _params[3], _params[4], _params[5],
+            1 if descent_mode else 0, float(wind_error), seed & 0xFFFFFFFFFFFFFFFF,
+            _output, _status)
+        metrics.observe('stage_duration_seconds', time.perf_counter() - _start, stage='engine_batch')
+
+        if _landed < 0:
+            metrics.count('failures_total', stage='engine_batch')
+            raise Exception("Prediction engine error.")
+        elif _landed < _n:
+            logging.debug("%d of %d flights ran out of wind data." % (_n - _landed, _n))
+
+        return (_output, _status)
+
+
+    def close(self):
+        ''' Free the dataset handle, and all wind data loaded through it. '''
+        if self.handle is not None:
+            self.lib.pred_dataset_free(self.handle)
+            self.handle = None
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *args):
+        self.close()
+
+
+    def __del__(self):
+        if getattr(self, 'handle', None) is not None:
+            self.close()
+
+
+# Test Script. Run a prediction for Adelaide Airport and print the landing location.
+if __name__ == "__main__":
+    import argparse
+    from dateutil.parser import parse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-g', '--gfs', type=str, default='./gfs', help="GFS data directory.")
+    parser.add_argument('-l', '--lib', type=str, default=None, help="Path to libpred.so.")
+    parser.add_argument('-t', '--time', type=str, default=None, help="Launch time (UTC). Default: now.")
+    args = parser.parse_args()
+
+    _launch_time = parse(args.time) if args.time else datetime.datetime.utcnow()
+
+    with Engine(gfs_path=args.gfs, lib_path=args.lib) as engine:
+        flight_path = engine.predict(launch_time=_launch_time)
+        if len(flight_path) > 0:
+            print("Landing: %s" % str(flight_path[-1].tolist()))
+        else:
+            print("No flight path returned.")
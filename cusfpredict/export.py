@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+#
+#   Project Horus
+#   CUSF Standalone Predictor Python Wrapper - Compact Prediction JSON Export
+#   Copyright 2020 Mark Jessop <vk5qi@rfhead.net>
+#
+#   Reduce the size of the prediction JSON files used by the web map (apps/web/index.html),
+#   by simplifying tracks, limiting coordinate precision, optionally delta-encoding the
+#   coordinates, and writing out a precompressed gzip copy for the web server to use.
+#   Prediction sets can also be split into a small index file, containing launch/landing
+#   information, and per-prediction track files which the web page loads as required.
+#
+import gzip
+import json
+import os
+import re
+import numpy as np
+
+
+# Approximate metres per degree of latitude.
+METRES_PER_DEGREE = 111320.0
+
+
+def simplify_track(flight_path, tolerance=0.0):
+    '''
+    Simplify a [[timestamp, lat, lon, alt], ...] flight path using the Douglas-Peucker algorithm.
+    Points are discarded if they are within <tolerance> metres (horizontally) of the simplified track.
+    The first, last and burst (highest) points are always kept.
+    Returns the simplified flight path.
+    '''
+    if tolerance <= 0 or len(flight_path) < 3:
+        return flight_path
+
+    _points = np.array(flight_path, dtype=float)
+
+    # Project to a local flat-earth approximation (metres), which is plenty good enough over a flight.
+    _y = _points[:,1] * METRES_PER_DEGREE
+    _x = _points[:,2] * METRES_PER_DEGREE * np.cos(np.radians(np.mean(_points[:,1])))
+
+    _keep = np.zeros(len(_points), dtype=bool)
+    _burst = int(np.argmax(_points[:,3]))
+    _keep[[0, _burst, len(_points)-1]] = True
+
+    # Work through segments with an explicit stack, rather than recursing.
+    _stack = [(0, _burst), (_burst, len(_points)-1)]
+    while _stack:
+        (_start, _end) = _stack.pop()
+        if _end - _start < 2:
+            continue
+
+        _dx = _x[_end] - _x[_start]
+        _dy = _y[_end] - _y[_start]
+        _px = _x[_start+1:_end] - _x[_start]
+        _py = _y[_start+1:_end] - _y[_start]
+        _length_sq = _dx*_dx + _dy*_dy
+
+        if _length_sq == 0.0:
+            _dist = np.hypot(_px, _py)
+        else:
+            # Distance from each point to the segment (clamped to the segment end-points)
+            _t = np.clip((_px*_dx + _py*_dy) / _length_sq, 0.0, 1.0)
+            _dist = np.hypot(_px - _t*_dx, _py - _t*_dy)
+
+        _max_index = int(np.argmax(_dist))
+        if _dist[_max_index] > tolerance:
+            _split = _start + 1 + _max_index
+            _keep[_split] = True
+            _stack.append((_start, _split))
+            _stack.append((_split, _end))
+
+    return [flight_path[_i] for _i in np.flatnonzero(_keep)]
+
+
+def encode_path(flight_path, precision=None, delta=False):
+    '''
+    Convert a flight path to a path suitable for use with leaflet's PolyLine ([lat, lon, alt] entries),
+    rounding latitude/longitude to <precision> decimal places and altitude to whole metres.
+    If delta is True, the path is instead returned as a dictionary containing a flat list of
+    integer coordinates (scaled by 10^precision), each relative to the previous point.
+    '''
+    _points = np.array([[_p[1], _p[2], _p[3]] for _p in flight_path], dtype=float)
+
+    if precision is None and not delta:
+        return _points.tolist()
+
+    if precision is None:
+        precision = 5
+
+    if not delta:
+        return [[round(_p[0], precision), round(_p[1], precision), round(_p[2])] for _p in _points.tolist()]
+
+    _scaled = np.round(_points * np.array([10**precision, 10**precision, 1])).astype(np.int64)
+    _scaled[1:] = np.diff(_scaled, axis=0)
+
+    return {
+        'encoding': 'delta',
+        'precision': precision,
+        'points': _scaled.flatten().tolist()
+    }
+
+
+def write_json(data, filename, gzip_copy=False):
+    ''' Write out a JSON blob atomically, optionally along with a precompressed filename.gz copy. '''
+    _text = json.dumps(data, separators=(',', ':'))
+
+    _temp_file = filename + ".tmp"
+    with open(_temp_file, 'w') as f:
+        f.write(_text)
+    os.replace(_temp_file, filename)
+
+    if gzip_copy:
+        _temp_file = filename + ".gz.tmp"
+        with gzip.open(_temp_file, 'wb', compresslevel=9) as f:
+            f.write(_text.encode('utf-8'))
+        os.replace(_temp_file, filename + ".gz")
+
+
+class PredictionExporter(object):
+    '''
+    Collect predictions for a launch site, and write them out in the JSON format used by the web map.
+
+    header is a dictionary of site information (dataset, site, launch_lat, launch_lon) included in the output.
+    tolerance - Track simplification tolerance (metres). 0 disables simplification.
+    precision - Number of decimal places of latitude/longitude to keep. None keeps full precision.
+    delta - Delta-encode track coordinates.
+    split - Write a small index file, with tracks written to separate files in a directory alongside it.
+    gzip_copy - Also write precompressed .gz copies of each file.
+    '''
+
+    def __init__(self, filename, header, tolerance=0.0, precision=None, delta=False, split=False, gzip_copy=False):
+        self.filename = filename
+        self.header = header
+        self.tolerance = tolerance
+        self.precision = precision
+        self.delta = delta
+        self.split = split
+        self.gzip_copy = gzip_copy
+
+        self.predictions = {}
+
+        # Per-prediction files are written to a directory named after the index file.
+        self.track_dir = os.path.splitext(filename)[0]
+        if self.split and not os.path.isdir(self.track_dir):
+            os.makedirs(self.track_dir)
+
+
+    def track_filename(self, name):
+        ''' Filename (relative to the index file) of the track file for a prediction '''
+        return os.path.basename(self.track_dir) + "/" + re.sub(r'[^A-Za-z0-9\-\.]', '_', name) + ".json"
+
+
+    def add(self, name, flight_path, **info):
+        ''' Add a prediction. Any additional keyword arguments (i.e. timestamp, burst_alt) are stored alongside it. '''
+        _path = encode_path(simplify_track(flight_path, self.tolerance), precision=self.precision, delta=self.delta)
+
+        _prediction = dict(info)
+        if self.split:
+            _prediction['landing'] = [flight_path[-1][1], flight_path[-1][2]]
+            _prediction['file'] = self.track_filename(name)
+            write_json({'path': _path}, os.path.join(os.path.dirname(self.filename), _prediction['file']), gzip_copy=self.gzip_copy)
+        else:
+            _prediction['path'] = _path
+
+        self.predictions[name] = _prediction
+
+
+    def write(self):
+        ''' Write out the prediction (index) file, with predictions in launch-time order. '''
+        _output = dict(self.header)
+        _output['predictions'] = dict(sorted(self.predictions.items()))
+        write_json(_output, self.filename, gzip_copy=self.gzip_copy)
+
+
+    def close(self):
+        ''' Write out the index file, and clean up any track files left over from previous runs. '''
+        self.write()
+
+        if self.split:
+            _current = set([os.path.basename(_p['file']) for _p in self.predictions.values()])
+            for _file in os.listdir(self.track_dir):
+                if _file.endswith(".tmp") or _file.split('.json')[0] + ".json" not in _current:
+                    os.remove(os.path.join(self.track_dir, _file))
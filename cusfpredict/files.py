@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+#
+#   Project Horus
+#   CUSF Standalone Predictor Python Wrapper - CUSF GFS File Naming
+#   Copyright 2020 Mark Jessop <vk5qi@rfhead.net>
+#
+#   Finding CUSF GFS files in a data directory. This module has no dependencies outside of the
+#   standard library, so it is cheap to import (i.e. for cusfpredict.predict).
+#
+import os
+import re
+
+
+# Extensions of compressed CUSF GFS files (i.e. gfs_1506052799_-33.0_139.0_10.0_10.0.dat.gz), and their formats.
+CUSF_COMPRESSION_EXTENSIONS = {'.gz': 'gzip', '.zst': 'zstd'}
+
+
+def is_cusf_filename(filename):
+    """ Check if a filename follows the CUSF GFS file naming scheme (compressed or not) """
+    _name = os.path.basename(filename)
+    if not _name.startswith('gfs_'):
+        return False
+    return any(_name.endswith('.dat' + _ext) for _ext in [''] + list(CUSF_COMPRESSION_EXTENSIONS.keys()))
+
+
+def cusf_files(directory):
+    """ List the CUSF GFS files (compressed or not) in a directory, sorted by name """
+    try:
+        _names = os.listdir(directory)
+    except OSError:
+        return []
+    return [os.path.join(directory, _name) for _name in sorted(_names) if is_cusf_filename(_name)]
+
+
+def has_cusf_files(directory):
+    """ Check if a directory contains any CUSF GFS files, stopping at the first one found """
+    try:
+        with os.scandir(directory) as _entries:
+            return any(is_cusf_filename(_entry.name) for _entry in _entries)
+    except OSError:
+        return False
+
+
+# Downsampled levels of a dataset are kept in subdirectories named by their resolution, i.e. 0p50 and 1p00.
+_PYRAMID_LEVEL_NAME = re.compile(r'^[0-9]+p[0-9]{2}$')
+
+def is_pyramid_level(name):
+    """ Check if a dataset subdirectory name is that of a downsampled (pyramid) level, i.e. 1p00 """
+    return _PYRAMID_LEVEL_NAME.match(name) is not None
+
+
+def _data_subdirectories(directory):
+    try:
+        _names = sorted(os.listdir(directory))
+    except OSError:
+        return []
+    return [_name for _name in _names if os.path.isdir(os.path.join(directory, _name)) and has_cusf_files(os.path.join(directory, _name))]
+
+
+def dataset_members(directory):
+    """ List the ensemble members of a dataset: the names of its subdirectories which contain CUSF GFS files """
+    return [_name for _name in _data_subdirectories(directory) if not is_pyramid_level(_name)]
+
+
+def dataset_levels(directory):
+    """ List the downsampled (pyramid) levels of a dataset, or of an ensemble member's data """
+    return [_name for _name in _data_subdirectories(directory) if is_pyramid_level(_name)]
@@ -11,6 +11,7 @@
 #
 import sys
 import glob
+import gzip
 import os.path
 from os import remove
 import shutil
@@ -18,17 +19,24 @@ from tempfile import mkdtemp
 import traceback
 import requests
 import argparse
+import json
 import logging
+import math
 import datetime
+import multiprocessing
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 import numpy as np
+from . import metrics
+from .files import dataset_members, dataset_levels
+from .reader import open_cusf_file
 
 try:
-    import xarray as xr
-    import cfgrib
+    import zstandard
 except ImportError:
-    print("xarray and/or cfgrib not installed! Check setup instructions...")
-    sys.exit(1)
+    zstandard = None
+
 
 # GRIB Filter URL
 GRIB_FILTER_URL = "http://nomads.ncep.noaa.gov/cgi-bin/filter_gfs_%s.pl"
@@ -40,20 +48,84 @@ GRIB_FILTER_URL = "http://nomads.ncep.noaa.gov/cgi-bin/filter_gfs_%s.pl"
 GFS_LEVELS = [1000.0,975.0,950.0,925.0,900.0,850.0,800.0,750.0,700.0,650.0,600.0,550.0,500.0,450.0,400.0,350.0,300.0,250.0,200.0,150.0,100.0,70.0,50.0,30.0,20.0,10.0,7.0,5.0,3.0,2.0,1.0]
 GFS_PARAMS = ['HGT', 'UGRD', 'VGRD']
 
+# GEFS (Global Ensemble Forecast System) members: the control run, and 30 perturbed runs.
+GEFS_MEMBERS = ['gec00'] + ['gep%02d' % _i for _i in range(1, 31)]
+# Pressure levels with height and wind data in the GEFS 'a' (commonly used parameters) files.
+GEFS_LEVELS = [1000.0,925.0,850.0,700.0,500.0,300.0,250.0,200.0,100.0,50.0,10.0]
+
 # Dictionary containg available times and other information for each supported model.
 # Times are an array of the available hours for the model.
+# Ensemble models also have a list of members, and are written out with a subdirectory per member.
+# Models which don't specify the GRIB filter URL, server directory or pressure levels use the GFS defaults.
+# The grid resolution (degrees) is used to estimate the size of downloads (see plan_downloads).
 
 VALID_MODELS = {
     '0p25_1hr'  : {'times': np.concatenate((np.arange(0,120,1),np.arange(120,240,3),np.arange(240,396,12))),
-                    'model_file': "gfs.t%sz.pgrb2.%s.f%03d" 
+                    'model_file': "gfs.t%sz.pgrb2.%s.f%03d",
+                    'resolution': 0.25
                     },
     '0p50'      : {'times': np.concatenate((np.arange(0,240,3),np.arange(240,396,12))),
-                    'model_file': "gfs.t%sz.pgrb2full.%s.f%03d"}
+                    'model_file': "gfs.t%sz.pgrb2full.%s.f%03d",
+                    'resolution': 0.5},
+    'gefs_0p50' : {'times': np.concatenate((np.arange(0,240,3),np.arange(240,390,6))),
+                    'model_file': "%s.t%sz.pgrb2a.0p50.f%03d",
+                    'resolution': 0.5,
+                    'filter_url': "http://nomads.ncep.noaa.gov/cgi-bin/filter_gefs_atmos_0p50a.pl",
+                    'model_dir': "gefs.%s/%s/atmos/pgrb2ap5",
+                    'levels': GEFS_LEVELS,
+                    'members': GEFS_MEMBERS}
+}
+
+# Downsampled levels of each tile written by write_pyramid, into a subdirectory of the dataset named by the level:
+# the grid resolution (degrees), and the pressure levels kept (None for all).
+PYRAMID_LEVELS = {
+    '0p50': {'resolution': 0.5, 'levels': None},
+    '1p00': {'resolution': 1.0, 'levels': GEFS_LEVELS},
 }
 
+# Download profiles, trading forecast hours, area and pressure levels for smaller (and fewer) downloads.
+# Each profile is a list of forecast hour ranges, each applying up until (but not including) hour 'until'
+# (None for the remaining hours), with:
+#   stride - Minimum hours between the forecast hours downloaded (the predictor interpolates between them).
+#   radius - Maximum area radius (degrees) downloaded, capped to the requested latdelta/londelta (None for the full area).
+#   max_alt - Highest altitude (m) flights are expected to reach (i.e. the maximum burst altitude). Only the pressure
+#             levels up to (and one above) this altitude are downloaded. None for all levels.
+# Profiles can also be loaded from a JSON file containing a list of ranges (see load_download_profile).
+DOWNLOAD_PROFILES = {
+    # Every forecast hour, and all levels over the full area.
+    'full': [
+        {'until': None, 'stride': 1, 'radius': None, 'max_alt': None}],
+    # Hourly data for the first two days, 3-hourly to 5 days, then 6-hourly over a smaller area, up to 40km.
+    'standard': [
+        {'until': 48, 'stride': 1, 'radius': None, 'max_alt': 40000.0},
+        {'until': 120, 'stride': 3, 'radius': None, 'max_alt': 40000.0},
+        {'until': None, 'stride': 6, 'radius': 6.0, 'max_alt': 40000.0}],
+    # Regular launches from a single site, with bursts below 33km. The full area is only kept for the first
+    # day (i.e. for tracking and chasing flights in progress), with predictions further out only needing the
+    # area around the launch site.
+    'site': [
+        {'until': 24, 'stride': 1, 'radius': None, 'max_alt': 33000.0},
+        {'until': 72, 'stride': 3, 'radius': 6.0, 'max_alt': 33000.0},
+        {'until': None, 'stride': 6, 'radius': 4.0, 'max_alt': 33000.0}],
+}
+DEFAULT_DOWNLOAD_PROFILE = 'full'
+
+# Approximate size of each value in a GRIB filter download (bytes), for estimating download sizes.
+GRIB_BYTES_PER_VALUE = 2.0
+
+# Compression formats for CUSF files (see wind_dict_to_cusf), and the extension appended to the filename for each.
+CUSF_COMPRESSION = {None: '', 'gzip': '.gz', 'zstd': '.zst'}
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+# Index of the wind data files in a dataset directory, read by pred at startup (see src/wind/wind_file_cache.h)
+DATASET_INDEX_FILENAME = "wind_index.txt"
+
 # Other Globals
 REQUEST_TIMEOUT = 60 # GRIB filter requests have been observed to take up to 60 seconds to complete...
 REQUEST_RETRIES = 10 # We often have to retry a LOT. 
+REQUEST_RATE_LIMIT = 1.5 # Requests per second, across all concurrent downloads. NOMADS blocks clients exceeding 120 requests/minute.
+ENSEMBLE_DOWNLOAD_WORKERS = 8 # Number of concurrent downloads when ingesting ensemble members.
 
 # Functions to Generate the GRIB Filter URL
 
@@ -79,29 +151,54 @@ def find_nearest(array, value):
     return idx
 
 
+def is_ensemble_model(model):
+    ''' Check if a model is an ensemble, with data for each of a list of members '''
+    return 'members' in VALID_MODELS[model]
+
+
+def model_filename(model, model_dt, forecast_time, member=None):
+    ''' Name of the GRIB file for a forecast hour of a model cycle (and ensemble member), on the NOMADS server '''
+    if model not in VALID_MODELS.keys():
+        raise ValueError("Invalid GFS Model!")
+
+    _model_hour = model_dt.strftime("%H")
+
+    if is_ensemble_model(model):
+        if member not in VALID_MODELS[model]['members']:
+            raise ValueError("Invalid ensemble member: %s" % str(member))
+        return VALID_MODELS[model]['model_file'] % (member, _model_hour, forecast_time)
+
+    return VALID_MODELS[model]['model_file'] % (_model_hour, model.split('_')[0], forecast_time)
+
+
+def model_directory(model, model_dt):
+    ''' Directory containing a model cycle on the NOMADS server, relative to the data root '''
+    return VALID_MODELS[model].get('model_dir', "gfs.%s/%s/atmos") % (model_dt.strftime("%Y%m%d"), model_dt.strftime("%H"))
+
+
 def generate_filter_request(model='0p25_1hr',
                             forecast_time=0,
                             model_dt=latest_model_name(0),
                             lat=-34.0,
                             lon=138.0,
                             latdelta=10.0,
-                            londelta=10.0
+                            londelta=10.0,
+                            member=None,
+                            levels=None
                             ):
-    ''' Generate a URL and a dictionary of request parameters for use with the GRIB filter '''
+    '''
+    Generate a URL and a dictionary of request parameters for use with the GRIB filter.
+    Requests all of the model's pressure levels, unless a list of levels is given.
+    '''
 
     if model not in VALID_MODELS.keys():
         raise ValueError("Invalid GFS Model!")
 
-    # Get latest model time
-    _model_dt = model_dt
-    _model_timestring = _model_dt.strftime("%Y%m%d/%H")
-    _model_hour = _model_dt.strftime("%H")
-
-    _filter_url = GRIB_FILTER_URL % model
+    _filter_url = VALID_MODELS[model].get('filter_url', GRIB_FILTER_URL % model)
 
     _filter_params = {}
-    _filter_params['file'] = VALID_MODELS[model]['model_file'] % (_model_hour, model.split('_')[0], forecast_time)
-    _filter_params['dir'] = "/gfs.%s/atmos" % (_model_timestring)
+    _filter_params['file'] = model_filename(model, model_dt, forecast_time, member=member)
+    _filter_params['dir'] = "/" + model_directory(model, model_dt)
     _filter_params['subregion'] = ''
     # TODO: Fix this to handle borders at -180 degrees properly.
     _filter_params['leftlon'] = max(-180, int(lon - londelta))
@@ -114,7 +211,10 @@ def generate_filter_request(model='0p25_1hr',
         _filter_params['var_%s'%_param] = 'on'
 
     # Add in the levels we want:
-    for _level in GFS_LEVELS:
+    if levels is None:
+        levels = VALID_MODELS[model].get('levels', GFS_LEVELS)
+
+    for _level in levels:
         if _level%1.0 == 0.0:
             _filter_params['lev_%d_mb' % int(_level)] = 'on'
         else:
@@ -127,99 +227,225 @@ def generate_filter_request(model='0p25_1hr',
     return (_filter_url, _filter_params)
 
 
-def determine_latest_available_dataset(model='0p25_1hr', forecast_time=0):
-    ''' Determine what the latest available dataset with <forecast_time> hours of model available is '''
-    # NOTE: Not all models have all forecast hours available!
-    # Clip the forecast time to the nearest available hour
-    _times = VALID_MODELS[model]['times']
-    _forecast_time = _times[find_nearest(_times, forecast_time)]
+def pressure_at_altitude(altitude):
+    ''' Pressure (hPa) at an altitude (m), from the same standard atmosphere model as the predictor (src/altitude.c) '''
+    if altitude > 25000:
+        _temp = -131.21 + 0.00299 * altitude
+        _pressure = 2.488 * ((_temp + 273.1) / 216.6) ** -11.388
+    elif altitude > 11000:
+        _pressure = 22.65 * math.exp(1.73 - 0.000157 * altitude)
+    else:
+        _temp = 15.04 - 0.00649 * altitude
+        _pressure = 101.29 * ((_temp + 273.1) / 288.08) ** 5.256
+
+    # kPa -> hPa
+    return _pressure * 10.0
+
+
+def profile_levels(levels, max_alt=None):
+    '''
+    Pressure levels required for flights up to max_alt (m): the levels below it, and the first level
+    above it, so the wind can still be interpolated at max_alt. All levels if max_alt is None.
+    '''
+    if max_alt is None:
+        return list(levels)
+
+    _top = pressure_at_altitude(max_alt)
+    _levels = sorted(levels, reverse=True)
+    _below = [_level for _level in _levels if _level >= _top]
+    return _levels[:len(_below) + 1]
+
+
+def load_download_profile(profile=DEFAULT_DOWNLOAD_PROFILE):
+    '''
+    Get a download profile (see DOWNLOAD_PROFILES) by name, or load one from a JSON file containing a list
+    of forecast hour ranges. Ranges may leave out any of their settings, which default to those of the
+    'full' profile. A list of ranges is returned as-is, after checking it.
+    '''
+    if isinstance(profile, str):
+        if profile in DOWNLOAD_PROFILES:
+            profile = DOWNLOAD_PROFILES[profile]
+        elif os.path.isfile(profile):
+            with open(profile, 'r') as _f:
+                profile = json.load(_f)
+        else:
+            raise ValueError("Unknown download profile: %s" % profile)
+
+    _ranges = []
+    for _range in profile:
+        _range = dict(DOWNLOAD_PROFILES['full'][0], **_range)
+        if int(_range['stride']) < 1:
+            raise ValueError("Download profile stride must be at least 1 hour.")
+        _ranges.append(_range)
+
+    if len(_ranges) == 0:
+        raise ValueError("Download profile has no forecast hour ranges.")
+
+    # Only the last range can run to the end of the forecast.
+    if any(_range['until'] is None for _range in _ranges[:-1]):
+        raise ValueError("Only the last range of a download profile can have no 'until' hour.")
+
+    return _ranges
+
+
+def _profile_range(profile, forecast_time):
+    ''' Index of the range of a download profile which a forecast hour falls in '''
+    for (_i, _range) in enumerate(profile):
+        if (_range['until'] is None) or (forecast_time < _range['until']):
+            return _i
+    # Hours past the end of the last range use its settings.
+    return len(profile) - 1
+
+
+def select_forecast_times(forecast_times, profile=DEFAULT_DOWNLOAD_PROFILE):
+    '''
+    Select the forecast hours to download from a list of available hours, according to a download profile:
+    the first available hour of each range, and then hours at least <stride> hours apart. The last hour is
+    always included, so the data still extends as far into the future as requested.
+    '''
+    profile = load_download_profile(profile)
+
+    _selected = []
+    _last_range = None
+    for _hour in forecast_times:
+        _range = _profile_range(profile, _hour)
+        if (_range != _last_range) or (_hour - _selected[-1] >= profile[_range]['stride']):
+            _selected.append(int(_hour))
+            _last_range = _range
+
+    if len(forecast_times) > 0 and _selected[-1] != int(forecast_times[-1]):
+        _selected.append(int(forecast_times[-1]))
+
+    return _selected
+
+
+def plan_downloads(model='0p25_1hr',
+                    model_dt=latest_model_name(0),
+                    forecast_times=[0],
+                    profile=DEFAULT_DOWNLOAD_PROFILE,
+                    lat=-34.0,
+                    lon=138.0,
+                    latdelta=10.0,
+                    londelta=10.0,
+                    member=None):
+    '''
+    Plan the minimal set of GRIB filter requests to ingest a list of available forecast hours under a download
+    profile (a name from DOWNLOAD_PROFILES, the path to a JSON profile, or a list of ranges): only the forecast
+    hours selected by the profile's strides, each over the profile's area and pressure levels for that hour.
+
+    Returns a list of dictionaries, with the forecast_time, url, params, latdelta, londelta and levels of each
+    request, and the number of values (grid points x levels x parameters) it will download.
+    '''
+    profile = load_download_profile(profile)
+    _resolution = VALID_MODELS[model]['resolution']
+    _model_levels = VALID_MODELS[model].get('levels', GFS_LEVELS)
+
+    _requests = []
+    for _forecast_time in select_forecast_times(forecast_times, profile):
+        _range = profile[_profile_range(profile, _forecast_time)]
+
+        _latdelta = latdelta if _range['radius'] is None else min(latdelta, _range['radius'])
+        _londelta = londelta if _range['radius'] is None else min(londelta, _range['radius'])
+        _levels = profile_levels(_model_levels, _range['max_alt'])
 
-    # Attempt to grab a small amount of data from the most recent model.
-    # if that fails, go to the next most recent, and continue until either we have data, or have completely failed.
-    for _model_age in range(0,-5,-1):
-        _model_dt = latest_model_name(_model_age)
-        _model_timestring = _model_dt.strftime("%Y%m%d/%H")
-        logging.info("Testing Model: %s" % _model_timestring)
         (_url, _params) = generate_filter_request(
-                                                model=model,
-                                                forecast_time=_forecast_time,
-                                                model_dt = _model_dt,
-                                                lat=0.0,
-                                                lon=0.0,
-                                                latdelta=1.0,
-                                                londelta=1.0)
+            model=model,
+            forecast_time=_forecast_time,
+            model_dt=model_dt,
+            lat=lat,
+            lon=lon,
+            latdelta=_latdelta,
+            londelta=_londelta,
+            member=member,
+            levels=_levels)
+
+        # The filter returns the grid points within the (whole-degree) bounds of the request.
+        _points = (round((_params['toplat'] - _params['bottomlat']) / _resolution) + 1) * \
+            (round((_params['rightlon'] - _params['leftlon']) / _resolution) + 1)
+
+        _requests.append({
+            'forecast_time': _forecast_time,
+            'url': _url,
+            'params': _params,
+            'latdelta': _latdelta,
+            'londelta': _londelta,
+            'levels': _levels,
+            'values': _points * len(_levels) * len(GFS_PARAMS)
+        })
+
+    return _requests
+
+
+def summarise_plan(requests):
+    ''' Summarise a list of planned requests (see plan_downloads): the number of requests, values, and estimated bytes '''
+    _values = sum(_request['values'] for _request in requests)
+    return {
+        'requests': len(requests),
+        'values': _values,
+        'bytes': int(_values * GRIB_BYTES_PER_VALUE),
+    }
 
 
-        _retries = REQUEST_RETRIES
-        while _retries > 0:
-            try:
-                _r = requests.get(_url, params=_params, timeout=REQUEST_TIMEOUT)
-                if _r.status_code == requests.codes.ok:
-                    logging.info("Found valid data in model %s!" % _model_timestring)
-                    return _model_dt
-                else:
-                    break
-            except Exception as e:
-                logging.error("Error when testing model, retrying: %s" % str(e))
-                _retries -= 1
-                continue
+def determine_latest_available_dataset(model='0p25_1hr', forecast_time=0):
+    ''' Determine what the latest available dataset with <forecast_time> hours of model available is '''
+    # Imported here, as the probe module depends on the model definitions above.
+    from .probe import find_latest_cycle
 
-    logging.error("Could not find a model with the required data.")
-    return None
+    return find_latest_cycle(model=model, forecast_time=forecast_time)
 
 
 def wait_for_newest_dataset(model='0p25_1hr', forecast_time=0, timeout=4*60):
-    ''' Wait until enough data from the newest dataset is available. '''
+    ''' Wait up to <timeout> minutes until enough data from the newest dataset is available. '''
+    from .probe import CycleWatcher
 
     # NOTE: Not all models have all forecast hours available!
     # Clip the forecast time to the nearest available hour
     _times = VALID_MODELS[model]['times']
     _forecast_time = _times[find_nearest(_times, forecast_time)]
 
-    # Attempt to grab a small amount of data from the most recent model.
-    # if that fails, go to the next most recent, and continue until either we have data, or have completely failed.
-    _start_time = time.time()
-    while (time.time()-_start_time) < timeout*60:
-        _model_dt = latest_model_name(0)
-        _model_timestring = _model_dt.strftime("%Y%m%d/%H")
-        logging.info("Testing Model: %s" % _model_timestring)
-        (_url, _params) = generate_filter_request(
-                                                model=model,
-                                                forecast_time=_forecast_time,
-                                                model_dt = _model_dt,
-                                                lat=0.0,
-                                                lon=0.0,
-                                                latdelta=1.0,
-                                                londelta=1.0)
-
-
-        _retries = REQUEST_RETRIES
-        while _retries > 0:
-            try:
-                _r = requests.get(_url, params=_params, timeout=REQUEST_TIMEOUT)
-                if _r.status_code == requests.codes.ok:
-                    logging.info("Found valid data in model %s!" % _model_timestring)
-                    return _model_dt
-                else:
-                    logging.info("Model does not exist, or does not contain the required data yet. Waiting...")
-                    time.sleep(120)
-                    break
-            except Exception as e:
-                logging.error("Error when testing model, retrying: %s" % str(e))
-                _retries -= 1
-                continue
+    _watcher = CycleWatcher(model=model, model_dt=latest_model_name(0), forecast_times=[_forecast_time])
 
+    for _hour in _watcher.watch(timeout=timeout*60):
+        logging.info("Found valid data in model %s!" % _watcher.model_dt.strftime("%Y%m%d/%H"))
+        return _watcher.model_dt
 
     logging.error("Could not find a model with the required data within timeout period.")
     return None
 
 
 # Functions to poll the GRIB filter, and download data.
-def download_grib(url, params, filename="temp.grib"):
-    ''' Attempt to download a GRIB file to disk '''
+class RateLimiter(object):
+    '''
+    Limit the rate of requests made from any number of threads to <rate> per second, allowing
+    bursts of up to <burst> requests after an idle period. Call wait() before each request.
+    '''
+
+    def __init__(self, rate=REQUEST_RATE_LIMIT, burst=1):
+        self.interval = 1.0/rate
+        self.burst = burst
+        self.lock = threading.Lock()
+        self.next_slot = time.monotonic()
+
+
+    def wait(self):
+        ''' Block until a request can be made. '''
+        with self.lock:
+            _now = time.monotonic()
+            _slot = max(self.next_slot, _now - (self.burst - 1) * self.interval)
+            self.next_slot = _slot + self.interval
+
+        if _slot > _now:
+            time.sleep(_slot - _now)
+
+
+def download_grib(url, params, filename="temp.grib", rate_limiter=None):
+    ''' Attempt to download a GRIB file to disk. Each attempt waits on the rate limiter, if one is provided. '''
     _retries = REQUEST_RETRIES
 
     while _retries > 0:
+        if rate_limiter is not None:
+            rate_limiter.wait()
+
         try:
             _start = time.time()
             _r = requests.get(url, params=params, timeout=REQUEST_TIMEOUT)
@@ -229,6 +455,8 @@ def download_grib(url, params, filename="temp.grib"):
                 # Writeout to disk.
                 _duration = time.time() - _start
                 logging.info("GRIB request took %.1f seconds." % _duration)
+                metrics.observe('stage_duration_seconds', _duration, stage='download')
+                metrics.observe('download_bytes', len(_r.content))
                 f = open(filename, 'wb')
                 f.write(_r.content)
                 f.close()
@@ -236,26 +464,91 @@ def download_grib(url, params, filename="temp.grib"):
             # Return status is something else...
             else:
                 logging.error("Request returned error code: %s" % str(_r.status_code))
+                metrics.count('retries_total', stage='download')
                 _retries -= 1
                 continue
 
         except Exception as e:
             logging.error("Request failed with error: %s" % str(e))
+            metrics.count('retries_total', stage='download')
             _retries -= 1
             continue
 
-    logging.error("Attempt to download GRIB failed after %d retries." % retries)
+    logging.error("Attempt to download GRIB failed after %d retries." % REQUEST_RETRIES)
+    metrics.count('failures_total', stage='download')
     return False
 
 
-def parse_grib_to_dict(gribfile):
-    ''' Parse a GRIB file into a python dictionary format '''
+def import_grib_decoder():
+    '''
+    Import xarray, with the cfgrib engine, used to decode GRIB files. These are slow to import, and not
+    needed to use the rest of this module, so are only imported when first required.
+    Raises ImportError if they are not installed.
+    '''
+    try:
+        import xarray
+        import cfgrib
+    except ImportError as e:
+        raise ImportError("xarray and/or cfgrib not installed! Check setup instructions... (%s)" % str(e))
+    return xarray
+
+
+def parse_grib_to_dict(gribfile, window=None):
+    '''
+    Parse a GRIB file into a python dictionary format.
+    If a window of (lat, lon, latdelta, londelta) is given, the data is cropped to it (see crop_window).
+    '''
+
+    with metrics.timed('decode'):
+        output = _parse_grib_to_dict(gribfile, window)
+
+    if output is None:
+        metrics.count('failures_total', stage='decode')
+
+    return output
+
+
+def crop_window(lat_scale, lon_scale, lat, lon, latdelta, londelta):
+    '''
+    Find the indices of the latitudes and longitudes of a grid within a window, with the same bounds as a
+    GRIB filter request (see generate_filter_request). The window is shifted by 360 degrees of longitude
+    if required to match the grid's longitudes (i.e. 0-360 for global GFS files).
+    Returns (lat_indices, lon_indices).
+    '''
+    _left = max(-180, int(lon - londelta))
+    _right = min(180, int(lon + londelta))
+    _top = min(90, int(lat + latdelta))
+    _bottom = max(-90, int(lat - latdelta))
+
+    _lon_min = np.min(lon_scale)
+    if _right < _lon_min:
+        _left += 360
+        _right += 360
+    elif _left > np.max(lon_scale):
+        _left -= 360
+        _right -= 360
+
+    _lats = np.nonzero((lat_scale >= _bottom) & (lat_scale <= _top))[0]
+    _lons = np.nonzero((lon_scale >= _left) & (lon_scale <= _right))[0]
+    return (_lats, _lons)
+
 
-    _grib = xr.open_dataset(gribfile, engine='cfgrib')
+def _parse_grib_to_dict(gribfile, window=None):
+    xr = import_grib_decoder()
+    # Files are only read once, so don't write out a cfgrib index file alongside each.
+    _grib = xr.open_dataset(gribfile, engine='cfgrib', backend_kwargs={'indexpath': ''})
 
     output = {}
 
     try:
+        if window is not None:
+            (_lats, _lons) = crop_window(_grib['latitude'].data, _grib['longitude'].data, *window)
+            if len(_lats) == 0 or len(_lons) == 0:
+                logging.error("%s has no data within the window." % gribfile)
+                return None
+            # Only the data within the window is decoded.
+            _grib = _grib.isel(latitude=_lats, longitude=_lons)
+
         # Extract coordinate scales.
         output['lon_scale'] = _grib['longitude'].data
         output['lat_scale'] = _grib['latitude'].data
@@ -264,8 +557,9 @@ def parse_grib_to_dict(gribfile):
         output['lat_centre'] = output['lat_scale'][len(output['lat_scale'])//2]
         output['lon_radius'] = (max(output['lon_scale']) - min(output['lon_scale']))/2.0
         output['lat_radius'] = (max(output['lat_scale']) - min(output['lat_scale']))/2.0
-        # Extract time.
+        # Extract time, and the model cycle (reference time).
         output['valid_time'] = int(_grib['valid_time'].data)//1000000000
+        output['model_time'] = int(_grib['time'].data)//1000000000
 
     except:
         traceback.print_exc()
@@ -289,19 +583,28 @@ def parse_grib_to_dict(gribfile):
     return output
 
 
-def wind_dict_to_cusf(data, output_dir='./gfs/'):
+def wind_dict_to_cusf(data, output_dir='./gfs/', compression=None):
     ''' 
     Export wind data to a cusf-standalone-predictor compatible file
     Note that the file-naming scheme is fixed, so only the output directory is user-selectable.
+    The file can optionally be compressed ('gzip' or 'zstd'), in which case .gz or .zst is appended
+    to the filename. Both pred and cusfpredict.reader read compressed files transparently.
     '''
+    _start = time.perf_counter()
+
+    if compression not in CUSF_COMPRESSION:
+        raise ValueError("Unknown compression format: %s" % str(compression))
+    if (compression == 'zstd') and (zstandard is None):
+        raise ImportError("zstandard module not installed - cannot write zstd compressed files.")
 
     # Generate Output Filename: i.e. gfs_1506052799_-33.0_139.0_10.0_10.0.dat
-    _output_filename = "gfs_%d_%.1f_%.1f_%.1f_%.1f.dat" % (
+    _output_filename = "gfs_%d_%.1f_%.1f_%.1f_%.1f.dat%s" % (
                         data['valid_time'],
                         data['lat_centre'],
                         data['lon_centre'],
                         data['lat_radius'],
-                        data['lon_radius']
+                        data['lon_radius'],
+                        CUSF_COMPRESSION[compression]
                         )
     _output_filename = os.path.join(output_dir, _output_filename)
 
@@ -375,12 +678,419 @@ def wind_dict_to_cusf(data, output_dir='./gfs/'):
                 output_text += "%.5f,%.5f,%.5f\n" % (_hgt_val,_ugrd_val,_vgrd_val)
 
     # Write out to file!
-    f = open(_output_filename,'w')
-    f.write(output_text)
-    f.close()
+    if compression == 'gzip':
+        with gzip.open(_output_filename, 'wt', compresslevel=GZIP_LEVEL) as f:
+            f.write(output_text)
+    elif compression == 'zstd':
+        with open(_output_filename, 'wb') as f:
+            with zstandard.ZstdCompressor(level=ZSTD_LEVEL).stream_writer(f, closefd=False) as _writer:
+                _writer.write(output_text.encode('ascii'))
+    else:
+        f = open(_output_filename,'w')
+        f.write(output_text)
+        f.close()
+
+    metrics.observe('stage_duration_seconds', time.perf_counter() - _start, stage='write')
 
     return (_output_filename, output_text)
 
+
+def _grid_indices(scale, resolution):
+    # Indices of the points of an axis which lie on a grid of the given resolution.
+    _steps = np.asarray(scale, dtype=float) / resolution
+    return np.nonzero(np.abs(_steps - np.round(_steps)) < 1e-6)[0]
+
+
+def downsample_wind_dict(data, resolution, levels=None):
+    '''
+    Downsample wind data (as returned by parse_grib_to_dict) to a coarser grid resolution (degrees), keeping
+    only the points which lie on the coarser grid (as the coarser GFS models do), and optionally only some
+    of the pressure levels. Returns None if the window is too small to hold at least 2x2 points at that resolution.
+    '''
+    _lats = _grid_indices(data['lat_scale'], resolution)
+    _lons = _grid_indices(data['lon_scale'], resolution)
+    if (len(_lats) < 2) or (len(_lons) < 2):
+        return None
+
+    output = {
+        'lat_scale': np.asarray(data['lat_scale'])[_lats],
+        'lon_scale': np.asarray(data['lon_scale'])[_lons],
+        'valid_time': data['valid_time'],
+    }
+    output['lon_centre'] = output['lon_scale'][len(output['lon_scale'])//2]
+    output['lat_centre'] = output['lat_scale'][len(output['lat_scale'])//2]
+    output['lon_radius'] = (max(output['lon_scale']) - min(output['lon_scale']))/2.0
+    output['lat_radius'] = (max(output['lat_scale']) - min(output['lat_scale']))/2.0
+
+    for _key in data.keys():
+        if type(_key) != int:
+            continue
+        if (levels is not None) and (_key not in levels):
+            continue
+        output[_key] = {_param: data[_key][_param][np.ix_(_lats, _lons)] for _param in GFS_PARAMS}
+
+    return output
+
+
+def write_pyramid(data, output_dir='./gfs/', compression=None, levels=PYRAMID_LEVELS):
+    '''
+    Write out downsampled copies of wind data (see downsample_wind_dict), for faster, coarser predictions.
+    Each level is written into a subdirectory of output_dir named by the level (i.e. 1p00), which can be
+    selected with Predictor.predict(resolution='1p00').
+    Returns a list of the filenames written.
+    '''
+    _filenames = []
+    for (_name, _level) in sorted(levels.items()):
+        _data = downsample_wind_dict(data, _level['resolution'], levels=_level['levels'])
+        if _data is None:
+            logging.warning("Data window is too small for a %s level - not writing it." % _name)
+            continue
+
+        _level_dir = os.path.join(output_dir, _name)
+        os.makedirs(_level_dir, exist_ok=True)
+        (_filename, _text) = wind_dict_to_cusf(_data, output_dir=_level_dir, compression=compression)
+        _filenames.append(_filename)
+
+    return _filenames
+
+def ingest_forecast_hour(model='0p25_1hr',
+                        model_dt=latest_model_name(0),
+                        forecast_time=0,
+                        lat=-34.0,
+                        lon=138.0,
+                        latdelta=10.0,
+                        londelta=10.0,
+                        output_dir='./gfs/',
+                        compression=None,
+                        member=None,
+                        pyramid=False,
+                        levels=None):
+    '''
+    Download, parse and write out a single forecast hour (of an ensemble member, for ensemble models).
+    Only the given pressure levels are downloaded, if provided (default: all of the model's levels).
+    If pyramid is True, the downsampled levels are also written out (see write_pyramid).
+    Returns the filename written, or None on failure.
+    '''
+
+    (url, params) = generate_filter_request(
+        model=model,
+        forecast_time=forecast_time,
+        model_dt=model_dt,
+        lat=lat,
+        lon=lon,
+        latdelta=latdelta,
+        londelta=londelta,
+        member=member,
+        levels=levels
+        )
+
+    # Use a per-hour GRIB filename, so multiple hours can be processed within the same directory.
+    _grib_file = os.path.join(output_dir, 'temp_f%03d.grib' % forecast_time)
+
+    success = download_grib(url, params, filename=_grib_file)
+
+    if success:
+        logging.info("Downloaded data for T+%03d" % forecast_time)
+    else:
+        logging.error("Could not download data for T+%03d" % forecast_time)
+        return None
+
+    # Now process the GRIB file.
+    logging.info("Processing GRIB file...")
+    return decode_grib_file(_grib_file, output_dir=output_dir, compression=compression, pyramid=pyramid)
+
+
+def decode_grib_file(grib_file, output_dir='./gfs/', compression=None, pyramid=False):
+    '''
+    Decode a downloaded GRIB file, write it out as a CUSF file (and its downsampled levels, if pyramid is True),
+    and remove it. Returns the filename written, or None on failure.
+    '''
+    _wind = parse_grib_to_dict(grib_file)
+    # Remove GRIB and index file.
+    remove(grib_file)
+    for _entry in glob.glob(grib_file + "*.idx"):
+        remove(_entry)
+
+    if _wind is not None:
+        (_filename, _text) = wind_dict_to_cusf(_wind, output_dir=output_dir, compression=compression)
+        logging.info("GFS data written to: %s" % _filename)
+        if pyramid:
+            write_pyramid(_wind, output_dir=output_dir, compression=compression)
+        return _filename
+    else:
+        logging.error("Error processing GRIB file.")
+        return None
+
+
+def plan_ensemble_requests(model='gefs_0p50',
+                        model_dt=latest_model_name(0),
+                        forecast_times=[0],
+                        members=None,
+                        lat=-34.0,
+                        lon=138.0,
+                        latdelta=10.0,
+                        londelta=10.0,
+                        output_dir='./gfs/',
+                        profile=DEFAULT_DOWNLOAD_PROFILE):
+    '''
+    List the GRIB filter requests required to ingest forecast hours of ensemble members (all members
+    if not specified), with the data for each member written into <output_dir>/<member>/.
+    The forecast hours, area and levels requested are reduced according to a download profile (see plan_downloads).
+    Requests are ordered by forecast hour, so the earliest hours are complete for all members first.
+    Returns a list of dictionaries, with the member, forecast_time, url, params, grib_file and output_dir of each
+    (along with the other planned request details).
+    '''
+    if not is_ensemble_model(model):
+        raise ValueError("%s is not an ensemble model!" % model)
+
+    if members is None:
+        members = VALID_MODELS[model]['members']
+
+    _plans = [plan_downloads(model=model, model_dt=model_dt, forecast_times=forecast_times, profile=profile,
+        lat=lat, lon=lon, latdelta=latdelta, londelta=londelta, member=_member) for _member in members]
+
+    _requests = []
+    for _hour_requests in zip(*_plans):
+        for (_member, _request) in zip(members, _hour_requests):
+            _member_dir = os.path.join(output_dir, _member)
+            _requests.append(dict(_request,
+                member=_member,
+                grib_file=os.path.join(_member_dir, 'temp_f%03d.grib' % _request['forecast_time']),
+                output_dir=_member_dir))
+
+    return _requests
+
+
+def _timed_download(request, rate_limiter):
+    _start = time.perf_counter()
+    _success = download_grib(request['url'], request['params'], filename=request['grib_file'], rate_limiter=rate_limiter)
+    return (_success, time.perf_counter() - _start)
+
+
+def _timed_decode(grib_file, output_dir, compression, pyramid):
+    # Run in a worker process, where metrics are not collected - the decode time is returned instead.
+    _start = time.perf_counter()
+    _filename = decode_grib_file(grib_file, output_dir=output_dir, compression=compression, pyramid=pyramid)
+    return (_filename, time.perf_counter() - _start)
+
+
+def ingest_ensemble(model='gefs_0p50',
+                    model_dt=latest_model_name(0),
+                    forecast_times=[0],
+                    members=None,
+                    lat=-34.0,
+                    lon=138.0,
+                    latdelta=10.0,
+                    londelta=10.0,
+                    output_dir='./gfs/',
+                    compression=None,
+                    rate_limit=REQUEST_RATE_LIMIT,
+                    download_workers=ENSEMBLE_DOWNLOAD_WORKERS,
+                    decode_workers=None,
+                    pyramid=False,
+                    profile=DEFAULT_DOWNLOAD_PROFILE):
+    '''
+    Download, decode and write out forecast hours of ensemble members (see plan_ensemble_requests),
+    reduced according to a download profile (see plan_downloads).
+    Downloads run concurrently, under a single rate limit (requests per second) across all of them, and
+    each GRIB file is decoded in a pool of <decode_workers> processes (default: one per CPU) as soon as
+    it has been downloaded. If pyramid is True, the downsampled levels of each file are also written out.
+
+    Returns a dictionary summarising the ingest: the number of requests, files written and failures,
+    bytes downloaded, the total (wall-clock) duration, and the time spent downloading and decoding,
+    summed across workers. Throughput is reported in files and bytes per second.
+    '''
+    _requests = plan_ensemble_requests(model=model, model_dt=model_dt, forecast_times=forecast_times, members=members,
+        lat=lat, lon=lon, latdelta=latdelta, londelta=londelta, output_dir=output_dir, profile=profile)
+
+    for _request in _requests:
+        os.makedirs(_request['output_dir'], exist_ok=True)
+
+    _summary = {'requests': len(_requests), 'written': 0, 'failed': 0, 'bytes': 0, 'download_time': 0.0, 'decode_time': 0.0}
+    _rate_limiter = RateLimiter(rate=rate_limit)
+    _start = time.perf_counter()
+
+    # The decoders are spawned rather than forked, as this process has threads running.
+    _context = multiprocessing.get_context('spawn')
+    with ThreadPoolExecutor(max_workers=download_workers) as _downloads, \
+        ProcessPoolExecutor(max_workers=decode_workers, mp_context=_context) as _decodes:
+
+        _download_futures = {_downloads.submit(_timed_download, _request, _rate_limiter): _request for _request in _requests}
+        _decode_futures = {}
+
+        for _future in as_completed(_download_futures):
+            _request = _download_futures[_future]
+            (_success, _duration) = _future.result()
+            _summary['download_time'] += _duration
+
+            if not _success:
+                logging.error("Could not download data for member %s T+%03d" % (_request['member'], _request['forecast_time']))
+                _summary['failed'] += 1
+                continue
+
+            _summary['bytes'] += os.path.getsize(_request['grib_file'])
+            _decode_futures[_decodes.submit(_timed_decode, _request['grib_file'], _request['output_dir'], compression, pyramid)] = _request
+
+        for _future in as_completed(_decode_futures):
+            _request = _decode_futures[_future]
+            try:
+                (_filename, _duration) = _future.result()
+            except Exception as e:
+                logging.error("Error decoding member %s T+%03d: %s" % (_request['member'], _request['forecast_time'], str(e)))
+                _filename = None
+                _duration = 0.0
+
+            _summary['decode_time'] += _duration
+            metrics.observe('stage_duration_seconds', _duration, stage='decode')
+
+            if _filename is None:
+                metrics.count('failures_total', stage='decode')
+                _summary['failed'] += 1
+            else:
+                _summary['written'] += 1
+
+    _summary['duration'] = time.perf_counter() - _start
+    _summary['files_per_second'] = _summary['written'] / _summary['duration']
+    _summary['bytes_per_second'] = _summary['bytes'] / _summary['duration']
+    metrics.observe('stage_duration_seconds', _summary['duration'], stage='ensemble_ingest')
+
+    logging.info("Ingested %d/%d member forecast hours (%.1f MB) in %.1f seconds: %.2f files/s, %.2f MB/s "
+        "(%.1f s downloading, %.1f s decoding, across all workers)." % (
+        _summary['written'], _summary['requests'], _summary['bytes']/1e6, _summary['duration'],
+        _summary['files_per_second'], _summary['bytes_per_second']/1e6, _summary['download_time'], _summary['decode_time']))
+
+    return _summary
+
+
+def write_dataset_info(output_dir, model_dt):
+    ''' Write the model name into dataset.txt within a dataset directory '''
+    f = open(os.path.join(output_dir, "dataset.txt"), 'w')
+    f.write("%s" % model_dt.strftime("%Y%m%d%Hz"))
+    f.close()
+
+
+def read_dataset_info(output_dir):
+    ''' Read the model time from dataset.txt within a dataset directory. Returns None if not available. '''
+    try:
+        with open(os.path.join(output_dir, "dataset.txt"), 'r') as f:
+            f_data = f.read().replace('\n', '')
+        return datetime.datetime.strptime(f_data, "%Y%m%d%Hz")
+    except Exception:
+        return None
+
+
+def write_dataset_index(output_dir):
+    '''
+    Write an index of the wind data files within a dataset directory (DATASET_INDEX_FILENAME), which pred
+    reads at startup instead of opening every file. As pred ignores the index if the directory has been
+    modified since the index was written, this must be done once all files are in place.
+    Returns the number of files indexed.
+    '''
+    _start = time.perf_counter()
+
+    # As per pred's directory scan, a data file is any file where the first non-comment line is the header.
+    _lines = []
+    for _filename in sorted(os.listdir(output_dir)):
+        _path = os.path.join(output_dir, _filename)
+        if (_filename == DATASET_INDEX_FILENAME) or (not os.path.isfile(_path)):
+            continue
+
+        try:
+            with open_cusf_file(_path) as _f:
+                for _line in _f:
+                    if not _line.startswith('#'):
+                        break
+            # window centre latitude, window latitude radius, window centre longitude, window longitude radius, POSIX timestamp
+            _fields = _line.strip().split(',')
+            [float(_field) for _field in _fields[:4]]
+            int(_fields[4])
+        except (ValueError, IndexError, UnicodeDecodeError, IOError, EOFError):
+            continue
+
+        _lines.append("%s,%s\n" % (_filename, ",".join(_fields[:5])))
+
+    _index_file = os.path.join(output_dir, DATASET_INDEX_FILENAME)
+    _temp_file = _index_file + ".tmp"
+    with open(_temp_file, 'w') as _f:
+        _f.write("# filename, window centre latitude, window latitude radius, window centre longitude, window longitude radius, POSIX timestamp\n")
+        _f.writelines(_lines)
+    os.replace(_temp_file, _index_file)
+
+    # The rename updated the directory's modification time - make sure the index is not older.
+    os.utime(_index_file, None)
+
+    metrics.observe('stage_duration_seconds', time.perf_counter() - _start, stage='index')
+    return len(_lines)
+
+
+def index_dataset(output_dir):
+    '''
+    Write the index of a dataset directory, and of each of its ensemble member subdirectories and
+    downsampled levels (if any).
+    '''
+    _files = 0
+    for _directory in [output_dir] + [os.path.join(output_dir, _member) for _member in dataset_members(output_dir)]:
+        _files += write_dataset_index(_directory)
+        for _level in dataset_levels(_directory):
+            _files += write_dataset_index(os.path.join(_directory, _level))
+    return _files
+
+
+def publish_dataset(staging_dir, output_dir, model_dt):
+    '''
+    Atomically publish a completed dataset.
+    The dataset is moved to <output_dir>.<model time>, and output_dir is (re-)pointed at it
+    using a symlink, so readers always see either the complete old or complete new dataset.
+    The previously published dataset directory is removed.
+    Returns the path of the published dataset directory.
+    '''
+    _output_dir = os.path.normpath(output_dir)
+    _target = "%s.%s" % (_output_dir, model_dt.strftime("%Y%m%d%Hz"))
+
+    # Determine what (if anything) is currently published.
+    _previous = None
+    if os.path.islink(_output_dir):
+        _previous = os.path.join(os.path.dirname(_output_dir), os.readlink(_output_dir))
+    elif os.path.isdir(_output_dir):
+        # A plain directory (i.e. from an earlier gfs.main() run). Move it out of the way,
+        # which leaves a very short window with no data.
+        _previous = _output_dir + ".old"
+        if os.path.exists(_previous):
+            shutil.rmtree(_previous)
+        os.rename(_output_dir, _previous)
+
+    if os.path.exists(_target):
+        # Re-publishing the same model cycle. Move the existing copy aside, and clean it up afterwards.
+        _replaced = "%s.replaced" % _target
+        if os.path.exists(_replaced):
+            shutil.rmtree(_replaced)
+        os.rename(_target, _replaced)
+        if (_previous is None) or (os.path.normpath(_previous) == os.path.normpath(_target)):
+            _previous = _replaced
+        else:
+            shutil.rmtree(_replaced)
+
+    _start = time.perf_counter()
+
+    # staging_dir must be on the same filesystem as output_dir for this to be atomic.
+    os.rename(staging_dir, _target)
+    index_dataset(_target)
+
+    _link_temp = _output_dir + ".tmp"
+    if os.path.lexists(_link_temp):
+        os.remove(_link_temp)
+    os.symlink(os.path.basename(_target), _link_temp)
+    os.replace(_link_temp, _output_dir)
+
+    if _previous and os.path.isdir(_previous) and (os.path.normpath(_previous) != os.path.normpath(_target)):
+        shutil.rmtree(_previous)
+
+    metrics.observe('stage_duration_seconds', time.perf_counter() - _start, stage='publish')
+    logging.info("Published dataset %s to %s" % (model_dt.strftime("%Y%m%d%Hz"), _output_dir))
+
+    return _target
+
+
 # Copy a directory over another existing directory ( https://stackoverflow.com/a/12514470 )
 def copytree(src, dst, symlinks=False, ignore=None):
     for item in os.listdir(src):
@@ -411,11 +1121,22 @@ def main():
     parser.add_argument('--lon', type=float, default=138.0, help="tile centre longitude in range (-180,180) degrees north")
     parser.add_argument('--latdelta', type=float, default=10.0, help='tile radius in latitude in degrees')
     parser.add_argument('--londelta', type=float, default=10.0, help='tile radius in longitude in degrees')
-    parser.add_argument('-m', '--model', type=str, default='0p25_1hr', help="GFS Model to use.")
+    parser.add_argument('-m', '--model', type=str, default='0p25_1hr', help="GFS Model to use (0p25_1hr, 0p50, or the gefs_0p50 ensemble).")
     parser.add_argument('-v', '--verbose', action='store_true', default=False, help="Verbose output.")
     parser.add_argument('-o', '--output_dir', type=str, default='./gfs/', help='GFS data output directory.')
-    parser.add_argument('--wait', type=int, default=0, help="Force use of the latest dataset, and wait up to X minutes for the data to become available.")
+    parser.add_argument('--wait', type=int, default=0, help="Force use of the latest dataset, and wait up to X minutes for the data to become available. Forecast hours are downloaded as they are published.")
     parser.add_argument('--override', action='store_true', default=False, help="Re-download data, even if there is existing data.")
+    parser.add_argument('--compression', type=str, default=None, choices=['gzip', 'zstd'], help="Compress the data files written (gzip, or zstd if the zstandard module is installed).")
+    parser.add_argument('--pyramid', action='store_true', default=False, help="Also write out downsampled (0.5 and 1 degree) copies of the data, for faster, coarser predictions.")
+    parser.add_argument('--members', type=str, default=None, help="Ensemble models only: members to download, as a comma-separated list (i.e. gec00,gep01), or a number of members. Default is all members.")
+    parser.add_argument('--rate_limit', type=float, default=REQUEST_RATE_LIMIT, help="Ensemble models only: maximum GRIB filter requests per second, across all concurrent downloads.")
+    parser.add_argument('--metrics_file', type=str, default=None, help="Write ingest metrics (Prometheus text format) to this file on completion.")
+    parser.add_argument('--archive', type=str, default=None, help="Also keep the dataset in this multi-cycle archive directory (see cusfpredict.archive).")
+    parser.add_argument('--keep_cycles', type=int, default=None, help="Archive only: number of model cycles to keep. Default is to keep all cycles.")
+    parser.add_argument('--thin_after', type=int, default=None, help="Archive only: thin all but this many of the newest cycles, keeping only their first --thin_hours forecast hours.")
+    parser.add_argument('--thin_hours', type=int, default=12, help="Archive only: forecast hours kept in thinned cycles. (Default: 12)")
+    parser.add_argument('--profile', type=str, default=DEFAULT_DOWNLOAD_PROFILE, help="Download profile (%s), or a JSON profile file, setting the forecast hours, area and pressure levels downloaded. (Default: %s)" % (', '.join(DOWNLOAD_PROFILES.keys()), DEFAULT_DOWNLOAD_PROFILE))
+    parser.add_argument('--plan', action='store_true', default=False, help="Print the requests planned for the download profile, and their estimated size against the full download, then exit.")
     args = parser.parse_args()
 
     if args.verbose:
@@ -423,85 +1144,154 @@ def main():
     else:
         logging.basicConfig(stream=sys.stdout, level=logging.INFO)
 
+    _members = None
+    if args.members and is_ensemble_model(args.model):
+        if args.members.isdigit():
+            _members = VALID_MODELS[args.model]['members'][:int(args.members)]
+        else:
+            _members = [_member.strip() for _member in args.members.split(',')]
+
+    # Get a list of valid forecast times, up until the user-specified time.
+    _times = VALID_MODELS[args.model]['times']
+    _forecast_times = _times[:find_nearest(_times, args.future)+1]
+
+    # Plan the requests for the download profile, and the full download to compare against.
+    # The planned URLs are only used for reporting here - each request is regenerated once the model time is known.
+    try:
+        _plan_args = {'model': args.model, 'forecast_times': _forecast_times, 'lat': args.lat, 'lon': args.lon,
+            'latdelta': args.latdelta, 'londelta': args.londelta,
+            'member': (_members or VALID_MODELS[args.model]['members'])[0] if is_ensemble_model(args.model) else None}
+        _plan = plan_downloads(profile=args.profile, **_plan_args)
+        _full_plan = plan_downloads(profile='full', **_plan_args)
+    except (ValueError, IOError) as e:
+        logging.critical(str(e))
+        sys.exit(1)
+
+    _plan_summary = summarise_plan(_plan)
+    _full_summary = summarise_plan(_full_plan)
+    logging.info("Download profile %s: %d requests%s, estimated %.1f MB (full download: %d requests, estimated %.1f MB)." % (
+        args.profile, _plan_summary['requests'], " per member" if is_ensemble_model(args.model) else "",
+        _plan_summary['bytes']/1e6, _full_summary['requests'], _full_summary['bytes']/1e6))
+
+    if args.plan:
+        for _request in _plan:
+            print("T+%03d: %.1f x %.1f degrees, %d levels (%d-%d hPa), ~%.2f MB" % (_request['forecast_time'],
+                _request['latdelta'], _request['londelta'], len(_request['levels']),
+                max(_request['levels']), min(_request['levels']), _request['values'] * GRIB_BYTES_PER_VALUE / 1e6))
+        sys.exit(0)
+
+    # Check we can decode the data before downloading anything (planning doesn't need the decoder).
+    try:
+        import_grib_decoder()
+    except ImportError as e:
+        logging.critical(str(e))
+        sys.exit(1)
+
+    _forecast_times = [_request['forecast_time'] for _request in _plan]
+    _planned = {_request['forecast_time']: _request for _request in _plan}
+
+    _watcher = None
+    if args.metrics_file:
+        _exporter = metrics.enable_prometheus()
+
     if args.wait == 0:
         _model_dt = determine_latest_available_dataset(model=args.model, forecast_time=args.future)
     else:
-        _model_dt = wait_for_newest_dataset(model=args.model, forecast_time=args.future, timeout=args.wait)
+        # Use the newest model, and start downloading forecast hours as soon as they are published.
+        from .probe import CycleWatcher
+        _model_dt = latest_model_name(0)
+        _watcher = CycleWatcher(model=args.model, model_dt=_model_dt, forecast_times=_forecast_times)
 
     if _model_dt == None:
         sys.exit(1)
 
     # Check for existing dataset
-    if os.path.exists(os.path.join(args.output_dir, "dataset.txt")):
-        with open(os.path.join(args.output_dir, "dataset.txt"), 'r') as f:
-            f_data = f.read().replace('\n', '')
-        logging.info("Found existing dataset %s", f_data)
-        _existing_model_dt = datetime.datetime.strptime(f_data, "%Y%m%d%Hz")
+    _existing_model_dt = read_dataset_info(args.output_dir)
+    if _existing_model_dt is not None:
+        logging.info("Found existing dataset %s", _existing_model_dt.strftime("%Y%m%d%Hz"))
         if( (_existing_model_dt >= _model_dt) and not args.override):
             logging.info("No new data available")
             sys.exit(0)
         else:
             logging.info("Downloading newer dataset %s" % _model_dt.strftime("%Y%m%d%Hz"))
 
-    # Create temporary directory for download
-    _temp_dir = mkdtemp()
+    # Count the bytes actually downloaded.
+    _downloaded = {'bytes': 0}
+    def _count_bytes(kind, name, value, labels):
+        if name == 'download_bytes':
+            _downloaded['bytes'] += value
+    metrics.add_hook(_count_bytes)
+    _ingest_start = time.perf_counter()
+
+    # Create temporary directory for download, alongside the output directory so it can be published by renaming it.
+    _temp_dir = mkdtemp(prefix=".staging-", dir=os.path.dirname(os.path.abspath(args.output_dir)))
     logging.info("Created temporary directory %s" % _temp_dir)
     logging.info("Starting download of wind data...")
     
-    # Get a list of valid forecast times, up until the user-specified time.
-    _times = VALID_MODELS[args.model]['times']
-    _forecast_times = _times[:find_nearest(_times, args.future)+1]
-    # Iterate through all forecast times, download and parse.
-    for forecast_time in _forecast_times:
-        (url, params) = generate_filter_request(
-            model=args.model,
-            forecast_time=forecast_time,
-            model_dt=_model_dt,
-            lat=args.lat,
-            lon=args.lon,
-            latdelta=args.latdelta,
-            londelta=args.londelta
-            )
-
-        success = download_grib(url, params, filename=os.path.join(_temp_dir, 'temp.grib'))
-
-        if success:
-            logging.info("Downloaded data for T+%03d" % forecast_time)
-        else:
-            logging.error("Could not download data for T+%03d" % forecast_time)
-            continue
-
-        # Now process the 
-        logging.info("Processing GRIB file...")
-        _wind = parse_grib_to_dict(os.path.join(_temp_dir, 'temp.grib'))
-        # Remove GRIB and index file.
-        remove(os.path.join(_temp_dir, 'temp.grib'))
-        for _entry in glob.glob(os.path.join(_temp_dir, "*.idx")):
-            remove(_entry)
-
-        if _wind is not None:
-            (_filename, _text) = wind_dict_to_cusf(_wind, output_dir=_temp_dir)
-            logging.info("GFS data written to: %s" % _filename)
-        else:
-            logging.error("Error processing GRIB file.")
-
-    # Clean out output directory if it already exists, create if it does not
-    if os.path.exists(args.output_dir):
-        remove_dir_contents(args.output_dir)
+    if _watcher is not None:
+        _forecast_times = _watcher.watch(timeout=args.wait*60)
+
+    if is_ensemble_model(args.model):
+        # Download all members of each batch of forecast hours concurrently. If we are waiting on the
+        # model to be published, each batch is an hour as it becomes available, otherwise it is all hours.
+        _batches = ([_hour] for _hour in _forecast_times) if (_watcher is not None) else [_forecast_times]
+        for _batch in _batches:
+            ingest_ensemble(
+                model=args.model,
+                model_dt=_model_dt,
+                forecast_times=_batch,
+                members=_members,
+                lat=args.lat,
+                lon=args.lon,
+                latdelta=args.latdelta,
+                londelta=args.londelta,
+                output_dir=_temp_dir,
+                compression=args.compression,
+                rate_limit=args.rate_limit,
+                pyramid=args.pyramid,
+                profile=args.profile)
     else:
-        os.mkdir(args.output_dir)
+        # Iterate through all forecast times, download and parse.
+        for forecast_time in _forecast_times:
+            ingest_forecast_hour(
+                model=args.model,
+                model_dt=_model_dt,
+                forecast_time=forecast_time,
+                lat=args.lat,
+                lon=args.lon,
+                latdelta=_planned[forecast_time]['latdelta'],
+                londelta=_planned[forecast_time]['londelta'],
+                output_dir=_temp_dir,
+                compression=args.compression,
+                pyramid=args.pyramid,
+                levels=_planned[forecast_time]['levels'])
+
+    metrics.remove_hook(_count_bytes)
+    _ingest_duration = time.perf_counter() - _ingest_start
+    logging.info("Downloaded %.1f MB in %.1f seconds using download profile %s (full download estimated at %.1f MB%s)." % (
+        _downloaded['bytes']/1e6, _ingest_duration, args.profile, _full_summary['bytes']/1e6,
+        " per member" if is_ensemble_model(args.model) else ""))
+
+    if (_watcher is not None) and not _watcher.complete:
+        logging.error("Could not find a model with the required data within timeout period.")
+        shutil.rmtree(_temp_dir)
+        sys.exit(1)
 
     # Write model name into dataset.txt
     logging.info("Writing out dataset info.")
-    f = open(os.path.join(_temp_dir, "dataset.txt"), 'w')
-    f.write("%s" % _model_dt.strftime("%Y%m%d%Hz"))
-    f.close()
+    write_dataset_info(_temp_dir, _model_dt)
+
+    # Replace the output directory with the new dataset, so a failed run never leaves it empty or partly written.
+    publish_dataset(_temp_dir, args.output_dir, _model_dt)
 
-    # Copy temporary directory into output directory
-    copytree(_temp_dir, args.output_dir)
+    if args.archive:
+        from .archive import Archive
+        _archive = Archive(args.archive)
+        _archive.add(args.output_dir, _model_dt)
+        _archive.apply_retention(keep=args.keep_cycles, thin_after=args.thin_after, thin_hours=args.thin_hours)
 
-    # Clean up temporary directory
-    shutil.rmtree(_temp_dir)
+    if args.metrics_file:
+        _exporter.write(args.metrics_file)
 
     logging.info("Finished!")
 
@@ -0,0 +1,466 @@
+#!/usr/bin/env python
+#
+#   Project Horus
+#   CUSF Standalone Predictor Python Wrapper - Landing Probability Heatmaps
+#   Copyright 2020 Mark Jessop <vk5qi@rfhead.net>
+#
+#   Aggregate the results of an ensemble of predictions (i.e. a dispersion study, varying ascent rate,
+#   burst altitude, descent rate and wind error) into a landing probability map.
+#
+#   Landing points, and optionally the grid cells crossed by each ground track, are binned into a
+#   fixed lat/lon grid as ensemble members complete. Only the grid itself (and a small buffer of
+#   pending landings) is held in memory, so memory use does not grow with the number of members.
+#   The grid can be smoothed with a gaussian kernel (a binned kernel density estimate), and exported
+#   as GeoJSON probability contours, or as a PNG image suitable for use as a map overlay.
+#
+#   Usage:
+#       from cusfpredict.heatmap import LandingGrid
+#       grid = LandingGrid.around(-34.95, 138.52, radius=150000, resolution=0.01, tracks=True)
+#       for flight_path in ensemble:
+#           grid.add_flight_path(flight_path)
+#       grid.write_geojson('landing.geojson', levels=(0.5, 0.9, 0.99), bandwidth=1000)
+#       grid.write_png('landing.png', bandwidth=1000)
+#
+import math
+import os
+import struct
+import zlib
+import numpy as np
+
+from .export import write_json, METRES_PER_DEGREE
+
+# Default PNG colour ramp (value, (r, g, b, a)), from low to high probability.
+DEFAULT_COLOURMAP = [
+    (0.0, (255, 255, 178, 64)),
+    (0.25, (254, 204, 92, 128)),
+    (0.5, (253, 141, 60, 160)),
+    (0.75, (240, 59, 32, 192)),
+    (1.0, (189, 0, 38, 224)),
+]
+
+
+def write_png(filename, rgba):
+    ''' Write a [rows, columns, 4] uint8 RGBA array out as a PNG image (atomically). The first row is the top of the image. '''
+    _rgba = np.ascontiguousarray(rgba, dtype=np.uint8)
+    (_height, _width) = _rgba.shape[:2]
+
+    def _chunk(chunk_type, data):
+        return struct.pack(">I", len(data)) + chunk_type + data + struct.pack(">I", zlib.crc32(chunk_type + data) & 0xffffffff)
+
+    # Each scanline is preceded by a filter-type byte (0 = no filtering).
+    _raw = np.zeros((_height, _width*4 + 1), dtype=np.uint8)
+    _raw[:, 1:] = _rgba.reshape(_height, _width*4)
+
+    _png = b"\x89PNG\r\n\x1a\n"
+    _png += _chunk(b"IHDR", struct.pack(">IIBBBBB", _width, _height, 8, 6, 0, 0, 0))
+    _png += _chunk(b"IDAT", zlib.compress(_raw.tobytes(), 6))
+    _png += _chunk(b"IEND", b"")
+
+    _temp_file = filename + ".tmp"
+    with open(_temp_file, 'wb') as f:
+        f.write(_png)
+    os.replace(_temp_file, filename)
+
+
+def gaussian_smooth(values, sigma_rows, sigma_cols):
+    '''
+    Smooth a 2D array with a separable gaussian kernel (standard deviations given in cells).
+    Mass smoothed beyond the edges of the array is lost.
+    '''
+    _result = np.asarray(values, dtype=float)
+
+    for (_axis, _sigma) in ((0, sigma_rows), (1, sigma_cols)):
+        if _sigma <= 0:
+            continue
+
+        _radius = int(math.ceil(4.0 * _sigma))
+        _kernel = np.exp(-0.5 * (np.arange(-_radius, _radius + 1) / _sigma)**2)
+        _kernel /= _kernel.sum()
+
+        # Sum shifted copies of the (zero-padded) array, one per kernel tap.
+        _pad = [(0, 0), (0, 0)]
+        _pad[_axis] = (_radius, _radius)
+        _padded = np.pad(_result, _pad, mode='constant')
+        _length = _result.shape[_axis]
+        _smoothed = np.zeros_like(_result)
+        for (_i, _weight) in enumerate(_kernel):
+            _smoothed += _weight * (_padded[_i:_i+_length, :] if _axis == 0 else _padded[:, _i:_i+_length])
+        _result = _smoothed
+
+    return _result
+
+
+def mass_thresholds(values, levels):
+    '''
+    For each level (a fraction of the total), find the value above which cells contain that fraction of the total,
+    i.e. the threshold for the highest-density region containing 50% of the landings.
+    '''
+    _sorted = np.sort(values, axis=None)[::-1]
+    _cumulative = np.cumsum(_sorted)
+    if len(_cumulative) == 0 or _cumulative[-1] <= 0:
+        return [np.inf for _level in levels]
+
+    _cumulative /= _cumulative[-1]
+    _thresholds = []
+    for _level in levels:
+        _index = min(int(np.searchsorted(_cumulative, _level)), len(_sorted) - 1)
+        _thresholds.append(_sorted[_index])
+    return _thresholds
+
+
+def mask_outlines(mask):
+    '''
+    Trace the outlines of the regions of True cells in a 2D [row, column] mask.
+    Returns a list of polygons, each a list of rings of (row, column) cell-corner vertices.
+    The first ring of each polygon is its exterior (counter-clockwise), and any others are holes (clockwise).
+    '''
+    _padded = np.pad(np.asarray(mask, dtype=bool), 1, mode='constant')
+    _inside = _padded[1:-1, 1:-1]
+
+    # Directed boundary edges, running counter-clockwise around the inside cells (in row = y, column = x space).
+    (_r, _c) = np.nonzero(_inside & ~_padded[:-2, 1:-1])
+    _edges = [np.stack([_r, _c, _r, _c+1], axis=1)]
+    (_r, _c) = np.nonzero(_inside & ~_padded[1:-1, 2:])
+    _edges.append(np.stack([_r, _c+1, _r+1, _c+1], axis=1))
+    (_r, _c) = np.nonzero(_inside & ~_padded[2:, 1:-1])
+    _edges.append(np.stack([_r+1, _c+1, _r+1, _c], axis=1))
+    (_r, _c) = np.nonzero(_inside & ~_padded[1:-1, :-2])
+    _edges.append(np.stack([_r+1, _c, _r, _c], axis=1))
+    _edges = np.concatenate(_edges).tolist()
+
+    _outgoing = {}
+    for (_r0, _c0, _r1, _c1) in _edges:
+        _outgoing.setdefault((_r0, _c0), []).append((_r1, _c1))
+
+    # Chain the edges into rings. Where two regions touch diagonally at a vertex, turn left (towards
+    # the inside of the current cell), so the regions are traced as separate rings.
+    _rings = []
+    while _outgoing:
+        _start = next(iter(_outgoing))
+        _ring = [_start]
+        _prev = None
+        _vertex = _start
+        while True:
+            _candidates = _outgoing[_vertex]
+            _next = _candidates[0]
+            if len(_candidates) > 1 and _prev is not None:
+                _din = (_vertex[0] - _prev[0], _vertex[1] - _prev[1])
+                for _candidate in _candidates:
+                    # Cross product of (column, row) direction vectors > 0 is a left turn.
+                    if _din[1]*(_candidate[0] - _vertex[0]) - _din[0]*(_candidate[1] - _vertex[1]) > 0:
+                        _next = _candidate
+                        break
+            _candidates.remove(_next)
+            if not _candidates:
+                del _outgoing[_vertex]
+            (_prev, _vertex) = (_vertex, _next)
+            if _vertex == _start:
+                break
+            _ring.append(_vertex)
+
+        # Drop the intermediate vertices of straight runs.
+        _simplified = []
+        for _i in range(len(_ring)):
+            (_a, _b, _c) = (_ring[_i-1], _ring[_i], _ring[(_i+1) % len(_ring)])
+            if (_b[0] - _a[0])*(_c[1] - _b[1]) != (_b[1] - _a[1])*(_c[0] - _b[0]):
+                _simplified.append(_b)
+        _rings.append(_simplified)
+
+    def _signed_area(ring):
+        _ring = np.array(ring, dtype=float)
+        return 0.5 * np.sum(_ring[:, 1]*np.roll(_ring[:, 0], -1) - np.roll(_ring[:, 1], -1)*_ring[:, 0])
+
+    def _contains(ring, point):
+        _ring = np.array(ring, dtype=float)
+        (_y0, _x0) = (_ring[:, 0], _ring[:, 1])
+        (_y1, _x1) = (np.roll(_y0, -1), np.roll(_x0, -1))
+        _crosses = (_y0 > point[0]) != (_y1 > point[0])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            _x = _x0 + (point[0] - _y0) * (_x1 - _x0) / (_y1 - _y0)
+        return bool(np.count_nonzero(_crosses & (point[1] < _x)) % 2)
+
+    _exteriors = []
+    _holes = []
+    for _ring in _rings:
+        _area = _signed_area(_ring)
+        if _area > 0:
+            _exteriors.append((_area, _ring))
+        else:
+            _holes.append(_ring)
+
+    _polygons = [[_ring] for (_area, _ring) in _exteriors]
+    for _hole in _holes:
+        # A point just inside the hole: the middle of its first edge, offset to the right (outside the region).
+        (_a, _b) = (_hole[0], _hole[1])
+        _length = float(max(abs(_b[0] - _a[0]), abs(_b[1] - _a[1])))
+        _point = ((_a[0] + _b[0])/2.0 - 0.5*(_b[1] - _a[1])/_length, (_a[1] + _b[1])/2.0 + 0.5*(_b[0] - _a[0])/_length)
+
+        # Assign the hole to the smallest exterior which contains it.
+        _best = None
+        for (_i, (_area, _ring)) in enumerate(_exteriors):
+            if (_best is None or _area < _exteriors[_best][0]) and _contains(_ring, _point):
+                _best = _i
+        if _best is not None:
+            _polygons[_best].append(_hole)
+
+    return _polygons
+
+
+class LandingGrid(object):
+    '''
+    Accumulate ensemble prediction results into a lat/lon grid.
+
+    bounds - (lat_min, lat_max, lon_min, lon_max) of the grid, in degrees.
+    resolution - Grid cell size, in degrees.
+    tracks - Also count the grid cells crossed by each ground track.
+    buffer_size - Number of landings to buffer before binning them.
+
+    Landings outside of the grid are counted (in outside), but not binned.
+    '''
+
+    def __init__(self, bounds, resolution=0.01, tracks=False, buffer_size=65536):
+        (self.lat_min, _lat_max, self.lon_min, _lon_max) = [float(_b) for _b in bounds]
+        self.resolution = float(resolution)
+        self.rows = max(1, int(math.ceil((_lat_max - self.lat_min) / self.resolution - 1e-9)))
+        self.cols = max(1, int(math.ceil(((_lon_max - self.lon_min) % 360.0 or 360.0) / self.resolution - 1e-9)))
+        self.buffer_size = buffer_size
+
+        self.landings = np.zeros((self.rows, self.cols), dtype=float)
+        self.tracks = np.zeros((self.rows, self.cols), dtype=float) if tracks else None
+        self.members = 0.0
+        self.outside = 0.0
+
+        self._pending = []
+
+
+    @classmethod
+    def around(cls, lat, lon, radius=200000.0, resolution=0.01, **kwargs):
+        ''' Create a grid covering <radius> metres around a location (i.e. a launch site) '''
+        _dlat = radius / METRES_PER_DEGREE
+        _dlon = radius / (METRES_PER_DEGREE * max(math.cos(math.radians(lat)), 0.01))
+        return cls((lat - _dlat, lat + _dlat, lon - _dlon, lon + _dlon), resolution=resolution, **kwargs)
+
+
+    @property
+    def bounds(self):
+        ''' (lat_min, lat_max, lon_min, lon_max) of the grid '''
+        return (self.lat_min, self.lat_min + self.rows*self.resolution, self.lon_min, self.lon_min + self.cols*self.resolution)
+
+
+    def cell_index(self, lats, lons):
+        ''' Get the flattened grid cell index of each location, or -1 for locations outside of the grid '''
+        _rows = np.floor((np.asarray(lats, dtype=float) - self.lat_min) / self.resolution).astype(np.int64)
+        _cols = np.floor(((np.asarray(lons, dtype=float) - self.lon_min) % 360.0) / self.resolution).astype(np.int64)
+        _valid = (_rows >= 0) & (_rows < self.rows) & (_cols >= 0) & (_cols < self.cols)
+        return np.where(_valid, _rows*self.cols + _cols, -1)
+
+
+    def add_landings(self, lats, lons, weights=None):
+        ''' Bin an array of landing locations (one per ensemble member), with optional per-member weights '''
+        _index = self.cell_index(lats, lons)
+        _weights = np.ones(len(_index)) if weights is None else np.asarray(weights, dtype=float)
+        _valid = _index >= 0
+
+        self.landings += np.bincount(_index[_valid], weights=_weights[_valid], minlength=self.rows*self.cols).reshape(self.rows, self.cols)
+        self.members += float(np.sum(_weights))
+        self.outside += float(np.sum(_weights[~_valid]))
+
+
+    def add_track(self, flight_path, weight=1.0):
+        '''
+        Count the grid cells crossed by a ground track. Each cell is counted at most once per track.
+        The track is sampled at half the grid resolution, so cells which the track only clips the corner of may be missed.
+        '''
+        _points = np.array([[_p[1], _p[2]] for _p in flight_path], dtype=float)
+        if len(_points) > 1:
+            _delta = np.diff(_points, axis=0)
+            _delta[:, 1] = (_delta[:, 1] + 180.0) % 360.0 - 180.0
+            _steps = np.maximum(1, np.ceil(np.max(np.abs(_delta), axis=1) * 2.0 / self.resolution)).astype(np.int64)
+            _segment = np.repeat(np.arange(len(_delta)), _steps)
+            _fraction = (np.arange(_steps.sum()) - np.repeat(np.cumsum(_steps) - _steps, _steps)) / np.repeat(_steps, _steps)
+            _points = np.concatenate([_points[_segment] + _fraction[:, None]*_delta[_segment], _points[-1:]])
+
+        _index = np.unique(self.cell_index(_points[:, 0], _points[:, 1]))
+        _index = _index[_index >= 0]
+        self.tracks.reshape(-1)[_index] += weight
+
+
+    def add_flight_path(self, flight_path, weight=1.0):
+        ''' Add an ensemble member's [[timestamp, lat, lon, alt], ...] flight path '''
+        self._pending.append((flight_path[-1][1], flight_path[-1][2], weight))
+        if len(self._pending) >= self.buffer_size:
+            self.flush()
+
+        if self.tracks is not None:
+            self.add_track(flight_path, weight)
+
+
+    def add_flight_paths(self, flight_paths):
+        ''' Add flight paths from an iterable (i.e. a generator yielding predictions as they complete) '''
+        for _flight_path in flight_paths:
+            self.add_flight_path(_flight_path)
+        self.flush()
+
+
+    def flush(self):
+        ''' Bin any buffered landings '''
+        if self._pending:
+            _pending = np.array(self._pending, dtype=float)
+            self._pending = []
+            self.add_landings(_pending[:, 0], _pending[:, 1], weights=_pending[:, 2])
+
+
+    def merge(self, other):
+        ''' Add the contents of another grid with the same layout (i.e. from another worker) into this one '''
+        if (self.bounds, self.rows, self.cols) != (other.bounds, other.rows, other.cols):
+            raise ValueError("Cannot merge grids with different layouts.")
+
+        self.flush()
+        other.flush()
+        self.landings += other.landings
+        if self.tracks is not None and other.tracks is not None:
+            self.tracks += other.tracks
+        self.members += other.members
+        self.outside += other.outside
+
+
+    def save(self, filename):
+        ''' Save the grid to a .npz file '''
+        self.flush()
+        _arrays = {
+            'bounds': np.array(self.bounds),
+            'resolution': self.resolution,
+            'landings': self.landings,
+            'members': self.members,
+            'outside': self.outside,
+        }
+        if self.tracks is not None:
+            _arrays['tracks'] = self.tracks
+        np.savez_compressed(filename, **_arrays)
+
+
+    @classmethod
+    def load(cls, filename):
+        ''' Load a grid saved with save() '''
+        with np.load(filename) as _data:
+            _grid = cls(_data['bounds'], resolution=float(_data['resolution']), tracks='tracks' in _data)
+            _grid.landings[:] = _data['landings']
+            if 'tracks' in _data:
+                _grid.tracks[:] = _data['tracks']
+            _grid.members = float(_data['members'])
+            _grid.outside = float(_data['outside'])
+        return _grid
+
+
+    def probability(self, field='landing', bandwidth=None):
+        '''
+        Get the probability of each grid cell, as a [row (latitude), column (longitude)] array.
+        field - 'landing' gives the probability of landing within each cell,
+                'track' the probability of the ground track crossing each cell.
+        bandwidth - If provided, smooth with a gaussian kernel with this standard deviation (metres).
+        '''
+        self.flush()
+        if field == 'landing':
+            _values = self.landings
+        elif field == 'track':
+            if self.tracks is None:
+                raise ValueError("Ground tracks were not recorded for this grid.")
+            _values = self.tracks
+        else:
+            raise ValueError("Unknown field: %s" % field)
+
+        if self.members <= 0:
+            return np.zeros_like(_values)
+
+        if bandwidth:
+            _cell_height = self.resolution * METRES_PER_DEGREE
+            _mid_lat = self.lat_min + self.rows*self.resolution/2.0
+            _cell_width = _cell_height * max(math.cos(math.radians(_mid_lat)), 0.01)
+            _values = gaussian_smooth(_values, bandwidth / _cell_height, bandwidth / _cell_width)
+
+        return _values / self.members
+
+
+    def contours(self, levels=(0.5, 0.9, 0.99), field='landing', bandwidth=None, mass=None, precision=5):
+        '''
+        Produce GeoJSON MultiPolygon features outlining the grid cells above each level.
+        If mass is True (the default for landings), each level is a fraction of the landings within the grid, and its
+        region is the smallest set of cells containing that fraction of them (i.e. 0.9 -> the 90% region).
+        Otherwise, each level is a probability threshold (the default for ground tracks).
+        Returns a GeoJSON FeatureCollection.
+        '''
+        _probability = self.probability(field, bandwidth=bandwidth)
+        if mass is None:
+            mass = (field == 'landing')
+
+        if mass:
+            _thresholds = mass_thresholds(_probability, levels)
+        else:
+            _thresholds = list(levels)
+
+        _features = []
+        for (_level, _threshold) in zip(levels, _thresholds):
+            _mask = (_probability >= _threshold) & (_probability > 0)
+            _polygons = []
+            for _polygon in mask_outlines(_mask):
+                _polygons.append([[[round(self.lon_min + _c*self.resolution, precision), round(self.lat_min + _r*self.resolution, precision)]
+                    for (_r, _c) in _ring + [_ring[0]]] for _ring in _polygon])
+
+            _features.append({
+                'type': 'Feature',
+                'geometry': {'type': 'MultiPolygon', 'coordinates': _polygons},
+                'properties': {
+                    'field': field,
+                    'level': _level,
+                    'threshold': float(_threshold),
+                    'probability': float(_probability[_mask].sum()) if field == 'landing' else None,
+                }
+            })
+
+        (_lat_min, _lat_max, _lon_min, _lon_max) = self.bounds
+        return {
+            'type': 'FeatureCollection',
+            'bbox': [_lon_min, _lat_min, _lon_max, _lat_max],
+            'properties': {'members': self.members, 'outside': self.outside, 'resolution': self.resolution, 'bandwidth': bandwidth},
+            'features': _features
+        }
+
+
+    def write_geojson(self, filename, levels=(0.5, 0.9, 0.99), field='landing', bandwidth=None, mass=None, gzip_copy=False):
+        ''' Write probability contours (see contours()) out to a GeoJSON file '''
+        write_json(self.contours(levels, field=field, bandwidth=bandwidth, mass=mass), filename, gzip_copy=gzip_copy)
+
+
+    def render(self, field='landing', bandwidth=None, scale='linear', colourmap=DEFAULT_COLOURMAP):
+        '''
+        Render the grid as a [rows, columns, 4] RGBA image, north at the top.
+        Values are normalised to the maximum cell, either linearly or on a log scale (covering 4 decades).
+        Empty cells are transparent.
+        '''
+        _probability = self.probability(field, bandwidth=bandwidth)
+        _max = _probability.max()
+        if _max <= 0:
+            return np.zeros((self.rows, self.cols, 4), dtype=np.uint8)
+
+        if scale == 'log':
+            with np.errstate(divide='ignore'):
+                _normalised = np.clip(1.0 + np.log10(_probability / _max) / 4.0, 0.0, 1.0)
+        else:
+            _normalised = _probability / _max
+
+        _stops = np.array([_s[0] for _s in colourmap])
+        _colours = np.array([_s[1] for _s in colourmap], dtype=float)
+        _rgba = np.stack([np.interp(_normalised, _stops, _colours[:, _i]) for _i in range(4)], axis=-1)
+        _rgba[_probability <= 0] = 0
+
+        return np.round(_rgba[::-1]).astype(np.uint8)
+
+
+    def write_png(self, filename, field='landing', bandwidth=None, scale='linear', colourmap=DEFAULT_COLOURMAP):
+        '''
+        Write the grid out as a PNG image (see render()).
+        Returns the [[lat_min, lon_min], [lat_max, lon_max]] bounds of the image, as used by leaflet's ImageOverlay.
+        '''
+        write_png(filename, self.render(field, bandwidth=bandwidth, scale=scale, colourmap=colourmap))
+        (_lat_min, _lat_max, _lon_min, _lon_max) = self.bounds
+        return [[_lat_min, _lon_min], [_lat_max, _lon_max]]
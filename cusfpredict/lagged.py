@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+#
+#   Project Horus
+#   CUSF Standalone Predictor Python Wrapper - Time-Lagged Cycle Comparison
+#   Copyright 2020 Mark Jessop <vk5qi@rfhead.net>
+#
+#   Run the same launch against the latest model cycle and a few previous cycles (from an archive of
+#   model cycles, see cusfpredict.archive), and summarise how much the landing moves between them.
+#   A landing which stays put from cycle to cycle can be trusted more than one which jumps around.
+#
+#   The runs for each cycle are made concurrently, in-process through libpred (see cusfpredict.engine).
+#   An engine handle is kept open for each cycle, so the wind data loaded for one comparison is re-used
+#   by the next, and each comparison only takes around as long as the slowest single prediction.
+#   If a pred binary is given instead of the library, each run spawns pred.
+#
+#   Usage:
+#       from cusfpredict.lagged import LaggedComparison
+#       comparison = LaggedComparison(archive_dir='./archive', lib_path='./libpred.so')
+#       result = comparison.compare({'launch_lat': -34.95, 'launch_lon': 138.52, 'launch_time': launch_time}, count=4)
+#       print(result['spread'])
+#
+#   Or from the command line:
+#       python3 -m cusfpredict.lagged --archive ./archive --lib ./libpred.so --lat -34.95 --lon 138.52 --time 2020-06-01T11:15Z
+#
+import argparse
+import json
+import logging
+import math
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from . import metrics
+from .archive import Archive, CYCLE_FORMAT
+from .live import distance_metres
+
+
+# Number of cycles compared, if not specified.
+DEFAULT_CYCLES = 4
+
+# Maximum number of cycles to keep engine handles (and their loaded wind data) open for.
+MAX_HANDLES = 8
+
+
+def landing_spread(landings):
+    '''
+    Summarise the spread of a list of landings ([timestamp, lat, lon, alt] entries, newest model cycle first):
+    the mean landing position, the RMS and maximum distance (m) of the landings from it, the maximum distance
+    between any two landings, the distance of each landing from the newest cycle's landing, and the spread of
+    the landing times (s). Returns None if there are no landings.
+    '''
+    if len(landings) == 0:
+        return None
+
+    _lat = sum(_landing[1] for _landing in landings) / len(landings)
+    # Average longitudes relative to the first, to cope with landings either side of the antimeridian.
+    _lon = landings[0][2] + sum((_landing[2] - landings[0][2] + 180.0) % 360.0 - 180.0 for _landing in landings) / len(landings)
+    _lon = (_lon + 180.0) % 360.0 - 180.0
+
+    _from_mean = [distance_metres(_lat, _lon, _landing[1], _landing[2]) for _landing in landings]
+    _pairwise = [distance_metres(_a[1], _a[2], _b[1], _b[2]) for _i, _a in enumerate(landings) for _b in landings[_i+1:]]
+    _times = [_landing[0] for _landing in landings]
+
+    return {
+        'count': len(landings),
+        'mean_lat': _lat,
+        'mean_lon': _lon,
+        'rms_distance': math.sqrt(sum(_d**2 for _d in _from_mean) / len(_from_mean)),
+        'max_distance_from_mean': max(_from_mean),
+        'max_distance': max(_pairwise) if _pairwise else 0.0,
+        'distance_from_latest': [distance_metres(landings[0][1], landings[0][2], _landing[1], _landing[2]) for _landing in landings],
+        'landing_time_spread': max(_times) - min(_times),
+    }
+
+
+class LaggedComparison(object):
+    '''
+    Compare predictions for a launch across the model cycles of an archive.
+
+    lib_path - libpred shared library to run predictions with (see cusfpredict.engine.find_library).
+    bin_path - Run predictions by spawning this pred binary instead.
+    member - Ensemble member to use, for archived ensemble datasets.
+    max_handles - Maximum number of cycles to keep engine handles open for (least recently used are closed first).
+    '''
+
+    def __init__(self, archive_dir='./archive', lib_path=None, bin_path=None, member=None, max_handles=MAX_HANDLES):
+        self.archive = Archive(archive_dir)
+        self.lib_path = lib_path
+        self.bin_path = bin_path
+        self.member = member
+        self.max_handles = max_handles
+
+        self.lock = threading.Lock()
+        # Cycle -> (predictor, lock). The lock is held while predicting, so a handle isn't closed underneath a prediction.
+        self._predictors = OrderedDict()
+        self.executor = ThreadPoolExecutor(max_workers=max_handles)
+
+        if bin_path is None:
+            # Fail early if the library can't be found.
+            from .engine import load_library
+            load_library(lib_path)
+
+
+    def _predictor(self, cycle):
+        ''' Get the (warm) predictor for a cycle and its lock, opening it if required. '''
+        with self.lock:
+            if cycle in self._predictors:
+                self._predictors.move_to_end(cycle)
+                return self._predictors[cycle]
+
+        if self.bin_path is not None:
+            from .predict import Predictor
+            _predictor = Predictor(bin_path=self.bin_path, gfs_path=self.archive.archive_dir, member=self.member, cycle=cycle)
+        else:
+            from .engine import Engine
+            _predictor = Engine(gfs_path=self.archive.path(cycle, self.member), lib_path=self.lib_path)
+
+        with self.lock:
+            if cycle in self._predictors:
+                # Opened by another thread in the meantime.
+                self._close((_predictor, threading.Lock()))
+                return self._predictors[cycle]
+            _entry = self._predictors[cycle] = (_predictor, threading.Lock())
+            while len(self._predictors) > self.max_handles:
+                self._close(self._predictors.popitem(last=False)[1])
+        return _entry
+
+
+    def _close(self, entry):
+        (_predictor, _lock) = entry
+        if hasattr(_predictor, 'close'):
+            # Wait for any prediction running against it to finish.
+            with _lock:
+                _predictor.close()
+
+
+    def _prune(self):
+        ''' Close the handles of cycles which are no longer in the archive (i.e. removed by retention). '''
+        _cycles = set(self.archive.cycles())
+        with self.lock:
+            for _cycle in [_cycle for _cycle in self._predictors if _cycle not in _cycles]:
+                self._close(self._predictors.pop(_cycle))
+
+
+    def select_cycles(self, scenario, count=DEFAULT_CYCLES):
+        ''' The newest <count> archived cycles with data for a scenario's launch time and position. '''
+        _cycles = []
+        for _entry in self.archive.find(scenario['launch_time'], scenario['launch_lat'], scenario['launch_lon'], member=self.member):
+            if (_entry['member'] == self.member) and (_entry['cycle'] not in _cycles):
+                _cycles.append(_entry['cycle'])
+        return _cycles[:count]
+
+
+    def _run(self, cycle, scenario):
+        (_predictor, _lock) = self._predictor(cycle)
+        with _lock:
+            _path = _predictor.predict(**scenario)
+            # Flight paths as lists of [timestamp, lat, lon, alt], as returned by Predictor.predict.
+            return _path.tolist() if hasattr(_path, 'tolist') else _path
+
+
+    def compare(self, scenario, cycles=None, count=DEFAULT_CYCLES):
+        '''
+        Run a scenario (a dictionary of Predictor.predict arguments) against each of a list of model cycles
+        (default: the newest <count> cycles covering the launch), concurrently.
+
+        Returns a dictionary with a list of 'runs' (newest cycle first), each with the 'cycle', 'flight_path',
+        'landing', and whether the flight was 'complete' (reached the ground); the landing 'spread' of the
+        complete runs (see landing_spread); and the 'duration' of the comparison.
+        '''
+        _start = time.perf_counter()
+        self._prune()
+
+        if cycles is None:
+            cycles = self.select_cycles(scenario, count=count)
+        cycles = sorted(cycles, reverse=True)
+        if len(cycles) == 0:
+            raise Exception("No archived model cycles cover the launch time.")
+
+        _futures = [self.executor.submit(self._run, _cycle, scenario) for _cycle in cycles]
+
+        _runs = []
+        for (_cycle, _future) in zip(cycles, _futures):
+            try:
+                _path = _future.result()
+            except Exception as e:
+                logging.error("Prediction against model %s failed - %s" % (_cycle.strftime(CYCLE_FORMAT), str(e)))
+                _path = []
+
+            # pred stops once the flight reaches sea level, or runs out of wind data.
+            _complete = len(_path) > 1 and _path[-1][3] <= 0.0
+            _runs.append({
+                'cycle': _cycle,
+                'flight_path': _path,
+                'landing': _path[-1] if _path else None,
+                'complete': _complete,
+            })
+
+        _duration = time.perf_counter() - _start
+        metrics.observe('stage_duration_seconds', _duration, stage='lagged_compare')
+
+        return {
+            'runs': _runs,
+            'spread': landing_spread([_run['landing'] for _run in _runs if _run['complete']]),
+            'duration': _duration,
+        }
+
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        with self.lock:
+            while self._predictors:
+                self._close(self._predictors.popitem()[1])
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def main():
+    from .utils import parse_time
+
+    parser = argparse.ArgumentParser(description="Compare a prediction across the model cycles of an archive.")
+    parser.add_argument('--archive', type=str, default='./archive', help="Archive of model cycles. (Default: ./archive)")
+    parser.add_argument('--lib', type=str, default=None, help="libpred shared library to run predictions with.")
+    parser.add_argument('--pred', type=str, default=None, help="Spawn this pred binary for each prediction, instead of using libpred.")
+    parser.add_argument('--member', type=str, default=None, help="Ensemble member to use, for ensemble datasets.")
+    parser.add_argument('-n', '--cycles', type=int, default=DEFAULT_CYCLES, help="Number of model cycles to compare. (Default: %d)" % DEFAULT_CYCLES)
+    parser.add_argument('--lat', type=float, required=True, help="Launch Latitude (dd.dddd)")
+    parser.add_argument('--lon', type=float, required=True, help="Launch Longitude (dd.dddd)")
+    parser.add_argument('--alt', type=float, default=0.0, help="Launch Altitude (m). Default 0m")
+    parser.add_argument('--time', type=str, required=True, help="Launch Time (string, UTC).")
+    parser.add_argument('-a', '--ascentrate', type=float, default=5.0, help="Ascent Rate (m/s). Default 5m/s")
+    parser.add_argument('-d', '--descentrate', type=float, default=6.0, help="Descent Rate (m/s). Default 6m/s")
+    parser.add_argument('-b', '--burstalt', type=float, default=26000.0, help="Burst Altitude (m). Default 26000m")
+    parser.add_argument('-v', '--verbose', action='store_true', default=False, help="Verbose output.")
+    args = parser.parse_args()
+
+    logging.basicConfig(stream=sys.stderr, level=logging.DEBUG if args.verbose else logging.INFO)
+
+    _scenario = {
+        'launch_lat': args.lat,
+        'launch_lon': args.lon,
+        'launch_alt': args.alt,
+        'ascent_rate': args.ascentrate,
+        'descent_rate': args.descentrate,
+        'burst_alt': args.burstalt,
+        # Times with a UTC offset are converted to UTC, rather than having the offset dropped.
+        'launch_time': parse_time(args.time),
+    }
+
+    with LaggedComparison(archive_dir=args.archive, lib_path=args.lib, bin_path=args.pred, member=args.member) as _comparison:
+        _result = _comparison.compare(_scenario, count=args.cycles)
+
+    for _run in _result['runs']:
+        _landing = _run['landing']
+        print("%s: %s" % (_run['cycle'].strftime(CYCLE_FORMAT),
+            "landing %.4f, %.4f at %d%s" % (_landing[1], _landing[2], _landing[0], "" if _run['complete'] else " (incomplete)") if _landing else "failed"))
+
+    if _result['spread'] is not None:
+        print(json.dumps(_result['spread'], indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,270 @@
+#!/usr/bin/env python
+#
+#   Project Horus
+#   CUSF Standalone Predictor Python Wrapper - Live Descent Re-Prediction
+#   Copyright 2020 Mark Jessop <vk5qi@rfhead.net>
+#
+#   Low-latency landing predictions for a descending payload, updated as telemetry arrives.
+#   Rather than running pred for every new position (which re-reads the wind data each time),
+#   the wind data for the descent is held in memory, the descent rate is estimated from
+#   recent position fixes, and the descent is integrated in Python using the same physics
+#   as the predictor binary.
+#
+#   If a new fix agrees with the previous solution (the payload is where we said it would be,
+#   and the descent rate has not changed), the previous solution is re-used, offset to the new position.
+#
+#   Usage:
+#       from cusfpredict.live import LivePredictor
+#       live = LivePredictor(gfs_path='./gfs')
+#       for (timestamp, lat, lon, alt) in telemetry:
+#           result = live.add_fix(timestamp, lat, lon, alt)
+#           if result:
+#               print(result['landing'])
+#
+import math
+import time
+from collections import deque
+
+from . import metrics
+from .wind import WindDataset
+
+# Constants, as per the predictor binary.
+RADIUS_OF_EARTH = 6371009.0
+# Converts a sea-level descent rate to a drag coefficient (sqrt of sea-level air density).
+DRAG_COEFF_SCALE = 1.10679
+
+
+def air_density(altitude):
+    ''' Density of the atmosphere (kg/m^3) at an altitude (m), using the same NASA model as the predictor binary '''
+    if altitude > 25000:
+        _temp = -131.21 + 0.00299 * altitude
+        _pressure = 2.488 * math.pow((_temp + 273.1) / 216.6, -11.388)
+    elif altitude > 11000:
+        _temp = -56.46
+        _pressure = 22.65 * math.exp(1.73 - 0.000157 * altitude)
+    else:
+        _temp = 15.04 - 0.00649 * altitude
+        _pressure = 101.29 * math.pow((_temp + 273.1) / 288.08, 5.256)
+
+    return _pressure / (0.2869 * (_temp + 273.1))
+
+
+def descent_rate_at(sea_level_rate, altitude):
+    ''' Terminal descent rate (m/s) at an altitude, for a payload with the given sea-level descent rate '''
+    return sea_level_rate * DRAG_COEFF_SCALE / math.sqrt(air_density(altitude))
+
+
+def sea_level_descent_rate(rate, altitude):
+    ''' Convert a descent rate observed at an altitude to a sea-level descent rate '''
+    return rate * math.sqrt(air_density(altitude)) / DRAG_COEFF_SCALE
+
+
+def distance_metres(lat1, lon1, lat2, lon2):
+    ''' Approximate horizontal distance (m) between two nearby points '''
+    _dlat = math.radians(lat2 - lat1)
+    _dlon = math.radians((lon2 - lon1 + 180.0) % 360.0 - 180.0) * math.cos(math.radians((lat1 + lat2) / 2.0))
+    return RADIUS_OF_EARTH * math.hypot(_dlat, _dlon)
+
+
+def predict_descent(wind, timestamp, lat, lon, alt, descent_rate, altitude_step=100.0, max_timestep=10.0, ground_alt=0.0):
+    '''
+    Integrate a descent from a position, using wind data from a WindDataset.
+    descent_rate is the sea-level descent rate (as used by pred).
+    The timestep is chosen so that each step covers at most altitude_step metres of descent,
+    and at most max_timestep seconds.
+    Returns a flight path list of [timestamp, lat, lon, alt] entries, ending at ground_alt.
+    '''
+    _t = float(timestamp)
+    _path = [[_t, lat, lon, alt]]
+
+    while alt > ground_alt:
+        _rate = descent_rate_at(descent_rate, alt)
+        _dt = min(max_timestep, altitude_step / _rate)
+        # Don't step below the ground.
+        if alt - _rate * _dt < ground_alt:
+            _dt = (alt - ground_alt) / _rate
+
+        (_u, _v) = wind.get_wind(lat, lon, alt, _t)
+
+        # Metres per degree of latitude and longitude at this position.
+        _r = RADIUS_OF_EARTH + alt
+        _ddlat = 2.0 * math.pi * _r / 360.0
+        _ddlon = _ddlat * math.sin(math.radians(90.0 - lat))
+
+        lat += _v * _dt / _ddlat
+        lon += _u * _dt / _ddlon
+        alt -= _rate * _dt
+        _t += _dt
+
+        _path.append([_t, lat, lon, alt])
+
+    return _path
+
+
+class LivePredictor(object):
+    '''
+    Track a descending payload, and maintain a landing prediction as position fixes arrive.
+
+    gfs_path - GFS data directory (ignored if an existing WindDataset is provided via wind)
+    history - Period (seconds) of fixes used to estimate the descent rate.
+    position_tolerance - Maximum distance (m) between a new fix and the previous solution for it to be re-used.
+    rate_tolerance - Maximum fractional change in descent rate for the previous solution to be re-used.
+    max_solution_age - Re-integrate at least this often (seconds of telemetry time).
+    altitude_step, max_timestep - Integration step limits, see predict_descent.
+    ground_alt - Altitude of the landing area (m).
+    '''
+
+    def __init__(self,
+        gfs_path="./gfs",
+        wind=None,
+        history=60.0,
+        position_tolerance=250.0,
+        rate_tolerance=0.1,
+        max_solution_age=120.0,
+        altitude_step=100.0,
+        max_timestep=10.0,
+        ground_alt=0.0):
+
+        self.wind = WindDataset(gfs_path, max_tiles=24) if wind is None else wind
+        self.history = history
+        self.position_tolerance = position_tolerance
+        self.rate_tolerance = rate_tolerance
+        self.max_solution_age = max_solution_age
+        self.altitude_step = altitude_step
+        self.max_timestep = max_timestep
+        self.ground_alt = ground_alt
+
+        self.fixes = deque()
+        self.solution = None
+        self._hot_range = None
+
+
+    def reset(self):
+        ''' Clear all fixes and the current solution, i.e. when tracking a new payload. '''
+        self.fixes.clear()
+        self.solution = None
+        self._hot_range = None
+
+
+    def estimate_descent_rate(self):
+        '''
+        Estimate the sea-level descent rate from the recent fixes.
+        Each pair of consecutive fixes gives an observed descent rate, which is corrected to sea level
+        for the altitude it was observed at. The median is used, to reject bad altitude fixes.
+        Returns None if the payload does not appear to be descending.
+        '''
+        _rates = []
+        for (_a, _b) in zip(list(self.fixes)[:-1], list(self.fixes)[1:]):
+            _dt = _b[0] - _a[0]
+            if _dt <= 0:
+                continue
+            _rate = (_a[3] - _b[3]) / _dt
+            _rates.append(sea_level_descent_rate(_rate, (_a[3] + _b[3]) / 2.0))
+
+        if len(_rates) == 0:
+            return None
+
+        _rates.sort()
+        _median = _rates[len(_rates) // 2]
+
+        # Less than 0.5 m/s of descent - probably still ascending, or floating.
+        if _median < 0.5:
+            return None
+
+        return _median
+
+
+    def keep_hot(self, timestamp, lat, lon, alt, descent_rate):
+        ''' Make sure the wind data for the rest of the descent is loaded. '''
+        # Upper bound on the time remaining in the descent.
+        _remaining = (alt - self.ground_alt) / descent_rate_at(descent_rate, self.ground_alt) * 1.5 + 600.0
+        _range = (timestamp, timestamp + _remaining)
+
+        if self._hot_range is not None and self._hot_range[0] <= _range[0] and _range[1] <= self._hot_range[1]:
+            return
+
+        self.wind.refresh()
+        self.wind.preload(_range[0], _range[1], lat, lon)
+        self._hot_range = _range
+
+
+    def _check_solution(self, timestamp, lat, lon, alt, descent_rate):
+        ''' Check if a fix is consistent with the current solution. Returns the (lat, lon) offset to apply to it, or None. '''
+        if self.solution is None:
+            return None
+
+        if timestamp - self.solution['timestamp'] > self.max_solution_age:
+            return None
+
+        if abs(descent_rate - self.solution['descent_rate']) > self.rate_tolerance * self.solution['descent_rate']:
+            return None
+
+        # Find where the solution expected the payload to be at this time.
+        _path = self.solution['path']
+        if timestamp < _path[0][0] or timestamp > _path[-1][0]:
+            return None
+
+        for _i in range(1, len(_path)):
+            if _path[_i][0] >= timestamp:
+                break
+        (_a, _b) = (_path[_i-1], _path[_i])
+        _lambda = (timestamp - _a[0]) / (_b[0] - _a[0]) if _b[0] > _a[0] else 0.0
+        _pred_lat = _a[1] + _lambda * (_b[1] - _a[1])
+        _pred_lon = _a[2] + _lambda * (_b[2] - _a[2])
+        _pred_alt = _a[3] + _lambda * (_b[3] - _a[3])
+
+        if distance_metres(lat, lon, _pred_lat, _pred_lon) > self.position_tolerance:
+            return None
+
+        # An altitude error corresponds to a time offset in the descent, so treat it as a position error.
+        if abs(alt - _pred_alt) > self.position_tolerance:
+            return None
+
+        return (lat - _pred_lat, lon - _pred_lon)
+
+
+    def add_fix(self, timestamp, lat, lon, alt):
+        '''
+        Add a position fix, and update the landing prediction.
+        Returns a dictionary containing:
+            landing - [timestamp, lat, lon, alt] of the predicted landing
+            descent_rate - Estimated sea-level descent rate (m/s)
+            reused - True if the previous solution was re-used
+            path - Predicted path from this fix to the landing
+            compute_time - Time taken to produce this update (seconds)
+        or None if the payload does not appear to be descending.
+        '''
+        _start = time.perf_counter()
+
+        self.fixes.append((float(timestamp), float(lat), float(lon), float(alt)))
+        while len(self.fixes) > 2 and (self.fixes[-1][0] - self.fixes[0][0]) > self.history:
+            self.fixes.popleft()
+
+        _rate = self.estimate_descent_rate()
+        if _rate is None:
+            return None
+
+        _offset = self._check_solution(timestamp, lat, lon, alt, _rate)
+
+        if _offset is not None:
+            # Shift the remainder of the existing solution to the new position.
+            _path = [[timestamp, lat, lon, alt]] + [[_p[0], _p[1] + _offset[0], _p[2] + _offset[1], _p[3]]
+                for _p in self.solution['path'] if _p[0] > timestamp]
+            _reused = True
+        else:
+            self.keep_hot(timestamp, lat, lon, alt, _rate)
+            _path = predict_descent(self.wind, timestamp, lat, lon, alt, _rate,
+                altitude_step=self.altitude_step, max_timestep=self.max_timestep, ground_alt=self.ground_alt)
+            self.solution = {'timestamp': timestamp, 'descent_rate': _rate, 'path': _path}
+            _reused = False
+
+        _duration = time.perf_counter() - _start
+        metrics.observe('stage_duration_seconds', _duration, stage='live_update', reused=_reused)
+
+        return {
+            'landing': _path[-1],
+            'descent_rate': _rate,
+            'reused': _reused,
+            'path': _path,
+            'compute_time': _duration
+        }
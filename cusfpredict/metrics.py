@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+#
+#   Project Horus
+#   CUSF Standalone Predictor Python Wrapper - Metrics & Instrumentation
+#   Copyright 2020 Mark Jessop <vk5qi@rfhead.net>
+#
+#   A small instrumentation surface for the ingest pipeline and predictor.
+#   Instrumented code reports stage timings, sizes and counters to any registered hooks.
+#   A hook is a callable accepting (kind, name, value, labels), where kind is either
+#   'observe' (a histogram sample) or 'count' (a counter increment).
+#
+#   A Prometheus text-format exporter is provided, which can be served over HTTP or
+#   written out to a file, i.e.:
+#
+#       from cusfpredict.metrics import enable_prometheus
+#       exporter = enable_prometheus(port=9101)
+#
+#   Metrics reported:
+#       stage_duration_seconds{stage=...}   - Histogram of stage durations. Stages are:
+#                                             probe, download, decode, write, publish (ingest pipeline)
+#                                             spawn, pred_runtime, parse (Predictor)
+#                                             request (HTTP prediction service, also labelled by endpoint)
+#       download_bytes                      - Histogram of GRIB download sizes.
+#       retries_total{stage=...}            - Counter of retried operations.
+#       failures_total{stage=...}           - Counter of failed operations.
+#       requests_total{endpoint=...,status=...} - Counter of HTTP prediction service requests.
+#
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Default histogram buckets.
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+BYTES_BUCKETS = (1e3, 1e4, 1e5, 1e6, 5e6, 1e7, 5e7, 1e8)
+
+# Registered hooks.
+_hooks = []
+
+
+def add_hook(hook):
+    ''' Register a hook to receive metrics. '''
+    if hook not in _hooks:
+        _hooks.append(hook)
+    return hook
+
+
+def remove_hook(hook):
+    ''' Un-register a metrics hook. '''
+    if hook in _hooks:
+        _hooks.remove(hook)
+
+
+def _emit(kind, name, value, labels):
+    for _hook in list(_hooks):
+        try:
+            _hook(kind, name, value, labels)
+        except Exception as e:
+            logging.debug("Metrics hook %s failed: %s" % (str(_hook), str(e)))
+
+
+def observe(name, value, **labels):
+    ''' Report a histogram sample '''
+    if _hooks:
+        _emit('observe', name, value, labels)
+
+
+def count(name, value=1, **labels):
+    ''' Increment a counter '''
+    if _hooks:
+        _emit('count', name, value, labels)
+
+
+@contextmanager
+def timed(stage, **labels):
+    ''' Time a block of code, reporting it as a stage duration. '''
+    _start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe('stage_duration_seconds', time.perf_counter() - _start, stage=stage, **labels)
+
+
+def _label_string(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(['%s="%s"' % (_k, str(labels[_k]).replace('\\', '\\\\').replace('"', '\\"')) for _k in sorted(labels)]) + "}"
+
+
+class PrometheusExporter(object):
+    ''' A metrics hook which accumulates histograms and counters, and renders them in the Prometheus text format. '''
+
+    def __init__(self, prefix='cusfpredict', buckets=None):
+        self.prefix = prefix
+        self.buckets = {'download_bytes': BYTES_BUCKETS}
+        if buckets:
+            self.buckets.update(buckets)
+
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+        self.server = None
+
+    def __call__(self, kind, name, value, labels):
+        _key = (name, tuple(sorted(labels.items())))
+
+        with self.lock:
+            if kind == 'count':
+                self.counters[_key] = self.counters.get(_key, 0) + value
+            elif kind == 'observe':
+                if _key not in self.histograms:
+                    _buckets = self.buckets.get(name, DURATION_BUCKETS)
+                    self.histograms[_key] = {'buckets': _buckets, 'counts': [0]*len(_buckets), 'sum': 0.0, 'count': 0}
+
+                _hist = self.histograms[_key]
+                for _i, _bound in enumerate(_hist['buckets']):
+                    if value <= _bound:
+                        _hist['counts'][_i] += 1
+                _hist['sum'] += value
+                _hist['count'] += 1
+
+    def render(self):
+        ''' Render all metrics in the Prometheus text exposition format. '''
+        _lines = []
+        with self.lock:
+            _seen = set()
+            for (_name, _labels) in sorted(self.histograms.keys()):
+                _hist = self.histograms[(_name, _labels)]
+                _full_name = "%s_%s" % (self.prefix, _name)
+                if _full_name not in _seen:
+                    _lines.append("# TYPE %s histogram" % _full_name)
+                    _seen.add(_full_name)
+
+                for _bound, _count in zip(_hist['buckets'], _hist['counts']):
+                    _lines.append("%s_bucket%s %d" % (_full_name, _label_string(dict(_labels, le="%g" % _bound)), _count))
+                _lines.append("%s_bucket%s %d" % (_full_name, _label_string(dict(_labels, le="+Inf")), _hist['count']))
+                _lines.append("%s_sum%s %g" % (_full_name, _label_string(dict(_labels)), _hist['sum']))
+                _lines.append("%s_count%s %d" % (_full_name, _label_string(dict(_labels)), _hist['count']))
+
+            for (_name, _labels) in sorted(self.counters.keys()):
+                _full_name = "%s_%s" % (self.prefix, _name)
+                if _full_name not in _seen:
+                    _lines.append("# TYPE %s counter" % _full_name)
+                    _seen.add(_full_name)
+                _lines.append("%s%s %g" % (_full_name, _label_string(dict(_labels)), self.counters[(_name, _labels)]))
+
+        return "\n".join(_lines) + "\n"
+
+    def write(self, filename):
+        ''' Write the current metrics out to a file (i.e. for the node_exporter textfile collector) '''
+        _temp_file = filename + ".tmp"
+        with open(_temp_file, 'w') as f:
+            f.write(self.render())
+        os.replace(_temp_file, filename)
+
+    def serve(self, port=9101, address='127.0.0.1'):
+        ''' Serve metrics over HTTP on http://<address>:<port>/metrics, from a background thread. '''
+        # Imported here, as metrics is imported by everything, and few users serve metrics.
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        _exporter = self
+
+        class _MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                _body = _exporter.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(_body)))
+                self.end_headers()
+                self.wfile.write(_body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((address, port), _MetricsHandler)
+        _thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        _thread.start()
+        logging.info("Serving metrics on http://%s:%d/metrics" % (address, self.server.server_port))
+        return self.server
+
+    def close(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server = None
+
+
+def enable_prometheus(port=None, address='127.0.0.1'):
+    ''' Create and register a Prometheus exporter, optionally serving it over HTTP. '''
+    _exporter = PrometheusExporter()
+    add_hook(_exporter)
+    if port is not None:
+        _exporter.serve(port=port, address=address)
+    return _exporter
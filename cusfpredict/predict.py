@@ -6,33 +6,119 @@
 #
 
 import subprocess
-import glob
 import os
 import time
 import datetime
 import logging
+import json
+import re
+import threading
+from queue import Queue, Empty
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from . import metrics
+from .files import has_cusf_files
+
+# Binaries which have passed test_pred_bin, and data directories known to contain data files,
+# by (real path, modification time), so constructing a Predictor is cheap after the first time.
+_valid_binaries = set()
+_valid_gfs_paths = set()
+
+def _file_key(path):
+    return (os.path.realpath(path), os.stat(path).st_mtime_ns)
+
+
+# Errors reported by pred on stderr, which are returned as structured events by Predictor.predict_stream.
+PRED_ERRORS = [
+    ('no_wind_data', re.compile(r"Do not have wind data for this \(lat, lon, alt, time\) \(([-\d.]+),([-\d.]+),([-\d.]+),(-?\d+)\)")),
+    ('no_wind_tile', re.compile(r"Could not locate appropriate wind data tile for location lat=([-\d.]+), lon=([-\d.]+)")),
+]
+
+def parse_pred_record(line):
+    ''' Parse a line of pred's CSV output into a [timestamp, lat, lon, alt] entry. Returns None if it is not a record. '''
+    try:
+        fields = line.split(',')
+        return [int(fields[0]), float(fields[1]), float(fields[2]), float(fields[3])]
+    except (ValueError, IndexError):
+        return None
+
+def parse_pred_error(line):
+    '''
+    Parse an error line from pred's stderr into an 'error' event (see Predictor.predict_stream), with an error code
+    of 'no_wind_data' (with the lat, lon, alt and timestamp where the data ran out), 'no_wind_tile' (with the lat
+    and lon), or 'error' for any other error. Returns None if the line is not an error.
+    '''
+    if not line.upper().startswith('ERROR'):
+        return None
+
+    _event = {'type': 'error', 'code': 'error', 'message': line.split(':', 1)[-1].strip()}
+    for (_code, _pattern) in PRED_ERRORS:
+        _match = _pattern.search(line)
+        if _match:
+            _event['code'] = _code
+            _values = [float(_value) for _value in _match.groups()]
+            # pred uses 0 <= lon < 360 internally.
+            if _values[1] > 180:
+                _values[1] -= 360
+            _event.update(zip(['lat', 'lon', 'alt', 'timestamp'], _values))
+            if 'timestamp' in _event:
+                _event['timestamp'] = int(_event['timestamp'])
+            break
+
+    return _event
 
 class Predictor:
-    ''' CUSF Standalone Predictor Wrapper '''
-    def __init__(self, bin_path = "./pred", gfs_path = "./gfs", verbose=False):
+    '''
+    CUSF Standalone Predictor Wrapper
+    For ensemble datasets (see cusfpredict.gfs.ingest_ensemble), the member to use is selected with <member>.
+    If gfs_path is an archive of model cycles (see cusfpredict.archive), <cycle> selects the cycle to use:
+    either a model cycle (datetime), or 'launch' to use the cycle which was current at each launch time.
+    '''
+    def __init__(self, bin_path = "./pred", gfs_path = "./gfs", verbose=False, member=None, cycle=None):
         # Sanity check that binary exists.
         if not os.path.isfile(bin_path):
             raise Exception("Predictor Binary does not exist.")
 
-        if not self.test_pred_bin(bin_path):
-            raise Exception("Not a valid CUSF predictor binary.")
+        # Only run the binary if we haven't seen it (or it has been replaced).
+        _key = _file_key(bin_path)
+        if _key not in _valid_binaries:
+            if not self.test_pred_bin(bin_path):
+                raise Exception("Not a valid CUSF predictor binary.")
+            _valid_binaries.add(_key)
 
         # Check that the gfs directory exists
         if not os.path.isdir(gfs_path):
             raise Exception("GFS data directory does not exist.")
 
-        # Check the gfs directory contains some gfs data files.
-        gfs_list = glob.glob(os.path.join(gfs_path, "gfs_*.dat"))
-        if len(gfs_list) == 0:
-            raise Exception("No GFS data files in directory.")
+        self.archive = None
+        if cycle == 'launch':
+            # The data directory is selected for each prediction.
+            from .archive import Archive
+            self.archive = Archive(gfs_path)
+            if len(self.archive.cycles()) == 0:
+                raise Exception("No model cycles in archive.")
+        elif cycle is not None:
+            from .archive import cycle_path
+            gfs_path = cycle_path(gfs_path, cycle)
+            if not os.path.isdir(gfs_path):
+                raise Exception("Model cycle %s is not in the archive." % cycle.strftime("%Y%m%d%Hz"))
+
+        # Ensemble member data is within a subdirectory per member.
+        if (member is not None) and (self.archive is None):
+            gfs_path = os.path.join(gfs_path, member)
+            if not os.path.isdir(gfs_path):
+                raise Exception("Ensemble member %s is not in the GFS data directory." % member)
+
+        # Check the gfs directory contains some gfs data files. Adding or removing files changes
+        # the directory's modification time, so the result holds until then.
+        _key = _file_key(gfs_path)
+        if (self.archive is None) and (_key not in _valid_gfs_paths):
+            if not has_cusf_files(gfs_path):
+                raise Exception("No GFS data files in directory.")
+            _valid_gfs_paths.add(_key)
 
         self.bin_path = bin_path
         self.gfs_path = gfs_path
+        self.member = member
         self.verbose = verbose
 
     def test_pred_bin(self, bin_path):
@@ -46,15 +132,11 @@ class Predictor:
         except:
             return False
 
-    def predict(self,launch_lat= -34.9499,
-            launch_lon = 138.5194,
-            launch_alt = 0,
-            ascent_rate = 5.0,
-            descent_rate = 8.0,
-            burst_alt = 26000,
-            launch_time = datetime.datetime.utcnow(),
-            descent_mode = False):
-
+    def _prepare(self, launch_lat, launch_lon, launch_alt, ascent_rate, descent_rate, burst_alt, launch_time, descent_mode, resolution, options):
+        '''
+        Generate the scenario input data and the command line to run pred with, with any extra pred options given.
+        Returns (scenario, subprocess_params, env), or None if there is no data for the launch time.
+        '''
 
         # Generate the 'scenario' input data (ini-like structure)
         scenario = "[launch-site]\n"
@@ -74,21 +156,81 @@ class Predictor:
         scenario += "month = %d\n" % launch_time.month
         scenario += "year = %d\n" % launch_time.year
 
-        # Attempt to run predictor
+        # Use the model cycle which was current at launch time.
+        _gfs_path = self.gfs_path
+        if self.archive is not None:
+            _cycle = self.archive.select_cycle(launch_time, launch_lat, launch_lon, member=self.member)
+            if _cycle is None:
+                logging.error("No archived model cycle covers launch time %s." % launch_time.isoformat())
+                return None
+            _gfs_path = self.archive.path(_cycle, self.member)
+
+        # Downsampled levels of the data (see cusfpredict.gfs.write_pyramid) are in a subdirectory per level.
+        if resolution is not None:
+            _gfs_path = os.path.join(_gfs_path, resolution)
+            if not os.path.isdir(_gfs_path):
+                raise Exception("Resolution %s is not available in the GFS data directory." % resolution)
 
         # Force the local timezone env-var to UTC.
         env = dict(os.environ)
         env['TZ'] = 'UTC'
-        subprocess_params = [self.bin_path, '-i', self.gfs_path]
+        subprocess_params = [self.bin_path, '-i', _gfs_path]
         # If we are using 'descent mode', we just flag this to the predictor, so it ignores the ascent rate and burst altitude params.
         if descent_mode:
             subprocess_params.append('-d')
 
         if self.verbose:
             subprocess_params.append('-vv')
+
+        subprocess_params.extend(options)
+
+        return (scenario, subprocess_params, env)
+
+    def predict(self,launch_lat= -34.9499,
+            launch_lon = 138.5194,
+            launch_alt = 0,
+            ascent_rate = 5.0,
+            descent_rate = 8.0,
+            burst_alt = 26000,
+            launch_time = datetime.datetime.utcnow(),
+            descent_mode = False,
+            resolution = None,
+            stats = False,
+            seed = None):
+        '''
+        Run a prediction. Returns a list of [timestamp, lat, lon, alt] entries.
+        For faster, coarser predictions, a downsampled level of the data (i.e. '0p50' or '1p00', if the dataset
+        was written with them) can be selected with <resolution>.
+        If stats is True, pred's profiling counters are also collected, and a tuple
+        of (flight_path, stats_dict) is returned.
+        If a seed is given, pred's sampling of the wind is seeded with it, so the prediction is reproducible.
+        '''
+
+        # Request profiling counters, which are written to stderr as JSON when pred exits.
+        _stderr = None
+        _options = []
+        if stats:
+            _options.append('--stats')
+            _stderr = subprocess.PIPE
+        if seed is not None:
+            _options += ['--seed', str(int(seed))]
+
+        _prepared = self._prepare(launch_lat, launch_lon, launch_alt, ascent_rate, descent_rate, burst_alt, launch_time, descent_mode, resolution, _options)
+        if _prepared is None:
+            return ([], {}) if stats else []
+        (scenario, subprocess_params, env) = _prepared
+
         # Run!
-        pred = subprocess.Popen(subprocess_params, stdin=subprocess.PIPE, stdout=subprocess.PIPE, env=env)
+        _start = time.perf_counter()
+        pred = subprocess.Popen(subprocess_params, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=_stderr, env=env)
+        _spawned = time.perf_counter()
         (pred_stdout, pred_stderr) = pred.communicate(scenario.encode('ascii'))
+        _finished = time.perf_counter()
+
+        metrics.observe('stage_duration_seconds', _spawned - _start, stage='spawn')
+        metrics.observe('stage_duration_seconds', _finished - _spawned, stage='pred_runtime')
+        if pred.returncode != 0:
+            metrics.count('failures_total', stage='pred_runtime')
 
         # Parse stdout data into an array of floats.
         logging.debug("Errors:")
@@ -97,18 +239,195 @@ class Predictor:
         # Parse output into an array.
         output = []
         for line in pred_stdout.decode('ascii').split('\n'):
-            try:
-                fields = line.split(',')
-                timestamp = int(fields[0])
-                lat = float(fields[1])
-                lon = float(fields[2])
-                alt = float(fields[3])
-                output.append([timestamp,lat,lon,alt])
-            except ValueError:
-                continue
+            _record = parse_pred_record(line)
+            if _record is not None:
+                output.append(_record)
+
+        metrics.observe('stage_duration_seconds', time.perf_counter() - _finished, stage='parse')
+
+        if stats:
+            return (output, self.parse_stats(pred_stderr))
 
         return output
 
+    def predict_stream(self,launch_lat= -34.9499,
+            launch_lon = 138.5194,
+            launch_alt = 0,
+            ascent_rate = 5.0,
+            descent_rate = 8.0,
+            burst_alt = 26000,
+            launch_time = None,
+            descent_mode = False,
+            resolution = None,
+            stats = False):
+        '''
+        Run a prediction (with the same arguments as predict), yielding events while pred is still running, so
+        the flight path can be shown as it is calculated. pred is run with --flush, so each record is available
+        as soon as it is written.
+        Events are dictionaries, with a 'type' of:
+            'points' - New flight path points ('points', a list of [timestamp, lat, lon, alt] entries),
+                       in small batches of whatever pred has written out since the last event.
+            'error'  - An error reported by pred (see parse_pred_error), i.e. running out of wind data.
+            'end'    - pred has exited: its 'returncode', the number of 'points' written, whether the flight was
+                       'complete' (pred exited successfully, without reporting errors), and 'stats' if requested.
+        The generator can be closed early (i.e. if the client goes away), which terminates pred.
+        '''
+        if launch_time is None:
+            launch_time = datetime.datetime.utcnow()
+
+        _options = ['--flush']
+        if stats:
+            _options.append('--stats')
+
+        _prepared = self._prepare(launch_lat, launch_lon, launch_alt, ascent_rate, descent_rate, burst_alt, launch_time, descent_mode, resolution, _options)
+        if _prepared is None:
+            yield {'type': 'error', 'code': 'no_wind_data', 'message': "No archived model cycle covers the launch time."}
+            yield {'type': 'end', 'returncode': None, 'points': 0, 'complete': False}
+            return
+        (scenario, subprocess_params, env) = _prepared
+
+        _start = time.perf_counter()
+        pred = subprocess.Popen(subprocess_params, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env)
+        _spawned = time.perf_counter()
+        metrics.observe('stage_duration_seconds', _spawned - _start, stage='spawn')
+
+        # stderr is read by a separate thread, so pred can't block writing to it while we wait on stdout.
+        _stderr = Queue()
+        def _read_stderr():
+            for _line in pred.stderr:
+                _stderr.put(_line.decode('ascii', errors='replace').rstrip())
+            _stderr.put(None)
+        _reader = threading.Thread(target=_read_stderr, daemon=True)
+        _reader.start()
+
+        _state = {'errors': 0, 'stats': [], 'finished': False}
+        def _stderr_events(block):
+            _events = []
+            while not _state['finished']:
+                try:
+                    _line = _stderr.get(block=block)
+                except Empty:
+                    break
+                if _line is None:
+                    _state['finished'] = True
+                elif _line.startswith('{'):
+                    _state['stats'].append(_line)
+                else:
+                    _event = parse_pred_error(_line)
+                    if _event is None:
+                        logging.debug(_line)
+                    else:
+                        _state['errors'] += 1
+                        _events.append(_event)
+            return _events
+
+        _count = 0
+        try:
+            try:
+                pred.stdin.write(scenario.encode('ascii'))
+                pred.stdin.close()
+            except BrokenPipeError:
+                # pred exited before reading the scenario - the reason is on stderr.
+                pass
+
+            _fd = pred.stdout.fileno()
+            _partial = b''
+            while True:
+                # Read whatever is available, rather than waiting for a full buffer.
+                _chunk = os.read(_fd, 65536)
+                _lines = (_partial + _chunk).split(b'\n')
+                _partial = _lines.pop() if _chunk else b''
+
+                _points = []
+                for _line in _lines:
+                    _record = parse_pred_record(_line.decode('ascii'))
+                    if _record is not None:
+                        _points.append(_record)
+                if _points:
+                    _count += len(_points)
+                    yield {'type': 'points', 'points': _points}
+
+                for _event in _stderr_events(block=False):
+                    yield _event
+
+                if not _chunk:
+                    break
+
+            pred.wait()
+            _finished = time.perf_counter()
+            for _event in _stderr_events(block=True):
+                yield _event
+            _reader.join()
+        finally:
+            if pred.poll() is None:
+                pred.kill()
+                pred.wait()
+            pred.stdout.close()
+
+        metrics.observe('stage_duration_seconds', _finished - _spawned, stage='pred_runtime')
+        if pred.returncode != 0:
+            metrics.count('failures_total', stage='pred_runtime')
+
+        _end = {'type': 'end', 'returncode': pred.returncode, 'points': _count,
+            'complete': (pred.returncode == 0) and (_state['errors'] == 0)}
+        if stats:
+            _end['stats'] = self.parse_stats("\n".join(_state['stats']).encode('ascii'))
+        yield _end
+
+    def parse_stats(self, pred_stderr):
+        ''' Extract the profiling counters JSON object from pred's stderr output. '''
+        _stats = {}
+        for line in pred_stderr.decode('ascii', errors='replace').split('\n'):
+            if line.startswith('{'):
+                try:
+                    _stats = json.loads(line)
+                except ValueError:
+                    logging.error("Could not parse pred stats: %s" % line)
+            elif line.strip() != "":
+                logging.debug(line)
+
+        return _stats
+
+
+class PredictorPool:
+    '''
+    A bounded pool of warm Predictor objects, used to run many predictions concurrently.
+    Each worker holds its own Predictor, so the binary and dataset checks are only performed once.
+    '''
+    def __init__(self, bin_path = "./pred", gfs_path = "./gfs", workers = 4, verbose=False, member=None, cycle=None):
+        self.workers = workers
+        self.predictors = Queue()
+        for _i in range(workers):
+            self.predictors.put(Predictor(bin_path=bin_path, gfs_path=gfs_path, verbose=verbose, member=member, cycle=cycle))
+
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+
+    def _run(self, scenario):
+        _pred = self.predictors.get()
+        try:
+            return _pred.predict(**scenario)
+        finally:
+            self.predictors.put(_pred)
+
+    def submit(self, **scenario):
+        ''' Submit a prediction, with the same arguments as Predictor.predict. Returns a Future. '''
+        return self.executor.submit(self._run, scenario)
+
+    def predict_many(self, scenarios):
+        '''
+        Run a list of scenarios (dictionaries of Predictor.predict arguments).
+        Yields (scenario, flight_path) tuples in order of completion.
+        '''
+        _futures = {}
+        for _scenario in scenarios:
+            _futures[self.submit(**_scenario)] = _scenario
+
+        for _future in as_completed(_futures):
+            yield (_futures[_future], _future.result())
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
 
 # Test Script. Run a prediction for Adelaide Airport and print the landing location.
 if __name__ == "__main__":
@@ -132,6 +451,8 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument('--pred', type=str, default=PRED_BINARY, help="Location of the pred binary. (Default: ./pred)")
     parser.add_argument('--gfs', type=str, default=GFS_PATH, help="Location of the GFS data store. (Default: ./gfs/)")
+    parser.add_argument('--member', type=str, default=None, help="Ensemble member to use, for ensemble datasets (i.e. gep01).")
+    parser.add_argument('--cycle', type=str, default=None, help="Model cycle to use, if --gfs is an archive: a cycle time (i.e. 2020101906), or 'launch' to use the cycle current at launch time.")
     parser.add_argument('-a', '--ascentrate', type=float, default=ASCENT_RATE, help="Ascent Rate (m/s). Default 5m/s")
     parser.add_argument('-d', '--descentrate', type=float, default=DESCENT_RATE, help="Descent Rate (m/s). Default 5m/s")
     parser.add_argument('-b', '--burstalt', type=float, default=BURST_ALT, help="Burst Altitude (m). Default 30000m")
@@ -157,12 +478,16 @@ if __name__ == "__main__":
     burst_alt_variations = [float(item) for item in args.altitude_deltas.split(',')]
     launch_time_variations = [float(item) for item in args.time_deltas.split(',')]
 
-    predictions = []
-
     print("Running using GFS Model: %s" % gfs_model_age(GFS_PATH))
 
     # Create the predictor object.
-    pred = Predictor(bin_path=args.pred, gfs_path=args.gfs)
+    _cycle = args.cycle
+    if (_cycle is not None) and (_cycle != 'launch'):
+        _cycle = datetime.datetime.strptime(_cycle, "%Y%m%d%H")
+    pred = Predictor(bin_path=args.pred, gfs_path=args.gfs, member=args.member, cycle=_cycle)
+
+    # Predictions are written out to the KML file as they are completed.
+    kml = KMLWriter(args.output, name="HAB Prediction")
 
     for _delta_alt in burst_alt_variations:
         for _delta_time in launch_time_variations:
@@ -184,11 +509,9 @@ if __name__ == "__main__":
 
             pred_comment = "%s %.1f/%.1f/%.1f" % (_launch_time.isoformat(), ASCENT_RATE, _burst_alt, DESCENT_RATE)
 
-            predictions.append(flight_path_to_geometry(flight_path, comment=pred_comment, altitude_mode=altitude_mode))
-            predictions.append(flight_path_burst_placemark(flight_path, comment="Burst (%dm)"%_burst_alt, altitude_mode=altitude_mode))
-            predictions.append(flight_path_landing_placemark(flight_path, comment=pred_comment))
+            kml.add_flight_path(flight_path, comment=pred_comment, altitude_mode=altitude_mode, burst=True, burst_comment="Burst (%dm)"%_burst_alt)
 
             print("%s - Landing: %.4f, %.4f at %s" % (pred_comment, flight_path[-1][1], flight_path[-1][2], datetime.datetime.utcfromtimestamp(flight_path[-1][0]).isoformat()))
 
-    write_flight_path_kml(predictions, filename=args.output)
+    kml.close()
     print("KML written to %s" % args.output)
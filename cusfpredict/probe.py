@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+#
+#   Project Horus
+#   CUSF Standalone Predictor Python Wrapper - GFS Model Availability Probing
+#   Copyright 2020 Mark Jessop <vk5qi@rfhead.net>
+#
+#   Determine which GFS model cycles and forecast hours have been published, using
+#   cheap HEAD requests against the GRIB index (.idx) files on the NOMADS data server,
+#   rather than pulling data through the GRIB filter.
+#
+import logging
+import random
+import time
+import requests
+from concurrent.futures import ThreadPoolExecutor
+
+from . import metrics
+from .gfs import VALID_MODELS, latest_model_name, find_nearest, is_ensemble_model, model_filename, model_directory
+
+# Base URL of the NOMADS GFS (and GEFS) production data directories.
+# These can be pointed at a local HTTP server for testing.
+GFS_DATA_URL = "https://nomads.ncep.noaa.gov/pub/data/nccf/com/gfs/prod"
+GEFS_DATA_URL = "https://nomads.ncep.noaa.gov/pub/data/nccf/com/gens/prod"
+
+# Probe settings
+PROBE_TIMEOUT = 10 # Index files are small, so we should get an answer quickly.
+PROBE_RETRIES = 5 # Number of attempts before declaring a probe result unknown.
+PROBE_BACKOFF = 1.0 # Base delay (seconds) for exponential backoff between retries.
+PROBE_BACKOFF_MAX = 60.0 # Maximum backoff delay (seconds)
+PROBE_WORKERS = 8 # Number of concurrent probe requests.
+PROBE_MAX_AGE = 5 # How many model cycles back to search for an available dataset.
+
+
+def backoff_delay(attempt, base=PROBE_BACKOFF, maximum=PROBE_BACKOFF_MAX):
+    ''' Exponential backoff delay with full jitter, for the N-th (zero-indexed) retry '''
+    return random.uniform(0, min(maximum, base * (2 ** attempt)))
+
+
+def model_index_url(model, model_dt, forecast_time, base_url=None, member=None):
+    '''
+    Generate the URL of the GRIB index file for a model cycle and forecast hour.
+    For ensemble models, the control member is probed unless another member is given, as all
+    members are published at (approximately) the same time.
+    '''
+
+    if model not in VALID_MODELS.keys():
+        raise ValueError("Invalid GFS Model!")
+
+    if is_ensemble_model(model):
+        if base_url is None:
+            base_url = GEFS_DATA_URL
+        if member is None:
+            member = VALID_MODELS[model]['members'][0]
+    elif base_url is None:
+        base_url = GFS_DATA_URL
+
+    return "%s/%s/%s.idx" % (base_url.rstrip('/'), model_directory(model, model_dt), model_filename(model, model_dt, forecast_time, member=member))
+
+
+def probe_url(url, session=None, timeout=PROBE_TIMEOUT, retries=PROBE_RETRIES):
+    '''
+    Check if a file exists on the server.
+    Returns True if it exists, False if the server reports it does not, or None
+    if we could not get a definitive answer within the allowed number of retries.
+    '''
+    if session is None:
+        session = requests
+
+    with metrics.timed('probe'):
+        _result = _probe_url(url, session, timeout, retries)
+
+    if _result is None:
+        metrics.count('failures_total', stage='probe')
+
+    return _result
+
+
+def _probe_url(url, session, timeout, retries):
+    for _attempt in range(retries):
+        try:
+            _r = session.head(url, timeout=timeout, allow_redirects=True)
+
+            # Some servers do not support HEAD. Index files are small, so just fetch it.
+            if _r.status_code == 405:
+                _r = session.get(url, timeout=timeout)
+
+            if _r.status_code == requests.codes.ok:
+                return True
+            elif _r.status_code in (403, 404):
+                return False
+            else:
+                logging.debug("Probe of %s returned status %d, retrying." % (url, _r.status_code))
+
+        except Exception as e:
+            logging.debug("Probe of %s failed with error: %s" % (url, str(e)))
+
+        if _attempt < retries - 1:
+            metrics.count('retries_total', stage='probe')
+            time.sleep(backoff_delay(_attempt))
+
+    logging.error("Could not determine if %s exists after %d attempts." % (url, retries))
+    return None
+
+
+def probe_forecast_hours(model='0p25_1hr', model_dt=None, forecast_times=None, base_url=None, session=None, workers=PROBE_WORKERS):
+    ''' Concurrently probe a list of forecast hours (default: T+000) of a model cycle. Returns a dictionary of hour: result '''
+
+    if model_dt is None:
+        model_dt = latest_model_name(0)
+
+    if forecast_times is None:
+        forecast_times = [0]
+
+    _urls = [model_index_url(model, model_dt, int(_hour), base_url=base_url) for _hour in forecast_times]
+
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(_urls)))) as _pool:
+        _results = list(_pool.map(lambda _url: probe_url(_url, session=session), _urls))
+
+    return dict(zip([int(_hour) for _hour in forecast_times], _results))
+
+
+def find_latest_cycle(model='0p25_1hr', forecast_time=0, max_age=PROBE_MAX_AGE, base_url=None, session=None, workers=PROBE_WORKERS):
+    ''' Find the most recent model cycle which has <forecast_time> hours of data available, probing all candidate cycles concurrently '''
+
+    # NOTE: Not all models have all forecast hours available!
+    # Clip the forecast time to the nearest available hour
+    _times = VALID_MODELS[model]['times']
+    _forecast_time = int(_times[find_nearest(_times, forecast_time)])
+
+    _cycles = [latest_model_name(-_age) for _age in range(max_age)]
+    _urls = [model_index_url(model, _cycle, _forecast_time, base_url=base_url) for _cycle in _cycles]
+
+    logging.info("Probing model cycles %s for T+%03d" % (", ".join([_c.strftime("%Y%m%d/%H") for _c in _cycles]), _forecast_time))
+
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(_urls)))) as _pool:
+        _results = list(_pool.map(lambda _url: probe_url(_url, session=session), _urls))
+
+    # Cycles are in newest-first order.
+    for _cycle, _result in zip(_cycles, _results):
+        if _result:
+            logging.info("Found valid data in model %s!" % _cycle.strftime("%Y%m%d/%H"))
+            return _cycle
+
+    logging.error("Could not find a model with the required data.")
+    return None
+
+
+class CycleWatcher(object):
+    '''
+    Watch a single model cycle as it is published, and report forecast hours as they become available.
+    This allows downloading of early forecast hours to begin while later hours are still being produced.
+    '''
+
+    def __init__(self,
+                model='0p25_1hr',
+                model_dt=None,
+                forecast_times=None,
+                base_url=None,
+                session=None,
+                workers=PROBE_WORKERS,
+                poll_interval=15.0,
+                poll_interval_max=300.0):
+
+        if model not in VALID_MODELS.keys():
+            raise ValueError("Invalid GFS Model!")
+
+        self.model = model
+        self.model_dt = latest_model_name(0) if model_dt is None else model_dt
+        self.base_url = base_url
+        self.session = requests.Session() if session is None else session
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.poll_interval_max = poll_interval_max
+
+        if forecast_times is None:
+            forecast_times = VALID_MODELS[model]['times']
+
+        # Forecast hours we are still waiting on, and those we have seen.
+        self.pending = sorted([int(_hour) for _hour in forecast_times])
+        self.available = []
+
+
+    @property
+    def complete(self):
+        ''' True once all requested forecast hours have been seen '''
+        return len(self.pending) == 0
+
+
+    def poll(self):
+        ''' Probe the pending forecast hours once. Returns a sorted list of newly available hours. '''
+
+        if self.complete:
+            return []
+
+        # NOMADS publishes forecast hours (approximately) in order, so only probe a window
+        # of the next few pending hours rather than hitting the server for all of them.
+        _window = self.pending[:self.workers*2]
+
+        _results = probe_forecast_hours(
+            model=self.model,
+            model_dt=self.model_dt,
+            forecast_times=_window,
+            base_url=self.base_url,
+            session=self.session,
+            workers=self.workers)
+
+        _new = sorted([_hour for _hour in _window if _results[_hour]])
+
+        for _hour in _new:
+            self.pending.remove(_hour)
+            self.available.append(_hour)
+
+        return _new
+
+
+    def watch(self, timeout=None):
+        '''
+        Generator yielding forecast hours as they become available, until all hours
+        have been seen, or <timeout> seconds have elapsed.
+        '''
+        _start_time = time.time()
+        _idle_polls = 0
+
+        while not self.complete:
+            _new = self.poll()
+
+            for _hour in _new:
+                yield _hour
+
+            if len(_new) > 0:
+                # Progress made, the next hour is probably not far away.
+                _idle_polls = 0
+                continue
+
+            if (timeout is not None) and (time.time() - _start_time) > timeout:
+                logging.error("Timed out waiting for model %s. %d hours still pending." % (self.model_dt.strftime("%Y%m%d/%H"), len(self.pending)))
+                return
+
+            # Nothing new, back off (with jitter) before polling again.
+            _delay = min(self.poll_interval_max, self.poll_interval * (2 ** _idle_polls))
+            _delay = random.uniform(0.5*_delay, _delay)
+            if timeout is not None:
+                _delay = max(0.0, min(_delay, timeout - (time.time() - _start_time)))
+
+            logging.info("Model %s has %d/%d hours available. Waiting %.0f seconds..." % (
+                self.model_dt.strftime("%Y%m%d/%H"), len(self.available), len(self.available)+len(self.pending), _delay))
+            time.sleep(_delay)
+            _idle_polls += 1
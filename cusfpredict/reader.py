@@ -5,18 +5,41 @@
 #   Copyright 2019 Mark Jessop <vk5qi@rfhead.net>
 #
 import datetime
+import gzip
+import io
 import math
 import pytz
 import numpy as np
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+def open_cusf_file(filename):
+    """
+    Open a CUSF GFS file for reading as text. Files ending in .gz or .zst are decompressed
+    as they are read, so the compressed and decompressed data are never both held in memory.
+    """
+    if filename.endswith('.gz'):
+        return gzip.open(filename, 'rt')
+    elif filename.endswith('.zst'):
+        if zstandard is None:
+            raise IOError("Cannot read %s - zstandard module not installed." % filename)
+        _reader = zstandard.ZstdDecompressor().stream_reader(open(filename, 'rb'), read_across_frames=True, closefd=True)
+        return io.TextIOWrapper(_reader)
+    else:
+        return open(filename, 'r')
+
 
 
 def read_cusf_gfs(filename):
-    """ Read in a CUSF-format GFS data file """
+    """ Read in a CUSF-format GFS data file (which may be compressed) """
 
     _output = {}
 
-    with open(filename, 'r') as _f:
+    with open_cusf_file(filename) as _f:
         # As this file has lots of comments, we just do the first few lines the hard way...
 
         # Check the first comment line exists.
@@ -94,6 +117,77 @@ def read_cusf_gfs(filename):
     return _output
 
 
+def _read_cusf_header(_f):
+    """ Read the header of a CUSF-format GFS data file (up to the start of the data lines) from an open file. """
+
+    _output = {}
+
+    _line = _f.readline()
+    if 'window centre latitude, window latitude radius' not in _line:
+        raise ValueError('Not a CUSF GFS file.')
+
+    _fields = _f.readline().split(',')
+    _output['window_centre_latitude'] = float(_fields[0])
+    _output['window_latitude_radius'] = float(_fields[1])
+    _output['window_centre_longitude'] = float(_fields[2])
+    _output['window_longitude_radius'] = float(_fields[3])
+    _output['posix_timestamp'] = int(_fields[4])
+
+    # Number of axes
+    _f.readline()
+    _output['axes'] = int(_f.readline())
+
+    # Axis definitions - pressure, latitude, longitude
+    for _axis in ['pressures', 'latitudes', 'longitudes']:
+        _f.readline()
+        _f.readline()
+        _output[_axis] = np.fromstring(_f.readline(), sep=',')
+
+    # Number of lines of data, and components per line
+    _f.readline()
+    _output['data_lines'] = int(_f.readline())
+    _f.readline()
+    _output['components'] = int(_f.readline())
+
+    # Two comment lines, then the data.
+    _f.readline()
+    _f.readline()
+
+    return _output
+
+
+def read_cusf_header(filename):
+    """
+    Read only the header of a CUSF-format GFS data file: the window, timestamp and axes.
+    This allows the size of the data to be determined without parsing it.
+    """
+    with open_cusf_file(filename) as _f:
+        return _read_cusf_header(_f)
+
+
+def read_cusf_wind(filename):
+    """
+    Read in a CUSF-format GFS data file, returning only the axes and a
+    [pressure, latitude, longitude, (height, u, v)] float32 data array.
+    This is much faster than read_cusf_gfs, as no per-point speed/direction values are calculated.
+    """
+
+    with open_cusf_file(filename) as _f:
+        _output = _read_cusf_header(_f)
+        # Parse the data lines straight from the (possibly decompressing) file object, without reading the text into memory.
+        try:
+            _data = np.loadtxt(_f, delimiter=',', dtype=np.float32, comments=None, ndmin=2, max_rows=_output['data_lines'])
+        except ValueError:
+            raise ValueError('Truncated or corrupt CUSF GFS file.')
+
+    if _data.shape != (_output['data_lines'], _output['components']):
+        raise ValueError('Truncated CUSF GFS file.')
+
+    _output['data'] = np.reshape(_data, (len(_output['pressures']), len(_output['latitudes']), len(_output['longitudes']), _output['components']), order='C')
+
+    return _output
+
+
 if __name__ == "__main__":
     import sys
 
@@ -0,0 +1,407 @@
+#!/usr/bin/env python
+#
+#   Project Horus
+#   CUSF Standalone Predictor Python Wrapper - HTTP Prediction Service
+#   Copyright 2020 Mark Jessop <vk5qi@rfhead.net>
+#
+#   A small JSON-over-HTTP prediction service, backed by a bounded pool of warm predictors.
+#   Identical requests which arrive while a prediction is already running share its result,
+#   and new work is rejected (HTTP 503) once the number of outstanding predictions reaches
+#   a limit, rather than letting the queue grow without bound.
+#
+#   Usage: python3 -m cusfpredict.server --pred ./pred --gfs ./gfs --port 8080
+#
+#   Endpoints:
+#       POST /predict   - Run a single prediction. Body is a JSON object of Predictor.predict arguments,
+#                         with launch_time as an ISO-8601 string (UTC), i.e.
+#                         {"launch_lat": -34.95, "launch_lon": 138.52, "ascent_rate": 5.0, "burst_alt": 26000,
+#                          "descent_rate": 6.0, "launch_time": "2020-06-01T11:15:00Z"}
+#       POST /batch     - Run a list of predictions: {"scenarios": [{...}, {...}]}
+#       GET  /wind      - Wind at a point: /wind?lat=-34.9&lon=138.5&alt=5000&time=2020-06-01T11:15:00Z
+#       POST /wind      - Wind at many points: {"points": [{"lat": .., "lon": .., "alt": .., "time": ..}, ...]}
+#       GET  /status    - Dataset, pool and request statistics.
+#       GET  /metrics   - Prometheus metrics (if enabled with --metrics)
+#
+import argparse
+import calendar
+import datetime
+import json
+import logging
+import math
+import sys
+import threading
+import time
+from concurrent.futures import TimeoutError
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from . import metrics
+from .gfs import read_dataset_info
+from .predict import PredictorPool
+from .utils import parse_time, scenario_key
+from .wind import WindDataset
+
+
+# Defaults for any prediction parameters not supplied in a request.
+SCENARIO_DEFAULTS = {
+    'launch_alt': 0.0,
+    'ascent_rate': 5.0,
+    'descent_rate': 6.0,
+    'burst_alt': 26000.0,
+    'descent_mode': False,
+}
+
+# Maximum request body size (bytes)
+MAX_BODY_SIZE = 1000000
+
+
+class ServiceBusy(Exception):
+    ''' Raised when a request would exceed the outstanding prediction limit. '''
+    pass
+
+
+def parse_scenario(request):
+    ''' Validate a prediction request, returning a dictionary of Predictor.predict arguments. Raises ValueError on bad input. '''
+    if not isinstance(request, dict):
+        raise ValueError("Prediction request must be a JSON object.")
+
+    _scenario = dict(SCENARIO_DEFAULTS)
+    _scenario.update(request)
+
+    _unknown = set(_scenario.keys()) - set(['launch_lat', 'launch_lon', 'launch_alt', 'ascent_rate', 'descent_rate', 'burst_alt', 'launch_time', 'descent_mode'])
+    if _unknown:
+        raise ValueError("Unknown prediction parameters: %s" % ", ".join(sorted(_unknown)))
+
+    if 'launch_lat' not in _scenario or 'launch_lon' not in _scenario:
+        raise ValueError("launch_lat and launch_lon must be provided.")
+
+    for _key in ['launch_lat', 'launch_lon', 'launch_alt', 'ascent_rate', 'descent_rate', 'burst_alt']:
+        _scenario[_key] = float(_scenario[_key])
+        if not math.isfinite(_scenario[_key]):
+            raise ValueError("%s must be a finite number." % _key)
+
+    if abs(_scenario['launch_lat']) > 90.0:
+        raise ValueError("launch_lat out of range.")
+    if _scenario['ascent_rate'] <= 0 or _scenario['descent_rate'] <= 0:
+        raise ValueError("Ascent and descent rates must be positive.")
+
+    _scenario['descent_mode'] = bool(_scenario['descent_mode'])
+    _scenario['launch_time'] = parse_time(_scenario.get('launch_time'))
+
+    return _scenario
+
+
+def prediction_result(scenario, flight_path):
+    ''' Format a prediction result for output '''
+    _scenario = dict(scenario)
+    _scenario['launch_time'] = scenario['launch_time'].strftime("%Y-%m-%dT%H:%M:%SZ")
+
+    if len(flight_path) <= 1:
+        return {'scenario': _scenario, 'error': "No wind data available for this prediction."}
+
+    _burst = max(flight_path, key=lambda _p: _p[3])
+
+    return {
+        'scenario': _scenario,
+        'launch': flight_path[0],
+        'burst': _burst,
+        'landing': flight_path[-1],
+        'path': flight_path
+    }
+
+
+class PredictionService(object):
+    ''' Prediction and wind lookup service logic, independent of the HTTP front-end. '''
+
+    def __init__(self, bin_path="./pred", gfs_path="./gfs", workers=4, max_queue=32, timeout=60.0):
+        self.gfs_path = gfs_path
+        self.workers = workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+
+        self.pool = PredictorPool(bin_path=bin_path, gfs_path=gfs_path, workers=workers)
+        self.wind = WindDataset(gfs_path)
+
+        self.lock = threading.Lock()
+        self.inflight = {}
+        self.pending = 0
+        self.stats = {'predictions': 0, 'coalesced': 0, 'rejected': 0, 'errors': 0}
+
+
+    def _submit(self, scenario):
+        # Must be called with self.lock held.
+        _key = scenario_key(scenario)
+        if _key in self.inflight:
+            self.stats['coalesced'] += 1
+            return self.inflight[_key]
+
+        self.pending += 1
+        self.stats['predictions'] += 1
+        _future = self.pool.submit(**scenario)
+        self.inflight[_key] = _future
+        return _future
+
+
+    def _done(self, key, future):
+        with self.lock:
+            if self.inflight.get(key) is future:
+                del self.inflight[key]
+            self.pending -= 1
+            if future.exception() is not None:
+                self.stats['errors'] += 1
+
+
+    def submit_many(self, scenarios):
+        '''
+        Submit a list of scenarios, returning a list of Futures.
+        Scenarios identical to an in-flight prediction share its Future.
+        Raises ServiceBusy, without submitting anything, if the outstanding prediction limit would be exceeded.
+        '''
+        _futures = []
+        _new = []
+        with self.lock:
+            _keys = set([scenario_key(_s) for _s in scenarios]) - set(self.inflight.keys())
+            if self.pending + len(_keys) > self.max_queue:
+                self.stats['rejected'] += 1
+                metrics.count('failures_total', stage='request')
+                raise ServiceBusy("Too many outstanding predictions (%d), try again later." % self.pending)
+
+            for _scenario in scenarios:
+                _key = scenario_key(_scenario)
+                _is_new = _key not in self.inflight
+                _future = self._submit(_scenario)
+                if _is_new:
+                    _new.append((_key, _future))
+                _futures.append(_future)
+
+        # Callbacks may run immediately if the prediction has already completed, so add them outside of the lock.
+        for (_key, _future) in _new:
+            _future.add_done_callback(lambda _f, _k=_key: self._done(_k, _f))
+
+        return _futures
+
+
+    def predict(self, scenario):
+        ''' Run a single prediction, returning a result dictionary. '''
+        return self.predict_many([scenario])[0]
+
+
+    def predict_many(self, scenarios):
+        ''' Run a list of predictions concurrently, returning a list of result dictionaries. '''
+        _futures = self.submit_many(scenarios)
+
+        _deadline = time.time() + self.timeout
+        _results = []
+        for (_scenario, _future) in zip(scenarios, _futures):
+            try:
+                _flight_path = _future.result(timeout=max(0.0, _deadline - time.time()))
+                _results.append(prediction_result(_scenario, _flight_path))
+            except TimeoutError:
+                _results.append({'error': "Prediction timed out."})
+            except Exception as e:
+                logging.error("Prediction failed: %s" % str(e))
+                _results.append({'error': "Prediction failed."})
+
+        return _results
+
+
+    def get_wind(self, lat, lon, alt, time_value=None):
+        ''' Wind at a point. Returns a result dictionary. '''
+        self.wind.refresh()
+        _time = parse_time(time_value)
+        _timestamp = calendar.timegm(_time.timetuple())
+        (_u, _v) = self.wind.get_wind(float(lat), float(lon), float(alt), _timestamp)
+
+        return {
+            'lat': float(lat),
+            'lon': float(lon),
+            'alt': float(alt),
+            'time': _time.strftime("%Y-%m-%dT%H:%M:%SZ"),
+            'u': round(_u, 3),
+            'v': round(_v, 3),
+            'speed': round(math.sqrt(_u*_u + _v*_v), 3),
+            # Direction the wind is coming from, in degrees.
+            'direction': round((math.degrees(math.atan2(_u, _v)) + 180.0) % 360.0, 1)
+        }
+
+
+    def status(self):
+        self.wind.refresh()
+        (_start, _end) = self.wind.time_range
+        _dataset = read_dataset_info(self.gfs_path)
+
+        with self.lock:
+            return {
+                'dataset': _dataset.strftime("%Y%m%d%Hz") if _dataset else None,
+                'data_start': datetime.datetime.utcfromtimestamp(_start).strftime("%Y-%m-%dT%H:%M:%SZ") if _start else None,
+                'data_end': datetime.datetime.utcfromtimestamp(_end).strftime("%Y-%m-%dT%H:%M:%SZ") if _end else None,
+                'workers': self.workers,
+                'max_queue': self.max_queue,
+                'pending': self.pending,
+                'stats': dict(self.stats)
+            }
+
+
+    def close(self):
+        self.pool.close()
+
+
+class PredictionRequestHandler(BaseHTTPRequestHandler):
+    ''' HTTP front-end for a PredictionService, which is accessed via self.server.service '''
+
+    protocol_version = "HTTP/1.1"
+
+    def send_json(self, status, data, headers=None):
+        _body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(_body)))
+        self.send_header('Access-Control-Allow-Origin', '*')
+        if headers:
+            for _header in headers:
+                self.send_header(_header, headers[_header])
+        self.end_headers()
+        self.wfile.write(_body)
+
+
+    def read_json(self):
+        _length = int(self.headers.get('Content-Length', 0))
+        if _length > MAX_BODY_SIZE:
+            raise ValueError("Request too large.")
+        return json.loads(self.rfile.read(_length).decode('utf-8'))
+
+
+    def handle_request(self, method):
+        _url = urlparse(self.path)
+        _service = self.server.service
+        _start = time.perf_counter()
+        _status = 200
+        # Metrics are labelled by route, rather than by the requested path, which may be anything.
+        _route = 'other'
+
+        try:
+            if method == 'POST' and _url.path == '/predict':
+                _route = 'predict'
+                _result = _service.predict(parse_scenario(self.read_json()))
+                if 'error' in _result:
+                    _status = 422
+
+            elif method == 'POST' and _url.path == '/batch':
+                _route = 'batch'
+                _request = self.read_json()
+                if not isinstance(_request, dict) or not isinstance(_request.get('scenarios'), list):
+                    raise ValueError("Batch request must contain a list of scenarios.")
+                if len(_request['scenarios']) > _service.max_queue:
+                    raise ValueError("Batch too large (maximum %d scenarios)." % _service.max_queue)
+                _result = {'results': _service.predict_many([parse_scenario(_s) for _s in _request['scenarios']])}
+
+            elif method == 'GET' and _url.path == '/wind':
+                _route = 'wind'
+                _query = dict([(_k, _v[0]) for (_k, _v) in parse_qs(_url.query).items()])
+                _result = _service.get_wind(_query['lat'], _query['lon'], _query.get('alt', 0.0), _query.get('time'))
+
+            elif method == 'POST' and _url.path == '/wind':
+                _route = 'wind_batch'
+                _request = self.read_json()
+                if not isinstance(_request, dict) or not isinstance(_request.get('points', []), list):
+                    raise ValueError("Wind request must contain a list of points.")
+                _points = _request.get('points', [])
+                _result = {'results': [_service.get_wind(_p['lat'], _p['lon'], _p.get('alt', 0.0), _p.get('time')) for _p in _points]}
+
+            elif method == 'GET' and _url.path == '/status':
+                _route = 'status'
+                _result = _service.status()
+
+            elif method == 'GET' and _url.path == '/metrics' and self.server.exporter is not None:
+                _route = 'metrics'
+                _body = self.server.exporter.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(_body)))
+                self.end_headers()
+                self.wfile.write(_body)
+                return
+
+            else:
+                _status = 404
+                _result = {'error': "Not found."}
+
+            self.send_json(_status, _result)
+
+        except ServiceBusy as e:
+            _status = 503
+            self.send_json(_status, {'error': str(e)}, headers={'Retry-After': '1'})
+        except (ValueError, KeyError, TypeError) as e:
+            _status = 400
+            self.send_json(_status, {'error': "Bad request: %s" % str(e)})
+        except Exception as e:
+            logging.exception("Error handling request %s" % self.path)
+            _status = 500
+            self.send_json(_status, {'error': "Internal error."})
+        finally:
+            metrics.observe('stage_duration_seconds', time.perf_counter() - _start, stage='request', endpoint=_route)
+            metrics.count('requests_total', endpoint=_route, status=_status)
+
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+    def log_message(self, format, *args):
+        logging.debug("%s - %s" % (self.address_string(), format % args))
+
+
+class PredictionServer(ThreadingHTTPServer):
+    ''' Threaded HTTP server for a PredictionService '''
+
+    daemon_threads = True
+
+    def __init__(self, service, address='127.0.0.1', port=8080, exporter=None):
+        self.service = service
+        self.exporter = exporter
+        super(PredictionServer, self).__init__((address, port), PredictionRequestHandler)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pred', type=str, default='./pred', help="Location of the pred binary. (Default: ./pred)")
+    parser.add_argument('--gfs', type=str, default='./gfs', help="Location of the GFS data store. (Default: ./gfs/)")
+    parser.add_argument('--address', type=str, default='127.0.0.1', help="Address to listen on. (Default: 127.0.0.1)")
+    parser.add_argument('--port', type=int, default=8080, help="Port to listen on. (Default: 8080)")
+    parser.add_argument('--workers', type=int, default=4, help="Number of predictions to run concurrently. (Default: 4)")
+    parser.add_argument('--max_queue', type=int, default=32, help="Maximum number of outstanding predictions before requests are rejected. (Default: 32)")
+    parser.add_argument('--timeout', type=float, default=60.0, help="Maximum time (seconds) to wait for a prediction. (Default: 60)")
+    parser.add_argument('--metrics', action='store_true', default=False, help="Serve Prometheus metrics on /metrics.")
+    parser.add_argument('-v', '--verbose', action='store_true', default=False, help="Verbose output.")
+    args = parser.parse_args()
+
+    if args.verbose:
+        logging.basicConfig(stream=sys.stdout, format="%(asctime)s %(levelname)s %(message)s", level=logging.DEBUG)
+    else:
+        logging.basicConfig(stream=sys.stdout, format="%(asctime)s %(levelname)s %(message)s", level=logging.INFO)
+
+    _exporter = metrics.enable_prometheus() if args.metrics else None
+
+    _service = PredictionService(
+        bin_path=args.pred,
+        gfs_path=args.gfs,
+        workers=args.workers,
+        max_queue=args.max_queue,
+        timeout=args.timeout)
+
+    _server = PredictionServer(_service, address=args.address, port=args.port, exporter=_exporter)
+    logging.info("Serving predictions on http://%s:%d/" % (args.address, _server.server_port))
+
+    try:
+        _server.serve_forever()
+    except KeyboardInterrupt:
+        logging.info("Shutting down.")
+    finally:
+        _server.server_close()
+        _service.close()
+
+
+if __name__ == '__main__':
+    main()
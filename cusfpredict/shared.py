@@ -0,0 +1,350 @@
+#!/usr/bin/env python
+#
+#   Project Horus
+#   CUSF Standalone Predictor Python Wrapper - Shared-Memory Wind Datasets
+#   Copyright 2020 Mark Jessop <vk5qi@rfhead.net>
+#
+#   Wind analysis spread across multiple processes would otherwise have each process parse and
+#   hold its own copy of every tile. A SharedWindDataset decodes each tile of a dataset once, into
+#   a single POSIX shared memory segment. Other processes attach to it by name, and get read-only
+#   numpy views onto the same memory, with the same lookup methods as cusfpredict.wind.WindDataset.
+#
+#   The segment is reference counted: each attached dataset holds a shared fcntl lock on a
+#   reference file in the temporary directory, which the kernel releases if the process exits or
+#   is killed. When a dataset is closed, the segment is removed if no other references remain.
+#   If the last process attached is killed, the segment is left behind, and can be removed with
+#   SharedWindDataset.unlink(name).
+#
+#   Segment layout: header length (int64), JSON header (tile axes and data offsets), then the
+#   height/u/v arrays of each tile, as float32 [3, pressure, lat, lon].
+#
+#   Usage:
+#       from cusfpredict.shared import SharedWindDataset
+#       dataset = SharedWindDataset.create('./gfs')
+#       # Pass dataset.name (or the dataset itself, which is pickled as its name) to the workers:
+#       with SharedWindDataset.attach(name) as wind:
+#           (u, v) = wind.get_wind(lat, lon, alt, timestamp)
+#       ...
+#       dataset.close()
+#
+import fcntl
+import json
+import logging
+import os
+import secrets
+import struct
+import sys
+import tempfile
+import time
+from multiprocessing import resource_tracker, shared_memory, util
+import numpy as np
+
+from . import metrics
+from .files import cusf_files
+from .reader import read_cusf_header
+from .wind import WindDataset, WindTile, parse_cusf_filename
+
+
+# Format version of the segment header.
+SEGMENT_VERSION = 1
+
+# Offset (bytes) of the first tile's data, and of the data of each following tile, are aligned to this.
+SEGMENT_ALIGNMENT = 64
+
+# Header length.
+_PREAMBLE = struct.Struct('<q')
+
+
+def _align(offset):
+    return (offset + SEGMENT_ALIGNMENT - 1) // SEGMENT_ALIGNMENT * SEGMENT_ALIGNMENT
+
+
+def _lock_path(name, suffix):
+    return os.path.join(tempfile.gettempdir(), "%s.%s" % (name.lstrip('/'), suffix))
+
+
+class _SegmentLock(object):
+    ''' Exclusive lock (fcntl) serialising attaching to and detaching from a segment, across processes. '''
+
+    def __init__(self, name):
+        self.path = _lock_path(name, 'lock')
+
+    def __enter__(self):
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *args):
+        fcntl.flock(self.fd, fcntl.LOCK_UN)
+        os.close(self.fd)
+
+
+# File descriptors holding references in this process.
+_references = set()
+
+def _reference(name):
+    ''' Take a reference to a segment: a shared lock on its reference file. Returns the file descriptor. '''
+    _fd = os.open(_lock_path(name, 'refs'), os.O_RDWR | os.O_CREAT, 0o600)
+    fcntl.flock(_fd, fcntl.LOCK_SH)
+    _references.add(_fd)
+    return _fd
+
+
+def _close_inherited_references():
+    # A forked child shares its parent's reference locks, which would keep the segment alive
+    # until the child exits (and then nobody would remove it). The child takes its own references.
+    for _fd in _references:
+        try:
+            os.close(_fd)
+        except OSError:
+            pass
+    _references.clear()
+
+os.register_at_fork(after_in_child=_close_inherited_references)
+
+
+# Python 3.13 added the option to not track segments with the resource tracker.
+_UNTRACKED = sys.version_info >= (3, 13)
+
+def _open_segment(name, create=False, size=0):
+    '''
+    Open (or create) a shared memory segment, without registering it with the multiprocessing
+    resource tracker, which would otherwise remove it when the first attached process exits.
+    We do our own reference counting instead.
+    '''
+    if _UNTRACKED:
+        return shared_memory.SharedMemory(name=name, create=create, size=size, track=False)
+
+    _shm = shared_memory.SharedMemory(name=name, create=create, size=size)
+    resource_tracker.unregister(_shm._name, 'shared_memory')
+    return _shm
+
+
+def _unlink_segment(shm):
+    if not _UNTRACKED:
+        # SharedMemory.unlink un-registers the segment from the resource tracker, which complains if it was never registered.
+        resource_tracker.register(shm._name, 'shared_memory')
+    shm.unlink()
+
+
+def _detach(shm, name, fd, pid):
+    ''' Drop a reference to a segment, removing it if this was the last. Returns True if it was removed. '''
+    if os.getpid() != pid:
+        # Inherited through a fork - this process never held the reference.
+        return False
+
+    _removed = False
+    with _SegmentLock(name):
+        _references.discard(fd)
+        os.close(fd)
+
+        # If nobody else holds a reference, we can get an exclusive lock on the reference file.
+        _fd = os.open(_lock_path(name, 'refs'), os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            _removed = True
+        except BlockingIOError:
+            pass
+        finally:
+            os.close(_fd)
+
+        if _removed:
+            _unlink(name)
+
+    try:
+        shm.close()
+    except BufferError:
+        # Views onto the data are still alive - the mapping is released when they are.
+        pass
+    return _removed
+
+
+def _unlink(name):
+    try:
+        _shm = _open_segment(name)
+        _shm.close()
+        _unlink_segment(_shm)
+    except FileNotFoundError:
+        pass
+
+    for _suffix in ['refs', 'lock']:
+        try:
+            os.unlink(_lock_path(name, _suffix))
+        except OSError:
+            pass
+
+
+class SharedWindDataset(WindDataset):
+    '''
+    A read-only WindDataset held in shared memory. Use create() to decode a dataset into a new
+    segment, and attach() (in other processes) to use it. All tiles are resident, so lookups
+    never parse files. The dataset is a snapshot: it is not refreshed if the directory changes.
+    '''
+
+    def __init__(self, shm, name, fd):
+        # Note - WindDataset.__init__ is not called, as there is no directory to scan.
+        self.shm = shm
+        self.name = name
+        self.max_tiles = None
+
+        # Detach when this object is garbage collected, or at exit (including multiprocessing workers).
+        self._finalizer = util.Finalize(self, _detach, args=(shm, name, fd, os.getpid()), exitpriority=10)
+
+        (_header_length,) = _PREAMBLE.unpack_from(shm.buf, 0)
+        self.header = json.loads(bytes(shm.buf[_PREAMBLE.size:_PREAMBLE.size + _header_length]).decode('utf-8'))
+        if self.header['version'] != SEGMENT_VERSION:
+            raise ValueError("Unsupported shared wind dataset version %s" % str(self.header['version']))
+
+        self.gfs_path = self.header['gfs_path']
+        self._dataset_id = tuple(self.header['dataset_id'])
+
+        _data_start = _align(_PREAMBLE.size + _header_length)
+
+        # Read-only views of each tile's arrays.
+        self.files = []
+        self.tiles = {}
+        for _entry in self.header['tiles']:
+            _shape = (3, len(_entry['pressures']), len(_entry['lats']), len(_entry['lons']))
+            _values = np.ndarray(_shape, dtype=np.float32, buffer=shm.buf, offset=_data_start + _entry['offset'])
+            _values.flags.writeable = False
+
+            _filename = _entry['filename']
+            self.tiles[_filename] = WindTile.from_arrays(_filename, _entry['timestamp'],
+                np.array(_entry['pressures']), np.array(_entry['lats']), np.array(_entry['lons']),
+                _values[0], _values[1], _values[2], monotonic=_entry['monotonic'])
+            self.files.append(tuple(_entry['file']) + (_filename,))
+
+
+    @classmethod
+    def create(cls, gfs_path="./gfs", name=None):
+        ''' Decode all tiles of a GFS data directory into a new shared memory segment. Returns the creating reference. '''
+        _start = time.perf_counter()
+        _real_path = os.path.realpath(gfs_path)
+
+        if name is None:
+            name = "cusf_%s" % secrets.token_hex(8)
+
+        # Size up the segment from the file headers, before decoding any data.
+        _tiles = []
+        _offset = 0
+        for _filename in cusf_files(_real_path):
+            try:
+                _file = parse_cusf_filename(_filename)
+            except (ValueError, IndexError):
+                logging.debug("Ignoring file with unexpected name: %s" % _filename)
+                continue
+
+            _header = read_cusf_header(_filename)
+            _lats = _header['latitudes'].tolist()
+            _entry = {
+                'filename': _filename,
+                'file': list(_file),
+                'timestamp': _header['posix_timestamp'],
+                'pressures': _header['pressures'].tolist(),
+                'lats': sorted(_lats),
+                'lons': _header['longitudes'].tolist(),
+                'offset': _offset,
+            }
+            _tiles.append(_entry)
+            _offset = _align(_offset + 3 * 4 * len(_entry['pressures']) * len(_lats) * len(_entry['lons']))
+
+        if len(_tiles) == 0:
+            raise Exception("No GFS data files in directory.")
+
+        _tiles.sort(key=lambda _entry: tuple(_entry['file']))
+
+        # The monotonic flag of each tile is only known once it has been decoded, so reserve space for it.
+        for _entry in _tiles:
+            _entry['monotonic'] = False
+
+        _header = {
+            'version': SEGMENT_VERSION,
+            'gfs_path': gfs_path,
+            'dataset_id': [_real_path, os.stat(_real_path).st_mtime],
+            'tiles': _tiles,
+        }
+        _header_length = len(json.dumps(_header).encode('utf-8')) + 16 * len(_tiles)
+        _data_start = _align(_PREAMBLE.size + _header_length)
+
+        with _SegmentLock(name):
+            _shm = _open_segment(name, create=True, size=_data_start + _offset)
+            try:
+                # Decode one tile at a time, straight into the segment.
+                for _entry in _tiles:
+                    _tile = WindTile(_entry['filename'])
+                    _shape = (3,) + _tile.hgt.shape
+                    _values = np.ndarray(_shape, dtype=np.float32, buffer=_shm.buf, offset=_data_start + _entry['offset'])
+                    _values[0] = _tile.hgt
+                    _values[1] = _tile.u
+                    _values[2] = _tile.v
+                    _entry['monotonic'] = _tile.monotonic
+                    del _values, _tile
+
+                _encoded = json.dumps(_header).encode('utf-8').ljust(_header_length)
+                _shm.buf[_PREAMBLE.size:_PREAMBLE.size + _header_length] = _encoded
+                _PREAMBLE.pack_into(_shm.buf, 0, _header_length)
+            except:
+                _shm.close()
+                _unlink_segment(_shm)
+                raise
+
+            _fd = _reference(name)
+
+        metrics.observe('stage_duration_seconds', time.perf_counter() - _start, stage='shared_create')
+        logging.info("Loaded %d tiles (%.1f MB) into shared memory segment %s" % (len(_tiles), _shm.size / 1e6, name))
+
+        return cls(_shm, name, _fd)
+
+
+    @classmethod
+    def attach(cls, name):
+        ''' Attach to an existing shared wind dataset by name. Raises FileNotFoundError if it does not exist. '''
+        with _SegmentLock(name):
+            try:
+                _shm = _open_segment(name)
+            except FileNotFoundError:
+                _unlink(name)
+                raise
+            if _PREAMBLE.unpack_from(_shm.buf, 0)[0] == 0:
+                # Creation failed part-way through.
+                _shm.close()
+                raise FileNotFoundError("Shared wind dataset %s is not available." % name)
+            _fd = _reference(name)
+
+        return cls(_shm, name, _fd)
+
+
+    @staticmethod
+    def unlink(name):
+        ''' Forcibly remove a shared wind dataset (i.e. one left behind by a killed process). '''
+        with _SegmentLock(name):
+            _unlink(name)
+
+
+    def close(self):
+        ''' Detach from the dataset. The views onto the data must not be used after this. '''
+        if self._finalizer.still_active():
+            self.tiles = {}
+            self.files = []
+            self._finalizer()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *args):
+        self.close()
+
+
+    def __reduce__(self):
+        # Pickle by name, so datasets can be passed to multiprocessing workers, which attach on arrival.
+        return (SharedWindDataset.attach, (self.name,))
+
+
+    def refresh(self, force=False):
+        return False
+
+
+    def tile(self, filename):
+        return self.tiles[filename]
@@ -0,0 +1,475 @@
+#!/usr/bin/env python
+#
+#   Project Horus
+#   CUSF Standalone Predictor Python Wrapper - Launch Parameter Solver
+#   Copyright 2020 Mark Jessop <vk5qi@rfhead.net>
+#
+#   Search for launch parameters (ascent rate, burst altitude, launch time, ...) which put the
+#   landing within a target area, and out of any areas to be avoided.
+#
+#   The search starts with a coarse grid over the allowed parameter ranges, then repeatedly refines
+#   the grid around the best options found so far, halving the step size each round. Each round is
+#   run as a batch of parallel predictions on a pool of warm predictors, and every result is cached,
+#   so repeated or overlapping searches against the same dataset do not re-run predictions.
+#   The search stops when the wall-clock budget is used up, and the Pareto-optimal options
+#   (i.e. trading off landing distance against launch delay) are returned.
+#
+#   Usage:
+#       from cusfpredict.solver import LaunchSolver, Target
+#       solver = LaunchSolver(bin_path='./pred', gfs_path='./gfs', workers=8)
+#       result = solver.solve(Target(lat=-34.6, lon=139.2, radius=5000),
+#           {'ascent_rate': (4.0, 6.0), 'burst_alt': (22000, 30000), 'launch_time': (start, end)},
+#           fixed={'launch_lat': -34.95, 'launch_lon': 138.52, 'descent_rate': 6.0}, budget=60)
+#       for option in result['options']:
+#           print(option['scenario'], option['landing'], option['objectives'])
+#
+#   Or from the command line:
+#       python3 -m cusfpredict.solver --pred ./pred --gfs ./gfs --target -34.6,139.2 --radius 5000 \
+#           --ascent_rate 4:6 --burst_alt 22000:30000 --launch_time 2020-06-01T00:00Z --window 6
+#
+import argparse
+import datetime
+import itertools
+import json
+import logging
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import wait
+
+from . import metrics
+from .live import distance_metres
+from .predict import PredictorPool
+from .utils import parse_time, scenario_key
+
+# Precision each searched parameter is passed to pred with. Candidates are rounded to this,
+# so that nearby candidates share cached results.
+PARAMETER_RESOLUTION = {
+    'ascent_rate': 0.1,
+    'descent_rate': 0.1,
+    'burst_alt': 1.0,
+    'launch_alt': 1.0,
+    'launch_lat': 1e-5,
+    'launch_lon': 1e-5,
+    'launch_time': 1.0,
+}
+
+# Defaults for prediction parameters which are neither searched nor fixed.
+SCENARIO_DEFAULTS = {
+    'launch_alt': 0.0,
+    'ascent_rate': 5.0,
+    'descent_rate': 6.0,
+    'burst_alt': 26000.0,
+    'descent_mode': False,
+}
+
+
+def _point_in_polygon(lat, lon, polygon):
+    ''' Ray-casting test of a point against a [(lat, lon), ...] polygon '''
+    _inside = False
+    for _i in range(len(polygon)):
+        (_lat0, _lon0) = polygon[_i-1]
+        (_lat1, _lon1) = polygon[_i]
+        if (_lat0 > lat) != (_lat1 > lat):
+            if lon < _lon0 + (lat - _lat0) * (_lon1 - _lon0) / (_lat1 - _lat0):
+                _inside = not _inside
+    return _inside
+
+
+def _distance_to_segment(lat, lon, a, b):
+    ''' Distance (m) from a point to a line segment, using a local flat-earth approximation '''
+    _scale = math.cos(math.radians(lat))
+    (_ax, _ay) = ((a[1] - lon) * _scale, a[0] - lat)
+    (_bx, _by) = ((b[1] - lon) * _scale, b[0] - lat)
+    (_dx, _dy) = (_bx - _ax, _by - _ay)
+    _length_sq = _dx*_dx + _dy*_dy
+    _t = 0.0 if _length_sq == 0 else min(1.0, max(0.0, -(_ax*_dx + _ay*_dy) / _length_sq))
+    (_x, _y) = (_ax + _t*_dx, _ay + _t*_dy)
+    return distance_metres(lat, lon, lat + _y, lon + _x / max(_scale, 1e-6))
+
+
+class Target(object):
+    '''
+    A landing target: either a point (with an optional radius, in metres), or a [(lat, lon), ...] polygon.
+    avoid is an optional list of polygons which landings must not fall within (i.e. the sea, or a restricted area).
+    '''
+
+    def __init__(self, lat=None, lon=None, radius=0.0, polygon=None, avoid=None):
+        if polygon is None and (lat is None or lon is None):
+            raise ValueError("Either a target point or polygon must be provided.")
+
+        self.lat = lat
+        self.lon = lon
+        self.radius = radius
+        self.polygon = polygon
+        self.avoid = avoid if avoid else []
+
+
+    def distance(self, lat, lon):
+        ''' Distance (m) from a landing location to the target area. 0 if within it. '''
+        if self.polygon is not None:
+            if _point_in_polygon(lat, lon, self.polygon):
+                return 0.0
+            return min([_distance_to_segment(lat, lon, self.polygon[_i-1], self.polygon[_i]) for _i in range(len(self.polygon))])
+
+        return max(0.0, distance_metres(lat, lon, self.lat, self.lon) - self.radius)
+
+
+    def allowed(self, lat, lon):
+        ''' Check a landing location is not within any of the areas to be avoided '''
+        for _polygon in self.avoid:
+            if _point_in_polygon(lat, lon, _polygon):
+                return False
+        return True
+
+
+def objective_distance(option):
+    ''' Distance (m) from the landing to the target area '''
+    return option['distance']
+
+def objective_delay(option):
+    ''' Launch delay (s) after the start of the launch window '''
+    return option['delay']
+
+def objective_ascent_rate(option):
+    ''' Ascent rate (m/s) - i.e. less gas '''
+    return option['scenario']['ascent_rate']
+
+def objective_burst_alt(option):
+    ''' Burst altitude (m) - i.e. a smaller balloon '''
+    return option['scenario']['burst_alt']
+
+def objective_duration(option):
+    ''' Flight duration (s) '''
+    return option['landing'][0] - option['launch'][0]
+
+# Objectives which can be referred to by name. Any function of an option can also be used.
+OBJECTIVES = {
+    'distance': objective_distance,
+    'delay': objective_delay,
+    'ascent_rate': objective_ascent_rate,
+    'burst_alt': objective_burst_alt,
+    'duration': objective_duration,
+}
+
+
+def pareto_front(options, names):
+    ''' Get the options which are not dominated by any other (all objectives minimised), sorted by the first objective '''
+    _options = sorted(options, key=lambda _o: tuple(_o['objectives'][_n] for _n in names))
+    _front = []
+    for _option in _options:
+        _values = [_option['objectives'][_n] for _n in names]
+        _dominated = False
+        for _other in _front:
+            _other_values = [_other['objectives'][_n] for _n in names]
+            if all(_b <= _a for (_a, _b) in zip(_values, _other_values)):
+                _dominated = True
+                break
+        if not _dominated:
+            _front.append(_option)
+    return _front
+
+
+class LaunchSolver(object):
+    '''
+    Parallel launch parameter search, using a pool of warm predictors.
+
+    pool - An existing PredictorPool to use. Otherwise one is created with bin_path, gfs_path and workers.
+    cache_size - Maximum number of prediction results to cache.
+
+    Cached results are discarded when the GFS dataset is updated.
+    '''
+
+    def __init__(self, bin_path="./pred", gfs_path="./gfs", workers=4, pool=None, cache_size=100000):
+        self.gfs_path = gfs_path
+        self._own_pool = pool is None
+        self.pool = PredictorPool(bin_path=bin_path, gfs_path=gfs_path, workers=workers) if pool is None else pool
+        self.workers = self.pool.workers
+
+        self.lock = threading.Lock()
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+        self._dataset_id = None
+        self.stats = {'predictions': 0, 'cache_hits': 0}
+
+
+    def _check_dataset(self):
+        ''' Clear the cache if the dataset has been updated since the results were cached. '''
+        _real_path = os.path.realpath(self.gfs_path)
+        try:
+            _dataset_id = (_real_path, os.stat(_real_path).st_mtime)
+        except OSError:
+            _dataset_id = (_real_path, None)
+
+        if _dataset_id != self._dataset_id:
+            with self.lock:
+                self.cache.clear()
+            self._dataset_id = _dataset_id
+
+
+    def _store(self, key, future):
+        ''' Cache a completed prediction. Predictions which finish after the budget has expired are still cached. '''
+        if future.cancelled() or future.exception() is not None:
+            return
+
+        _path = future.result()
+        if len(_path) > 1:
+            _result = (_path[0], max(_path, key=lambda _p: _p[3]), _path[-1])
+        else:
+            _result = None
+
+        with self.lock:
+            self.cache[key] = _result
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+
+    def evaluate(self, scenarios, deadline=None):
+        '''
+        Run a batch of scenarios (dictionaries of Predictor.predict arguments) in parallel, using cached results where available.
+        Returns a list of (scenario, (launch, burst, landing)) tuples, with None in place of failed predictions.
+        Scenarios which do not complete before the deadline (a time.monotonic() value) are left out.
+        '''
+        _results = []
+        _futures = {}
+        _submitted = set()
+        for _scenario in scenarios:
+            _key = scenario_key(_scenario)
+            with self.lock:
+                _cached = _key in self.cache
+                if _cached:
+                    self.cache.move_to_end(_key)
+                    _results.append((_scenario, self.cache[_key]))
+            if _cached:
+                self.stats['cache_hits'] += 1
+            elif _key not in _submitted:
+                _future = self.pool.submit(**_scenario)
+                _future.add_done_callback(lambda _f, _key=_key: self._store(_key, _f))
+                _futures[_future] = (_scenario, _key)
+                _submitted.add(_key)
+
+        if not _futures:
+            return _results
+
+        _timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+        (_done, _not_done) = wait(list(_futures.keys()), timeout=_timeout)
+        for _future in _not_done:
+            _future.cancel()
+
+        for _future in _done:
+            (_scenario, _key) = _futures[_future]
+            if _future.exception() is not None:
+                logging.error("Prediction failed: %s" % str(_future.exception()))
+                continue
+            self.stats['predictions'] += 1
+            # The done callback may not have run yet, so make sure the result is stored.
+            self._store(_key, _future)
+            with self.lock:
+                _results.append((_scenario, self.cache.get(_key)))
+
+        return _results
+
+
+    def solve(self, target, ranges, fixed=None, objectives=('distance', 'delay'), grid=5, keep=4, budget=60.0, max_rounds=20):
+        '''
+        Search for launch parameters which land within a target.
+
+        target - A Target
+        ranges - Dictionary of searched Predictor.predict parameters, each a (minimum, maximum) tuple.
+                 launch_time may be given as datetimes, or anything parse_time accepts.
+        fixed - Dictionary of other Predictor.predict parameters (i.e. launch_lat, launch_lon, descent_rate).
+        objectives - Objectives to minimise, either names from OBJECTIVES or functions of an option.
+        grid - Number of points across each parameter range in the initial grid.
+        keep - Number of options to refine around in each round.
+        budget - Wall-clock time limit (seconds).
+
+        Returns a dictionary containing:
+            options - The Pareto-optimal options, sorted by the first objective. Each option contains the scenario,
+                      the launch, burst and landing points, distance to target, and objective values.
+            best - The option with the lowest first objective, or None if no predictions succeeded.
+            evaluated - Number of options evaluated.
+            rounds - Number of search rounds completed.
+            elapsed - Time taken (seconds).
+        '''
+        _start = time.monotonic()
+        _deadline = _start + budget
+        self._check_dataset()
+
+        _fixed = dict(SCENARIO_DEFAULTS)
+        _fixed.update(fixed if fixed else {})
+        _objectives = [(_o if callable(_o) else OBJECTIVES[_o]) for _o in objectives]
+        _names = [(_o.__name__ if callable(_o) else _o) for _o in objectives]
+
+        # Searched parameters, as (name, minimum, maximum, resolution). Launch times are searched as seconds from the window start.
+        _window_start = None
+        _dimensions = []
+        for (_name, (_min, _max)) in sorted(ranges.items()):
+            if _name == 'launch_time':
+                _window_start = parse_time(_min)
+                (_min, _max) = (0.0, (parse_time(_max) - _window_start).total_seconds())
+            if _max < _min:
+                raise ValueError("Invalid range for %s" % _name)
+            _dimensions.append((_name, float(_min), float(_max), PARAMETER_RESOLUTION.get(_name, 1e-6)))
+
+        if _window_start is None:
+            _window_start = parse_time(_fixed.get('launch_time'))
+
+        def _quantise(point):
+            _point = []
+            for (_value, (_name, _min, _max, _resolution)) in zip(point, _dimensions):
+                _value = round(min(_max, max(_min, _value)) / _resolution) * _resolution
+                _point.append(round(_value, 6))
+            return tuple(_point)
+
+        def _scenario(point):
+            _scenario = dict(_fixed)
+            _scenario['launch_time'] = _window_start
+            for (_value, (_name, _min, _max, _resolution)) in zip(point, _dimensions):
+                if _name == 'launch_time':
+                    _scenario['launch_time'] = _window_start + datetime.timedelta(seconds=_value)
+                else:
+                    _scenario[_name] = _value
+            return _scenario
+
+        _options = {}
+
+        def _run(points):
+            _points = [_p for _p in set(points) if _p not in _options]
+            _scenarios = dict([(scenario_key(_scenario(_p)), _p) for _p in _points])
+            for (_scenario_, _result) in self.evaluate([_scenario(_p) for _p in _points], deadline=_deadline):
+                _point = _scenarios[scenario_key(_scenario_)]
+                if _result is None:
+                    _options[_point] = None
+                    continue
+
+                (_launch, _burst, _landing) = _result
+                _option = {
+                    'scenario': _scenario_,
+                    'launch': _launch,
+                    'burst': _burst,
+                    'landing': _landing,
+                    'distance': target.distance(_landing[1], _landing[2]),
+                    'delay': (_scenario_['launch_time'] - _window_start).total_seconds(),
+                    'allowed': target.allowed(_landing[1], _landing[2]),
+                }
+                _option['objectives'] = dict([(_n, _f(_option)) for (_n, _f) in zip(_names, _objectives)])
+                _options[_point] = _option
+
+        def _candidates():
+            return [_o for _o in _options.values() if _o is not None and _o['allowed']]
+
+        # Initial coarse grid.
+        _axes = [sorted(set([_min + (_max - _min) * _i / max(grid - 1, 1) for _i in range(grid)])) for (_name, _min, _max, _res) in _dimensions]
+        _steps = [(_max - _min) / max(grid - 1, 1) for (_name, _min, _max, _res) in _dimensions]
+        _run([_quantise(_p) for _p in itertools.product(*_axes)])
+        _rounds = 1
+
+        # Refine around the best options, halving the step size each round.
+        while _rounds < max_rounds and time.monotonic() < _deadline:
+            _steps = [_s / 2.0 for _s in _steps]
+            if all(_s < _res for (_s, (_name, _min, _max, _res)) in zip(_steps, _dimensions)):
+                break
+
+            _front = pareto_front(_candidates(), _names)
+            _best = sorted(_candidates(), key=lambda _o: _o['objectives'][_names[0]])
+            _centres = []
+            for _option in _front[:keep] + _best[:keep]:
+                if _option not in _centres:
+                    _centres.append(_option)
+
+            _points = []
+            _lookup = dict([(id(_o), _p) for (_p, _o) in _options.items() if _o is not None])
+            for _option in _centres:
+                _centre = _lookup[id(_option)]
+                for _offsets in itertools.product([-1, 0, 1], repeat=len(_dimensions)):
+                    _points.append(_quantise([_c + _o*_s for (_c, _o, _s) in zip(_centre, _offsets, _steps)]))
+
+            if not [_p for _p in _points if _p not in _options]:
+                continue
+
+            _run(_points)
+            _rounds += 1
+
+        _front = pareto_front(_candidates(), _names)
+        _elapsed = time.monotonic() - _start
+        metrics.observe('stage_duration_seconds', _elapsed, stage='solver')
+
+        return {
+            'options': _front,
+            'best': _front[0] if _front else None,
+            'evaluated': len(_options),
+            'rounds': _rounds,
+            'elapsed': _elapsed,
+        }
+
+
+    def close(self):
+        if self._own_pool:
+            self.pool.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Search for launch parameters which land within a target area.")
+    parser.add_argument('--pred', type=str, default="./pred", help="Location of the pred binary. (Default: ./pred)")
+    parser.add_argument('--gfs', type=str, default="./gfs", help="Location of the GFS data store. (Default: ./gfs/)")
+    parser.add_argument('--workers', type=int, default=4, help="Number of concurrent predictions. (Default: 4)")
+    parser.add_argument('--latitude', type=float, default=-34.9499, help="Launch Latitude (dd.dddd)")
+    parser.add_argument('--longitude', type=float, default=138.5194, help="Launch Longitude (dd.dddd)")
+    parser.add_argument('--launchalt', type=float, default=0.0, help="Launch Altitude (m). Default 0m")
+    parser.add_argument('--descentrate', type=float, default=6.0, help="Descent Rate (m/s). Default 6m/s")
+    parser.add_argument('--target', type=str, required=True, help="Target point (lat,lon), or polygon (lat,lon;lat,lon;...)")
+    parser.add_argument('--radius', type=float, default=0.0, help="Target radius (m), for a point target. Default 0m")
+    parser.add_argument('--avoid', type=str, action='append', default=[], help="Polygon (lat,lon;lat,lon;...) to avoid. Can be given multiple times.")
+    parser.add_argument('--ascent_rate', type=str, default="5.0", help="Ascent rate (m/s), or range (min:max). Default 5m/s")
+    parser.add_argument('--burst_alt', type=str, default="26000", help="Burst altitude (m), or range (min:max). Default 26000m")
+    parser.add_argument('--launch_time', type=str, default=None, help="Launch time, or start of the launch window (UTC). Default: Now")
+    parser.add_argument('--window', type=float, default=0.0, help="Length of the launch window (hours). Default: 0 (launch at --launch_time)")
+    parser.add_argument('--objectives', type=str, default="distance,delay", help="Comma-separated objectives, from: %s" % ", ".join(sorted(OBJECTIVES.keys())))
+    parser.add_argument('--grid', type=int, default=5, help="Initial grid points per parameter. Default 5")
+    parser.add_argument('--budget', type=float, default=60.0, help="Time limit (seconds). Default 60")
+    parser.add_argument('-v', '--verbose', action="store_true", default=False, help="Verbose output.")
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s %(levelname)s:%(message)s', level=logging.DEBUG if args.verbose else logging.INFO)
+
+    def _polygon(value):
+        return [tuple(float(_v) for _v in _point.split(',')) for _point in value.split(';')]
+
+    _target_points = _polygon(args.target)
+    if len(_target_points) == 1:
+        _target = Target(lat=_target_points[0][0], lon=_target_points[0][1], radius=args.radius, avoid=[_polygon(_a) for _a in args.avoid])
+    else:
+        _target = Target(polygon=_target_points, avoid=[_polygon(_a) for _a in args.avoid])
+
+    _fixed = {'launch_lat': args.latitude, 'launch_lon': args.longitude, 'launch_alt': args.launchalt, 'descent_rate': args.descentrate}
+    _ranges = {}
+    for _name in ['ascent_rate', 'burst_alt']:
+        _values = getattr(args, _name).split(':')
+        if len(_values) == 2:
+            _ranges[_name] = (float(_values[0]), float(_values[1]))
+        else:
+            _fixed[_name] = float(_values[0])
+
+    _launch_time = parse_time(args.launch_time)
+    if args.window > 0:
+        _ranges['launch_time'] = (_launch_time, _launch_time + datetime.timedelta(seconds=args.window*3600))
+    else:
+        _fixed['launch_time'] = _launch_time
+
+    _solver = LaunchSolver(bin_path=args.pred, gfs_path=args.gfs, workers=args.workers)
+    try:
+        _result = _solver.solve(_target, _ranges, fixed=_fixed, objectives=args.objectives.split(','), grid=args.grid, budget=args.budget)
+    finally:
+        _solver.close()
+
+    logging.info("Evaluated %d options in %d rounds (%.1f s), %d cache hits." % (_result['evaluated'], _result['rounds'], _result['elapsed'], _solver.stats['cache_hits']))
+    for _option in _result['options']:
+        _scenario = dict(_option['scenario'])
+        _scenario['launch_time'] = _scenario['launch_time'].strftime("%Y-%m-%dT%H:%M:%SZ")
+        print(json.dumps({'scenario': _scenario, 'landing': _option['landing'], 'objectives': _option['objectives']}))
+
+
+if __name__ == "__main__":
+    main()
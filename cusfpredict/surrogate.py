@@ -0,0 +1,278 @@
+#!/usr/bin/env python
+#
+#   Project Horus
+#   CUSF Standalone Predictor Python Wrapper - Precomputed Landing Surrogates
+#   Copyright 2020 Mark Jessop <vk5qi@rfhead.net>
+#
+#   Answer "where does it land if we launch at HH:MM with X m/s?" questions for a launch site
+#   without running pred each time. After each dataset update, predictions are run over a grid of
+#   launch time x ascent rate x burst altitude x descent rate, and the landing positions are saved
+#   to a compact .npz file. Queries within the grid are then answered by multilinear interpolation
+#   between the 16 surrounding grid points, in microseconds.
+#
+#   Each answer comes with an error estimate (metres), based on how non-linear the landing position
+#   is along each axis of the grid around the query point. Queries outside of the grid (or next to
+#   grid points where pred failed) fall back to running pred, if a Predictor is provided.
+#
+#   Usage:
+#       from cusfpredict.surrogate import LandingSurrogate
+#       surrogate = LandingSurrogate.load('adelaide_surrogate.npz', predictor=Predictor(bin_path='./pred', gfs_path='./gfs'))
+#       result = surrogate.query(launch_time, ascent_rate=5.0, burst_alt=26000, descent_rate=6.0)
+#       print(result['landing'], result['error'], result['source'])
+#
+#   Or from the command line:
+#       python3 -m cusfpredict.surrogate adelaide_surrogate.npz --time 2020-06-01T11:15Z -a 5.0 -b 26000 -d 6.0
+#
+import argparse
+import bisect
+import calendar
+import datetime
+import json
+import logging
+import math
+import os
+import time
+import numpy as np
+
+from . import metrics
+from .export import METRES_PER_DEGREE
+
+# Axes of the surrogate grid, in order.
+AXES = ['launch_time', 'ascent_rate', 'burst_alt', 'descent_rate']
+
+
+def parse_axis(value):
+    ''' Parse an axis specification: a comma-separated list of values, or min:max:count '''
+    if ':' in value:
+        (_min, _max, _count) = value.split(':')
+        return np.linspace(float(_min), float(_max), int(_count)).tolist()
+    return sorted([float(_v) for _v in value.split(',')])
+
+
+def _curvature(values, axis_values, axis):
+    '''
+    Estimate the magnitude of the second derivative of a [..., 2] array of (x, y) positions along one axis,
+    at each grid point, allowing for non-uniform spacing. Grid points at the ends of the axis use the value of
+    their neighbour. Axes with fewer than 3 points give zero.
+    '''
+    _values = np.moveaxis(values, axis, 0)
+    _n = _values.shape[0]
+    _result = np.zeros(_values.shape[:-1])
+    if _n < 3:
+        return np.moveaxis(_result, 0, axis)
+
+    _h = np.diff(np.asarray(axis_values, dtype=float))
+    (_h1, _h2) = (_h[:-1], _h[1:])
+    _shape = (-1,) + (1,) * (_values.ndim - 1)
+    _second = 2.0 * (_values[:-2] / (_h1*(_h1 + _h2)).reshape(_shape)
+        - _values[1:-1] / (_h1*_h2).reshape(_shape)
+        + _values[2:] / (_h2*(_h1 + _h2)).reshape(_shape))
+
+    _result[1:-1] = np.hypot(_second[..., 0], _second[..., 1])
+    _result[0] = _result[1]
+    _result[-1] = _result[-2]
+    return np.moveaxis(_result, 0, axis)
+
+
+def _axis_cell(axis, value):
+    ''' Find the cell (start index, size, weights) containing a value on an ascending axis list, or None if outside it '''
+    if len(axis) == 1:
+        return (0, 1, np.ones(1), 0.0, 0.0) if value == axis[0] else None
+    if value < axis[0] or value > axis[-1]:
+        return None
+    _i = min(bisect.bisect_right(axis, value) - 1, len(axis) - 2)
+    _width = axis[_i+1] - axis[_i]
+    _lambda = (value - axis[_i]) / _width
+    return (_i, 2, np.array([1.0 - _lambda, _lambda]), _lambda, _width)
+
+
+class LandingSurrogate(object):
+    '''
+    Interpolated landing predictions for a launch site.
+
+    axes - Dictionary of ascending grid values for each of AXES (launch_time as POSIX timestamps).
+    landings - [time, ascent, burst, descent, 3] array of landing (latitude, longitude, flight duration),
+               with longitudes unwrapped to within 180 degrees of the launch site, and NaN where pred failed.
+    site - Dictionary of launch site information (name, latitude, longitude, altitude).
+    dataset - Name of the dataset the predictions were run against.
+    predictor - Optional Predictor, used for queries outside of the grid.
+    '''
+
+    def __init__(self, axes, landings, site, dataset=None, predictor=None):
+        self.axes = dict([(_name, [float(_v) for _v in axes[_name]]) for _name in AXES])
+        self.landings = np.asarray(landings, dtype=np.float32)
+        self.site = site
+        self.dataset = dataset
+        self.predictor = predictor
+
+        # Curvature of the landing position (m per unit^2) along each axis, used for error estimates.
+        _scale = np.array([METRES_PER_DEGREE, METRES_PER_DEGREE * math.cos(math.radians(site['latitude']))])
+        _positions = self.landings[..., :2].astype(float) * _scale
+        self.curvature = np.stack([_curvature(_positions, self.axes[_name], _i) for (_i, _name) in enumerate(AXES)]).astype(np.float32)
+
+
+    @property
+    def size(self):
+        return int(np.prod(self.landings.shape[:4]))
+
+
+    def save(self, filename):
+        ''' Save the surrogate to a .npz file, atomically. '''
+        _info = {'site': self.site, 'dataset': self.dataset, 'created': datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")}
+        _arrays = dict([(_name, np.array(self.axes[_name])) for _name in AXES])
+
+        # np.savez adds a .npz suffix to filenames without one, so write to a file object.
+        _temp_file = filename + ".tmp"
+        with open(_temp_file, 'wb') as f:
+            np.savez_compressed(f, landings=self.landings, info=np.array(json.dumps(_info)), **_arrays)
+        os.replace(_temp_file, filename)
+
+
+    @classmethod
+    def load(cls, filename, predictor=None):
+        ''' Load a surrogate saved with save() '''
+        with np.load(filename) as _data:
+            _info = json.loads(str(_data['info']))
+            return cls(dict([(_name, _data[_name]) for _name in AXES]), _data['landings'], _info['site'], dataset=_info['dataset'], predictor=predictor)
+
+
+    def predict(self, launch_time, ascent_rate, burst_alt, descent_rate):
+        ''' Run pred for a query, returning a result dictionary as per query(), or None if the prediction failed. '''
+        if self.predictor is None:
+            return None
+
+        _flight_path = self.predictor.predict(
+            launch_lat=self.site['latitude'],
+            launch_lon=self.site['longitude'],
+            launch_alt=self.site.get('altitude', 0.0),
+            ascent_rate=ascent_rate,
+            descent_rate=descent_rate,
+            burst_alt=burst_alt,
+            launch_time=datetime.datetime.utcfromtimestamp(launch_time))
+
+        if len(_flight_path) <= 1:
+            return None
+
+        return {'landing': _flight_path[-1][:3], 'error': 0.0, 'source': 'pred'}
+
+
+    def query(self, launch_time, ascent_rate, burst_alt, descent_rate):
+        '''
+        Predict the landing for a launch. launch_time is a datetime (UTC) or POSIX timestamp.
+        Returns a dictionary containing:
+            landing - [timestamp, lat, lon] of the landing
+            error - Estimated error (metres) of the landing position
+            source - 'surrogate' if interpolated, or 'pred' if pred was run
+        Raises ValueError if the query is outside of the grid, and no Predictor was provided.
+        '''
+        if isinstance(launch_time, datetime.datetime):
+            launch_time = calendar.timegm(launch_time.timetuple())
+
+        _values = (float(launch_time), float(ascent_rate), float(burst_alt), float(descent_rate))
+        _cells = [_axis_cell(self.axes[_name], _value) for (_name, _value) in zip(AXES, _values)]
+
+        if None not in _cells:
+            _index = tuple(slice(_c[0], _c[0] + _c[1]) for _c in _cells)
+            # Weight of each of the (up to) 16 surrounding grid points.
+            _weights = np.einsum('i,j,k,l->ijkl', *[_c[2] for _c in _cells])
+            _corners = self.landings[_index]
+
+            if not np.isnan(_corners).any():
+                (_lat, _lon, _duration) = _weights.reshape(-1).dot(_corners.reshape(-1, 3)).tolist()
+
+                # Linear interpolation error along each axis is about lambda*(1-lambda)/2 * width^2 * f''.
+                _curvature = self.curvature[(slice(None),) + _index].reshape(4, -1).max(axis=1)
+                _error = sum([0.5 * _c[3] * (1.0 - _c[3]) * _c[4]**2 * float(_k) for (_c, _k) in zip(_cells, _curvature)])
+
+                return {
+                    'landing': [launch_time + _duration, _lat, (_lon + 180.0) % 360.0 - 180.0],
+                    'error': _error,
+                    'source': 'surrogate'
+                }
+
+        _result = self.predict(*_values)
+        if _result is None:
+            raise ValueError("Launch parameters are outside of the surrogate grid, or no prediction is available.")
+        return _result
+
+
+def build_surrogate(pool, site, axes, dataset=None):
+    '''
+    Run predictions over a grid of launch parameters for a site, using a PredictorPool.
+    site - Dictionary with latitude, longitude and altitude of the launch site (and a name).
+    axes - Dictionary of values for each of AXES. launch_time values may be datetimes or POSIX timestamps.
+    Returns a LandingSurrogate.
+    '''
+    _axes = dict(axes)
+    _axes['launch_time'] = sorted([calendar.timegm(_t.timetuple()) if isinstance(_t, datetime.datetime) else float(_t) for _t in axes['launch_time']])
+    for _name in AXES[1:]:
+        _axes[_name] = sorted([float(_v) for _v in axes[_name]])
+
+    _shape = tuple(len(_axes[_name]) for _name in AXES)
+    _landings = np.full(_shape + (3,), np.nan, dtype=np.float32)
+
+    # Predictor.predict arguments for each grid point, keyed by the identity of the scenario dictionary.
+    _scenarios = {}
+    for _index in np.ndindex(*_shape):
+        _scenario = {
+            'launch_lat': site['latitude'],
+            'launch_lon': site['longitude'],
+            'launch_alt': site.get('altitude', 0.0),
+            'launch_time': datetime.datetime.utcfromtimestamp(_axes['launch_time'][_index[0]]),
+            'ascent_rate': _axes['ascent_rate'][_index[1]],
+            'burst_alt': _axes['burst_alt'][_index[2]],
+            'descent_rate': _axes['descent_rate'][_index[3]],
+        }
+        _scenarios[id(_scenario)] = (_index, _scenario)
+
+    _start = time.time()
+    for (_scenario, _flight_path) in pool.predict_many([_s for (_i, _s) in _scenarios.values()]):
+        if len(_flight_path) <= 1:
+            continue
+        _landing = _flight_path[-1]
+        _landings[_scenarios[id(_scenario)][0]] = (
+            _landing[1],
+            site['longitude'] + (_landing[2] - site['longitude'] + 180.0) % 360.0 - 180.0,
+            _landing[0] - _flight_path[0][0])
+
+    metrics.observe('stage_duration_seconds', time.time() - _start, stage='surrogate_build')
+
+    _failed = int(np.isnan(_landings[..., 0]).sum())
+    if _failed > 0:
+        logging.warning("Surrogate for %s: %d of %d predictions failed." % (site.get('name', 'site'), _failed, len(_scenarios)))
+
+    return LandingSurrogate(_axes, _landings, site, dataset=dataset)
+
+
+def main():
+    from dateutil.parser import parse
+    from .predict import Predictor
+
+    parser = argparse.ArgumentParser(description="Query a precomputed landing surrogate.")
+    parser.add_argument('surrogate', type=str, help="Surrogate file (.npz), as written by the daemon.")
+    parser.add_argument('--time', type=str, required=True, help="Launch time (UTC).")
+    parser.add_argument('-a', '--ascentrate', type=float, default=5.0, help="Ascent Rate (m/s). Default 5m/s")
+    parser.add_argument('-b', '--burstalt', type=float, default=26000.0, help="Burst Altitude (m). Default 26000m")
+    parser.add_argument('-d', '--descentrate', type=float, default=6.0, help="Descent Rate (m/s). Default 6m/s")
+    parser.add_argument('--pred', type=str, default=None, help="Location of the pred binary, to use for queries outside of the grid.")
+    parser.add_argument('--gfs', type=str, default="./gfs", help="Location of the GFS data store. (Default: ./gfs/)")
+    args = parser.parse_args()
+
+    _predictor = Predictor(bin_path=args.pred, gfs_path=args.gfs) if args.pred else None
+    _surrogate = LandingSurrogate.load(args.surrogate, predictor=_predictor)
+
+    _launch_time = parse(args.time)
+    if _launch_time.tzinfo is not None:
+        _launch_time = _launch_time.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+
+    _start = time.perf_counter()
+    _result = _surrogate.query(_launch_time, args.ascentrate, args.burstalt, args.descentrate)
+    _duration = time.perf_counter() - _start
+
+    print("%s (dataset %s) - Landing: %.4f, %.4f at %s (+/- %.0f m, %s, %.3f ms)" % (
+        _surrogate.site.get('name', ''), _surrogate.dataset, _result['landing'][1], _result['landing'][2],
+        datetime.datetime.utcfromtimestamp(_result['landing'][0]).isoformat(), _result['error'], _result['source'], _duration*1e3))
+
+
+if __name__ == "__main__":
+    main()
@@ -4,16 +4,25 @@
 #   CUSF Standalone Predictor Python Wrapper - Utilities
 #   Copyright 2017 Mark Jessop <vk5qi@rfhead.net>
 #
-import fastkml
-import glob
 import datetime
+import json
 import os.path
-from shapely.geometry import Point, LineString
+from xml.sax.saxutils import escape
+from dateutil.parser import parse
+
+from .files import cusf_files
+
+# fastkml and shapely are only required for the object-based KML functions below, and are
+# imported by _check_fastkml() on first use, as they are slow to import.
+# The streaming writers (KMLWriter, GeoJSONWriter) have no external dependencies.
+fastkml = None
+Point = None
+LineString = None
 
 def available_gfs(gfs_path='./gfs'):
     """ Determine the time extent of the GFS dataset """
 
-    gfs_files = glob.glob(os.path.join(gfs_path,"gfs_*.dat"))
+    gfs_files = cusf_files(gfs_path)
 
     if len(gfs_files) == 0:
         return (None, None)
@@ -23,7 +32,7 @@ def available_gfs(gfs_path='./gfs'):
 
     for _filename in gfs_files:
         try:
-            _ts = int(_filename.split('_')[1])
+            _ts = int(os.path.basename(_filename).split('_')[1])
             _timestamps.append(_ts)
         except:
             pass
@@ -51,14 +60,71 @@ def gfs_model_age(gfs_path="./gfs"):
         return "Unknown"
 
 
+def parse_time(value):
+    ''' Parse a time string (or POSIX timestamp, or datetime) to a naive UTC datetime. '''
+    if value is None:
+        return datetime.datetime.utcnow().replace(microsecond=0)
+
+    if isinstance(value, datetime.datetime):
+        _time = value
+    elif isinstance(value, (int, float)):
+        return datetime.datetime.utcfromtimestamp(value)
+    else:
+        _time = parse(value)
+
+    if _time.tzinfo is not None:
+        _time = _time.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return _time
+
+
+def scenario_key(scenario):
+    '''
+    A key identifying identical predictions, used to coalesce concurrent requests.
+    Values are rounded to the precision they are passed to pred with.
+    '''
+    return (
+        round(scenario['launch_lat'], 5),
+        round(scenario['launch_lon'], 5),
+        int(scenario['launch_alt']),
+        round(scenario['ascent_rate'], 1),
+        round(scenario['descent_rate'], 1),
+        int(scenario['launch_alt']) if scenario['descent_mode'] else int(scenario['burst_alt']),
+        scenario['launch_time'].replace(microsecond=0),
+        scenario['descent_mode'])
+
+
 
 
 # Geometry and KML related stuff
 ns = '{http://www.opengis.net/kml/2.2}'
 
+def _check_fastkml():
+    global fastkml, Point, LineString
+    if fastkml is not None:
+        return
+
+    try:
+        import fastkml as _fastkml
+        from shapely.geometry import Point, LineString
+    except ImportError:
+        raise ImportError("fastkml (1.x) and shapely are required for this function. Use KMLWriter instead, or install them.")
+    if not hasattr(_fastkml, 'create_kml_geometry'):
+        raise ImportError("fastkml 1.x is required for this function (found %s). Use KMLWriter instead, or upgrade it." % getattr(_fastkml, '__version__', 'unknown'))
+    fastkml = _fastkml
+
+
+def _kml_geometry(geometry, altitude_mode, **kwargs):
+    # fastkml takes pygeoif geometries, which can be made from shapely's via the geo interface.
+    import pygeoif
+
+    return fastkml.create_kml_geometry(pygeoif.shape(geometry), ns=ns,
+        altitude_mode=fastkml.enums.AltitudeMode(altitude_mode), **kwargs)
+
 def flight_path_to_linestring(flight_path):
     ''' Convert a predicted flight path to a LineString geometry object '''
 
+    _check_fastkml()
+
     track_points = []
     for _point in flight_path:
         # Flight path array is in lat,lon,alt order, needs to be in lon,lat,alt
@@ -85,6 +151,7 @@ def flight_path_to_geometry(flight_path,
     track_width=3.0,
     altitude_mode = 'absolute'):
     ''' Produce a fastkml geometry object from a flight path array '''
+    _check_fastkml()
 
     flight_track_line_style = fastkml.styles.LineStyle(
         ns=ns,
@@ -99,18 +166,12 @@ def flight_path_to_geometry(flight_path,
         ns=ns,
         styles=[flight_track_line_style, flight_extrusion_style])
 
-    flight_line = fastkml.kml.Placemark(
+    flight_line = fastkml.Placemark(
         ns=ns,
         id=name,
         name=comment,
-        styles=[flight_track_style])
-
-    flight_line.geometry = fastkml.geometry.Geometry(
-        ns=ns,
-        geometry=flight_path_to_linestring(flight_path),
-        altitude_mode=altitude_mode,
-        extrude=True,
-        tessellate=True)
+        styles=[flight_track_style],
+        kml_geometry=_kml_geometry(flight_path_to_linestring(flight_path), altitude_mode, extrude=True, tessellate=True))
 
     return flight_line
 
@@ -119,6 +180,7 @@ def flight_path_landing_placemark(flight_path,
     name="Flight Path",
     comment="Landing"):
     """ Produce a placemark of the landing position of a flight """
+    _check_fastkml()
 
     flight_icon_style = fastkml.styles.IconStyle(
         ns=ns, 
@@ -129,26 +191,37 @@ def flight_path_landing_placemark(flight_path,
         ns=ns,
         styles=[flight_icon_style])
 
-    flight_placemark = fastkml.kml.Placemark(
+    flight_placemark = fastkml.Placemark(
         ns=ns, 
         id=name,
         name=comment,
         description="",
-        styles=[flight_style])
-
-    flight_placemark.geometry = fastkml.geometry.Geometry(
-        ns=ns,
-        geometry=Point(flight_path[-1][2], flight_path[-1][1], flight_path[-1][3]),
-        altitude_mode='clampToGround')
+        styles=[flight_style],
+        kml_geometry=_kml_geometry(Point(flight_path[-1][2], flight_path[-1][1], flight_path[-1][3]), 'clampToGround'))
 
     return flight_placemark
 
 
+def flight_path_burst_index(flight_path):
+    """ Find the index of the burst (maximum altitude) point of a flight path """
+
+    # Read through array and hunt for max altitude point.
+    current_alt = 0.0
+    current_index = 0
+    for i in range(len(flight_path)):
+        if flight_path[i][3] > current_alt:
+            current_alt = flight_path[i][3]
+            current_index = i
+
+    return current_index
+
+
 def flight_path_burst_placemark(flight_path,
     name="Flight Path",
     comment="Burst",
     altitude_mode = 'absolute'):
     """ Produce a placemark of the burst position of a flight """
+    _check_fastkml()
 
     flight_icon_style = fastkml.styles.IconStyle(
         ns=ns, 
@@ -159,26 +232,15 @@ def flight_path_burst_placemark(flight_path,
         ns=ns,
         styles=[flight_icon_style])
 
-    flight_placemark = fastkml.kml.Placemark(
+    current_index = flight_path_burst_index(flight_path)
+
+    flight_placemark = fastkml.Placemark(
         ns=ns, 
         id=name,
         name=comment,
         description="",
-        styles=[flight_style])
-
-    # Read through array and hunt for max altitude point.
-    current_alt = 0.0
-    current_index = 0
-    for i in range(len(flight_path)):
-        if flight_path[i][3] > current_alt:
-            current_alt = flight_path[i][3]
-            current_index = i
-
-
-    flight_placemark.geometry = fastkml.geometry.Geometry(
-        ns=ns,
-        geometry=Point(flight_path[current_index][2], flight_path[current_index][1], flight_path[current_index][3]),
-        altitude_mode=altitude_mode)
+        styles=[flight_style],
+        kml_geometry=_kml_geometry(Point(flight_path[current_index][2], flight_path[current_index][1], flight_path[current_index][3]), altitude_mode))
 
     return flight_placemark
 
@@ -188,9 +250,9 @@ def write_flight_path_kml(flight_data,
                         comment="HAB Prediction",
                         kml_hack=True):
     """ Write out flight path geometry objects to a kml file. """
+    _check_fastkml()
 
-    kml_root = fastkml.kml.KML()
-    kml_doc = fastkml.kml.Document(
+    kml_doc = fastkml.Document(
         ns=ns,
         name=comment)
 
@@ -206,3 +268,182 @@ def write_flight_path_kml(flight_data,
             kml_str = kml_str.replace('kml:','').replace(':kml','')
         kml_file.write(kml_str)
         kml_file.close()
+
+
+# Streaming writers
+# These write predictions out to a file as they are produced, rather than building a
+# full document in memory first. Styles are defined once at the top of the document, and
+# referenced by each placemark.
+
+KML_ICON_LANDING = "http://maps.google.com/mapfiles/kml/shapes/cross-hairs.png"
+KML_ICON_BURST = "http://maps.google.com/mapfiles/kml/shapes/star.png"
+
+
+def _kml_coordinate(point):
+    # Flight path array is in lat,lon,alt order, needs to be in lon,lat,alt
+    return "%.5f,%.5f,%.1f" % (point[2], point[1], point[3])
+
+
+class KMLWriter(object):
+    """
+    Write flight paths out to a KML file incrementally.
+
+    Usage:
+        with KMLWriter("prediction.kml", name="HAB Prediction") as kml:
+            for flight_path in predictions:
+                kml.add_flight_path(flight_path, comment="...")
+
+    output can either be a filename, or an open (text-mode) file object.
+    """
+
+    def __init__(self,
+        output,
+        name="HAB Prediction",
+        track_color="ffff8000",
+        poly_color="20000000",
+        track_width=3.0):
+
+        if hasattr(output, 'write'):
+            self.file = output
+            self._close_file = False
+        else:
+            self.file = open(output, 'w')
+            self._close_file = True
+
+        self.count = 0
+        self.closed = False
+
+        self.file.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        self.file.write('<kml xmlns="http://www.opengis.net/kml/2.2">\n<Document>\n')
+        self.file.write('<name>%s</name>\n' % escape(name))
+
+        # Shared styles
+        self.file.write('<Style id="flightTrack"><LineStyle><color>%s</color><width>%.1f</width></LineStyle>'
+            '<PolyStyle><color>%s</color></PolyStyle></Style>\n' % (track_color, track_width, poly_color))
+        self.file.write('<Style id="landing"><IconStyle><scale>2.0</scale><Icon><href>%s</href></Icon></IconStyle></Style>\n' % KML_ICON_LANDING)
+        self.file.write('<Style id="burst"><IconStyle><scale>2.0</scale><Icon><href>%s</href></Icon></IconStyle></Style>\n' % KML_ICON_BURST)
+
+
+    def add_track(self, flight_path, comment="Predicted Flight Path Data", altitude_mode='absolute'):
+        """ Write a flight path out as an extruded LineString """
+        self.file.write('<Placemark><name>%s</name><styleUrl>#flightTrack</styleUrl>'
+            '<LineString><extrude>1</extrude><tessellate>1</tessellate><altitudeMode>%s</altitudeMode><coordinates>' % (
+            escape(comment), altitude_mode))
+        self.file.write(" ".join([_kml_coordinate(_point) for _point in flight_path]))
+        self.file.write('</coordinates></LineString></Placemark>\n')
+
+
+    def add_point(self, point, comment, style, altitude_mode='absolute'):
+        """ Write a single [timestamp, lat, lon, alt] point out as a placemark, using one of the shared styles """
+        self.file.write('<Placemark><name>%s</name><description></description><styleUrl>#%s</styleUrl>'
+            '<Point><altitudeMode>%s</altitudeMode><coordinates>%s</coordinates></Point></Placemark>\n' % (
+            escape(comment), style, altitude_mode, _kml_coordinate(point)))
+
+
+    def add_flight_path(self, flight_path, comment="Predicted Flight Path Data", altitude_mode='absolute', burst=False, landing=True, burst_comment=None):
+        """ Write out a flight path track, along with landing and (optionally) burst placemarks """
+        self.add_track(flight_path, comment=comment, altitude_mode=altitude_mode)
+
+        if burst:
+            _burst = flight_path[flight_path_burst_index(flight_path)]
+            self.add_point(_burst, burst_comment if burst_comment else comment, 'burst', altitude_mode=altitude_mode)
+
+        if landing:
+            self.add_point(flight_path[-1], comment, 'landing', altitude_mode='clampToGround')
+
+        self.count += 1
+
+
+    def close(self):
+        if self.closed:
+            return
+
+        self.file.write('</Document>\n</kml>\n')
+        if self._close_file:
+            self.file.close()
+        self.closed = True
+
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class GeoJSONWriter(object):
+    """
+    Write flight paths out to a GeoJSON FeatureCollection incrementally.
+    Each flight path is written as a LineString feature, with the launch, burst and landing
+    details in its properties, suitable for loading with Leaflet's L.geoJSON.
+
+    output can either be a filename, or an open (text-mode) file object.
+    """
+
+    def __init__(self, output, name=None):
+
+        if hasattr(output, 'write'):
+            self.file = output
+            self._close_file = False
+        else:
+            self.file = open(output, 'w')
+            self._close_file = True
+
+        self.count = 0
+        self.closed = False
+
+        self.file.write('{"type": "FeatureCollection", ')
+        if name is not None:
+            self.file.write('"name": %s, ' % json.dumps(name))
+        self.file.write('"features": [\n')
+
+
+    def add_feature(self, feature):
+        """ Write out a pre-built GeoJSON feature dictionary """
+        if self.count > 0:
+            self.file.write(',\n')
+        self.file.write(json.dumps(feature, separators=(',', ':')))
+        self.count += 1
+
+
+    def add_flight_path(self, flight_path, comment="Predicted Flight Path Data", properties=None):
+        """ Write out a flight path as a LineString feature """
+        _burst = flight_path[flight_path_burst_index(flight_path)]
+
+        _properties = {
+            'name': comment,
+            'launch_time': flight_path[0][0],
+            'burst': [_burst[1], _burst[2], _burst[3]],
+            'burst_time': _burst[0],
+            'landing': [flight_path[-1][1], flight_path[-1][2], flight_path[-1][3]],
+            'landing_time': flight_path[-1][0]
+        }
+        if properties:
+            _properties.update(properties)
+
+        self.add_feature({
+            'type': 'Feature',
+            'properties': _properties,
+            'geometry': {
+                'type': 'LineString',
+                # GeoJSON coordinates are in lon,lat,alt order.
+                'coordinates': [[_point[2], _point[1], _point[3]] for _point in flight_path]
+            }
+        })
+
+
+    def close(self):
+        if self.closed:
+            return
+
+        self.file.write('\n]}\n')
+        if self._close_file:
+            self.file.close()
+        self.closed = True
+
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
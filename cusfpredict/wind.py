@@ -0,0 +1,303 @@
+#!/usr/bin/env python
+#
+#   Project Horus
+#   CUSF Standalone Predictor Python Wrapper - Wind Dataset Access
+#   Copyright 2020 Mark Jessop <vk5qi@rfhead.net>
+#
+#   Look up wind values from a directory of CUSF-format GFS files, using the same
+#   interpolation scheme as the predictor binary (bilinear in latitude/longitude,
+#   linear in geopotential height, then linear in time between the two nearest files).
+#   Parsed files are held in a small cache, so repeated queries are cheap.
+#
+import bisect
+import logging
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+
+from .files import cusf_files, CUSF_COMPRESSION_EXTENSIONS
+from .reader import read_cusf_wind
+
+
+def parse_cusf_filename(filename):
+    ''' Extract (timestamp, lat, lon, latrad, lonrad) from a CUSF GFS filename, i.e. gfs_1506052799_-33.0_139.0_10.0_10.0.dat(.gz) '''
+    _name = os.path.basename(filename)
+    for _ext in CUSF_COMPRESSION_EXTENSIONS:
+        if _name.endswith(_ext):
+            _name = _name[:-len(_ext)]
+    _fields = _name[:-4].split('_')
+    return (int(_fields[1]), float(_fields[2]), float(_fields[3]), float(_fields[4]), float(_fields[5]))
+
+
+def _axis_position(axis, value):
+    ''' Find the bracketing indices, and the normalised position between them, of a value on an ascending axis (a list) '''
+    _right = bisect.bisect_left(axis, value)
+    if _right == 0:
+        return (0, 0, 0.5)
+    if _right == len(axis):
+        return (len(axis)-1, len(axis)-1, 0.5)
+    _left = _right - 1
+    return (_left, _right, (value - axis[_left]) / (axis[_right] - axis[_left]))
+
+
+class WindTile(object):
+    ''' A single CUSF GFS file, with latitudes re-ordered to be ascending. '''
+
+    def __init__(self, filename):
+        _data = read_cusf_wind(filename)
+
+        _lats = _data['latitudes']
+        _values = _data['data']
+
+        if len(_lats) > 1 and _lats[0] > _lats[-1]:
+            _lats = _lats[::-1]
+            _values = _values[:, ::-1, :, :]
+
+        # Separate, contiguous [pressure, latitude, longitude] arrays.
+        self._setup(filename, _data['posix_timestamp'], _data['pressures'], _lats, _data['longitudes'],
+            np.ascontiguousarray(_values[..., 0]),
+            np.ascontiguousarray(_values[..., 1]),
+            np.ascontiguousarray(_values[..., 2]))
+
+
+    @classmethod
+    def from_arrays(cls, filename, timestamp, pressures, lats, lons, hgt, u, v, monotonic=None):
+        '''
+        Create a tile from already-decoded [pressure, latitude, longitude] arrays, with latitudes ascending.
+        The arrays are used as-is (not copied), so may be read-only views.
+        '''
+        _tile = cls.__new__(cls)
+        _tile._setup(filename, timestamp, pressures, lats, lons, hgt, u, v, monotonic)
+        return _tile
+
+
+    def _setup(self, filename, timestamp, pressures, lats, lons, hgt, u, v, monotonic=None):
+        self.filename = filename
+        self.timestamp = timestamp
+        self.pressures = pressures
+        self.lats = lats
+        self.lons = lons
+        self.hgt = hgt
+        self.u = u
+        self.v = v
+
+        # Axes as lists, which are faster to search for single values.
+        self._lat_list = self.lats.tolist()
+        self._lon_list = self.lons.tolist()
+
+        # If heights increase with each pressure level everywhere (which they should), the
+        # pressure levels either side of an altitude can be found with a binary search.
+        if monotonic is None:
+            monotonic = bool(np.all(np.diff(self.hgt, axis=0) > 0))
+        self.monotonic = monotonic
+
+        # Cache of [height/u/v, pressure, corner] data for recently used grid cells.
+        self._cells = {}
+
+
+    def canonical_longitude(self, lon):
+        ''' Shift a longitude by multiples of 360 degrees into the range of this tile, if possible '''
+        while lon < self.lons[0]:
+            lon += 360.0
+        while lon - 360.0 >= self.lons[0]:
+            lon -= 360.0
+        return lon
+
+
+    def covers(self, lat, lon):
+        ''' Check if a location is within this tile '''
+        lon = self.canonical_longitude(lon)
+        return (self.lats[0] <= lat <= self.lats[-1]) and (self.lons[0] <= lon <= self.lons[-1])
+
+
+    def _cell(self, lat_idx, lon_idx):
+        ''' Get the height/u/v columns at the 4 corners of a grid cell, as a [3, pressure, 4] array '''
+        _key = (lat_idx[0], lat_idx[2], lon_idx[0], lon_idx[1])
+        _cell = self._cells.get(_key)
+        if _cell is None:
+            _cell = np.stack([self.hgt[:, lat_idx, lon_idx], self.u[:, lat_idx, lon_idx], self.v[:, lat_idx, lon_idx]]).astype(float)
+            if len(self._cells) > 4096:
+                self._cells.clear()
+            self._cells[_key] = _cell
+        return _cell
+
+
+    def get_wind(self, lat, lon, alt):
+        ''' Interpolate the wind at a location and altitude (m). Returns (u, v) in m/s. '''
+        lon = self.canonical_longitude(lon)
+
+        if not self.covers(lat, lon):
+            raise ValueError("Location (%.4f, %.4f) is not covered by %s" % (lat, lon, self.filename))
+
+        (_lat0, _lat1, _lat_lambda) = _axis_position(self._lat_list, lat)
+        (_lon0, _lon1, _lon_lambda) = _axis_position(self._lon_list, lon)
+
+        # Bilinear interpolation weights for the 4 corners of our cell.
+        _w = np.array([
+            (1.0 - _lat_lambda) * (1.0 - _lon_lambda),
+            (1.0 - _lat_lambda) * _lon_lambda,
+            _lat_lambda * (1.0 - _lon_lambda),
+            _lat_lambda * _lon_lambda])
+
+        # Interpolated height, u and v of every pressure level at this location.
+        (_heights, _u, _v) = self._cell((_lat0, _lat0, _lat1, _lat1), (_lon0, _lon1, _lon0, _lon1)).dot(_w)
+
+        # Find the pressure levels either side of our altitude.
+        # Above or below our data, we just use the nearest level.
+        if self.monotonic:
+            _right = int(np.searchsorted(_heights, alt))
+            if _right == 0:
+                (_left, _right) = (0, 0)
+            elif _right == len(_heights):
+                (_left, _right) = (_right - 1, _right - 1)
+            elif _heights[_right] == alt:
+                _left = _right
+            else:
+                _left = _right - 1
+        else:
+            _below = _heights <= alt
+            _above = _heights >= alt
+            _left = int(np.argmax(np.where(_below, _heights, -np.inf))) if _below.any() else None
+            _right = int(np.argmin(np.where(_above, _heights, np.inf))) if _above.any() else None
+            if _left is None:
+                _left = _right
+            if _right is None:
+                _right = _left
+
+        if _left != _right:
+            _pr_lambda = min(1.0, max(0.0, (alt - _heights[_left]) / (_heights[_right] - _heights[_left])))
+        else:
+            _pr_lambda = 0.5
+
+        return (float((1.0 - _pr_lambda) * _u[_left] + _pr_lambda * _u[_right]),
+            float((1.0 - _pr_lambda) * _v[_left] + _pr_lambda * _v[_right]))
+
+
+class WindDataset(object):
+    '''
+    Wind lookups against a GFS data directory, as written by cusfpredict.gfs.
+    Up to max_tiles parsed files are kept in memory. If the dataset is re-published
+    (i.e. the daemon swaps the directory symlink), the file list and cache are refreshed.
+    '''
+
+    def __init__(self, gfs_path="./gfs", max_tiles=12):
+        self.gfs_path = gfs_path
+        self.max_tiles = max_tiles
+
+        self.lock = threading.Lock()
+        self.tiles = OrderedDict()
+        self.files = []
+        self._dataset_id = None
+
+        self.refresh()
+
+
+    def refresh(self, force=False):
+        ''' Re-scan the data directory if the published dataset has changed. '''
+        _real_path = os.path.realpath(self.gfs_path)
+        try:
+            _mtime = os.stat(_real_path).st_mtime
+        except OSError:
+            _mtime = None
+
+        _dataset_id = (_real_path, _mtime)
+        if (_dataset_id == self._dataset_id) and not force:
+            return False
+
+        _files = []
+        for _filename in cusf_files(_real_path):
+            try:
+                _files.append(parse_cusf_filename(_filename) + (_filename,))
+            except (ValueError, IndexError):
+                logging.debug("Ignoring file with unexpected name: %s" % _filename)
+
+        with self.lock:
+            self.files = sorted(_files)
+            self.tiles.clear()
+            self._dataset_id = _dataset_id
+
+        return True
+
+
+    @property
+    def time_range(self):
+        ''' (earliest, latest) timestamp covered by the dataset, or (None, None) if empty '''
+        if len(self.files) == 0:
+            return (None, None)
+        return (self.files[0][0], self.files[-1][0])
+
+
+    def tile(self, filename):
+        ''' Get a parsed tile, loading it if it is not already cached. '''
+        with self.lock:
+            if filename in self.tiles:
+                self.tiles.move_to_end(filename)
+                return self.tiles[filename]
+
+        # Parse outside of the lock, so lookups against other tiles are not held up.
+        _tile = WindTile(filename)
+
+        with self.lock:
+            self.tiles[filename] = _tile
+            while len(self.tiles) > self.max_tiles:
+                self.tiles.popitem(last=False)
+
+        return _tile
+
+
+    def find_tiles(self, lat, lon, timestamp):
+        ''' Find the files either side of a timestamp which cover a location. Returns (earlier, later) filenames. '''
+        _earlier = None
+        _later = None
+        for (_ts, _lat, _lon, _latrad, _lonrad, _filename) in self.files:
+            _dlon = (lon - _lon + 180.0) % 360.0 - 180.0
+            if abs(lat - _lat) > _latrad or abs(_dlon) > _lonrad:
+                continue
+            if _ts <= timestamp:
+                _earlier = (_ts, _filename)
+            elif _later is None:
+                _later = (_ts, _filename)
+
+        if _earlier is not None and _later is None and _earlier[0] == timestamp:
+            _later = _earlier
+
+        if _earlier is None or _later is None:
+            raise ValueError("Do not have wind data for (%.4f, %.4f) at %d" % (lat, lon, timestamp))
+
+        return (_earlier, _later)
+
+
+    def preload(self, start, end, lat, lon):
+        ''' Load all tiles needed for lookups at a location between two timestamps, so subsequent lookups are fast. '''
+        _covering = []
+        for (_ts, _lat, _lon, _latrad, _lonrad, _filename) in self.files:
+            _dlon = (lon - _lon + 180.0) % 360.0 - 180.0
+            if abs(lat - _lat) <= _latrad and abs(_dlon) <= _lonrad:
+                _covering.append((_ts, _filename))
+
+        # Include the files either side of the time range.
+        _first = max([_ts for (_ts, _f) in _covering if _ts <= start] or [start])
+        _last = min([_ts for (_ts, _f) in _covering if _ts >= end] or [end])
+
+        _loaded = []
+        for (_ts, _filename) in _covering:
+            if _first <= _ts <= _last:
+                self.tile(_filename)
+                _loaded.append(_filename)
+
+        return _loaded
+
+
+    def get_wind(self, lat, lon, alt, timestamp):
+        ''' Interpolate the wind at a location, altitude (m) and time (POSIX timestamp). Returns (u, v) in m/s. '''
+        ((_ts0, _file0), (_ts1, _file1)) = self.find_tiles(lat, lon, timestamp)
+
+        (_u0, _v0) = self.tile(_file0).get_wind(lat, lon, alt)
+        if _file1 == _file0:
+            return (_u0, _v0)
+
+        (_u1, _v1) = self.tile(_file1).get_wind(lat, lon, alt)
+        _lambda = (timestamp - _ts0) / float(_ts1 - _ts0)
+
+        return ((1.0 - _lambda) * _u0 + _lambda * _u1, (1.0 - _lambda) * _v0 + _lambda * _v1)
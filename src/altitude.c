@@ -14,6 +14,7 @@
 #include <stdio.h>
 #include <stdlib.h>
 #include <math.h>
+#include <pthread.h>
 
 #include "pred.h"
 #include "altitude.h"
@@ -105,6 +106,25 @@ altitude_model_get_altitude(altitude_model_t* self, int time_into_flight, float*
     
 }
 
+static float density_table[ALTITUDE_TABLE_SIZE];
+static pthread_once_t density_table_once = PTHREAD_ONCE_INIT;
+
+static void
+_build_density_table(void)
+{
+    int i;
+
+    for (i = 0; i < ALTITUDE_TABLE_SIZE; i++)
+        density_table[i] = 1.0 / sqrt(get_density(i * ALTITUDE_TABLE_STEP));
+}
+
+const float*
+altitude_model_density_table(void)
+{
+    pthread_once(&density_table_once, _build_density_table);
+    return density_table;
+}
+
 float get_density(float altitude) {
     
     float temp = 0.f, pressure = 0.f;
@@ -38,6 +38,14 @@ int                  altitude_model_get_altitude
                                             float              *alt);
 
 
+// table of 1/sqrt(air density) at altitudes of 0, ALTITUDE_TABLE_STEP, 2*ALTITUDE_TABLE_STEP,
+// ... metres, for models which step many flights at once (see run_batch.h). The terminal
+// velocity at an altitude is the drag coefficient times this. The table is built on first use.
+const float         *altitude_model_density_table
+                                           (void);
+
+#define ALTITUDE_TABLE_STEP 10
+#define ALTITUDE_TABLE_SIZE 6001    // up to 60km
 
 // it seems like overkill to do it this way but it is in preparation for being able to load in
 // arbitrary altitude/time profiles from a file
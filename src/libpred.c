@@ -0,0 +1,208 @@
+// --------------------------------------------------------------
+// CU Spaceflight Landing Prediction
+// Copyright (c) CU Spaceflight 2009, All Right Reserved
+//
+// THIS CODE AND INFORMATION ARE PROVIDED "AS IS" WITHOUT WARRANTY OF ANY 
+// KIND, EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+// IMPLIED WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A
+// PARTICULAR PURPOSE.
+// --------------------------------------------------------------
+
+#include <stdio.h>
+#include <stdlib.h>
+
+#include "wind/wind_file_cache.h"
+
+#include "libpred.h"
+#include "run_model.h"
+#include "run_batch.h"
+#include "pred.h"
+#include "altitude.h"
+#include "stats.h"
+#include "util/random.h"
+
+// Used by the engine for diagnostic output. pred.c provides this for the pred binary.
+int verbosity = 0;
+
+struct pred_dataset_s
+{
+    wind_file_cache_t  *cache;
+};
+
+// Destination of the flight path entries for the prediction running on this thread.
+typedef struct pred_output_s pred_output_t;
+struct pred_output_s
+{
+    double             *buffer;
+    int                 max_points;
+    int                 n_points;
+};
+
+static __thread pred_output_t *current_output = NULL;
+
+// The engine (run_model) writes each flight path entry out through this function.
+// For the pred binary this is implemented in pred.c, writing CSV/KML; here the
+// entries are stored in the caller's buffer instead.
+void write_position(float lat, float lng, float alt, int timestamp) {
+    pred_output_t *output = current_output;
+
+    // the predictor uses 0<=lng<360; most other things expect -180<lng<=180
+    if (lng > 180)
+        lng -= 360;
+
+    if (output->n_points < output->max_points) {
+        double *row = output->buffer + 4 * output->n_points;
+        row[0] = timestamp;
+        row[1] = lat;
+        row[2] = lng;
+        row[3] = alt;
+    }
+
+    output->n_points++;
+    if(stats_enabled)
+        pred_stats.output_records++;
+}
+
+pred_dataset_t *pred_dataset_open(const char *directory) {
+    pred_dataset_t *dataset;
+
+    if (!directory)
+        return NULL;
+
+    dataset = (pred_dataset_t*) malloc(sizeof(pred_dataset_t));
+    if (!dataset)
+        return NULL;
+
+    dataset->cache = wind_file_cache_new(directory);
+    if (!dataset->cache) {
+        free(dataset);
+        return NULL;
+    }
+
+    return dataset;
+}
+
+void pred_dataset_free(pred_dataset_t *dataset) {
+    if (!dataset)
+        return;
+
+    wind_file_cache_free(dataset->cache);
+    free(dataset);
+}
+
+unsigned int pred_dataset_files(pred_dataset_t *dataset) {
+    if (!dataset)
+        return 0;
+
+    return wind_file_cache_n_entries(dataset->cache);
+}
+
+int pred_run(pred_dataset_t *dataset,
+             double launch_lat, double launch_lon, double launch_alt, long int launch_time,
+             double ascent_rate, double descent_rate, double burst_alt,
+             int descent_mode, double wind_error,
+             double *output, int max_points, int *status) {
+    altitude_model_t *alt_model;
+    pred_output_t run_output;
+    float drag_coeff;
+    int rv;
+
+    if (!dataset || !output || !status || max_points < 0) {
+        if (status)
+            *status = PRED_ERROR;
+        return 0;
+    }
+
+    // As per pred.c, the descent rate is converted to a drag coefficient using
+    // the square root of the sea-level air density.
+    drag_coeff = descent_rate * 1.10679;
+
+    // In descent mode, the ascent rate and burst altitude are ignored.
+    if (descent_mode)
+        burst_alt = launch_alt;
+
+    alt_model = altitude_model_new(descent_mode ? DESCENT_MODE_DESCENDING : DESCENT_MODE_NORMAL,
+                                   burst_alt, ascent_rate, drag_coeff);
+    if (!alt_model) {
+        *status = PRED_ERROR;
+        return 0;
+    }
+
+    run_output.buffer = output;
+    run_output.max_points = max_points;
+    run_output.n_points = 0;
+    current_output = &run_output;
+
+    rv = run_model(dataset->cache, alt_model, launch_lat, launch_lon, launch_alt,
+                   launch_time, wind_error);
+
+    current_output = NULL;
+    altitude_model_free(alt_model);
+
+    *status = rv ? PRED_OK : PRED_MODEL_ERROR;
+    return run_output.n_points;
+}
+
+int pred_run_batch(pred_dataset_t *dataset, int n,
+                   const double *launch_lat, const double *launch_lon, const double *launch_alt,
+                   const long int *launch_time, const double *ascent_rate,
+                   const double *descent_rate, const double *burst_alt,
+                   int descent_mode, double wind_error, unsigned long seed,
+                   double *output, int *status) {
+    batch_params_t params;
+    double *drag_coeff;
+    int i, rv;
+
+    if (!dataset || n < 0 || !launch_lat || !launch_lon || !launch_alt || !launch_time ||
+            !ascent_rate || !descent_rate || !burst_alt || !output || !status)
+        return -1;
+
+    // As per pred_run.
+    drag_coeff = (double*) malloc(sizeof(double) * (n ? n : 1));
+    if (!drag_coeff)
+        return -1;
+    for (i = 0; i < n; i++)
+        drag_coeff[i] = descent_rate[i] * 1.10679;
+
+    params.n = n;
+    params.lat = launch_lat;
+    params.lng = launch_lon;
+    params.alt = launch_alt;
+    params.timestamp = launch_time;
+    params.ascent_rate = ascent_rate;
+    params.drag_coeff = drag_coeff;
+    params.burst_alt = burst_alt;
+    params.descent_mode = descent_mode ? DESCENT_MODE_DESCENDING : DESCENT_MODE_NORMAL;
+    params.rmswinderror = wind_error;
+    params.seed = seed;
+
+    rv = run_batch(dataset->cache, &params, output, status);
+    free(drag_coeff);
+
+    if (rv < 0)
+        return -1;
+
+    for (i = 0; i < n; i++) {
+        // as per write_position
+        if (output[4*i + 2] > 180)
+            output[4*i + 2] -= 360;
+        status[i] = status[i] ? PRED_OK : PRED_MODEL_ERROR;
+    }
+    if(stats_enabled)
+        pred_stats.output_records += n;
+
+    return rv;
+}
+
+void pred_set_verbosity(int level) {
+    verbosity = level;
+}
+
+void pred_seed(unsigned long seed) {
+    random_seed(seed);
+}
+
+const char *pred_version(void) {
+    return VERSION;
+}
+
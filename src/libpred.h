@@ -0,0 +1,99 @@
+// --------------------------------------------------------------
+// CU Spaceflight Landing Prediction
+// Copyright (c) CU Spaceflight 2009, All Right Reserved
+//
+// THIS CODE AND INFORMATION ARE PROVIDED "AS IS" WITHOUT WARRANTY OF ANY 
+// KIND, EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+// IMPLIED WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A
+// PARTICULAR PURPOSE.
+// --------------------------------------------------------------
+
+#ifndef __LIBPRED_H__
+#define __LIBPRED_H__
+
+#ifdef __cplusplus
+extern "C" {
+#endif // __cplusplus
+
+// Shared library interface to the prediction engine, for running predictions
+// in-process rather than by spawning pred and parsing its output.
+//
+// A dataset handle indexes a wind data directory (as per pred's --data_dir).
+// Wind data files are loaded as they are first needed, and stay loaded until
+// the handle is freed, so repeated predictions against a handle are fast.
+// A handle may be shared between threads, each running its own prediction.
+
+typedef struct pred_dataset_s pred_dataset_t;
+
+// Status codes returned by pred_run
+#define PRED_OK             1   // prediction completed
+#define PRED_MODEL_ERROR    0   // ran out of wind data; the partial flight path is returned
+#define PRED_ERROR         -1   // invalid arguments, or could not allocate memory
+
+// open a wind data directory. Returns NULL if the directory could not be read.
+pred_dataset_t      *pred_dataset_open     (const char         *directory);
+
+// free a dataset handle, and all wind data loaded through it.
+void                 pred_dataset_free     (pred_dataset_t     *dataset);
+
+// number of wind data files found in the dataset directory.
+unsigned int         pred_dataset_files    (pred_dataset_t     *dataset);
+
+// run a prediction, writing flight path entries into the output buffer as
+// rows of 4 doubles (timestamp, latitude, longitude, altitude), as per pred's
+// CSV output. At most max_points rows are written. Returns the number of rows
+// the flight path contains: if this is greater than max_points, the flight path
+// was truncated, and the caller should retry with a larger buffer.
+// The result of the run (one of the PRED_ codes above) is stored in status.
+int                  pred_run              (pred_dataset_t     *dataset,
+                                            double              launch_lat,
+                                            double              launch_lon,
+                                            double              launch_alt,
+                                            long int            launch_time,
+                                            double              ascent_rate,
+                                            double              descent_rate,
+                                            double              burst_alt,
+                                            int                 descent_mode,
+                                            double              wind_error,
+                                            double             *output,
+                                            int                 max_points,
+                                            int                *status);
+
+// run a batch of n predictions (i.e. an ensemble with varied launch parameters),
+// stepping all of the flights together (see run_batch.h). Each of the launch
+// parameter arrays holds n values. Only the landing of each flight (or its last
+// position, if it ran out of wind data) is written to output, as a row of 4
+// doubles as per pred_run, and its result (PRED_OK or PRED_MODEL_ERROR) to
+// status. The wind is sampled using random numbers seeded from seed, so a batch
+// is reproducible. Returns the number of flights which landed, or -1 on error.
+int                  pred_run_batch        (pred_dataset_t     *dataset,
+                                            int                 n,
+                                            const double       *launch_lat,
+                                            const double       *launch_lon,
+                                            const double       *launch_alt,
+                                            const long int     *launch_time,
+                                            const double       *ascent_rate,
+                                            const double       *descent_rate,
+                                            const double       *burst_alt,
+                                            int                 descent_mode,
+                                            double              wind_error,
+                                            unsigned long       seed,
+                                            double             *output,
+                                            int                *status);
+
+// set the verbosity of diagnostic messages written to stderr (as per pred -v).
+void                 pred_set_verbosity    (int                 level);
+
+// seed the wind sampling of subsequent pred_run calls on this thread (as per
+// pred --seed), for reproducible predictions.
+void                 pred_seed             (unsigned long       seed);
+
+// version of the prediction engine.
+const char          *pred_version          (void);
+
+#ifdef __cplusplus
+}
+#endif // __cplusplus
+
+#endif // __LIBPRED_H__
+
@@ -23,13 +23,16 @@
 #include "wind/wind_file_cache.h"
 
 #include "run_model.h"
+#include "util/random.h"
 #include "pred.h"
 #include "altitude.h"
+#include "stats.h"
 
 FILE* output;
 FILE* kml_file;
 const char* data_dir;
 int verbosity;
+int flush_output;
 
 int main(int argc, const char *argv[]) {
     
@@ -51,12 +54,15 @@ int main(int argc, const char *argv[]) {
         gopt_option('h', 0, gopt_shorts('h', '?'), gopt_longs("help")),
         gopt_option('z', 0, gopt_shorts(0), gopt_longs("version")),
         gopt_option('v', GOPT_REPEAT, gopt_shorts('v'), gopt_longs("verbose")),
+        gopt_option('s', 0, gopt_shorts('s'), gopt_longs("stats")),
+        gopt_option('f', 0, gopt_shorts('f'), gopt_longs("flush")),
         gopt_option('o', GOPT_ARG, gopt_shorts('o'), gopt_longs("output")),
         gopt_option('k', GOPT_ARG, gopt_shorts('k'), gopt_longs("kml")),
         gopt_option('t', GOPT_ARG, gopt_shorts('t'), gopt_longs("start_time")),
         gopt_option('i', GOPT_ARG, gopt_shorts('i'), gopt_longs("data_dir")),
         gopt_option('d', 0, gopt_shorts('d'), gopt_longs("descending")),
         gopt_option('e', GOPT_ARG, gopt_shorts('e'), gopt_longs("wind_error")),
+        gopt_option('r', GOPT_ARG, gopt_shorts('r'), gopt_longs("seed")),
         gopt_option('a', GOPT_ARG, gopt_shorts('a'), gopt_longs("alarm"))
     ));
 
@@ -69,6 +75,8 @@ int main(int argc, const char *argv[]) {
         printf(" --version               Display version information.\n");
         printf(" -v --verbose            Display more information while running,\n");
         printf("                           Use -vv, -vvv etc. for even more verbose output.\n");
+        printf(" -s --stats              Write profiling counters to stderr as JSON on exit.\n");
+        printf(" -f --flush              Flush the CSV output after each record, for streaming.\n");
         printf(" -t --start_time <int>   Start time of model, defaults to current time.\n");
         printf("                           Should be a UNIX standard format timestamp.\n");
         printf(" -o --output <file>      Output file for CSV data, defaults to stdout. Overrides scenario.\n");
@@ -77,6 +85,7 @@ int main(int argc, const char *argv[]) {
         printf("                           burst or cutdown. burst_alt and ascent_rate ignored.\n");
         printf(" -i --data_dir <dir>     Input directory for wind data, defaults to current dir.\n\n");
         printf(" -e --wind_error <err>   RMS windspeed error (m/s).\n");
+        printf(" -r --seed <int>         Seed the wind sampling, for reproducible predictions.\n");
         printf(" -a --alarm <seconds>    Use alarm() to kill pred incase it hangs.\n");
         printf("The scenario file is an INI-like file giving the launch scenario. If it is\n");
         printf("omitted, the scenario is read from standard input.\n");
@@ -99,6 +108,20 @@ int main(int argc, const char *argv[]) {
     }
     
     verbosity = gopt(options, 'v');
+
+    if (gopt(options, 's'))
+        stats_enable();
+
+    if (gopt_arg(options, 'r', &argument) && strcmp(argument, "-")) {
+        unsigned long seed = strtoul(argument, &endptr, 0);
+        if (endptr == argument) {
+            fprintf(stderr, "ERROR: %s: invalid seed\n", argument);
+            exit(1);
+        }
+        random_seed(seed);
+    }
+
+    flush_output = gopt(options, 'f');
     
     if (gopt(options, 'd'))
         descent_mode = DESCENT_MODE_DESCENDING;
@@ -330,6 +353,10 @@ void write_position(float lat, float lng, float alt, int timestamp) {
     }
         
     fprintf(output, "%d,%g,%g,%g\n", timestamp, lat, lng, alt);
+    if(stats_enabled)
+        pred_stats.output_records++;
+    if (flush_output)
+        fflush(output);
     if (ferror(output)) {
       fprintf(stderr, "ERROR: error writing to CSV file\n");
       exit(1);
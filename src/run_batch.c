@@ -0,0 +1,394 @@
+// --------------------------------------------------------------
+// CU Spaceflight Landing Prediction
+// Copyright (c) CU Spaceflight 2009, All Right Reserved
+//
+// THIS CODE AND INFORMATION ARE PROVIDED "AS IS" WITHOUT WARRANTY OF ANY
+// KIND, EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+// IMPLIED WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A
+// PARTICULAR PURPOSE.
+// --------------------------------------------------------------
+
+#include <math.h>
+#include <stdint.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+
+#include "wind/wind_file.h"
+#include "run_batch.h"
+#include "run_model.h"
+#include "pred.h"
+#include "altitude.h"
+#include "stats.h"
+
+extern int verbosity;
+
+#define RADIUS_OF_EARTH 6371009.f
+
+// State of the flights in a batch. Each field is a separate array with an entry
+// per flight, so that the loops over them can be vectorised. The flights still
+// running are held in the first n_active entries of each array.
+typedef struct batch_s batch_t;
+struct batch_s
+{
+    unsigned int        n_active;
+
+    unsigned int       *id;             // index of the flight in the batch parameters
+    float              *lat;
+    float              *lng;
+    float              *alt;
+    float              *initial_alt;
+    float              *ascent_rate;
+    float              *drag_coeff;
+    int                *burst_time;     // -1 if the flight starts off descending
+    long int           *launch_time;
+    uint64_t           *rng;
+    unsigned char      *pr_idx;         // pressure level of the last wind lookup
+    wind_file_cache_entry_t **earlier;  // wind data either side of the current time
+    wind_file_cache_entry_t **later;
+
+    // working space for each timestep
+    float              *lambda;
+    float              *u0, *v0, *var0;
+    float              *u1, *v1, *var1;
+    unsigned char      *failed;
+    unsigned int       *order;
+    void               *scratch;
+};
+
+// The per-flight state, which is moved around as flights finish and are regrouped.
+#define BATCH_STATE(X) X(id) X(lat) X(lng) X(alt) X(initial_alt) X(ascent_rate) \
+    X(drag_coeff) X(burst_time) X(launch_time) X(rng) X(pr_idx) X(earlier) X(later)
+
+#define BATCH_WORKSPACE(X) X(lambda) X(u0) X(v0) X(var0) X(u1) X(v1) X(var1) \
+    X(failed) X(order)
+
+static void _batch_free(batch_t* b)
+{
+#define FREE_FIELD(f) free(b->f);
+    BATCH_STATE(FREE_FIELD)
+    BATCH_WORKSPACE(FREE_FIELD)
+#undef FREE_FIELD
+    free(b->scratch);
+    free(b);
+}
+
+static batch_t* _batch_new(unsigned int n)
+{
+    batch_t* b = (batch_t*) calloc(1, sizeof(batch_t));
+    int ok = 1;
+
+    if (!b)
+        return NULL;
+
+#define ALLOC_FIELD(f) b->f = malloc(n * sizeof(*b->f)); ok = ok && b->f;
+    BATCH_STATE(ALLOC_FIELD)
+    BATCH_WORKSPACE(ALLOC_FIELD)
+#undef ALLOC_FIELD
+    // large enough to hold any one field, or the sort keys.
+    b->scratch = malloc(n * 4 * sizeof(uint64_t));
+
+    if (!ok || !b->scratch) {
+        _batch_free(b);
+        return NULL;
+    }
+
+    return b;
+}
+
+// Remove flight i from the active flights, writing out its final position.
+static void _batch_finish(batch_t* b, unsigned int i, unsigned long timestamp, int landed,
+                          double* output, int* status)
+{
+    unsigned int last = b->n_active - 1;
+    double* row = output + 4 * b->id[i];
+
+    row[0] = timestamp;
+    row[1] = b->lat[i];
+    row[2] = b->lng[i];
+    row[3] = b->alt[i];
+    status[b->id[i]] = landed;
+
+#define MOVE_FIELD(f) b->f[i] = b->f[last];
+    BATCH_STATE(MOVE_FIELD)
+#undef MOVE_FIELD
+
+    b->n_active--;
+}
+
+typedef struct batch_key_s batch_key_t;
+struct batch_key_s
+{
+    uintptr_t           earlier;
+    uintptr_t           later;
+    int                 cell;
+    unsigned int        index;
+};
+
+static int _batch_key_compare(const void* a, const void* b)
+{
+    const batch_key_t* ka = (const batch_key_t*)a;
+    const batch_key_t* kb = (const batch_key_t*)b;
+
+    if (ka->earlier != kb->earlier)
+        return (ka->earlier < kb->earlier) ? -1 : 1;
+    if (ka->later != kb->later)
+        return (ka->later < kb->later) ? -1 : 1;
+    if (ka->cell != kb->cell)
+        return (ka->cell < kb->cell) ? -1 : 1;
+    return (ka->index < kb->index) ? -1 : (ka->index > kb->index);
+}
+
+static void _permute(void* array, size_t size, const unsigned int* order, unsigned int n,
+                     void* scratch)
+{
+    unsigned int i;
+
+    for (i = 0; i < n; ++i)
+        memcpy((char*)scratch + i * size, (char*)array + order[i] * size, size);
+    memcpy(array, scratch, n * size);
+}
+
+// Sort the active flights by wind data, then by the wind data cell they are in,
+// so that flights sharing wind data are contiguous, and neighbouring flights
+// read the same parts of it.
+static void _batch_regroup(batch_t* b)
+{
+    batch_key_t* keys = (batch_key_t*)b->scratch;
+    unsigned int i, m = b->n_active;
+
+    for (i = 0; i < m; ++i) {
+        wind_file_t* file = wind_file_cache_entry_file(b->earlier[i]);
+        keys[i].earlier = (uintptr_t)b->earlier[i];
+        keys[i].later = (uintptr_t)b->later[i];
+        keys[i].cell = file ? wind_file_cell(file, b->lat[i], b->lng[i]) : -1;
+        keys[i].index = i;
+    }
+
+    qsort(keys, m, sizeof(batch_key_t), _batch_key_compare);
+
+    for (i = 0; i < m; ++i)
+        b->order[i] = keys[i].index;
+
+#define PERMUTE_FIELD(f) _permute(b->f, sizeof(*b->f), b->order, m, b->scratch);
+    BATCH_STATE(PERMUTE_FIELD)
+#undef PERMUTE_FIELD
+}
+
+// Look up the wind from one file for flights start to end-1, falling back to
+// wind_file_get_wind if the file isn't supported by the batched lookup.
+static void _batch_get_wind(batch_t* b, wind_file_t* file, unsigned int start, unsigned int end,
+                            float* u, float* v, float* var)
+{
+    unsigned int i;
+
+    if (wind_file_get_wind_batch(file, end - start, b->lat + start, b->lng + start,
+                                 b->alt + start, b->pr_idx + start,
+                                 u + start, v + start, var + start))
+        return;
+
+    for (i = start; i < end; ++i) {
+        float uvar, vvar;
+        if (!wind_file_get_wind(file, b->lat[i], b->lng[i], b->alt[i], &u[i], &v[i], &uvar, &vvar))
+            b->failed[i] = 1;
+        var[i] = 0.5f * (uvar + vvar);
+    }
+    if(stats_enabled)
+        pred_stats.interpolations += end - start;
+}
+
+static uint64_t _splitmix64(uint64_t x)
+{
+    x += 0x9E3779B97F4A7C15ULL;
+    x = (x ^ (x >> 30)) * 0xBF58476D1CE4E5B9ULL;
+    x = (x ^ (x >> 27)) * 0x94D049BB133111EBULL;
+    return x ^ (x >> 31);
+}
+
+int run_batch(wind_file_cache_t* cache, const batch_params_t* params,
+              double* output, int* status)
+{
+    const float* density_table = altitude_model_density_table();
+    const float rms2 = params->rmswinderror * params->rmswinderror;
+    batch_t* b;
+    unsigned int i, n_landed = 0;
+    int t, regroup = 1;
+
+    b = _batch_new(params->n ? params->n : 1);
+    if (!b)
+        return -1;
+
+    for (i = 0; i < params->n; ++i) {
+        b->id[i] = i;
+        b->lat[i] = params->lat[i];
+        b->lng[i] = params->lng[i];
+        b->alt[i] = params->alt[i];
+        b->initial_alt[i] = params->alt[i];
+        b->ascent_rate[i] = params->ascent_rate[i];
+        b->drag_coeff[i] = params->drag_coeff[i];
+        b->launch_time[i] = params->timestamp[i];
+        // as per altitude_model_get_altitude.
+        b->burst_time[i] = (params->descent_mode == DESCENT_MODE_DESCENDING) ? -1 :
+            (int)((float)(params->burst_alt[i] - b->initial_alt[i]) / b->ascent_rate[i]);
+        b->rng[i] = _splitmix64(params->seed * 0x100000001B3ULL + i) | 1;
+        b->pr_idx[i] = 0;
+        b->earlier[i] = b->later[i] = NULL;
+    }
+    b->n_active = params->n;
+
+    for (t = 0; b->n_active > 0; t += TIMESTEP)
+    {
+        unsigned int m = b->n_active;
+        unsigned int start, end;
+
+        if(stats_enabled)
+            pred_stats.integration_steps += m;
+
+        // altitude model: constant ascent rate until burst, then terminal
+        // velocity, which varies with air density.
+        for (i = 0; i < m; ++i) {
+            float f = b->alt[i] * (1.f / ALTITUDE_TABLE_STEP);
+            float descent_alt, inv_sqrt_density;
+            int j;
+
+            f = (f < 0.f) ? 0.f : f;
+            f = (f > ALTITUDE_TABLE_SIZE - 1) ? ALTITUDE_TABLE_SIZE - 1 : f;
+            j = (int)f;
+            j = (j > ALTITUDE_TABLE_SIZE - 2) ? ALTITUDE_TABLE_SIZE - 2 : j;
+            inv_sqrt_density = density_table[j] + (f - j) * (density_table[j+1] - density_table[j]);
+
+            descent_alt = b->alt[i] - TIMESTEP * b->drag_coeff[i] * inv_sqrt_density;
+            b->alt[i] = (t <= b->burst_time[i]) ?
+                b->initial_alt[i] + t * b->ascent_rate[i] : descent_alt;
+        }
+
+        // finish landed flights, and find the wind data for the rest.
+        for (i = 0; i < b->n_active; ) {
+            long int timestamp = b->launch_time[i] + t;
+            wind_file_cache_entry_t* earlier = b->earlier[i];
+            wind_file_cache_entry_t* later = b->later[i];
+
+            if ((t > b->burst_time[i]) && (b->alt[i] <= 0.f)) {
+                _batch_finish(b, i, timestamp, 1, output, status);
+                n_landed++;
+                continue;
+            }
+
+            // as per get_wind, move on to the next pair of files once the later one is reached.
+            if (!earlier ||
+                    (timestamp < wind_file_cache_entry_timestamp(earlier)) ||
+                    (timestamp >= wind_file_cache_entry_timestamp(later)) ||
+                    !wind_file_cache_entry_contains_point(earlier, b->lat[i], b->lng[i]) ||
+                    !wind_file_cache_entry_contains_point(later, b->lat[i], b->lng[i]))
+            {
+                wind_file_cache_find_entry(cache, b->lat[i], b->lng[i], timestamp, &earlier, &later);
+
+                if (!earlier || !later ||
+                        !wind_file_cache_entry_contains_point(earlier, b->lat[i], b->lng[i]) ||
+                        !wind_file_cache_entry_contains_point(later, b->lat[i], b->lng[i])) {
+                    if (verbosity > 0)
+                        fprintf(stderr, "WARN: Do not have wind data for this (lat, lon, alt, time) "
+                                "(%.4f,%.4f,%.1f,%ld).\n", b->lat[i], b->lng[i], b->alt[i], timestamp);
+                    _batch_finish(b, i, timestamp, 0, output, status);
+                    continue;
+                }
+
+                b->earlier[i] = earlier;
+                b->later[i] = later;
+                regroup = 1;
+            }
+
+            i++;
+        }
+
+        m = b->n_active;
+        if (m == 0)
+            break;
+
+        if (regroup || (t % REGROUP_INTERVAL == 0)) {
+            _batch_regroup(b);
+            regroup = 0;
+        }
+
+        // wind lookups, for each run of flights sharing the same wind data.
+        memset(b->failed, 0, m);
+        for (start = 0; start < m; start = end) {
+            wind_file_cache_entry_t* earlier = b->earlier[start];
+            wind_file_cache_entry_t* later = b->later[start];
+            wind_file_t* earlier_file = wind_file_cache_entry_file(earlier);
+            wind_file_t* later_file = wind_file_cache_entry_file(later);
+            float earlier_ts = wind_file_cache_entry_timestamp(earlier);
+            float later_ts = wind_file_cache_entry_timestamp(later);
+
+            for (end = start + 1; end < m; ++end)
+                if ((b->earlier[end] != earlier) || (b->later[end] != later))
+                    break;
+
+            if (!earlier_file || !later_file) {
+                memset(b->failed + start, 1, end - start);
+                continue;
+            }
+
+            for (i = start; i < end; ++i)
+                b->lambda[i] = (earlier_ts != later_ts) ?
+                    ((float)(b->launch_time[i] + t) - earlier_ts) / (later_ts - earlier_ts) : 0.5f;
+
+            _batch_get_wind(b, earlier_file, start, end, b->u0, b->v0, b->var0);
+            _batch_get_wind(b, later_file, start, end, b->u1, b->v1, b->var1);
+        }
+
+        // flights without wind data end here, as per run_model.
+        for (i = 0; i < b->n_active; ) {
+            if (b->failed[i]) {
+                b->failed[i] = b->failed[b->n_active - 1];
+                b->lambda[i] = b->lambda[b->n_active - 1];
+                b->u0[i] = b->u0[b->n_active - 1]; b->v0[i] = b->v0[b->n_active - 1];
+                b->var0[i] = b->var0[b->n_active - 1];
+                b->u1[i] = b->u1[b->n_active - 1]; b->v1[i] = b->v1[b->n_active - 1];
+                b->var1[i] = b->var1[b->n_active - 1];
+                _batch_finish(b, i, b->launch_time[i] + t, 0, output, status);
+                regroup = 1;
+                continue;
+            }
+            i++;
+        }
+        m = b->n_active;
+
+        // sample the wind, and move the flights.
+        for (i = 0; i < m; ++i) {
+            float lambda = b->lambda[i];
+            float wind_u = lambda * b->u1[i] + (1.f - lambda) * b->u0[i];
+            float wind_v = lambda * b->v1[i] + (1.f - lambda) * b->v0[i];
+            float wind_var = b->var0[i] + b->var1[i] + rms2;
+            float r1, r2, mag, theta, r, ddlat, ddlng;
+            uint64_t x = b->rng[i];
+
+            // xorshift64*, and a Box-Muller transform giving a normal sample for each of u and v.
+            x ^= x >> 12;
+            x ^= x << 25;
+            x ^= x >> 27;
+            b->rng[i] = x;
+            x *= 0x2545F4914F6CDD1DULL;
+            r1 = ((float)(x >> 40) + 0.5f) * (1.f / 16777216.f);
+            r2 = (float)((x >> 16) & 0xFFFFFF) * (1.f / 16777216.f);
+
+            wind_var = (wind_var > 0.f) ? wind_var : 0.f;
+            mag = sqrtf(-2.f * logf(r1) * wind_var);
+
+            // as per _get_frame in run_model.c
+            theta = 2.f * M_PI * (90.f - b->lat[i]) / 360.f;
+            r = RADIUS_OF_EARTH + b->alt[i];
+            ddlat = (2.f * M_PI) * r / 360.f;
+            ddlng = ddlat * sinf(theta);
+
+            b->lat[i] += (wind_v + mag * sinf(2.f * M_PI * r2)) * TIMESTEP / ddlat;
+            b->lng[i] += (wind_u + mag * cosf(2.f * M_PI * r2)) * TIMESTEP / ddlng;
+        }
+    }
+
+    _batch_free(b);
+
+    return n_landed;
+}
+
+// vim:sw=4:ts=4:et:cindent
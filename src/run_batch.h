@@ -0,0 +1,54 @@
+// --------------------------------------------------------------
+// CU Spaceflight Landing Prediction
+// Copyright (c) CU Spaceflight 2009, All Right Reserved
+//
+// THIS CODE AND INFORMATION ARE PROVIDED "AS IS" WITHOUT WARRANTY OF ANY
+// KIND, EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+// IMPLIED WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A
+// PARTICULAR PURPOSE.
+// --------------------------------------------------------------
+
+#ifndef __RUN_BATCH_H__
+#define __RUN_BATCH_H__
+
+#include "wind/wind_file_cache.h"
+
+// Batched version of run_model, for large numbers of flights (i.e. ensembles
+// with varied launch parameters). All of the flights are stepped together,
+// with the state of each held in separate arrays, the descent rate taken from
+// a precomputed density table, and the flights grouped by wind data cell so
+// that the wind interpolation runs over contiguous arrays.
+//
+// The model is the same as run_model's, including sampling the wind from the
+// variance of the surrounding data plus rmswinderror, but with a random number
+// generator per flight (seeded from 'seed'), so a batch is reproducible.
+
+// Launch parameters of a batch of flights, one array entry per flight.
+typedef struct batch_params_s batch_params_t;
+struct batch_params_s
+{
+    unsigned int        n;
+    const double       *lat;
+    const double       *lng;
+    const double       *alt;
+    const long int     *timestamp;
+    const double       *ascent_rate;
+    const double       *drag_coeff;
+    const double       *burst_alt;
+    int                 descent_mode;
+    float               rmswinderror;
+    unsigned long       seed;
+};
+
+// run the batch. The landing of each flight (or last position, if it ran out
+// of wind data) is written to output as a row of 4 doubles (timestamp,
+// latitude, longitude, altitude), and status is set to 1 if the flight landed
+// or 0 if it ran out of wind data. Returns the number of flights which landed,
+// or -1 if memory could not be allocated.
+int run_batch(wind_file_cache_t* cache, const batch_params_t* params,
+              double* output, int* status);
+
+#define REGROUP_INTERVAL 60 // re-sort flights by wind data cell every x timesteps
+
+#endif // __RUN_BATCH_H__
+
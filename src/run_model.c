@@ -21,6 +21,7 @@
 #include "run_model.h"
 #include "pred.h"
 #include "altitude.h"
+#include "stats.h"
 
 extern int verbosity;
 
@@ -73,6 +74,9 @@ _advance_one_timestep(wind_file_cache_t* cache,
         float u_samp, v_samp, u_lik, v_lik;
         model_state_t* state = &(states[i]);
 
+        if(stats_enabled)
+            pred_stats.integration_steps++;
+
         if(!altitude_model_get_altitude(state->alt_model, 
                                         timestamp - initial_timestamp, &state->alt))
             return 0; // alt < 0; finished
@@ -182,8 +186,27 @@ int run_model(wind_file_cache_t* cache, altitude_model_t* alt_model,
     return return_code;
 }
 
+static int _get_wind(wind_file_cache_t* cache, float lat, float lng, float alt, long int timestamp,
+        float* wind_v, float* wind_u, float *wind_var);
+
 int get_wind(wind_file_cache_t* cache, float lat, float lng, float alt, long int timestamp,
         float* wind_v, float* wind_u, float *wind_var) {
+    int rv;
+    double start;
+
+    if(!stats_enabled)
+        return _get_wind(cache, lat, lng, alt, timestamp, wind_v, wind_u, wind_var);
+
+    start = stats_now();
+    rv = _get_wind(cache, lat, lng, alt, timestamp, wind_v, wind_u, wind_var);
+    pred_stats.get_wind_calls++;
+    pred_stats.get_wind_time += stats_now() - start;
+
+    return rv;
+}
+
+static int _get_wind(wind_file_cache_t* cache, float lat, float lng, float alt, long int timestamp,
+        float* wind_v, float* wind_u, float *wind_var) {
     int i, s;
     float lambda, wu_l, wv_l, wu_h, wv_h;
     float wuvar_l, wvvar_l, wuvar_h, wvvar_h;
@@ -229,10 +252,20 @@ int get_wind(wind_file_cache_t* cache, float lat, float lng, float alt, long int
     else
         lambda = 0.5f;
 
-    s = wind_file_get_wind(found_files[0], lat, lng, alt, &wu_l, &wv_l, &wuvar_l, &wvvar_l);
-    if (s == 0) return 0; // hard error
-    s = wind_file_get_wind(found_files[1], lat, lng, alt, &wu_h, &wv_h, &wuvar_h, &wvvar_h);
-    if (s == 0) return 0;
+    if(stats_enabled) {
+        double start = stats_now();
+        s = wind_file_get_wind(found_files[0], lat, lng, alt, &wu_l, &wv_l, &wuvar_l, &wvvar_l);
+        if (s != 0)
+            s = wind_file_get_wind(found_files[1], lat, lng, alt, &wu_h, &wv_h, &wuvar_h, &wvvar_h);
+        pred_stats.interpolations += 2;
+        pred_stats.interpolation_time += stats_now() - start;
+        if (s == 0) return 0;
+    } else {
+        s = wind_file_get_wind(found_files[0], lat, lng, alt, &wu_l, &wv_l, &wuvar_l, &wvvar_l);
+        if (s == 0) return 0; // hard error
+        s = wind_file_get_wind(found_files[1], lat, lng, alt, &wu_h, &wv_h, &wuvar_h, &wvvar_h);
+        if (s == 0) return 0;
+    }
 
     *wind_u = lambda * wu_h + (1.f-lambda) * wu_l;
     *wind_v = lambda * wv_h + (1.f-lambda) * wv_l;
@@ -0,0 +1,69 @@
+// --------------------------------------------------------------
+// CU Spaceflight Landing Prediction
+// Copyright (c) CU Spaceflight 2009, All Right Reserved
+//
+// THIS CODE AND INFORMATION ARE PROVIDED "AS IS" WITHOUT WARRANTY OF ANY 
+// KIND, EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+// IMPLIED WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A
+// PARTICULAR PURPOSE.
+// --------------------------------------------------------------
+
+#include <stdio.h>
+#include <stdlib.h>
+#include <time.h>
+
+#include "stats.h"
+
+int          stats_enabled = 0;
+pred_stats_t pred_stats;
+
+static double _start_time;
+
+double
+stats_now(void)
+{
+    struct timespec ts;
+    clock_gettime(CLOCK_MONOTONIC, &ts);
+    return (double)ts.tv_sec + 1e-9 * (double)ts.tv_nsec;
+}
+
+static void
+_stats_at_exit(void)
+{
+    stats_print_json(stderr);
+}
+
+void
+stats_enable(void)
+{
+    if(stats_enabled)
+        return;
+
+    stats_enabled = 1;
+    _start_time = stats_now();
+    atexit(_stats_at_exit);
+}
+
+void
+stats_print_json(FILE* stream)
+{
+    const pred_stats_t* s = &pred_stats;
+
+    fprintf(stream, "{\"total_time\": %.6f, "
+            "\"dir_scans\": %lu, \"files_indexed\": %lu, \"index_loads\": %lu, \"dir_scan_time\": %.6f, "
+            "\"tile_loads\": %lu, \"bytes_parsed\": %lu, \"tile_load_time\": %.6f, "
+            "\"cache_lookups\": %lu, \"cache_lookup_time\": %.6f, "
+            "\"get_wind_calls\": %lu, \"get_wind_time\": %.6f, "
+            "\"interpolations\": %lu, \"interpolation_time\": %.6f, "
+            "\"integration_steps\": %lu, \"output_records\": %lu}\n",
+            stats_now() - _start_time,
+            s->dir_scans, s->files_indexed, s->index_loads, s->dir_scan_time,
+            s->tile_loads, s->bytes_parsed, s->tile_load_time,
+            s->cache_lookups, s->cache_lookup_time,
+            s->get_wind_calls, s->get_wind_time,
+            s->interpolations, s->interpolation_time,
+            s->integration_steps, s->output_records);
+    fflush(stream);
+}
+
+// vim:sw=4:ts=4:et:cindent
@@ -0,0 +1,57 @@
+// --------------------------------------------------------------
+// CU Spaceflight Landing Prediction
+// Copyright (c) CU Spaceflight 2009, All Right Reserved
+//
+// THIS CODE AND INFORMATION ARE PROVIDED "AS IS" WITHOUT WARRANTY OF ANY 
+// KIND, EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+// IMPLIED WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A
+// PARTICULAR PURPOSE.
+// --------------------------------------------------------------
+
+#ifndef __STATS_H__
+#define __STATS_H__
+
+#include <stdio.h>
+
+// Opt-in profiling counters, enabled with the -s / --stats option.
+// When enabled, a single JSON object summarising where the time went is
+// written to stderr when pred exits.
+
+typedef struct pred_stats_s pred_stats_t;
+struct pred_stats_s
+{
+    unsigned long   dir_scans;              // wind_file_cache_new calls
+    unsigned long   files_indexed;          // tiles found by the directory scan
+    unsigned long   index_loads;            // directory scans replaced by loading the directory index
+    double          dir_scan_time;
+
+    unsigned long   tile_loads;             // wind_file_new calls
+    unsigned long   bytes_parsed;           // bytes read from tile files
+    double          tile_load_time;
+
+    unsigned long   cache_lookups;          // wind_file_cache_find_entry calls
+    double          cache_lookup_time;
+
+    unsigned long   get_wind_calls;         // get_wind calls (includes lookups and interpolation)
+    double          get_wind_time;
+
+    unsigned long   interpolations;         // wind_file_get_wind calls
+    double          interpolation_time;
+
+    unsigned long   integration_steps;      // particle timesteps integrated
+    unsigned long   output_records;         // positions written
+};
+
+extern int          stats_enabled;
+extern pred_stats_t pred_stats;
+
+// monotonic time in seconds, for timing sections of code.
+double              stats_now           (void);
+
+// enable stats collection, and register an exit handler to print them.
+void                stats_enable        (void);
+
+// write the collected stats as a single line JSON object.
+void                stats_print_json    (FILE* stream);
+
+#endif // __STATS_H__
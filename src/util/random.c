@@ -14,6 +14,36 @@
 
 #include <glib.h>
 #include <math.h>
+#include <stdint.h>
+
+// Generator state for this thread, once seeded with random_seed (xorshift64*,
+// as per run_batch.c). Until then, samples are drawn from glib's generator.
+static __thread int seeded = 0;
+static __thread uint64_t state;
+
+void random_seed(unsigned long seed)
+{
+    // splitmix64, so that nearby seeds give unrelated states (which must be non-zero).
+    uint64_t z = (uint64_t)seed + 0x9e3779b97f4a7c15ULL;
+    z = (z ^ (z >> 30)) * 0xbf58476d1ce4e5b9ULL;
+    z = (z ^ (z >> 27)) * 0x94d049bb133111ebULL;
+    z ^= z >> 31;
+
+    state = z ? z : 1;
+    seeded = 1;
+}
+
+// Uniform sample in (0, 1].
+static double _random_double(void)
+{
+    if (!seeded)
+        return g_random_double();
+
+    state ^= state >> 12;
+    state ^= state << 25;
+    state ^= state >> 27;
+    return ((state * 0x2545F4914F6CDD1DULL) >> 11) * (1.0 / 9007199254740992.0) + (1.0 / 9007199254740992.0);
+}
 
 // Sample from a normal distribution with zero mean and unit variance.
 // See http://en.wikipedia.org/wiki/Normal_distribution
@@ -23,8 +53,8 @@ static float _random_sample_normal_intl(float* loglik)
     double u, v = 0.0;
     static const double k = 0.918938533204673; // = 0.5 * (log(2) + log(pi)), see below.
 
-    u = g_random_double();
-    v = g_random_double();
+    u = _random_double();
+    v = _random_double();
     v = sqrt(-2.0 * log(u)) * cos(2.0 * G_PI * v);
 
     // actual likelihood is 1/sqrt(2*pi) exp(-(x^2)) since mu = 0 and sigma^2 = 1.
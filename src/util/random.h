@@ -18,6 +18,10 @@
 // of drawing that sample.
 float random_sample_normal(float mu, float sigma2, float *loglik);
 
+// Seed the samples drawn on this thread, for reproducible predictions. Until
+// this is called, samples are drawn from glib's (randomly seeded) generator.
+void random_seed(unsigned long seed);
+
 #endif /* __RANDOM_H__ */
 
 // vim:sw=4:ts=4:et:cindent
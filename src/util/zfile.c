@@ -0,0 +1,323 @@
+// --------------------------------------------------------------
+// CU Spaceflight Landing Prediction
+// Copyright (c) CU Spaceflight 2009, All Right Reserved
+//
+// THIS CODE AND INFORMATION ARE PROVIDED "AS IS" WITHOUT WARRANTY OF ANY
+// KIND, EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+// IMPLIED WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A
+// PARTICULAR PURPOSE.
+// --------------------------------------------------------------
+
+// Compressed files are wrapped in a stdio stream (fopencookie on glibc,
+// funopen on the BSDs/macOS), so that the existing line-based parsing code
+// can read them unchanged. Data is decompressed in small blocks as it is
+// read, so the whole file is never held in memory.
+
+#ifndef _GNU_SOURCE
+#define _GNU_SOURCE
+#endif
+
+#include "zfile.h"
+
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <errno.h>
+#include <sys/types.h>
+
+#ifdef HAVE_ZLIB
+#include <zlib.h>
+#endif
+
+#ifdef HAVE_ZSTD
+#include <zstd.h>
+#endif
+
+#if defined(__APPLE__) || defined(__FreeBSD__) || defined(__OpenBSD__) || defined(__NetBSD__)
+#define ZFILE_FUNOPEN
+#endif
+
+#if defined(HAVE_ZLIB) || defined(HAVE_ZSTD)
+#define ZFILE_COMPRESSION
+#endif
+
+// Largest read passed to zlib at once.
+#define ZFILE_BUFFER_SIZE       (128*1024)
+
+static int
+_has_extension(const char* filepath, const char* extension)
+{
+        size_t path_len = strlen(filepath);
+        size_t ext_len = strlen(extension);
+
+        return (path_len > ext_len) && (0 == strcmp(filepath + path_len - ext_len, extension));
+}
+
+#ifdef ZFILE_COMPRESSION
+typedef ssize_t (*zfile_read_fn)(void *cookie, char *buf, size_t size);
+typedef int (*zfile_close_fn)(void *cookie);
+
+// Common state for all compressed streams: the position within the
+// decompressed data (for ftell), and the format-specific functions.
+typedef struct zfile_cookie_s zfile_cookie_t;
+struct zfile_cookie_s
+{
+        long                    position;
+        zfile_read_fn           read;
+        zfile_close_fn          close;
+};
+
+static ssize_t
+_cookie_read(void *cookie, char *buf, size_t size)
+{
+        zfile_cookie_t* self = (zfile_cookie_t*)cookie;
+        ssize_t rv = self->read(cookie, buf, size);
+
+        if(rv > 0)
+                self->position += rv;
+        return rv;
+}
+
+static int
+_cookie_close(void *cookie)
+{
+        zfile_cookie_t* self = (zfile_cookie_t*)cookie;
+        return self->close(cookie);
+}
+
+// Only reporting the current position (for ftell) is supported.
+static int
+_cookie_tell(zfile_cookie_t* self, long offset, int whence, long* position)
+{
+        if((whence == SEEK_CUR) && (offset == 0)) {
+                *position = self->position;
+                return 0;
+        }
+
+        errno = ESPIPE;
+        return -1;
+}
+
+#ifdef ZFILE_FUNOPEN
+static int
+_funopen_read(void *cookie, char *buf, int size)
+{
+        return (int)_cookie_read(cookie, buf, size);
+}
+
+static fpos_t
+_funopen_seek(void *cookie, fpos_t offset, int whence)
+{
+        long position;
+        if(_cookie_tell((zfile_cookie_t*)cookie, (long)offset, whence, &position) < 0)
+                return -1;
+        return (fpos_t)position;
+}
+#else
+static int
+_fopencookie_seek(void *cookie, off64_t *offset, int whence)
+{
+        long position;
+        if(_cookie_tell((zfile_cookie_t*)cookie, (long)*offset, whence, &position) < 0)
+                return -1;
+        *offset = position;
+        return 0;
+}
+#endif
+
+// Wrap a cookie in a stdio stream. The cookie is closed if this fails.
+static FILE*
+_cookie_stream(zfile_cookie_t* cookie)
+{
+        FILE* file;
+
+#ifdef ZFILE_FUNOPEN
+        file = funopen(cookie, _funopen_read, NULL, _funopen_seek, _cookie_close);
+#else
+        cookie_io_functions_t functions = {
+                .read = _cookie_read,
+                .write = NULL,
+                .seek = _fopencookie_seek,
+                .close = _cookie_close,
+        };
+        file = fopencookie(cookie, "r", functions);
+#endif
+
+        if(!file)
+                _cookie_close(cookie);
+
+        return file;
+}
+#endif // ZFILE_COMPRESSION
+
+#ifdef HAVE_ZLIB
+typedef struct zfile_gzip_s zfile_gzip_t;
+struct zfile_gzip_s
+{
+        zfile_cookie_t          cookie;
+        gzFile                  gz;
+};
+
+static ssize_t
+_gzip_read(void *cookie, char *buf, size_t size)
+{
+        zfile_gzip_t* self = (zfile_gzip_t*)cookie;
+        int rv;
+
+        if(size > ZFILE_BUFFER_SIZE)
+                size = ZFILE_BUFFER_SIZE;
+
+        rv = gzread(self->gz, buf, (unsigned int)size);
+        if(rv < 0) {
+                int error;
+                fprintf(stderr, "ERROR: Could not decompress file: %s\n", gzerror(self->gz, &error));
+                errno = EIO;
+                return -1;
+        }
+        return rv;
+}
+
+static int
+_gzip_close(void *cookie)
+{
+        zfile_gzip_t* self = (zfile_gzip_t*)cookie;
+        int rv = gzclose(self->gz);
+        free(self);
+        return (rv == Z_OK) ? 0 : EOF;
+}
+
+static FILE*
+_gzip_open(const char* filepath)
+{
+        zfile_gzip_t* self;
+        gzFile gz;
+
+        // zlib's default buffer size is kept: a larger buffer makes reading just
+        // the header (when scanning the data directory) decompress far more data.
+        gz = gzopen(filepath, "rb");
+        if(!gz)
+                return NULL;
+
+        self = (zfile_gzip_t*)malloc(sizeof(zfile_gzip_t));
+        self->cookie.position = 0;
+        self->cookie.read = _gzip_read;
+        self->cookie.close = _gzip_close;
+        self->gz = gz;
+
+        return _cookie_stream(&self->cookie);
+}
+#endif // HAVE_ZLIB
+
+#ifdef HAVE_ZSTD
+typedef struct zfile_zstd_s zfile_zstd_t;
+struct zfile_zstd_s
+{
+        zfile_cookie_t          cookie;
+        FILE                   *raw;
+        ZSTD_DStream           *stream;
+        ZSTD_inBuffer           input;
+        char                   *input_buffer;
+        size_t                  input_size;
+};
+
+static ssize_t
+_zstd_read(void *cookie, char *buf, size_t size)
+{
+        zfile_zstd_t* self = (zfile_zstd_t*)cookie;
+        ZSTD_outBuffer output = { buf, size, 0 };
+
+        // Decompress until we have some output, or run out of input.
+        while(output.pos == 0)
+        {
+                size_t rv;
+
+                if(self->input.pos == self->input.size)
+                {
+                        self->input.size = fread(self->input_buffer, 1, self->input_size, self->raw);
+                        self->input.pos = 0;
+                        if(self->input.size == 0) {
+                                if(ferror(self->raw))
+                                        return -1;
+                                break;
+                        }
+                }
+
+                rv = ZSTD_decompressStream(self->stream, &output, &self->input);
+                if(ZSTD_isError(rv)) {
+                        fprintf(stderr, "ERROR: Could not decompress file: %s\n", ZSTD_getErrorName(rv));
+                        errno = EIO;
+                        return -1;
+                }
+        }
+
+        return output.pos;
+}
+
+static int
+_zstd_close(void *cookie)
+{
+        zfile_zstd_t* self = (zfile_zstd_t*)cookie;
+        int rv = fclose(self->raw);
+        ZSTD_freeDStream(self->stream);
+        free(self->input_buffer);
+        free(self);
+        return rv;
+}
+
+static FILE*
+_zstd_open(const char* filepath)
+{
+        zfile_zstd_t* self;
+        FILE* raw;
+
+        raw = fopen(filepath, "rb");
+        if(!raw)
+                return NULL;
+
+        self = (zfile_zstd_t*)malloc(sizeof(zfile_zstd_t));
+        self->cookie.position = 0;
+        self->cookie.read = _zstd_read;
+        self->cookie.close = _zstd_close;
+        self->raw = raw;
+        self->stream = ZSTD_createDStream();
+        ZSTD_initDStream(self->stream);
+        self->input_size = ZSTD_DStreamInSize();
+        self->input_buffer = (char*)malloc(self->input_size);
+        self->input.src = self->input_buffer;
+        self->input.size = 0;
+        self->input.pos = 0;
+
+        return _cookie_stream(&self->cookie);
+}
+#endif // HAVE_ZSTD
+
+FILE*
+zfile_open(const char* filepath)
+{
+        if(_has_extension(filepath, ".gz"))
+        {
+#ifdef HAVE_ZLIB
+                return _gzip_open(filepath);
+#else
+                fprintf(stderr, "ERROR: Cannot read '%s': not built with zlib support.\n", filepath);
+                errno = ENOTSUP;
+                return NULL;
+#endif
+        }
+
+        if(_has_extension(filepath, ".zst"))
+        {
+#ifdef HAVE_ZSTD
+                return _zstd_open(filepath);
+#else
+                fprintf(stderr, "ERROR: Cannot read '%s': not built with zstd support.\n", filepath);
+                errno = ENOTSUP;
+                return NULL;
+#endif
+        }
+
+        return fopen(filepath, "r");
+}
+
+// Data for God's own editor.
+// vim:sw=8:ts=8:et:cindent
@@ -0,0 +1,36 @@
+// --------------------------------------------------------------
+// CU Spaceflight Landing Prediction
+// Copyright (c) CU Spaceflight 2009, All Right Reserved
+//
+// THIS CODE AND INFORMATION ARE PROVIDED "AS IS" WITHOUT WARRANTY OF ANY
+// KIND, EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+// IMPLIED WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A
+// PARTICULAR PURPOSE.
+// --------------------------------------------------------------
+
+#ifndef __ZFILE_H__
+#define __ZFILE_H__
+
+#include <stdio.h>
+
+#ifdef __cplusplus
+extern "C" {
+#endif // __cplusplus
+
+// Open a file for reading, decompressing it as it is read if the file name
+// has the extension of a supported compression format:
+//      .gz     gzip (requires zlib, HAVE_ZLIB)
+//      .zst    zstandard (requires libzstd, HAVE_ZSTD)
+// Any other file is opened as-is. The returned stream is read (and closed
+// with fclose) as per any other stdio stream; ftell reports the position
+// within the decompressed data. Returns NULL (with errno set) on failure.
+FILE                   *zfile_open             (const char               *filepath);
+
+#ifdef __cplusplus
+}
+#endif // __cplusplus
+
+#endif // __ZFILE_H__
+
+// Data for God's own editor.
+// vim:sw=8:ts=8:et:cindent
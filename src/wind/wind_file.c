@@ -14,10 +14,13 @@
 
 #include <stdio.h>
 #include <stdlib.h>
+#include <string.h>
 #include <assert.h>
 #include <math.h>
 
 #include "../util/getline.h"
+#include "../util/zfile.h"
+#include "../stats.h"
 
 extern int verbosity;
 
@@ -45,6 +48,13 @@ struct wind_file_s
 
         //                      A pointer to the actual data.
         float                  *data;
+
+        //                      Non-zero if the latitude and longitude axes are evenly spaced,
+        //                      and heights increase along the pressure axis, in which case the
+        //                      batched lookup can be used (see wind_file_get_wind_batch).
+        int                     regular;
+        float                   lat0, dlat;
+        float                   lon0, dlon;
 };
 
 // These exciting functions are all to do with the fact that 'left' and 'right'
@@ -197,6 +207,58 @@ _parse_values_line(const char* line, unsigned int n_values, float* values)
         return record_idx == n_values;
 }
 
+static float*
+_wind_file_get_record(wind_file_t* file, 
+                unsigned int lat_idx, unsigned int lon_idx,
+                unsigned int pressure_idx);
+
+// Work out whether the file's grid is regular, and if so its origin and spacing.
+static void
+_wind_file_check_grid(wind_file_t* file)
+{
+        wind_file_axis_t *pr_axis = file->axes[0];
+        wind_file_axis_t *lat_axis = file->axes[1];
+        wind_file_axis_t *lon_axis = file->axes[2];
+        unsigned int i;
+
+        file->regular = 0;
+
+        if((lat_axis->n_values < 2) || (lon_axis->n_values < 2) || (pr_axis->n_values < 2))
+                return;
+
+        file->lat0 = lat_axis->values[0];
+        file->dlat = lat_axis->values[1] - lat_axis->values[0];
+        file->lon0 = _canonicalise_longitude(lon_axis->values[0]);
+        file->dlon = _canonicalise_longitude(lon_axis->values[1] - lon_axis->values[0]);
+
+        if((file->dlat == 0.f) || (file->dlon == 0.f) || (file->dlon >= 180.f))
+                return;
+
+        for(i=1; i<lat_axis->n_values; ++i)
+        {
+                float d = lat_axis->values[i] - lat_axis->values[i-1];
+                if(fabsf(d - file->dlat) > 1e-3f * fabsf(file->dlat))
+                        return;
+        }
+
+        for(i=1; i<lon_axis->n_values; ++i)
+        {
+                float d = _canonicalise_longitude(lon_axis->values[i] - lon_axis->values[i-1]);
+                if(fabsf(d - file->dlon) > 1e-3f * file->dlon)
+                        return;
+        }
+
+        // The batched lookup walks up and down the pressure levels from the previous
+        // level of each point, which needs the heights to be in order.
+        for(i=1; i<pr_axis->n_values; ++i)
+        {
+                if(_wind_file_get_record(file, 0, 0, i)[0] <= _wind_file_get_record(file, 0, 0, i-1)[0])
+                        return;
+        }
+
+        file->regular = 1;
+}
+
 wind_file_t*
 wind_file_new(const char* filepath)
 {
@@ -205,11 +267,16 @@ wind_file_new(const char* filepath)
         size_t line_len;
         int num_lines, num_axes, num_components, i;
         wind_file_t* self;
+        double start = 0.0;
+
+        if(stats_enabled)
+                start = stats_now();
 
         if(verbosity > 0)
                 fprintf(stderr, "INFO: Loading wind data from '%s'.\n", filepath);
 
-        file = fopen(filepath, "r");
+        // Compressed files are decompressed as they are read.
+        file = zfile_open(filepath);
         if(!file) {
                 perror("ERROR: Could not open file.");
                 return NULL;
@@ -224,6 +291,7 @@ wind_file_new(const char* filepath)
         }
 
         self = (wind_file_t*)malloc(sizeof(wind_file_t));
+        self->regular = 0;
         self->n_axes = 0;
         self->axes = NULL;
         self->data = NULL;
@@ -382,6 +450,11 @@ wind_file_new(const char* filepath)
         }
 
         // close the file since we're done with it now.
+        if(stats_enabled) {
+                pred_stats.tile_loads++;
+                pred_stats.bytes_parsed += ftell(file);
+                pred_stats.tile_load_time += stats_now() - start;
+        }
         fclose(file);
 
         if(self->n_axes != 3) 
@@ -398,6 +471,8 @@ wind_file_new(const char* filepath)
                 return NULL;
         }
 
+        _wind_file_check_grid(self);
+
         return self;
 }
 
@@ -472,21 +547,96 @@ _bilinear_interpolate(float ll, float lr, float rl, float rr, float lambda1, flo
         return _lerp(il,ir,lambda2);
 }
 
+// Grid locations last looked up in a file, for wind_file_get_wind. Entries are
+// keyed by the file and the shape and extent of its axes, as a prediction
+// interpolates between two files on every step (which, with download profiles,
+// can cover different areas and levels), and a thread can run predictions
+// against several datasets in turn (i.e. with libpred, see libpred.h).
+typedef struct _wind_lookup_s _wind_lookup_t;
+struct _wind_lookup_s
+{
+        const wind_file_t      *file;
+        unsigned int            n_values[3];
+        float                   first[3], last[3];
+        unsigned long           used;
+
+        int                     have_valid_latlon_cache;
+        int                     have_valid_pressure_cache;
+
+        unsigned int            left_lat_idx, right_lat_idx;
+        unsigned int            left_lon_idx, right_lon_idx;
+        unsigned int            left_pr_idx, right_pr_idx;
+
+        float                   left_lat, right_lat;
+        float                   left_lon, right_lon;
+};
+
+// number of files to keep grid locations for, per thread.
+#define WIND_LOOKUP_ENTRIES 4
+
+static int
+_wind_lookup_matches(const _wind_lookup_t* entry, const wind_file_t* file)
+{
+        int i;
+
+        if(entry->file != file)
+                return 0;
+
+        for(i=0; i<3; ++i)
+        {
+                const wind_file_axis_t* axis = file->axes[i];
+                if((entry->n_values[i] != axis->n_values) ||
+                   (entry->first[i] != axis->values[0]) ||
+                   (entry->last[i] != axis->values[axis->n_values-1]))
+                        return 0;
+        }
+
+        return 1;
+}
+
+// Get the grid locations cached for a file, replacing the least recently used
+// entry (with an empty one) if the file has none. These are thread-local, so
+// that predictions can be run concurrently when built as a shared library.
+static _wind_lookup_t*
+_wind_file_lookup(const wind_file_t* file)
+{
+        static __thread _wind_lookup_t entries[WIND_LOOKUP_ENTRIES];
+        static __thread unsigned long used = 0;
+        _wind_lookup_t* entry = &entries[0];
+        int i;
+
+        for(i=0; i<WIND_LOOKUP_ENTRIES; ++i)
+        {
+                if(_wind_lookup_matches(&entries[i], file))
+                {
+                        entries[i].used = ++used;
+                        return &entries[i];
+                }
+                if(entries[i].used < entry->used)
+                        entry = &entries[i];
+        }
+
+        memset(entry, 0, sizeof(*entry));
+        entry->file = file;
+        for(i=0; i<3; ++i)
+        {
+                const wind_file_axis_t* axis = file->axes[i];
+                entry->n_values[i] = axis->n_values;
+                entry->first[i] = axis->values[0];
+                entry->last[i] = axis->values[axis->n_values-1];
+        }
+        entry->used = ++used;
+
+        return entry;
+}
+
 int
 wind_file_get_wind(wind_file_t* file, float lat, float lon, float height, 
                 float* windu, float *windv, float *uvar, float *vvar)
 {
-        // we use static variables to 'cache' the last left and right lat/longs
-        // and heights so that we can avoid searching the axes if necessary
-        static int have_valid_latlon_cache = 0;
-        static int have_valid_pressure_cache = 0;
-
-        static unsigned int left_lat_idx, right_lat_idx;
-        static unsigned int left_lon_idx, right_lon_idx;
-        static unsigned int left_pr_idx, right_pr_idx;
-
-        static float left_lat, right_lat;
-        static float left_lon, right_lon;
+        // we 'cache' the last left and right lat/longs and heights looked up in
+        // this file so that we can avoid searching the axes if necessary.
+        _wind_lookup_t* cache = _wind_file_lookup(file);
 
         int i;
         float left_height, right_height;
@@ -502,57 +652,57 @@ wind_file_get_wind(wind_file_t* file, float lat, float lon, float height,
         *windu = *windv = 0.f;
 
         // see if the cache is indeed valid
-        if(have_valid_latlon_cache)
+        if(cache->have_valid_latlon_cache)
         {
-                if((left_lat > lat) || 
-                   (right_lat < lat) ||
-                   !_longitude_is_left_of(left_lon, lon) || 
-                   !_longitude_is_left_of(lon, right_lon))
+                if((cache->left_lat > lat) || 
+                   (cache->right_lat < lat) ||
+                   !_longitude_is_left_of(cache->left_lon, lon) || 
+                   !_longitude_is_left_of(lon, cache->right_lon))
                 {
-                        have_valid_latlon_cache = 0;
+                        cache->have_valid_latlon_cache = 0;
                 }
         }
 
         // if we have no cached grid locations, look for them.
-        if(!have_valid_latlon_cache)
+        if(!cache->have_valid_latlon_cache)
         {
                 // look for latitude along second axis 
                 if(!_wind_file_axis_find_value(file->axes[1], lat,
-                                        _float_is_left_of, &left_lat_idx, &right_lat_idx))
+                                        _float_is_left_of, &cache->left_lat_idx, &cache->right_lat_idx))
                 {
                         fprintf(stderr, "ERROR: Latitude %f is not covered by file.\n", lat);
                         return 0;
                 }
-                left_lat = file->axes[1]->values[left_lat_idx];
-                right_lat = file->axes[1]->values[right_lat_idx];
+                cache->left_lat = file->axes[1]->values[cache->left_lat_idx];
+                cache->right_lat = file->axes[1]->values[cache->right_lat_idx];
 
                 // look for longitude along third axis
                 if(!_wind_file_axis_find_value(file->axes[2], lon,
-                                        _longitude_is_left_of, &left_lon_idx, &right_lon_idx))
+                                        _longitude_is_left_of, &cache->left_lon_idx, &cache->right_lon_idx))
                 {
                         fprintf(stderr, "ERROR: Longitude %f is not covered by file.\n", lon);
                         return 0;
                 }
-                left_lon = file->axes[2]->values[left_lon_idx];
-                right_lon = file->axes[2]->values[right_lon_idx];
+                cache->left_lon = file->axes[2]->values[cache->left_lon_idx];
+                cache->right_lon = file->axes[2]->values[cache->right_lon_idx];
 
                 if(verbosity > 1)
                         fprintf(stderr, "INFO: Moved to latitude/longitude "
                                         "cell (%f,%f)-(%f,%f)\n",
-                                        left_lat, left_lon, right_lat, right_lon);
+                                        cache->left_lat, cache->left_lon, cache->right_lat, cache->right_lon);
 
-                have_valid_latlon_cache = 1;
+                cache->have_valid_latlon_cache = 1;
         }
 
         // compute the normalised lat/lon co-ordinate within the cell we're in.
-        if(left_lat_idx != right_lat_idx)
-                lat_lambda = (lat - left_lat) / (right_lat - left_lat);
+        if(cache->left_lat_idx != cache->right_lat_idx)
+                lat_lambda = (lat - cache->left_lat) / (cache->right_lat - cache->left_lat);
         else
                 lat_lambda = 0.5f;
 
-        if(left_lon_idx != right_lon_idx)
-                lon_lambda = _longitude_distance(lon, left_lon) 
-                        / _longitude_distance(right_lon, left_lon);
+        if(cache->left_lon_idx != cache->right_lon_idx)
+                lon_lambda = _longitude_distance(lon, cache->left_lon) 
+                        / _longitude_distance(cache->right_lon, cache->left_lon);
         else
                 lon_lambda = 0.5f;
 
@@ -564,50 +714,50 @@ wind_file_get_wind(wind_file_t* file, float lat, float lon, float height,
         lon_lambda = (lon_lambda > 1.f) ? 1.f : lon_lambda;
 
         // use this normalised co-ordinate to check the left and right heights
-        if(have_valid_pressure_cache)
+        if(cache->have_valid_pressure_cache)
         {
                 float ll_height, lr_height, rl_height, rr_height;
 
                 // left
-                ll_height = _wind_file_get_height(file, left_lat_idx, left_lon_idx, left_pr_idx);
-                lr_height = _wind_file_get_height(file, left_lat_idx, right_lon_idx, left_pr_idx);
-                rl_height = _wind_file_get_height(file, right_lat_idx, left_lon_idx, left_pr_idx);
-                rr_height = _wind_file_get_height(file, right_lat_idx, right_lon_idx, left_pr_idx);
+                ll_height = _wind_file_get_height(file, cache->left_lat_idx, cache->left_lon_idx, cache->left_pr_idx);
+                lr_height = _wind_file_get_height(file, cache->left_lat_idx, cache->right_lon_idx, cache->left_pr_idx);
+                rl_height = _wind_file_get_height(file, cache->right_lat_idx, cache->left_lon_idx, cache->left_pr_idx);
+                rr_height = _wind_file_get_height(file, cache->right_lat_idx, cache->right_lon_idx, cache->left_pr_idx);
                 left_height = _bilinear_interpolate(ll_height, lr_height, rl_height, rr_height,
                                 lat_lambda, lon_lambda);
                 // if the leftmost height is too small and we can go lower...
-                if((left_height > height) && (left_pr_idx > 0))
-                        have_valid_pressure_cache = 0;
+                if((left_height > height) && (cache->left_pr_idx > 0))
+                        cache->have_valid_pressure_cache = 0;
 
                 // right
-                ll_height = _wind_file_get_height(file, left_lat_idx, left_lon_idx, right_pr_idx);
-                lr_height = _wind_file_get_height(file, left_lat_idx, right_lon_idx, right_pr_idx);
-                rl_height = _wind_file_get_height(file, right_lat_idx, left_lon_idx, right_pr_idx);
-                rr_height = _wind_file_get_height(file, right_lat_idx, right_lon_idx, right_pr_idx);
+                ll_height = _wind_file_get_height(file, cache->left_lat_idx, cache->left_lon_idx, cache->right_pr_idx);
+                lr_height = _wind_file_get_height(file, cache->left_lat_idx, cache->right_lon_idx, cache->right_pr_idx);
+                rl_height = _wind_file_get_height(file, cache->right_lat_idx, cache->left_lon_idx, cache->right_pr_idx);
+                rr_height = _wind_file_get_height(file, cache->right_lat_idx, cache->right_lon_idx, cache->right_pr_idx);
                 right_height = _bilinear_interpolate(ll_height, lr_height, rl_height, rr_height,
                                 lat_lambda, lon_lambda);
                 // if the rightmost height is too small and we can go higher...
-                if((right_height < height) && (right_pr_idx < file->axes[0]->n_values-1))
-                        have_valid_pressure_cache = 0;
+                if((right_height < height) && (cache->right_pr_idx < file->axes[0]->n_values-1))
+                        cache->have_valid_pressure_cache = 0;
         }
         
         // if our height cache is out of whack, find a better cell.
-        if(!have_valid_pressure_cache)
+        if(!cache->have_valid_pressure_cache)
         {
                 // search along all heights to find what pressure level we're at
-                left_pr_idx = right_pr_idx = file->axes[0]->n_values;
+                cache->left_pr_idx = cache->right_pr_idx = file->axes[0]->n_values;
                 left_height = right_height = -1.f;
                 for(i=0; i<file->axes[0]->n_values; ++i)
                 {
                         // get heights for each corner of our lat/lon cell.
                         float ll_height = _wind_file_get_height(file, 
-                                        left_lat_idx, left_lon_idx, i);
+                                        cache->left_lat_idx, cache->left_lon_idx, i);
                         float lr_height = _wind_file_get_height(file, 
-                                        left_lat_idx, right_lon_idx, i);
+                                        cache->left_lat_idx, cache->right_lon_idx, i);
                         float rl_height = _wind_file_get_height(file, 
-                                        right_lat_idx, left_lon_idx, i);
+                                        cache->right_lat_idx, cache->left_lon_idx, i);
                         float rr_height = _wind_file_get_height(file,
-                                        right_lat_idx, right_lon_idx, i);
+                                        cache->right_lat_idx, cache->right_lon_idx, i);
 
                         // interpolate within our cell.
                         float interp_height = _bilinear_interpolate(
@@ -616,49 +766,49 @@ wind_file_get_wind(wind_file_t* file, float lat, float lon, float height,
 
                         if((interp_height <= height) && 
                            ((interp_height >= left_height) || 
-                            (left_pr_idx == file->axes[0]->n_values)))
+                            (cache->left_pr_idx == file->axes[0]->n_values)))
                         {
-                                left_pr_idx = i;
+                                cache->left_pr_idx = i;
                                 left_height = interp_height;
                         }
 
                         if((interp_height >= height) && 
                            ((interp_height <= right_height) ||
-                            (right_pr_idx == file->axes[0]->n_values)))
+                            (cache->right_pr_idx == file->axes[0]->n_values)))
                         {
-                                right_pr_idx = i;
+                                cache->right_pr_idx = i;
                                 right_height = interp_height;
                         }
                 }
 
-                if(left_pr_idx == file->axes[0]->n_values)
+                if(cache->left_pr_idx == file->axes[0]->n_values)
                 {
-                        left_pr_idx = right_pr_idx;
+                        cache->left_pr_idx = cache->right_pr_idx;
                         if(verbosity > 0)
                                 fprintf(stderr, "WARN: Moved to %.2fm, below height where we "
                                                 "have data. "
                                                 "Assuming we're at %.fmb or approx. %.2fm.\n",
                                                 height,
-                                                file->axes[0]->values[left_pr_idx],
+                                                file->axes[0]->values[cache->left_pr_idx],
                                                 _wind_file_get_height(file,
-                                                        left_lat_idx, left_lon_idx, left_pr_idx));
+                                                        cache->left_lat_idx, cache->left_lon_idx, cache->left_pr_idx));
                 }
 
-                if(right_pr_idx == file->axes[0]->n_values)
+                if(cache->right_pr_idx == file->axes[0]->n_values)
                 {
-                        right_pr_idx = left_pr_idx;
+                        cache->right_pr_idx = cache->left_pr_idx;
                         if(verbosity > 0)
                                 fprintf(stderr, "WARN: Moved to %.2fm, above height where we "
                                                 "have data. "
                                                 "Assuming we're at %.fmb or approx. %.2fm.\n",
                                                 height,
-                                                file->axes[0]->values[right_pr_idx],
+                                                file->axes[0]->values[cache->right_pr_idx],
                                                 _wind_file_get_height(file,
-                                                        left_lat_idx, left_lon_idx, right_pr_idx));
+                                                        cache->left_lat_idx, cache->left_lon_idx, cache->right_pr_idx));
                 }
 
-                if((left_pr_idx == file->axes[0]->n_values) ||
-                   (right_pr_idx == file->axes[0]->n_values))
+                if((cache->left_pr_idx == file->axes[0]->n_values) ||
+                   (cache->right_pr_idx == file->axes[0]->n_values))
                 {
                         fprintf(stderr, "ERROR: Moved to a totally stupid height (%f). "
                                         "Giving up!\n", height);
@@ -667,14 +817,14 @@ wind_file_get_wind(wind_file_t* file, float lat, float lon, float height,
 
                 if(verbosity > 1)
                         fprintf(stderr, "INFO: Moved to pressure cell (%.fmb, %.fmb)\n", 
-                                        file->axes[0]->values[left_pr_idx],
-                                        file->axes[0]->values[right_pr_idx]);
+                                        file->axes[0]->values[cache->left_pr_idx],
+                                        file->axes[0]->values[cache->right_pr_idx]);
 
-                have_valid_pressure_cache = 1;
+                cache->have_valid_pressure_cache = 1;
         }
 
         // compute the normalised pressure co-ordinate within the cell we're in.
-        if(left_pr_idx != right_pr_idx)
+        if(cache->left_pr_idx != cache->right_pr_idx)
                 pr_lambda = (height - left_height) / (right_height - left_height);
         else
                 pr_lambda = 0.5f;
@@ -711,13 +861,13 @@ wind_file_get_wind(wind_file_t* file, float lat, float lon, float height,
 
                 // let's get the wind u and v for the lower lat/lon cell
                 _wind_file_get_wind_raw(file, 
-                                left_lat_idx, left_lon_idx, left_pr_idx, &llu, &llv);
+                                cache->left_lat_idx, cache->left_lon_idx, cache->left_pr_idx, &llu, &llv);
                 _wind_file_get_wind_raw(file, 
-                                left_lat_idx, right_lon_idx, left_pr_idx, &lru, &lrv);
+                                cache->left_lat_idx, cache->right_lon_idx, cache->left_pr_idx, &lru, &lrv);
                 _wind_file_get_wind_raw(file, 
-                                right_lat_idx, left_lon_idx, left_pr_idx, &rlu, &rlv);
+                                cache->right_lat_idx, cache->left_lon_idx, cache->left_pr_idx, &rlu, &rlv);
                 _wind_file_get_wind_raw(file, 
-                                right_lat_idx, right_lon_idx, left_pr_idx, &rru, &rrv);
+                                cache->right_lat_idx, cache->right_lon_idx, cache->left_pr_idx, &rru, &rrv);
 
                 lowu = _bilinear_interpolate(llu, lru, rlu, rru, lat_lambda, lon_lambda);
                 lowv = _bilinear_interpolate(llv, lrv, rlv, rrv, lat_lambda, lon_lambda);
@@ -736,13 +886,13 @@ wind_file_get_wind(wind_file_t* file, float lat, float lon, float height,
                 
                 // let's get the wind u and v for the upper lat/lon cell
                 _wind_file_get_wind_raw(file, 
-                                left_lat_idx, left_lon_idx, right_pr_idx, &llu, &llv);
+                                cache->left_lat_idx, cache->left_lon_idx, cache->right_pr_idx, &llu, &llv);
                 _wind_file_get_wind_raw(file, 
-                                left_lat_idx, right_lon_idx, right_pr_idx, &lru, &lrv);
+                                cache->left_lat_idx, cache->right_lon_idx, cache->right_pr_idx, &lru, &lrv);
                 _wind_file_get_wind_raw(file, 
-                                right_lat_idx, left_lon_idx, right_pr_idx, &rlu, &rlv);
+                                cache->right_lat_idx, cache->left_lon_idx, cache->right_pr_idx, &rlu, &rlv);
                 _wind_file_get_wind_raw(file, 
-                                right_lat_idx, right_lon_idx, right_pr_idx, &rru, &rrv);
+                                cache->right_lat_idx, cache->right_lon_idx, cache->right_pr_idx, &rru, &rrv);
 
                 highu = _bilinear_interpolate(llu, lru, rlu, rru, lat_lambda, lon_lambda);
                 highv = _bilinear_interpolate(llv, lrv, rlv, rrv, lat_lambda, lon_lambda);
@@ -781,5 +931,202 @@ wind_file_get_wind(wind_file_t* file, float lat, float lon, float height,
         return 1;
 }
 
+int
+wind_file_cell(wind_file_t* file, float lat, float lon)
+{
+        float lat_f, lon_f;
+
+        if(!file->regular)
+                return -1;
+
+        lon -= file->lon0;
+        lon -= 360.f * floorf(lon / 360.f);
+        lat_f = (lat - file->lat0) / file->dlat;
+        lon_f = lon / file->dlon;
+
+        if((lat_f < 0.f) || (lat_f >= (float)file->axes[1]->n_values) ||
+           (lon_f >= (float)file->axes[2]->n_values))
+                return -1;
+
+        return (int)lat_f * file->axes[2]->n_values + (int)lon_f;
+}
+
+// Points are looked up in chunks of this many, so that the intermediate values
+// for each point can be kept on the stack.
+#define BATCH_CHUNK 256
+
+int
+wind_file_get_wind_batch(wind_file_t* file, unsigned int n,
+                const float *lat, const float *lon, const float *height,
+                unsigned char *pr_idx,
+                float *windu, float *windv, float *var)
+{
+        const int nc = file->n_components;
+        const unsigned int n_pr = file->axes[0]->n_values;
+        const unsigned int n_lat = file->axes[1]->n_values;
+        const unsigned int n_lon = file->axes[2]->n_values;
+        const int row = nc * n_lon;
+        const int level = row * n_lat;
+        float inv_dlat, inv_dlon;
+        unsigned int start;
+
+        if(!file->regular || (n_pr > 255))
+                return 0;
+
+        inv_dlat = 1.f / file->dlat;
+        inv_dlon = 1.f / file->dlon;
+
+        for(start=0; start<n; start+=BATCH_CHUNK)
+        {
+                const unsigned int m = (n - start < BATCH_CHUNK) ? n - start : BATCH_CHUNK;
+                const float *clat = lat + start;
+                const float *clon = lon + start;
+                const float *cheight = height + start;
+                unsigned char *cpr = pr_idx + start;
+                float * restrict cwindu = windu + start;
+                float * restrict cwindv = windv + start;
+                float * restrict cvar = var + start;
+
+                float lat_f[BATCH_CHUNK], lon_f[BATCH_CHUNK];
+                float lat_lambda[BATCH_CHUNK], lon_lambda[BATCH_CHUNK], pr_lambda[BATCH_CHUNK];
+                int offset[BATCH_CHUNK], upper[BATCH_CHUNK];
+                float u[8][BATCH_CHUNK], v[8][BATCH_CHUNK];
+                int outside = 0;
+                unsigned int i;
+
+                // position of each point in grid cells from the first grid point.
+                for(i=0; i<m; ++i)
+                {
+                        // canonicalise the longitude difference (rounding down, not towards zero)
+                        float dlon = clon[i] - file->lon0;
+                        int turns = (int)(dlon * (1.f / 360.f));
+                        turns -= (dlon < 360.f * turns);
+                        dlon -= 360.f * turns;
+
+                        lat_f[i] = (clat[i] - file->lat0) * inv_dlat;
+                        lon_f[i] = dlon * inv_dlon;
+                        outside |= (lat_f[i] < 0.f) | (lat_f[i] > (float)(n_lat - 1)) |
+                                (lon_f[i] > (float)(n_lon - 1));
+                }
+
+                // leave points right on the edge of the file to wind_file_get_wind.
+                if(outside)
+                        return 0;
+
+                // cell containing each point, and the normalised co-ordinate within it.
+                for(i=0; i<m; ++i)
+                {
+                        int lat_idx = (int)lat_f[i];
+                        int lon_idx = (int)lon_f[i];
+                        lat_idx = (lat_idx > (int)n_lat - 2) ? (int)n_lat - 2 : lat_idx;
+                        lon_idx = (lon_idx > (int)n_lon - 2) ? (int)n_lon - 2 : lon_idx;
+
+                        lat_lambda[i] = lat_f[i] - (float)lat_idx;
+                        lon_lambda[i] = lon_f[i] - (float)lon_idx;
+                        offset[i] = nc * lon_idx + row * lat_idx;
+                }
+
+                // pressure levels either side of each point. Points don't move far
+                // between lookups, so walk from the level used last time.
+                for(i=0; i<m; ++i)
+                {
+                        const float a = lat_lambda[i], b = lon_lambda[i];
+                        const float w_ll = (1.f-a)*(1.f-b), w_lr = (1.f-a)*b;
+                        const float w_rl = a*(1.f-b), w_rr = a*b;
+                        const float *cell = file->data + offset[i];
+                        unsigned int k = (cpr[i] < n_pr - 1) ? cpr[i] : n_pr - 2;
+                        float h_low, h_high, lambda;
+
+#define CELL_HEIGHT(k) (w_ll*cell[(k)*level] + w_lr*cell[(k)*level + nc] + \
+                        w_rl*cell[(k)*level + row] + w_rr*cell[(k)*level + row + nc])
+
+                        h_low = CELL_HEIGHT(k);
+                        h_high = CELL_HEIGHT(k+1);
+                        while((cheight[i] > h_high) && (k < n_pr - 2))
+                        {
+                                k++;
+                                h_low = h_high;
+                                h_high = CELL_HEIGHT(k+1);
+                        }
+                        while((cheight[i] < h_low) && (k > 0))
+                        {
+                                k--;
+                                h_high = h_low;
+                                h_low = CELL_HEIGHT(k);
+                        }
+#undef CELL_HEIGHT
+
+                        cpr[i] = k;
+                        offset[i] += k * level;
+                        upper[i] = level;
+
+                        // above or below our data, as per wind_file_get_wind, use the
+                        // nearest level for both sides of the pressure cell.
+                        if(cheight[i] < h_low)
+                        {
+                                upper[i] = 0;
+                        } else if(cheight[i] > h_high) {
+                                offset[i] += level;
+                                upper[i] = 0;
+                        }
+
+                        lambda = (cheight[i] - h_low) / (h_high - h_low);
+                        lambda = (lambda < 0.f) ? 0.f : lambda;
+                        pr_lambda[i] = (lambda > 1.f) ? 1.f : lambda;
+                }
+
+                // gather the wind at the corners of each point's cell, above and below it...
+                for(i=0; i<m; ++i)
+                {
+                        const float *lo = file->data + offset[i];
+                        const float *hi = lo + upper[i];
+                        const int corner[4] = { 0, nc, row, row + nc };
+                        int c;
+
+                        for(c=0; c<4; ++c)
+                        {
+                                u[c][i] = lo[corner[c] + 1];
+                                v[c][i] = lo[corner[c] + 2];
+                                u[c+4][i] = hi[corner[c] + 1];
+                                v[c+4][i] = hi[corner[c] + 2];
+                        }
+                }
+
+                // ...then interpolate it, and compute the neighbourhood variance, as
+                // per wind_file_get_wind.
+                for(i=0; i<m; ++i)
+                {
+                        const float a = lat_lambda[i], b = lon_lambda[i], p = pr_lambda[i];
+                        const float w_ll = (1.f-a)*(1.f-b), w_lr = (1.f-a)*b;
+                        const float w_rl = a*(1.f-b), w_rr = a*b;
+
+                        const float lowu = w_ll*u[0][i] + w_lr*u[1][i] + w_rl*u[2][i] + w_rr*u[3][i];
+                        const float lowv = w_ll*v[0][i] + w_lr*v[1][i] + w_rl*v[2][i] + w_rr*v[3][i];
+                        const float highu = w_ll*u[4][i] + w_lr*u[5][i] + w_rl*u[6][i] + w_rr*u[7][i];
+                        const float highv = w_ll*v[4][i] + w_lr*v[5][i] + w_rl*v[6][i] + w_rr*v[7][i];
+
+                        const float umean = 0.125f * (u[0][i] + u[1][i] + u[2][i] + u[3][i] +
+                                        u[4][i] + u[5][i] + u[6][i] + u[7][i]);
+                        const float vmean = 0.125f * (v[0][i] + v[1][i] + v[2][i] + v[3][i] +
+                                        v[4][i] + v[5][i] + v[6][i] + v[7][i]);
+                        const float usqmean = 0.125f * (u[0][i]*u[0][i] + u[1][i]*u[1][i] +
+                                        u[2][i]*u[2][i] + u[3][i]*u[3][i] + u[4][i]*u[4][i] +
+                                        u[5][i]*u[5][i] + u[6][i]*u[6][i] + u[7][i]*u[7][i]);
+                        const float vsqmean = 0.125f * (v[0][i]*v[0][i] + v[1][i]*v[1][i] +
+                                        v[2][i]*v[2][i] + v[3][i]*v[3][i] + v[4][i]*v[4][i] +
+                                        v[5][i]*v[5][i] + v[6][i]*v[6][i] + v[7][i]*v[7][i]);
+
+                        cwindu[i] = lowu * (1.f - p) + highu * p;
+                        cwindv[i] = lowv * (1.f - p) + highv * p;
+                        cvar[i] = 0.5f * ((usqmean - umean*umean) + (vsqmean - vmean*vmean));
+                }
+        }
+
+        if(stats_enabled)
+                pred_stats.interpolations += n;
+
+        return n;
+}
+
 // Data for God's own editor.
 // vim:sw=8:ts=8:et:cindent
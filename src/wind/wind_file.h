@@ -38,6 +38,31 @@ int                     wind_file_get_wind     (wind_file_t        *file,
                                                 float              *windusq,
                                                 float              *windvsq);
 
+//                      Number of the lat/lon grid cell containing a point, for grouping points
+//                      by cell. Returns -1 if the point is outside of the file, or the file's
+//                      grid isn't supported by the batched lookup.
+int                     wind_file_cell         (wind_file_t        *file,
+                                                float               lat,
+                                                float               lon);
+
+//                      Batched version of wind_file_get_wind, for 'n' points held in separate
+//                      lat, lon and height arrays. 'pr_idx' holds the lower pressure level used
+//                      for each point by the previous lookup (or 0), and is updated. 'var'
+//                      receives the neighbourhood variance of u and v flattened into one value,
+//                      0.5 * (windusq + windvsq). Returns 'n', or 0 if the file's grid isn't
+//                      supported by the batched lookup or a point lies on the edge of (or
+//                      outside) the file, in which case wind_file_get_wind should be used.
+int                     wind_file_get_wind_batch
+                                               (wind_file_t        *file,
+                                                unsigned int        n,
+                                                const float        *lat,
+                                                const float        *lon,
+                                                const float        *height,
+                                                unsigned char      *pr_idx,
+                                                float              *windu,
+                                                float              *windv,
+                                                float              *var);
+
 #ifdef __cplusplus
 }
 #endif // __cplusplus
@@ -25,8 +25,11 @@
 #include <errno.h>
 #include <string.h>
 #include <math.h>
+#include <pthread.h>
 
 #include "../util/getline.h"
+#include "../util/zfile.h"
+#include "../stats.h"
 
 extern int verbosity;
 
@@ -48,6 +51,10 @@ struct wind_file_cache_s
 
 // Yuk! Needed to make use of scandir. Gotta love APIs designed in the 80s.
 static wind_file_cache_t* _scandir_current_cache;
+static pthread_mutex_t _scandir_lock = PTHREAD_MUTEX_INITIALIZER;
+
+// Guards the lazy loading of files, so that a cache can be shared between threads.
+static pthread_mutex_t _load_lock = PTHREAD_MUTEX_INITIALIZER;
 
 static int
 _parse_header(const char* filepath,
@@ -59,8 +66,8 @@ _parse_header(const char* filepath,
         char* line;
         size_t line_len;
 
-        // Can I open this file?
-        file = fopen(filepath, "r");
+        // Can I open this file? (Compressed files are decompressed as they are read.)
+        file = zfile_open(filepath);
         if(!file) {
                 // No, abort
                 return 0;
@@ -99,6 +106,142 @@ _parse_header(const char* filepath,
         return 1;
 }
 
+static char*
+_join_path(const char* directory, const char* name)
+{
+        int filepath_len;
+        char* filepath;
+
+        filepath_len = 1 + snprintf(NULL, 0, "%s/%s", directory, name);
+        filepath = (char*)malloc(filepath_len);
+        snprintf(filepath, filepath_len, "%s/%s", directory, name);
+
+        return filepath;
+}
+
+// Compare the modification times of two files, with sub-second resolution.
+static int
+_mtime_compare(const struct stat *a, const struct stat *b)
+{
+#ifdef __APPLE__
+        const struct timespec *ta = &a->st_mtimespec, *tb = &b->st_mtimespec;
+#else
+        const struct timespec *ta = &a->st_mtim, *tb = &b->st_mtim;
+#endif
+        if(ta->tv_sec != tb->tv_sec)
+                return (ta->tv_sec < tb->tv_sec) ? -1 : 1;
+        if(ta->tv_nsec != tb->tv_nsec)
+                return (ta->tv_nsec < tb->tv_nsec) ? -1 : 1;
+        return 0;
+}
+
+// Load the entries from the directory's index file (as written by the python
+// wrapper), rather than opening every file in the directory. The index is only
+// used if it is at least as new as the directory itself, i.e. no files have
+// been added, removed or renamed since it was written.
+// Returns 1 if the index was loaded, 0 if the directory needs to be scanned.
+static int
+_load_index(wind_file_cache_t* self)
+{
+        char* index_path;
+        struct stat dir_stat, index_stat;
+        FILE* file;
+        char *buffer, *line, *next, *comma;
+        size_t size;
+        unsigned int n_lines;
+
+        index_path = _join_path(self->directory_name, WIND_INDEX_FILENAME);
+        if((stat(self->directory_name, &dir_stat) < 0) || (stat(index_path, &index_stat) < 0))
+        {
+                free(index_path);
+                return 0;
+        }
+
+        if(_mtime_compare(&index_stat, &dir_stat) < 0)
+        {
+                if(verbosity > 0)
+                        fprintf(stderr, "INFO: Directory index is out of date.\n");
+                free(index_path);
+                return 0;
+        }
+
+        // Read the whole index in one go.
+        file = fopen(index_path, "r");
+        free(index_path);
+        if(!file)
+                return 0;
+
+        size = index_stat.st_size;
+        buffer = (char*)malloc(size + 1);
+        if(fread(buffer, 1, size, file) != size)
+        {
+                free(buffer);
+                fclose(file);
+                return 0;
+        }
+        buffer[size] = '\0';
+        fclose(file);
+
+        // There is at most one entry per line.
+        n_lines = 1;
+        for(line = buffer; *line; ++line)
+                if(*line == '\n')
+                        n_lines++;
+
+        self->entries = (struct wind_file_cache_entry_s**)malloc(sizeof(struct wind_file_cache_entry_s*)*n_lines);
+        self->n_entries = 0;
+
+        for(line = buffer; line && *line; line = next)
+        {
+                struct wind_file_cache_entry_s* entry;
+
+                next = strchr(line, '\n');
+                if(next)
+                        *(next++) = '\0';
+
+                // Skip comments and blank lines.
+                if((line[0] == '#') || (line[0] == '\0'))
+                        continue;
+
+                // filename,window centre lat,lat radius,window centre lon,lon radius,POSIX timestamp
+                comma = strchr(line, ',');
+                if(!comma)
+                        goto invalid;
+                *comma = '\0';
+
+                entry = (struct wind_file_cache_entry_s*)malloc(sizeof(struct wind_file_cache_entry_s));
+                if(5 != sscanf(comma + 1, "%f,%f,%f,%f,%ld",
+                                &entry->lat, &entry->latrad, &entry->lon, &entry->lonrad, &entry->timestamp))
+                {
+                        free(entry);
+                        goto invalid;
+                }
+
+                entry->filepath = _join_path(self->directory_name, line);
+                entry->loaded_file = NULL;
+                self->entries[self->n_entries++] = entry;
+        }
+
+        free(buffer);
+
+        return 1;
+
+invalid:
+        fprintf(stderr, "WARN: Could not parse the directory index.\n");
+
+        while(self->n_entries > 0)
+        {
+                self->n_entries--;
+                free(self->entries[self->n_entries]->filepath);
+                free(self->entries[self->n_entries]);
+        }
+        free(self->entries);
+        self->entries = NULL;
+        free(buffer);
+
+        return 0;
+}
+
 #ifdef __APPLE__
 static int
 _file_filter(struct dirent *entry)
@@ -156,20 +299,47 @@ wind_file_cache_new(const char *directory)
         wind_file_cache_t* self;
         int rv, i;
         struct dirent **dir_entries;
+        double start = 0.0;
 
         assert(directory);
 
+        if(stats_enabled)
+                start = stats_now();
+
         // Allocate memory for ourself
         self = (wind_file_cache_t*) malloc(sizeof(wind_file_cache_t));
         self->n_entries = 0;
+        self->entries = NULL;
         self->directory_name = strdup(directory);
 
+        if(_load_index(self))
+        {
+                if(verbosity > 0)
+                        fprintf(stderr, "INFO: Loaded index of %i data files in '%s'.\n", self->n_entries, directory);
+
+                if(verbosity > 1) {
+                        for(i=0; i<self->n_entries; ++i)
+                                fprintf(stderr, "INFO: Found %s.\n", self->entries[i]->filepath);
+                }
+
+                if(stats_enabled) {
+                        pred_stats.dir_scans++;
+                        pred_stats.index_loads++;
+                        pred_stats.files_indexed += self->n_entries;
+                        pred_stats.dir_scan_time += stats_now() - start;
+                }
+
+                return self;
+        }
+
         if(verbosity > 0)
                 fprintf(stderr, "INFO: Scanning directory '%s'.\n", directory);
 
         // Use scandir scan the directory looking for data files.
+        pthread_mutex_lock(&_scandir_lock);
         _scandir_current_cache = self; // ew!
         rv = scandir(directory, &dir_entries, _file_filter, alphasort);
+        pthread_mutex_unlock(&_scandir_lock);
         if(rv < 0) {
                 perror(NULL);
                 wind_file_cache_free(self);
@@ -226,6 +396,12 @@ wind_file_cache_new(const char *directory)
         // finished with the dir entries.
         free(dir_entries);
 
+        if(stats_enabled) {
+                pred_stats.dir_scans++;
+                pred_stats.files_indexed += self->n_entries;
+                pred_stats.dir_scan_time += stats_now() - start;
+        }
+
         return self;
 }
 
@@ -243,6 +419,8 @@ wind_file_cache_free(wind_file_cache_t *cache)
                 for(i=0; i<cache->n_entries; ++i)
                 {
                         free(cache->entries[i]->filepath);
+                        if(cache->entries[i]->loaded_file)
+                                wind_file_free(cache->entries[i]->loaded_file);
                         free(cache->entries[i]);
                         cache->entries[i] = NULL;
                 }
@@ -252,6 +430,14 @@ wind_file_cache_free(wind_file_cache_t *cache)
         free(cache);
 }
 
+unsigned int
+wind_file_cache_n_entries(wind_file_cache_t *cache)
+{
+        if(!cache)
+                return 0;
+        return cache->n_entries;
+}
+
 static float
 _lon_dist(float a, float b)
 {
@@ -281,6 +467,8 @@ wind_file_cache_find_entry(wind_file_cache_t *cache,
                 wind_file_cache_entry_t** earlier,
                 wind_file_cache_entry_t** later)
 {
+        double start = 0.0;
+
         assert(cache && earlier && later);
 
         *earlier = *later = NULL;
@@ -289,6 +477,9 @@ wind_file_cache_find_entry(wind_file_cache_t *cache,
         if(cache->n_entries == 0)
                 return;
 
+        if(stats_enabled)
+                start = stats_now();
+
         // Search for earlier and later entries which match
         unsigned int i;
         for(i=0; i<cache->n_entries; ++i)
@@ -310,6 +501,11 @@ wind_file_cache_find_entry(wind_file_cache_t *cache,
                         }
                 }
         }
+
+        if(stats_enabled) {
+                pred_stats.cache_lookups++;
+                pred_stats.cache_lookup_time += stats_now() - start;
+        }
 }
 
 const char*
@@ -332,19 +528,29 @@ wind_file_t*
 wind_file_cache_entry_file(wind_file_cache_entry_t *entry)
 {
         const char* filepath;
+        wind_file_t* file;
 
         if(!entry)
                 return NULL;
 
-        if(entry->loaded_file)
-                return entry->loaded_file;
+        file = __atomic_load_n(&entry->loaded_file, __ATOMIC_ACQUIRE);
+        if(file)
+                return file;
 
         filepath = wind_file_cache_entry_file_path(entry);
         if(!filepath)
                 return NULL;
 
-        entry->loaded_file = wind_file_new(filepath);
-        return entry->loaded_file;
+        // Another thread may have loaded the file while we waited for the lock.
+        pthread_mutex_lock(&_load_lock);
+        file = entry->loaded_file;
+        if(!file) {
+                file = wind_file_new(filepath);
+                __atomic_store_n(&entry->loaded_file, file, __ATOMIC_RELEASE);
+        }
+        pthread_mutex_unlock(&_load_lock);
+
+        return file;
 }
 
 // Data for God's own editor.
@@ -19,6 +19,14 @@
 // the header and parse out their timestamp and window information. It then
 // allows one to query for files closest in time and space for a specified
 // latitude/longitude/time.
+//
+// If the directory contains an up-to-date index file (listing the header
+// information of each file), this is read instead of scanning the directory.
+// Each line of the index is: filename,window centre latitude,window latitude
+// radius,window centre longitude,window longitude radius,POSIX timestamp
+// The index is only used if it was modified no earlier than the directory.
+
+#define WIND_INDEX_FILENAME     "wind_index.txt"
 
 #ifdef __cplusplus
 extern "C" {
@@ -36,6 +44,10 @@ wind_file_cache_t      *wind_file_cache_new    (const char               *direct
 //                      Free resources associated with 'cache'.
 void                    wind_file_cache_free   (wind_file_cache_t        *cache);
 
+//                      Number of wind files found in the cache's directory.
+unsigned int            wind_file_cache_n_entries
+                                               (wind_file_cache_t        *cache);
+
 //                      Search for a cache entry closest to the specified lat, lon and time.
 //                      *earlier and *later are set to the nearest cache entries which are
 //                      (respectively) earlier and later.
@@ -0,0 +1,86 @@
+#
+#   Project Horus
+#   CUSF Standalone Predictor Python Wrapper - Test Fixtures
+#   Copyright 2020 Mark Jessop <vk5qi@rfhead.net>
+#
+#   Tests run offline, against synthetic wind datasets (see benchmarks/synthetic.py).
+#   Tests of the predictor itself need a pred binary (CUSFPREDICT_PRED, or 'pred' on the PATH)
+#   and/or the libpred shared library (CUSFPREDICT_LIB, see cusfpredict.engine.find_library),
+#   and are skipped if they are not available.
+#
+import calendar
+import datetime
+import os
+import shutil
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+
+# Model time of the synthetic datasets.
+MODEL_DT = datetime.datetime(2026, 10, 19, 0)
+
+
+def crop_wind_dict(data, lat, lon, radius):
+    ''' Crop a wind dictionary (as produced by cusfpredict.gfs.parse_grib_to_dict) to lat/lon +/- radius '''
+    from cusfpredict.gfs import crop_window
+
+    (_lats, _lons) = crop_window(data['lat_scale'], data['lon_scale'], lat, lon, radius, radius)
+    _output = dict(data)
+    _output['lat_scale'] = data['lat_scale'][_lats]
+    _output['lon_scale'] = data['lon_scale'][_lons]
+    _output['lat_centre'] = _output['lat_scale'][len(_lats)//2]
+    _output['lon_centre'] = _output['lon_scale'][len(_lons)//2]
+    _output['lat_radius'] = (max(_output['lat_scale']) - min(_output['lat_scale']))/2.0
+    _output['lon_radius'] = (max(_output['lon_scale']) - min(_output['lon_scale']))/2.0
+    for _level in [_key for _key in data if type(_key) == int]:
+        _output[_level] = {_param: _values[np.ix_(_lats, _lons)] for (_param, _values) in data[_level].items()}
+    return _output
+
+
+@pytest.fixture
+def make_dataset(tmp_path):
+    '''
+    Returns a function writing a synthetic dataset into a new directory: <hours> hourly files from MODEL_DT,
+    with the files from hour <crop_from> onwards cropped to +/- crop_radius degrees. Returns the directory.
+    '''
+    from synthetic import synthetic_wind_dict
+    from cusfpredict.gfs import wind_dict_to_cusf, write_dataset_info, index_dataset
+
+    def _make_dataset(name, hours=9, lat=-34.0, lon=138.0, radius=10.0, seed=0, crop_from=None, crop_radius=None):
+        _dir = str(tmp_path / name)
+        os.makedirs(_dir)
+        for _hour in range(hours):
+            _valid_time = calendar.timegm((MODEL_DT + datetime.timedelta(hours=_hour)).timetuple())
+            _data = synthetic_wind_dict(_valid_time, lat=lat, lon=lon, radius=radius, seed=seed)
+            if (crop_from is not None) and (_hour >= crop_from):
+                _data = crop_wind_dict(_data, lat, lon, crop_radius)
+            wind_dict_to_cusf(_data, output_dir=_dir)
+        write_dataset_info(_dir, MODEL_DT)
+        index_dataset(_dir)
+        return _dir
+
+    return _make_dataset
+
+
+@pytest.fixture
+def libpred():
+    ''' Path to the libpred shared library '''
+    from cusfpredict.engine import find_library
+
+    _path = find_library()
+    if _path is None:
+        pytest.skip("libpred shared library not found (set CUSFPREDICT_LIB)")
+    return _path
+
+
+@pytest.fixture
+def pred_binary():
+    ''' Path to the pred binary '''
+    _path = os.environ.get('CUSFPREDICT_PRED') or shutil.which('pred')
+    if not _path or not os.path.isfile(_path):
+        pytest.skip("pred binary not found (set CUSFPREDICT_PRED)")
+    return _path
@@ -0,0 +1,91 @@
+#
+#   Project Horus
+#   CUSF Standalone Predictor Python Wrapper - Offline GRIB Converter Tests
+#
+#   Converts synthetic GRIB files (see benchmarks/synthetic.py). Requires eccodes and cfgrib.
+#
+import calendar
+import datetime
+import os
+
+import pytest
+
+from conftest import MODEL_DT
+
+
+WINDOW = (-34.0, 138.0, 2.0, 2.0)
+
+
+@pytest.fixture
+def grib_dir(tmp_path):
+    ''' A directory of synthetic GRIB files for T+0 to T+2 '''
+    pytest.importorskip('eccodes')
+    pytest.importorskip('cfgrib')
+    from synthetic import synthetic_wind_dict, write_grib
+
+    _dir = tmp_path / 'grib'
+    _dir.mkdir()
+    for _hour in range(3):
+        _valid_time = calendar.timegm((MODEL_DT + datetime.timedelta(hours=_hour)).timetuple())
+        write_grib(synthetic_wind_dict(_valid_time, lat=WINDOW[0], lon=WINDOW[1], radius=4.0),
+            str(_dir / ('gfs.t00z.pgrb2.0p25.f%03d' % _hour)), MODEL_DT, _hour)
+    return str(_dir)
+
+
+def _write_gh_only(source, filename):
+    ''' Copy only the geopotential height messages of a GRIB file, which decodes, but can't be converted. '''
+    import eccodes
+
+    with open(source, 'rb') as _in, open(filename, 'wb') as _out:
+        while True:
+            _h = eccodes.codes_grib_new_from_file(_in)
+            if _h is None:
+                break
+            if eccodes.codes_get(_h, 'shortName') == 'gh':
+                eccodes.codes_write(_h, _out)
+            eccodes.codes_release(_h)
+
+
+def _dataset_files(output_dir):
+    return sorted(os.listdir(os.path.realpath(output_dir)))
+
+
+def test_convert_grib_files(tmp_path, grib_dir):
+    from cusfpredict.convert import convert_grib_files, CONVERT_MANIFEST_FILENAME
+    from cusfpredict.gfs import read_dataset_info
+    from cusfpredict.reader import read_cusf_header
+
+    _output_dir = str(tmp_path / 'gfs')
+    _summary = convert_grib_files([grib_dir], output_dir=_output_dir, window=WINDOW, workers=2)
+    assert (_summary['files'], _summary['converted'], _summary['failed']) == (3, 3, 0)
+    assert os.path.islink(_output_dir)
+    assert read_dataset_info(_output_dir) == MODEL_DT
+
+    _files = [_name for _name in _dataset_files(_output_dir) if _name.startswith('gfs_')]
+    assert len(_files) == 3
+    _header = read_cusf_header(os.path.join(_output_dir, _files[0]))
+    assert (min(_header['latitudes']), max(_header['latitudes'])) == (WINDOW[0] - WINDOW[2], WINDOW[0] + WINDOW[2])
+    assert os.path.isfile(os.path.join(_output_dir, CONVERT_MANIFEST_FILENAME))
+
+    # Nothing to do when re-run, and only a modified file is converted again.
+    _summary = convert_grib_files([grib_dir], output_dir=_output_dir, window=WINDOW, workers=2)
+    assert (_summary['converted'], _summary['reused'], _summary['published']) == (0, 3, None)
+
+    _modified = os.path.join(grib_dir, 'gfs.t00z.pgrb2.0p25.f001')
+    os.utime(_modified, ns=(os.stat(_modified).st_atime_ns, os.stat(_modified).st_mtime_ns + 1000000000))
+    _summary = convert_grib_files([grib_dir], output_dir=_output_dir, window=WINDOW, workers=2)
+    assert (_summary['converted'], _summary['reused']) == (1, 2)
+    assert [_name for _name in _dataset_files(_output_dir) if _name.startswith('gfs_')] == _files
+
+
+def test_failed_conversion_not_published(tmp_path, grib_dir):
+    ''' A file which fails part-way through conversion leaves nothing behind in the published dataset. '''
+    from cusfpredict.convert import convert_grib_files
+
+    _write_gh_only(os.path.join(grib_dir, 'gfs.t00z.pgrb2.0p25.f002'), os.path.join(grib_dir, 'gfs.t00z.pgrb2.0p25.f003'))
+
+    _output_dir = str(tmp_path / 'gfs')
+    _summary = convert_grib_files([grib_dir], output_dir=_output_dir, window=WINDOW, workers=2)
+    assert (_summary['files'], _summary['converted'], _summary['failed']) == (4, 3, 1)
+    assert [_name for _name in _dataset_files(_output_dir) if _name.startswith('.')] == []
+    assert [_name for _name in os.listdir(str(tmp_path)) if _name.startswith('.staging-')] == []
@@ -0,0 +1,105 @@
+#
+#   Project Horus
+#   CUSF Standalone Predictor Python Wrapper - Daemon Tests
+#
+#   Model cycle ingest (PredictionDaemon.ingest_cycle), with the forecast hour downloads stood in for,
+#   checking that a cycle is only published once every forecast hour has been ingested.
+#
+import datetime
+import os
+
+import pytest
+
+from cusfpredict import daemon
+from cusfpredict.gfs import read_dataset_info, write_dataset_info, publish_dataset
+
+
+PREVIOUS_DT = datetime.datetime(2026, 10, 18, 18)
+MODEL_DT = datetime.datetime(2026, 10, 19, 0)
+
+
+class _Watcher(object):
+    ''' Stand-in for cusfpredict.probe.CycleWatcher, with every forecast hour already published. '''
+
+    def __init__(self, model, model_dt, forecast_times):
+        self.forecast_times = forecast_times
+        self.complete = False
+
+    def watch(self, timeout=None):
+        for _hour in self.forecast_times:
+            yield _hour
+        self.complete = True
+
+
+@pytest.fixture
+def prediction_daemon(tmp_path, monkeypatch):
+    ''' A daemon with a published dataset (PREVIOUS_DT), and stand-ins for the download of each forecast hour '''
+    _output_dir = str(tmp_path / 'gfs')
+    _previous = str(tmp_path / 'previous')
+    os.makedirs(_previous)
+    write_dataset_info(_previous, PREVIOUS_DT)
+    publish_dataset(_previous, _output_dir, PREVIOUS_DT)
+
+    _config = str(tmp_path / 'daemon.cfg')
+    with open(_config, 'w') as _f:
+        _f.write("[daemon]\nfuture = 6\noutput_dir = %s\ningest_retries = 2\ningest_retry_delay = 0\n" % _output_dir)
+    _daemon = daemon.PredictionDaemon(*daemon.read_config(_config))
+    # Number of times each forecast hour fails to download, and the hours at which the daemon is stopped.
+    _daemon.failures = {}
+    _daemon.interrupt = []
+    _daemon.attempts = []
+
+    def _ingest_forecast_hour(forecast_time, output_dir, **kwargs):
+        _daemon.attempts.append(forecast_time)
+        if forecast_time in _daemon.interrupt:
+            raise KeyboardInterrupt()
+        if _daemon.failures.get(forecast_time, 0) > 0:
+            _daemon.failures[forecast_time] -= 1
+            return None
+        _filename = os.path.join(output_dir, 'gfs_%03d.dat' % forecast_time)
+        with open(_filename, 'w') as _f:
+            _f.write('data')
+        return _filename
+
+    monkeypatch.setattr(daemon, 'CycleWatcher', _Watcher)
+    monkeypatch.setattr(daemon, 'ingest_forecast_hour', _ingest_forecast_hour)
+    yield _daemon
+    _daemon.close()
+
+
+def _staging_dirs(prediction_daemon):
+    _parent = os.path.dirname(os.path.abspath(prediction_daemon.settings['output_dir']))
+    return [_name for _name in os.listdir(_parent) if _name.startswith('.staging-')]
+
+
+def test_ingest_cycle(prediction_daemon):
+    assert prediction_daemon.ingest_cycle(MODEL_DT) is not None
+    assert read_dataset_info(prediction_daemon.settings['output_dir']) == MODEL_DT
+    assert _staging_dirs(prediction_daemon) == []
+
+
+def test_failed_hour_retried(prediction_daemon):
+    ''' A forecast hour which fails once is retried, and the cycle published. '''
+    prediction_daemon.failures = {3: 1}
+    assert prediction_daemon.ingest_cycle(MODEL_DT) is not None
+    assert prediction_daemon.attempts.count(3) == 2
+    assert read_dataset_info(prediction_daemon.settings['output_dir']) == MODEL_DT
+    assert os.path.isfile(os.path.join(prediction_daemon.settings['output_dir'], 'gfs_003.dat'))
+
+
+def test_failed_hour_keeps_previous_dataset(prediction_daemon):
+    ''' A forecast hour which can't be ingested abandons the cycle, leaving the previous dataset published. '''
+    prediction_daemon.failures = {3: 10}
+    assert prediction_daemon.ingest_cycle(MODEL_DT) is None
+    assert prediction_daemon.attempts.count(3) == 3
+    assert read_dataset_info(prediction_daemon.settings['output_dir']) == PREVIOUS_DT
+    assert _staging_dirs(prediction_daemon) == []
+
+
+def test_interrupted_ingest_cleans_up(prediction_daemon):
+    ''' Stopping the daemon (SIGTERM is handled as per Ctrl-C) part-way through a cycle removes its staging directory. '''
+    prediction_daemon.interrupt = [3]
+    with pytest.raises(KeyboardInterrupt):
+        prediction_daemon.ingest_cycle(MODEL_DT)
+    assert read_dataset_info(prediction_daemon.settings['output_dir']) == PREVIOUS_DT
+    assert _staging_dirs(prediction_daemon) == []
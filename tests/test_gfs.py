@@ -0,0 +1,71 @@
+#
+#   Project Horus
+#   CUSF Standalone Predictor Python Wrapper - GFS Downloader Tests
+#
+#   The command line downloader (cusfpredict.gfs.main), with the model cycle lookup and the download of
+#   each forecast hour stood in for.
+#
+import datetime
+import os
+import sys
+
+import pytest
+
+from cusfpredict import gfs
+from cusfpredict.gfs import read_dataset_info, write_dataset_info
+
+
+PREVIOUS_DT = datetime.datetime(2026, 10, 18, 18)
+MODEL_DT = datetime.datetime(2026, 10, 19, 0)
+
+
+@pytest.fixture
+def run_main(tmp_path, monkeypatch):
+    ''' Returns a function running gfs.main() with the given arguments, writing a placeholder file for each forecast hour '''
+    def _ingest_forecast_hour(forecast_time, output_dir, **kwargs):
+        _filename = os.path.join(output_dir, 'gfs_%03d.dat' % forecast_time)
+        with open(_filename, 'w') as _f:
+            _f.write('data')
+        return _filename
+
+    monkeypatch.setattr(gfs, 'import_grib_decoder', lambda: None)
+    monkeypatch.setattr(gfs, 'determine_latest_available_dataset', lambda model, forecast_time: MODEL_DT)
+    monkeypatch.setattr(gfs, 'ingest_forecast_hour', _ingest_forecast_hour)
+
+    def _run_main(*args):
+        monkeypatch.setattr(sys, 'argv', ['gfs'] + list(args))
+        gfs.main()
+    return _run_main
+
+
+def test_main_replaces_dataset(tmp_path, run_main):
+    ''' A dataset downloaded by an earlier version (a plain directory) is replaced by the published dataset. '''
+    _output_dir = str(tmp_path / 'gfs')
+    os.makedirs(_output_dir)
+    write_dataset_info(_output_dir, PREVIOUS_DT)
+
+    run_main('-o', _output_dir, '-f', '3', '--profile', 'full')
+
+    assert read_dataset_info(_output_dir) == MODEL_DT
+    assert os.path.islink(_output_dir)
+    assert sorted([_name for _name in os.listdir(_output_dir) if _name.endswith('.dat')]) == \
+        ['gfs_000.dat', 'gfs_001.dat', 'gfs_002.dat', 'gfs_003.dat']
+    assert sorted(os.listdir(str(tmp_path))) == ['gfs', 'gfs.2026101900z']
+
+
+def test_main_plan_without_decoder(tmp_path, monkeypatch, run_main, capsys):
+    ''' Requests can be planned without the GRIB decoder installed, but nothing is downloaded without it. '''
+    def _import_grib_decoder():
+        raise ImportError("cfgrib not installed")
+    monkeypatch.setattr(gfs, 'import_grib_decoder', _import_grib_decoder)
+    _output_dir = str(tmp_path / 'gfs')
+
+    with pytest.raises(SystemExit) as e:
+        run_main('-o', _output_dir, '-f', '3', '--profile', 'full', '--plan')
+    assert e.value.code == 0
+    assert len(capsys.readouterr().out.splitlines()) == 4
+
+    with pytest.raises(SystemExit) as e:
+        run_main('-o', _output_dir, '-f', '3', '--profile', 'full')
+    assert e.value.code == 1
+    assert not os.path.exists(_output_dir)
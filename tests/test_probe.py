@@ -0,0 +1,136 @@
+#
+#   Project Horus
+#   CUSF Standalone Predictor Python Wrapper - GFS Model Availability Probing Tests
+#
+#   The NOMADS data server is stood in for by a local HTTP server (via the probes' base_url),
+#   serving the index files of whichever forecast hours a test has 'published'.
+#
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+import pytest
+
+from conftest import MODEL_DT
+from cusfpredict import probe
+from cusfpredict.gfs import latest_model_name, model_directory, model_filename
+
+
+MODEL = '0p25_1hr'
+
+
+class _DataServer(object):
+    ''' Local stand-in for the NOMADS data directories. '''
+
+    def __init__(self):
+        # Paths which exist, paths which respond with errors (a list of status codes, one per request),
+        # and the requests made, as (method, path).
+        self.published = set()
+        self.errors = {}
+        self.requests = []
+        self.no_head = False
+
+        _server = self
+        class _Handler(BaseHTTPRequestHandler):
+            def _respond(self, method):
+                _path = urlparse(self.path).path
+                _server.requests.append((method, _path))
+                if method == 'HEAD' and _server.no_head:
+                    _status = 405
+                elif _server.errors.get(_path):
+                    _status = _server.errors[_path].pop(0)
+                else:
+                    _status = 200 if _path in _server.published else 404
+                _body = b'1:0:d=2020010100:HGT:1000 mb:anl:\n' if (_status == 200 and method == 'GET') else b''
+                self.send_response(_status)
+                self.send_header('Content-Length', str(len(_body)))
+                self.end_headers()
+                self.wfile.write(_body)
+
+            def do_HEAD(self):
+                self._respond('HEAD')
+
+            def do_GET(self):
+                self._respond('GET')
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        self.base_url = "http://127.0.0.1:%d/gfs/prod" % self.httpd.server_port
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+
+    def path(self, model_dt, forecast_time):
+        ''' Path of the index file of a forecast hour '''
+        return "/gfs/prod/%s/%s.idx" % (model_directory(MODEL, model_dt), model_filename(MODEL, model_dt, forecast_time))
+
+
+    def publish(self, model_dt, forecast_times):
+        for _hour in forecast_times:
+            self.published.add(self.path(model_dt, _hour))
+
+
+@pytest.fixture
+def data_server(monkeypatch):
+    # No waiting between retries.
+    monkeypatch.setattr(probe, 'backoff_delay', lambda attempt: 0.0)
+    _server = _DataServer()
+    yield _server
+    _server.httpd.shutdown()
+    _server.httpd.server_close()
+
+
+def test_model_index_url():
+    _url = probe.model_index_url(MODEL, MODEL_DT, 3, base_url="http://127.0.0.1:8000/gfs/prod/")
+    assert _url == "http://127.0.0.1:8000/gfs/prod/gfs.20261019/00/atmos/gfs.t00z.pgrb2.0p25.f003.idx"
+
+
+def test_probe_forecast_hours(data_server):
+    data_server.publish(MODEL_DT, [0, 1, 2])
+    _results = probe.probe_forecast_hours(model=MODEL, model_dt=MODEL_DT, forecast_times=[0, 1, 2, 3, 4], base_url=data_server.base_url)
+    assert _results == {0: True, 1: True, 2: True, 3: False, 4: False}
+    assert all([_method == 'HEAD' for (_method, _) in data_server.requests])
+
+
+def test_probe_retries(data_server):
+    ''' Server errors are retried, and reported as unknown (None) if they persist. '''
+    data_server.publish(MODEL_DT, [0, 1])
+    data_server.errors[data_server.path(MODEL_DT, 0)] = [503, 500]
+    data_server.errors[data_server.path(MODEL_DT, 1)] = [503] * 10
+    _url = probe.model_index_url(MODEL, MODEL_DT, 0, base_url=data_server.base_url)
+    assert probe.probe_url(_url, retries=3) is True
+    _url = probe.model_index_url(MODEL, MODEL_DT, 1, base_url=data_server.base_url)
+    assert probe.probe_url(_url, retries=3) is None
+    assert len(data_server.requests) == 6
+
+
+def test_probe_without_head(data_server):
+    ''' Servers which don't support HEAD requests are probed with GET. '''
+    data_server.no_head = True
+    data_server.publish(MODEL_DT, [0])
+    assert probe.probe_url(probe.model_index_url(MODEL, MODEL_DT, 0, base_url=data_server.base_url)) is True
+    assert [_method for (_method, _) in data_server.requests] == ['HEAD', 'GET']
+
+
+def test_find_latest_cycle(data_server):
+    ''' The newest cycle with the requested forecast hour is found, skipping newer cycles still being published. '''
+    data_server.publish(latest_model_name(0), [0, 1, 2])
+    data_server.publish(latest_model_name(-1), [0, 1, 2, 6])
+    data_server.publish(latest_model_name(-2), [0, 1, 2, 6])
+    assert probe.find_latest_cycle(model=MODEL, forecast_time=6, base_url=data_server.base_url) == latest_model_name(-1)
+    assert probe.find_latest_cycle(model=MODEL, forecast_time=12, base_url=data_server.base_url) is None
+
+
+def test_cycle_watcher(data_server):
+    ''' Forecast hours are reported as they are published. '''
+    _watcher = probe.CycleWatcher(model=MODEL, model_dt=MODEL_DT, forecast_times=[0, 1, 2, 3], base_url=data_server.base_url)
+    assert _watcher.poll() == []
+
+    data_server.publish(MODEL_DT, [0, 1])
+    assert _watcher.poll() == [0, 1]
+    assert not _watcher.complete
+
+    data_server.publish(MODEL_DT, [2, 3])
+    assert list(_watcher.watch(timeout=5)) == [2, 3]
+    assert _watcher.complete
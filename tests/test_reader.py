@@ -0,0 +1,51 @@
+#
+#   Project Horus
+#   CUSF Standalone Predictor Python Wrapper - CUSF GFS File Reader Tests
+#
+import calendar
+
+import numpy as np
+import pytest
+
+from conftest import MODEL_DT
+
+
+@pytest.fixture
+def wind_dict():
+    from synthetic import synthetic_wind_dict
+
+    return synthetic_wind_dict(calendar.timegm(MODEL_DT.timetuple()), lat=-34.0, lon=138.0, radius=2.0)
+
+
+@pytest.mark.parametrize('compression', [None, 'gzip'])
+def test_read_cusf_wind(tmp_path, wind_dict, compression):
+    from cusfpredict.gfs import wind_dict_to_cusf
+    from cusfpredict.reader import read_cusf_wind
+
+    (_filename, _) = wind_dict_to_cusf(wind_dict, output_dir=str(tmp_path), compression=compression)
+    _wind = read_cusf_wind(_filename)
+
+    _levels = sorted([_key for _key in wind_dict if type(_key) == int], reverse=True)
+    assert _wind['data'].shape == (len(_levels), len(wind_dict['lat_scale']), len(wind_dict['lon_scale']), 3)
+    assert _wind['data'].dtype == np.float32
+    np.testing.assert_allclose(_wind['pressures'], _levels)
+
+    # Values are written out to 5 decimal places.
+    _level = _levels.index(500)
+    np.testing.assert_allclose(_wind['data'][_level, :, :, 1], wind_dict[500]['UGRD'], atol=1e-4)
+    np.testing.assert_allclose(_wind['data'][_level, :, :, 2], wind_dict[500]['VGRD'], atol=1e-4)
+
+
+@pytest.mark.parametrize('cut', [20, 500])
+def test_read_cusf_wind_truncated(tmp_path, wind_dict, cut):
+    from cusfpredict.gfs import wind_dict_to_cusf
+    from cusfpredict.reader import read_cusf_wind
+
+    (_filename, _) = wind_dict_to_cusf(wind_dict, output_dir=str(tmp_path))
+    with open(_filename, 'rb') as _f:
+        _text = _f.read()
+    with open(_filename, 'wb') as _f:
+        _f.write(_text[:-cut])
+
+    with pytest.raises(ValueError):
+        read_cusf_wind(_filename)
@@ -0,0 +1,60 @@
+#
+#   Project Horus
+#   CUSF Standalone Predictor Python Wrapper - Seeded Prediction Tests
+#
+#   The wind at each step is sampled within the spread of the surrounding grid points. With a seed
+#   (pred --seed, or seed= on Predictor.predict and Engine.predict), predictions are reproducible.
+#
+import datetime
+import threading
+
+import numpy as np
+
+from conftest import MODEL_DT
+
+
+LAUNCH = {'launch_lat': -34.95, 'launch_lon': 138.52, 'ascent_rate': 5.0, 'descent_rate': 6.0, 'burst_alt': 26000.0,
+    'launch_time': MODEL_DT + datetime.timedelta(hours=1)}
+
+# Tolerance of comparisons against pred, which writes out positions to 6 significant figures.
+PRED_ATOL = 1e-3
+
+
+def _engine_predict(engine, **kwargs):
+    # Run on a new thread, as each thread keeps its own wind lookup state (see src/wind/wind_file.c).
+    _result = []
+    _thread = threading.Thread(target=lambda: _result.append(np.array(engine.predict(**dict(LAUNCH, **kwargs)))))
+    _thread.start()
+    _thread.join()
+    return _result[0]
+
+
+def test_engine_seed(make_dataset, libpred):
+    from cusfpredict.engine import Engine
+
+    with Engine(gfs_path=make_dataset('gfs'), lib_path=libpred) as _engine:
+        _first = _engine_predict(_engine, seed=1)
+        _other = _engine_predict(_engine, seed=2)
+        _second = _engine_predict(_engine, seed=1)
+
+    np.testing.assert_array_equal(_first, _second)
+    assert not np.array_equal(_first[-1], _other[-1])
+
+
+def test_pred_seed(make_dataset, libpred, pred_binary):
+    ''' pred gives the same flight path for a seed on each run, and the same as the engine. '''
+    from cusfpredict.engine import Engine
+    from cusfpredict.predict import Predictor
+
+    _dataset = make_dataset('gfs')
+    _predictor = Predictor(bin_path=pred_binary, gfs_path=_dataset)
+    _first = np.array(_predictor.predict(seed=1, **LAUNCH))
+    _second = np.array(_predictor.predict(seed=1, **LAUNCH))
+    np.testing.assert_array_equal(_first, _second)
+
+    with Engine(gfs_path=_dataset, lib_path=libpred) as _engine:
+        _engine_landing = _engine_predict(_engine, seed=1)[-1]
+    np.testing.assert_allclose(_first[-1], _engine_landing, rtol=0, atol=PRED_ATOL)
+
+    _other = np.array(_predictor.predict(seed=2, **LAUNCH))
+    assert not np.array_equal(_first[-1], _other[-1])
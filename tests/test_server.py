@@ -0,0 +1,81 @@
+#
+#   Project Horus
+#   CUSF Standalone Predictor Python Wrapper - Prediction Server Tests
+#
+#   Request handling of the HTTP prediction service, against a synthetic dataset.
+#
+import datetime
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+
+from conftest import MODEL_DT
+
+
+@pytest.fixture
+def server_url(make_dataset, pred_binary):
+    from cusfpredict.server import PredictionService, PredictionServer
+
+    _service = PredictionService(bin_path=pred_binary, gfs_path=make_dataset('gfs', hours=3), workers=1)
+    _server = PredictionServer(_service, port=0)
+    threading.Thread(target=_server.serve_forever, daemon=True).start()
+    yield "http://127.0.0.1:%d" % _server.server_port
+    _server.shutdown()
+    _server.server_close()
+    _service.close()
+
+
+def _post(url, body):
+    ''' POST a JSON body, returning (status, response) '''
+    _request = urllib.request.Request(url, data=json.dumps(body).encode('utf-8'), headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(_request) as _response:
+            return (_response.status, json.loads(_response.read()))
+    except urllib.error.HTTPError as e:
+        return (e.code, json.loads(e.read()))
+
+
+@pytest.fixture
+def requests_counted():
+    ''' The labels of each requests_total count made while the test runs '''
+    from cusfpredict import metrics
+
+    _labels = []
+    def _hook(kind, name, value, labels):
+        if name == 'requests_total':
+            _labels.append(dict(labels))
+    metrics.add_hook(_hook)
+    yield _labels
+    metrics.remove_hook(_hook)
+
+
+def test_wind_points(server_url):
+    _time = (MODEL_DT + datetime.timedelta(hours=1)).strftime("%Y-%m-%dT%H:%M:%SZ")
+    (_status, _response) = _post(server_url + '/wind', {'points': [{'lat': -34.0, 'lon': 138.0, 'alt': 5000.0, 'time': _time}]})
+    assert _status == 200
+    assert len(_response['results']) == 1
+
+
+@pytest.mark.parametrize('body', [[{'lat': -34.0, 'lon': 138.0}], "points", 1, None, {'points': "-34,138"}])
+def test_wind_points_bad_request(server_url, body):
+    ''' Request bodies which aren't a JSON object with a list of points are rejected as a bad request, rather than an internal error. '''
+    (_status, _response) = _post(server_url + '/wind', body)
+    assert _status == 400
+
+
+def test_requests_labelled_by_route(server_url, requests_counted):
+    ''' Request metrics are labelled by route, with any unknown path counted as 'other'. '''
+    _post(server_url + '/wind', {'points': []})
+    _post(server_url + '/no/such/path/12345', {})
+    with urllib.request.urlopen(server_url + '/status') as _response:
+        _response.read()
+
+    # Requests are counted once the response has been sent.
+    _deadline = time.time() + 5.0
+    while len(requests_counted) < 3 and time.time() < _deadline:
+        time.sleep(0.01)
+    assert [_labels['endpoint'] for _labels in requests_counted] == ['wind_batch', 'other', 'status']
@@ -0,0 +1,60 @@
+#
+#   Project Horus
+#   CUSF Standalone Predictor Python Wrapper - Landing Surrogate Tests
+#
+import calendar
+
+import numpy as np
+import pytest
+
+from conftest import MODEL_DT
+from cusfpredict.surrogate import LandingSurrogate
+
+
+class _Predictor(object):
+    ''' Stand-in for a Predictor, recording its predictions, and landing 1 degree east of the launch site an hour later. '''
+
+    def __init__(self):
+        self.calls = []
+
+    def predict(self, **kwargs):
+        self.calls.append(kwargs)
+        _launch = calendar.timegm(kwargs['launch_time'].timetuple())
+        return [[_launch, kwargs['launch_lat'], kwargs['launch_lon'], kwargs['launch_alt']],
+            [_launch + 3600, kwargs['launch_lat'], kwargs['launch_lon'] + 1.0, 0.0]]
+
+
+def _surrogate(site, predictor=None):
+    ''' A surrogate over a 2x2x2x2 grid, with landings moving east with the launch time '''
+    _start = calendar.timegm(MODEL_DT.timetuple())
+    _axes = {'launch_time': [_start, _start + 3600], 'ascent_rate': [4.0, 6.0], 'burst_alt': [22000, 30000], 'descent_rate': [5.0, 7.0]}
+    _landings = np.zeros((2, 2, 2, 2, 3))
+    _landings[..., 0] = site['latitude']
+    _landings[0, ..., 1] = site['longitude'] + 1.0
+    _landings[1, ..., 1] = site['longitude'] + 2.0
+    _landings[..., 2] = 7200.0
+    return LandingSurrogate(_axes, _landings, site, predictor=predictor)
+
+
+def test_query_interpolated():
+    _grid = _surrogate({'name': 'Test', 'latitude': -34.95, 'longitude': 138.52})
+    _start = calendar.timegm(MODEL_DT.timetuple())
+    _result = _grid.query(_start + 1800, 5.0, 26000, 6.0)
+    assert _result['source'] == 'surrogate'
+    np.testing.assert_allclose(_result['landing'], [_start + 1800 + 7200, -34.95, 140.02], atol=1e-4)
+
+
+def test_query_outside_grid_without_altitude():
+    ''' Queries outside of the grid run pred, from ground level if the site has no altitude. '''
+    _predictor = _Predictor()
+    _grid = _surrogate({'name': 'Test', 'latitude': -34.95, 'longitude': 138.52}, predictor=_predictor)
+    _result = _grid.query(calendar.timegm(MODEL_DT.timetuple()), 5.0, 35000, 6.0)
+    assert _result['source'] == 'pred'
+    assert _predictor.calls[0]['launch_alt'] == 0.0
+    assert _result['landing'][1:] == [-34.95, 139.52]
+
+
+def test_query_outside_grid_no_predictor():
+    _grid = _surrogate({'name': 'Test', 'latitude': -34.95, 'longitude': 138.52, 'altitude': 10.0})
+    with pytest.raises(ValueError):
+        _grid.query(calendar.timegm(MODEL_DT.timetuple()), 5.0, 35000, 6.0)
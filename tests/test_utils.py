@@ -0,0 +1,50 @@
+#
+#   Project Horus
+#   CUSF Standalone Predictor Python Wrapper - Utility Tests
+#
+import datetime
+import xml.etree.ElementTree as ET
+
+import pytest
+
+from cusfpredict.utils import parse_time, scenario_key
+
+
+def test_parse_time():
+    _expected = datetime.datetime(2020, 6, 1, 1, 15)
+    assert parse_time("2020-06-01T01:15:00Z") == _expected
+    assert parse_time("2020-06-01T11:45:00+10:30") == _expected
+    assert parse_time(1590974100) == _expected
+    assert parse_time(datetime.datetime(2020, 6, 1, 11, 15, tzinfo=datetime.timezone(datetime.timedelta(hours=10)))) == _expected
+
+
+def test_scenario_key():
+    _scenario = {'launch_lat': -34.9499, 'launch_lon': 138.5194, 'launch_alt': 0.0, 'ascent_rate': 5.0, 'descent_rate': 6.0,
+        'burst_alt': 26000.0, 'launch_time': datetime.datetime(2020, 6, 1, 1, 15), 'descent_mode': False}
+    # Differences below the precision passed to pred are the same prediction.
+    assert scenario_key(_scenario) == scenario_key(dict(_scenario, ascent_rate=5.01, launch_time=datetime.datetime(2020, 6, 1, 1, 15, 0, 500)))
+    assert scenario_key(_scenario) != scenario_key(dict(_scenario, burst_alt=25000.0))
+    # Burst altitude is not used in descent mode.
+    assert scenario_key(dict(_scenario, descent_mode=True)) == scenario_key(dict(_scenario, descent_mode=True, burst_alt=25000.0))
+
+
+FLIGHT_PATH = [[1590974100, -34.95, 138.52, 0.0], [1590974160, -34.94, 138.53, 300.0], [1590974220, -34.93, 138.55, 100.0]]
+
+
+def test_write_flight_path_kml(tmp_path):
+    pytest.importorskip('fastkml')
+    pytest.importorskip('shapely')
+    from cusfpredict.utils import flight_path_to_geometry, flight_path_landing_placemark, flight_path_burst_placemark, \
+        write_flight_path_kml
+
+    _filename = str(tmp_path / 'prediction.kml')
+    write_flight_path_kml([flight_path_to_geometry(FLIGHT_PATH), flight_path_landing_placemark(FLIGHT_PATH),
+        flight_path_burst_placemark(FLIGHT_PATH)], filename=_filename)
+
+    _ns = {'kml': 'http://www.opengis.net/kml/2.2'}
+    _placemarks = ET.parse(_filename).getroot().findall('kml:Placemark', _ns)
+    assert [_p.find('kml:name', _ns).text for _p in _placemarks] == ["Predicted Flight Path Data", "Landing", "Burst"]
+    assert _placemarks[0].find('kml:LineString/kml:coordinates', _ns).text.split() == \
+        ["138.52,-34.95,0.0", "138.53,-34.94,300.0", "138.55,-34.93,100.0"]
+    assert _placemarks[1].find('kml:Point/kml:coordinates', _ns).text == "138.55,-34.93,100.0"
+    assert _placemarks[2].find('kml:Point/kml:coordinates', _ns).text == "138.53,-34.94,300.0"
@@ -0,0 +1,86 @@
+#
+#   Project Horus
+#   CUSF Standalone Predictor Python Wrapper - Wind Lookup Tests
+#
+#   The predictor caches the grid cell and pressure levels of its last wind lookup in each file
+#   (src/wind/wind_file.c). Predictions interpolate between two files on every step, which may have
+#   different grids (i.e. with download profiles), and a thread may run predictions against several
+#   datasets in turn (cusfpredict.engine), so none of these can be allowed to affect the result.
+#
+import datetime
+
+import numpy as np
+
+from conftest import MODEL_DT
+
+
+LAUNCH = {'launch_lat': -34.95, 'launch_lon': 138.52, 'ascent_rate': 5.0, 'descent_rate': 6.0, 'burst_alt': 26000.0}
+
+# Launch times, with flights using only full-window files, straddling the change of window, and only cropped files.
+LAUNCH_TIMES = [MODEL_DT + datetime.timedelta(hours=0, minutes=30),
+                MODEL_DT + datetime.timedelta(hours=1, minutes=30),
+                MODEL_DT + datetime.timedelta(hours=3, minutes=10)]
+
+# Tolerance of comparisons against pred, which writes out positions to 6 significant figures.
+PRED_ATOL = 1e-3
+
+
+def _landings(predictor, launch_times=LAUNCH_TIMES, **kwargs):
+    # The wind is sampled within the variance of the surrounding grid points, so the predictions are seeded.
+    return [np.array(predictor.predict(launch_time=_time, seed=1, **dict(LAUNCH, **kwargs))[-1]) for _time in launch_times]
+
+
+def test_mixed_window_dataset(make_dataset, libpred, pred_binary):
+    ''' A dataset with smaller windows from T+3 (as per a download profile) predicts the same as the full-window dataset. '''
+    from cusfpredict.engine import Engine
+    from cusfpredict.predict import Predictor
+
+    _full = make_dataset('full')
+    _mixed = make_dataset('mixed', crop_from=3, crop_radius=6.0)
+
+    with Engine(gfs_path=_full, lib_path=libpred) as _engine:
+        _expected = _landings(_engine)
+
+    with Engine(gfs_path=_mixed, lib_path=libpred) as _engine:
+        for (_landing, _expected_landing) in zip(_landings(_engine), _expected):
+            np.testing.assert_allclose(_landing, _expected_landing, rtol=0, atol=1e-5)
+
+    for (_landing, _expected_landing) in zip(_landings(Predictor(bin_path=pred_binary, gfs_path=_mixed)), _expected):
+        np.testing.assert_allclose(_landing, _expected_landing, rtol=0, atol=PRED_ATOL)
+
+
+def test_alternating_engines(make_dataset, libpred, pred_binary):
+    ''' Predictions from two engines on one thread don't depend on the order they are run in, and match pred. '''
+    from cusfpredict.engine import Engine
+    from cusfpredict.predict import Predictor
+
+    _datasets = [make_dataset('a', lat=-32.0, lon=139.0, radius=10.0, seed=1),
+                 make_dataset('b', lat=-35.0, lon=137.0, radius=7.0, seed=2)]
+    # Low flights, which land in the grid cell they launched from - where the other engine starts its next flight.
+    _launch = {'launch_lat': -33.6, 'launch_lon': 138.1, 'burst_alt': 600.0}
+
+    _expected = [_landings(Predictor(bin_path=pred_binary, gfs_path=_dataset), **_launch) for _dataset in _datasets]
+
+    _engines = [Engine(gfs_path=_dataset, lib_path=libpred) for _dataset in _datasets]
+    try:
+        for _order in ([0, 1], [1, 0]):
+            # Alternate between the engines for each launch time.
+            for (_i, _time) in enumerate(LAUNCH_TIMES):
+                for _engine in _order:
+                    _landing = _landings(_engines[_engine], launch_times=[_time], **_launch)[0]
+                    np.testing.assert_allclose(_landing, _expected[_engine][_i], rtol=0, atol=PRED_ATOL)
+    finally:
+        for _engine in _engines:
+            _engine.close()
+
+
+def test_repeated_predictions(make_dataset, libpred):
+    ''' A prediction on a thread isn't affected by the lookups of the predictions run before it. '''
+    from cusfpredict.engine import Engine
+
+    with Engine(gfs_path=make_dataset('gfs'), lib_path=libpred) as _engine:
+        _first = [np.array(_engine.predict(launch_time=_time, seed=1, **LAUNCH)) for _time in LAUNCH_TIMES]
+        _second = [np.array(_engine.predict(launch_time=_time, seed=1, **LAUNCH)) for _time in LAUNCH_TIMES]
+
+    for (_path, _expected_path) in zip(_second, _first):
+        np.testing.assert_array_equal(_path, _expected_path)